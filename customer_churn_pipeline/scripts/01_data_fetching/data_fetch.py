@@ -1,9 +1,15 @@
-import requests
 import pandas as pd
+import json
 import logging
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.hf_fetcher import FetchCheckpoint, FetchError, PaginatedFetcher
+from common.instrumentation import span, start_stage
+from common.parquet_sink import ParquetPageSink
+
 # Load environment variables
 load_dotenv()
 
@@ -17,6 +23,7 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
+stage = start_stage("Data Fetching")
 
 # Configuration from .env
 DATASET_NAME = os.getenv("DATASET_NAME")
@@ -24,48 +31,134 @@ CONFIG = os.getenv("CONFIG", "default")
 SPLIT = os.getenv("SPLIT", "train")
 BASE_URL = os.getenv("BASE_URL", "https://datasets-server.huggingface.co/rows")
 
-# Other constants
-BATCH_SIZE = 100
+# Fetch tuning (page size is capped at 100 by the datasets-server)
+BATCH_SIZE = int(os.getenv("FETCH_PAGE_SIZE", 100))
+MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", 4))
+MAX_RETRIES = int(os.getenv("FETCH_MAX_RETRIES", 5))
 OUTPUT_CSV = os.getenv("CSV_DATA_FROM_API")
 
-# Start ingestion
-logging.info("Starting download from Hugging Face for dataset: %s", DATASET_NAME)
-all_records = []
-offset = 0
-
-while True:
-    params = {
-        "dataset": DATASET_NAME,
-        "config": CONFIG,
-        "split": SPLIT,
-        "offset": offset,
-        "length": BATCH_SIZE
-    }
+# "memory" builds one DataFrame at the end, "stream" writes every page straight to Parquet
+FETCH_MODE = os.getenv("FETCH_MODE", "memory").lower()
+OUTPUT_PARQUET_DIR = os.getenv("PARQUET_DATA_FROM_API", os.path.splitext(OUTPUT_CSV)[0] + "_parquet")
+ROWS_PER_PART = int(os.getenv("FETCH_ROWS_PER_PART", 100000))
+EXPORT_CSV = os.getenv("FETCH_EXPORT_CSV", "true").lower() == "true"
+
+CHECKPOINT_KEY = f"{DATASET_NAME}/{CONFIG}/{SPLIT}"
+
+
+def make_fetcher():
+    return PaginatedFetcher(
+        BASE_URL, DATASET_NAME, CONFIG, SPLIT,
+        max_workers=MAX_WORKERS,
+        page_size=BATCH_SIZE,
+        max_retries=MAX_RETRIES
+    )
+
+
+def fetch_to_memory():
+    """Spill pages to a JSON Lines file, then build one DataFrame and save it as CSV."""
+    # Pages are spilled to disk as they arrive so an interrupted run can resume
+    spill_file = OUTPUT_CSV + ".partial.jsonl"
+    checkpoint = FetchCheckpoint(OUTPUT_CSV + ".checkpoint.json", key=CHECKPOINT_KEY)
+    state = checkpoint.load()
+
+    if state and os.path.exists(spill_file):
+        start_offset = state["next_offset"]
+        num_rows_total = state["num_rows_total"]
+        # Drop anything written after the last checkpoint
+        with open(spill_file, "r+b") as spill:
+            spill.truncate(state["spill_bytes"])
+        logging.info("Resuming download from offset %d", start_offset)
+    else:
+        start_offset = 0
+        num_rows_total = None
+        open(spill_file, "wb").close()
+
+    fetcher = make_fetcher()
+    total_fetched = start_offset
 
     try:
-        response = requests.get(BASE_URL, params=params)
-        response.raise_for_status()
-    except requests.RequestException as e:
-        logging.error("HTTP error at offset %d: %s", offset, str(e))
-        break
+        with span("download"), open(spill_file, "ab") as spill:
+            for offset, batch in fetcher.iter_pages(start_offset, num_rows_total):
+                spill.write("".join(json.dumps(record) + "\n" for record in batch).encode("utf-8"))
+                spill.flush()
+                os.fsync(spill.fileno())
+                total_fetched = offset + len(batch)
+                checkpoint.save(
+                    next_offset=total_fetched,
+                    spill_bytes=spill.tell(),
+                    num_rows_total=fetcher.num_rows_total
+                )
+                logging.info("Fetched %d rows (Total so far: %d)", len(batch), total_fetched)
+    except FetchError as e:
+        # Keep the checkpoint so the next run picks up where this one stopped
+        logging.error("Download aborted after %d rows: %s", total_fetched, str(e))
+        raise
 
-    data = response.json()
-    rows = data.get("rows", [])
+    logging.info("No more rows to fetch.")
 
-    if not rows:
-        logging.info("No more rows to fetch.")
-        break
+    # Convert to DataFrame
+    with open(spill_file, "r", encoding="utf-8") as spill:
+        all_records = [json.loads(line) for line in spill]
+    df = pd.DataFrame(all_records)
 
-    batch = [row["row"] for row in rows]
-    all_records.extend(batch)
+    # Save to CSV
+    with span("write_csv"):
+        df.to_csv(OUTPUT_CSV, index=False)
+    stage.add(rows_out=len(df))
+    logging.info("Saved %d rows to '%s'", len(df), OUTPUT_CSV)
 
-    logging.info("Fetched %d rows (Total so far: %d)", len(batch), len(all_records))
+    checkpoint.clear()
+    os.remove(spill_file)
 
-    offset += BATCH_SIZE
 
-# Convert to DataFrame
-df = pd.DataFrame(all_records)
+def fetch_to_parquet():
+    """Write every page as a Parquet row group so memory stays bounded by a page."""
+    sink = ParquetPageSink(OUTPUT_PARQUET_DIR, rows_per_part=ROWS_PER_PART)
+    checkpoint = FetchCheckpoint(os.path.join(OUTPUT_PARQUET_DIR, "_checkpoint.json"), key=CHECKPOINT_KEY)
+    state = checkpoint.load()
 
-# Save to CSV
-df.to_csv(OUTPUT_CSV, index=False)
-logging.info("Saved %d rows to '%s'", len(df), OUTPUT_CSV)
+    # Only closed part files are committed, so a resumed run restarts from the last one
+    if state:
+        start_offset = state["next_offset"]
+        num_rows_total = state["num_rows_total"]
+        sink.resume(state["parts"])
+        logging.info("Resuming download from offset %d (%d committed parts)", start_offset, len(sink.parts))
+    else:
+        start_offset = 0
+        num_rows_total = None
+        sink.resume([])
+
+    fetcher = make_fetcher()
+    total_fetched = start_offset
+
+    try:
+        for offset, batch in fetcher.iter_pages(start_offset, num_rows_total):
+            total_fetched = offset + len(batch)
+            if sink.write_page(batch):
+                checkpoint.save(next_offset=total_fetched, parts=sink.parts, num_rows_total=fetcher.num_rows_total)
+            logging.info("Fetched %d rows (Total so far: %d)", len(batch), total_fetched)
+        sink.close_part()
+        checkpoint.save(next_offset=total_fetched, parts=sink.parts, num_rows_total=fetcher.num_rows_total)
+    except FetchError as e:
+        # Keep the checkpoint so the next run picks up where this one stopped
+        logging.error("Download aborted after %d rows: %s", total_fetched, str(e))
+        raise
+
+    logging.info("No more rows to fetch.")
+    logging.info("Saved %d rows to Parquet parts in '%s'", sink.num_rows(), OUTPUT_PARQUET_DIR)
+    stage.add(rows_out=sink.num_rows())
+
+    if EXPORT_CSV:
+        with span("write_csv"):
+            rows = sink.to_csv(OUTPUT_CSV)
+        logging.info("Saved %d rows to '%s'", rows, OUTPUT_CSV)
+    checkpoint.clear()
+
+
+# Start ingestion
+logging.info("Starting download from Hugging Face for dataset: %s (mode: %s)", DATASET_NAME, FETCH_MODE)
+if FETCH_MODE == "stream":
+    fetch_to_parquet()
+else:
+    fetch_to_memory()
@@ -1,11 +1,15 @@
 import pandas as pd
 import numpy as np
 import logging
-import snowflake.connector
-from snowflake.connector.pandas_tools import write_pandas
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.bulk_loader import BulkLoader
+from common.instrumentation import span, start_stage
+from common.warehouse import get_client
+
 # Load environment variables
 load_dotenv()
 
@@ -19,44 +23,33 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
+stage = start_stage("Data Ingestion")
 logging.info("Starting data ingestion process...Into snowflake")
-data = pd.read_csv(os.getenv("CSV_DATA_FROM_API"))
+with span("read_csv"):
+    data = pd.read_csv(os.getenv("CSV_DATA_FROM_API"))
+stage.add(rows_in=len(data))
 logging.info("customer churn data read from csv successfully.")
 
 logging.info(f"Data shape: {data.shape}")
 logging.info(f"Data columns: {data.columns.tolist()}") 
-logging.info(f"establishing connection to snowflake")
+# Bulk loader options (see common/bulk_loader.py)
+LOAD_CHUNK_ROWS = int(os.getenv("LOAD_CHUNK_ROWS", 50000))
+LOAD_MAX_WORKERS = int(os.getenv("LOAD_MAX_WORKERS", 4))
+
+backend = get_client().backend
+logging.info(f"Uploading data to the {backend.name} warehouse...")
 try:
-    conn = snowflake.connector.connect(
-        user=os.getenv("user"),
-        password=os.getenv("password"),
-        account=os.getenv("account"),
-        warehouse=os.getenv("warehouse"),
-        database=os.getenv("database"),
-        schema=os.getenv("schema"))
-    logging.info("Connection to Snowflake established successfully.")
-except Exception as e:  
-    logging.error(f"Error connecting to Snowflake: {e}")
+    # Chunks are staged as Parquet in parallel over pooled connections, then
+    # merged on Customer ID instead of overwriting the table
+    with span("warehouse_load"), BulkLoader(chunk_rows=LOAD_CHUNK_ROWS, max_workers=LOAD_MAX_WORKERS) as loader:
+        result = loader.load(data, table="customer_churn", key="Customer ID")
+    stage.add(rows_out=result["rows"])
+except Exception as e:
+    logging.error(f"Upload to {backend.name} failed: {e}")
     raise
 
-logging.info("Uploading data to Snowflake...")
-# 3. Upload dataframe using write_pandas (best method!)
-success, nchunks, nrows, _ = write_pandas(
-    conn=conn,
-    df=data,
-    table_name="customer_churn",
-    auto_create_table=True,    # Will create table if it doesn't exist
-    overwrite=True             # Replace existing data
+logging.info(
+    f"Upserted {result['rows']} rows into 'customer_churn' "
+    f"({result['inserted']} inserted, {result['updated']} updated, {result['rows_per_sec']} rows/s)."
 )
-
-# 4. Result
-if success:
-    logging.info(f"Uploaded {nrows} rows to 'customer_churn' in Snowflake.")
-else:
-    print("Upload failed.")
-    logging.error("Upload to Snowflake failed.")
-
-# 5. Close connection
-conn.close()
-logging.info("Connection to Snowflake closed.")
-logging.info("customer churn data ingested to snowflake successfully.")
\ No newline at end of file
+logging.info("customer churn data ingested to snowflake successfully.")
@@ -1,10 +1,17 @@
 import pandas as pd
-import snowflake.connector
 import logging
 from datetime import datetime
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import RAW, PartitionCatalog
+from common.extraction import Extractor
+from common.instrumentation import span, start_stage, traced
+from common.storage import PartitionWriter, iter_file_chunks, write_partition
+from common.warehouse import get_client, quote_identifier
+
 # Load environment variables
 load_dotenv()
 
@@ -18,21 +25,24 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
+stage = start_stage("Raw Data Storage")
 logging.info("Starting raw data storage script")
 logging.info("Environment variables loaded")
 logging.info(f"Log file path: {LOG_FILE_NAME}")
 
-# Snowflake connection config
-logging.info("Setting up Snowflake connection config")
-SNOWFLAKE_CONFIG = {
-    "user": os.getenv("user"),
-    "password": os.getenv("password"),
-    "account": os.getenv("account"),
-    "warehouse": os.getenv("warehouse"),
-    "database": os.getenv("database"),
-    "schema":os.getenv("schema")
-}
-logging.info("Snowflake connection config set")
+# Extraction options. "memory" reads the table in one query, "stream" writes
+# result batches to the partition as they arrive (see common/extraction.py)
+EXTRACT_MODE = os.getenv("EXTRACT_MODE", "memory").lower()
+EXTRACT_TABLE = os.getenv("EXTRACT_TABLE", "customer_churn")
+EXTRACT_COLUMNS = [c.strip() for c in os.getenv("EXTRACT_COLUMNS", "").split(",") if c.strip()] or None
+EXTRACT_BATCH_ROWS = int(os.getenv("EXTRACT_BATCH_ROWS", 50000))
+# Parallel sub-queries split on EXTRACT_KEY by hash bucket or key range
+EXTRACT_PARTS = int(os.getenv("EXTRACT_PARTS", 1))
+EXTRACT_SPLIT = os.getenv("EXTRACT_SPLIT", "hash").lower()
+EXTRACT_KEY = os.getenv("EXTRACT_KEY", "Customer ID")
+# Column that grows whenever a row changes (e.g. an updated-at timestamp); when set,
+# stream mode only pulls rows above the previous partition's high-water mark
+EXTRACT_WATERMARK_COLUMN = os.getenv("EXTRACT_WATERMARK_COLUMN")
 
 # Current date partition (e.g., 2025-08-16)
 logging.info("Setting up date partition and output paths")
@@ -40,48 +50,106 @@ partition_date = datetime.now().strftime('%Y-%m-%d')
 output_folder_base = os.getenv("OUTPUT_FOLDER_BASE")
 logging.info(f"Output folder base: {output_folder_base}")
 output_folder = os.path.join(output_folder_base, partition_date)
-output_file = os.path.join(output_folder, "customer_churn_raw.csv")
 logging.info(f"Output folder: {output_folder}")
-logging.info(f"Output file: {output_file}") 
 logging.info("Date partition and output paths set")
 
-try:
-    # Connect to Snowflake
-    logging.info("Connecting to Snowflake") 
-    conn = snowflake.connector.connect(
-          user=os.getenv("user"),
-        password=os.getenv("password"),
-        account=os.getenv("account"),
-        warehouse=os.getenv("warehouse"),
-        database=os.getenv("database"),
-        schema=os.getenv("schema"))
-    
-    logging.info("Connected to Snowflake")
-except Exception as e:
-    logging.error(f"Failed to connect to Snowflake: {e}")
-    raise
+
+def json_value(value):
+    """Plain Python value for a watermark read out of a DataFrame."""
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value.item() if hasattr(value, "item") else value
+
+
+@traced("extract_stream")
+def extract_stream(extractor, previous):
+    """Stream the table into today's partition; returns (path, rows, high-water mark)."""
+    columns = EXTRACT_COLUMNS
+    if columns:
+        # The key and watermark columns are needed to merge incremental pulls
+        columns = columns + [c for c in (EXTRACT_KEY, EXTRACT_WATERMARK_COLUMN) if c and c not in columns]
+
+    since = None
+    if EXTRACT_WATERMARK_COLUMN and previous is not None:
+        since = catalog.watermark(RAW, previous["partition_date"], watermark_name)
+    where, params = None, ()
+    if since is not None:
+        where = f"{quote_identifier(EXTRACT_WATERMARK_COLUMN)} > {extractor.backend.placeholder}"
+        params = (since,)
+        logging.info(f"Incremental extraction of rows with {EXTRACT_WATERMARK_COLUMN} > {since}")
+
+    writer = PartitionWriter(output_folder, "customer_churn_raw")
+    high_water = None
+    pulled_keys = set()
+    try:
+        batches = extractor.iter_batches(
+            EXTRACT_TABLE, columns=columns, key=EXTRACT_KEY, parts=EXTRACT_PARTS,
+            method=EXTRACT_SPLIT, where=where, params=params
+        )
+        for batch in batches:
+            writer.write(batch)
+            if EXTRACT_WATERMARK_COLUMN and len(batch):
+                batch_max = batch[EXTRACT_WATERMARK_COLUMN].max()
+                if pd.notna(batch_max) and (high_water is None or batch_max > high_water):
+                    high_water = batch_max
+            if since is not None:
+                pulled_keys.update(batch[EXTRACT_KEY])
+        logging.info(f"Pulled {writer.rows} rows from {EXTRACT_TABLE}")
+
+        if since is not None:
+            # Rows unchanged since the previous partition are carried over from it
+            pulled = writer.rows
+            for chunk in iter_file_chunks(previous["path"], columns=columns):
+                writer.write(chunk[~chunk[EXTRACT_KEY].isin(pulled_keys)])
+            logging.info(f"Carried over {writer.rows - pulled} unchanged rows from {previous['path']}")
+        path = writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    high_water = since if high_water is None else json_value(high_water)
+    return path, writer.rows, high_water
+
+
+client = get_client()
+backend = client.backend
+catalog = PartitionCatalog()
+watermark_name = f"{EXTRACT_TABLE}.{EXTRACT_WATERMARK_COLUMN}"
 
 try:
-    # Run query
-    query = '''SELECT * FROM TELECOM."customer_churn";'''
-    snowflake_df = pd.read_sql(query, conn)
-    logging.info("Data read from Snowflake successfully")
+    # Latest complete partition, looked up before begin() marks a same-day re-run as pending
+    previous = catalog.latest(RAW, base_dir=output_folder_base)
 
-    # Ensure partition folder exists
-    os.makedirs(output_folder, exist_ok=True)
+    # Sub-queries beyond WAREHOUSE_POOL_SIZE wait for a pooled connection
+    with Extractor(batch_rows=EXTRACT_BATCH_ROWS, max_workers=max(EXTRACT_PARTS, 1)) as extractor:
+        # The partition only becomes visible to later stages once it is committed
+        catalog.begin(RAW, partition_date, base_dir=output_folder_base)
+        if EXTRACT_MODE == "stream":
+            logging.info(f"Streaming {EXTRACT_TABLE} from {backend.name} in batches of {EXTRACT_BATCH_ROWS} rows")
+            output_file, row_count, high_water = extract_stream(extractor, previous)
+            if EXTRACT_WATERMARK_COLUMN and high_water is not None:
+                catalog.set_watermark(RAW, partition_date, watermark_name, high_water)
+                logging.info(f"High-water mark of {EXTRACT_WATERMARK_COLUMN}: {high_water}")
+        else:
+            # Run query (served from the client's cache while the table is unchanged)
+            query = extractor.build_query(EXTRACT_TABLE, EXTRACT_COLUMNS)
+            with span("warehouse_query"):
+                snowflake_df = client.query(query, tables=[EXTRACT_TABLE])
+            logging.info("Data read from Snowflake successfully")
 
-    # Save as CSV in partitioned folder
-    snowflake_df.to_csv(output_file, index=False)
+            # Save in the partitioned folder (columnar format, see common/storage.py)
+            output_file = write_partition(snowflake_df, output_folder, "customer_churn_raw")
+            row_count = len(snowflake_df)
+        catalog.commit(RAW, partition_date, output_file, row_count=row_count)
+        stage.add(rows_out=row_count)
     logging.info(f"Data saved to partitioned folder: {output_file}")
-    logging.info(f"Read {len(snowflake_df)} rows from Snowflake")
-
-    conn.close()
-    logging.info("Snowflake connection closed after successful data extraction")
+    logging.info(f"Read {row_count} rows from {backend.name}")
+    logging.info("Warehouse connections closed after successful data extraction")
 
 except Exception as e:
     logging.error(f"Failed to read data from Snowflake: {e}")
-    conn.close()
-    logging.info("Snowflake connection closed due to error")
+    catalog.fail(RAW, partition_date)
+    logging.info("Warehouse connections closed due to error")
     raise
 
 logging.info("Script completed successfully")
@@ -2,8 +2,16 @@ import pandas as pd
 import numpy as np
 import logging
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import RAW, PartitionCatalog
+from common.instrumentation import span, start_stage
+from common.profiling import profile_chunks, profile_frame
+from common.schema import load_schema
+from common.storage import iter_file_chunks, read_file
+
 # Load env variables
 load_dotenv()
 
@@ -19,70 +27,89 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+stage = start_stage("Data Validation")
 logging.info("Starting custom data validation...")
 
-# === Dynamically Find Latest Partition Folder ===
-base_data_dir = os.getenv("OUTPUT_FOLDER_BASE", r"C:\Users\adity\Mtech\DMML\DMML_Assignment\customer_churn_pipeline\data\raw_ingested_data")
-
-# Get all date folders
-partition_folders = [
-    f for f in os.listdir(base_data_dir)
-    if os.path.isdir(os.path.join(base_data_dir, f)) and f[:4].isdigit()
-]
-
-if not partition_folders:
-    logging.error("No partitioned date folders found in raw_ingested_data.")
-    raise Exception("No partition folders found.")
+# Profiling options: worker processes for column groups, and sketches instead of exact counts
+PROFILE_N_JOBS = int(os.getenv("VALIDATION_N_JOBS", 1))
+PROFILE_APPROXIMATE = os.getenv("VALIDATION_APPROXIMATE", "false").lower() == "true"
+# Chunked mode for partitions larger than RAM (0 = load the whole partition); columns with
+# more distinct values than VALIDATION_MAX_EXACT_VALUES fall back to sketches (0 = no limit)
+VALIDATION_CHUNK_ROWS = int(os.getenv("VALIDATION_CHUNK_ROWS", 0))
+VALIDATION_MAX_EXACT_VALUES = int(os.getenv("VALIDATION_MAX_EXACT_VALUES", 0)) or None
 
-# Sort and get the latest one
-latest_partition = sorted(partition_folders)[-1]
-latest_data_path = os.path.join(base_data_dir, latest_partition, "customer_churn_raw.csv")
-
-if not os.path.exists(latest_data_path):
-    logging.error(f"No CSV file found at expected location: {latest_data_path}")
-    raise FileNotFoundError(f"CSV not found: {latest_data_path}")
-
-# Load dataset
-csv_path = latest_data_path
-if not os.path.exists(csv_path):
-    logging.error(f"CSV path does not exist: {csv_path}")
-    raise FileNotFoundError(f"CSV path not found: {csv_path}")
+# === Find Latest Complete Partition ===
+base_data_dir = os.getenv("OUTPUT_FOLDER_BASE", r"C:\Users\adity\Mtech\DMML\DMML_Assignment\customer_churn_pipeline\data\raw_ingested_data")
 
-df = pd.read_csv(csv_path)
-logging.info("Data loaded from %s", csv_path)
+# The catalog only returns partitions whose write was committed
+catalog = PartitionCatalog()
+latest = catalog.latest(RAW, base_dir=base_data_dir)
+
+if latest is None:
+    logging.error("No complete partition found in raw_ingested_data.")
+    raise Exception("No complete partition found.")
+
+latest_partition = latest["partition_date"]
+latest_data_path = latest["path"]
+stage.add(rows_in=latest["row_count"])
+
+# The report profiles the partition as stored (pandas' inferred dtypes and values); the
+# registered schema only checks it, and its violations are added to the report
+schema = load_schema()
+schema_violations = []
+if schema is not None:
+    logging.info("Checking against schema %s v%s", schema.name, schema.version)
+
+
+def checked(chunk):
+    """``chunk`` unchanged, its schema violations collected for the report."""
+    if schema is not None:
+        schema_violations.extend(schema.validate(chunk))
+    return chunk
+
+
+# Create validation summary (one pass per column, see common/profiling.py)
+with span("profile"):
+    if VALIDATION_CHUNK_ROWS > 0:
+        logging.info("Profiling %s in chunks of %d rows", latest_data_path, VALIDATION_CHUNK_ROWS)
+        stats = profile_chunks(
+            (checked(chunk) for chunk in iter_file_chunks(latest_data_path, chunk_rows=VALIDATION_CHUNK_ROWS)),
+            n_jobs=PROFILE_N_JOBS,
+            approximate=PROFILE_APPROXIMATE,
+            max_exact_values=VALIDATION_MAX_EXACT_VALUES
+        )
+    else:
+        df = checked(read_file(latest_data_path))
+        logging.info("Data loaded from %s", latest_data_path)
+        stats = profile_frame(df, n_jobs=PROFILE_N_JOBS, approximate=PROFILE_APPROXIMATE)
+logging.info("Profiled %d columns (approximate: %s, jobs: %d)", len(stats), PROFILE_APPROXIMATE, PROFILE_N_JOBS)
 
-# Create validation summary
 report = []
 
-for col in df.columns:
-    data = df[col]
-    dtype = data.dtype
-    missing_pct = round(data.isnull().mean() * 100, 2)
-    n_unique = data.nunique()
-    is_constant = n_unique == 1
-    is_unique = data.is_unique
-    most_frequent = data.mode().iloc[0] if not data.mode().empty else None
+for col_stats in stats:
+    col = col_stats["Column"]
 
     # Simple rule-based status
-    if missing_pct > 50:
+    if col_stats["Missing (%)"] > 50:
         status = "High Missing"
-    elif is_constant:
+    elif col_stats["Is Constant"]:
         status = "Constant Value"
-    elif is_unique and not col.lower().startswith("id"):
+    elif col_stats["Is Unique"] and not col.lower().startswith("id"):
         status = "Unexpected Unique"
     else:
         status = "OK"
 
-    report.append({
-        "Column": col,
-        "Data Type": str(dtype),
-        "Missing (%)": missing_pct,
-        "Unique Values": n_unique,
-        "Is Constant": is_constant,
-        "Is Unique": is_unique,
-        "Most Frequent Value": most_frequent,
-        "Check Status": status
-    })
+    report.append({**col_stats, "Check Status": status})
+
+# Schema violations are reported, not raised (chunks repeat a column's violation, keep each once)
+if schema_violations:
+    logging.warning("Schema %s v%s: %d violations", schema.name, schema.version, len(schema_violations))
+    by_column = {}
+    for violation in schema_violations:
+        col, message = violation.split(": ", 1)
+        by_column.setdefault(col, {})[message] = None
+    for col, messages in by_column.items():
+        report.append({"Column": col, "Check Status": "Schema Violation: " + "; ".join(messages)})
 
 # Convert to DataFrame
 report_df = pd.DataFrame(report)
@@ -0,0 +1,62 @@
+"""Derive the customer churn schema from partitions and register it if it changed.
+
+The latest registered version is widened to cover every given partition
+(see common/schema.py), so registering never makes a loaded partition
+invalid. Without paths, the latest raw partition of the catalog is used.
+
+    python register_schema.py
+    python register_schema.py ../../data/raw_ingested_data/2025-08-24/customer_churn_raw.csv
+    python register_schema.py --show
+"""
+import argparse
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import RAW, PartitionCatalog
+from common.schema import DATASET, SchemaRegistry, infer_schema
+from common.storage import read_file
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="partition files, defaults to the latest raw partition")
+    parser.add_argument("--name", default=DATASET)
+    parser.add_argument("--registry", default=None, help="registry directory, defaults to SCHEMA_REGISTRY_PATH")
+    parser.add_argument("--show", action="store_true", help="print the latest registered version and exit")
+    args = parser.parse_args()
+
+    registry = SchemaRegistry(args.registry)
+    latest = registry.get(args.name)
+    if args.show:
+        if latest is None:
+            sys.exit(f"No schema registered for {args.name} in {registry.directory}")
+        print(json.dumps(latest.to_dict(), indent=2, ensure_ascii=False))
+        return
+
+    paths = args.paths
+    if not paths:
+        entry = PartitionCatalog().latest(RAW, base_dir=os.getenv("OUTPUT_FOLDER_BASE"))
+        if entry is None:
+            sys.exit("No raw partition to derive the schema from; pass partition paths")
+        paths = [entry["path"]]
+
+    schema = latest
+    for path in paths:
+        schema = infer_schema(read_file(path), name=args.name, previous=schema, source=os.path.basename(path))
+    registered = registry.register(schema)
+    if latest is not None and registered.version == latest.version:
+        print(f"Schema {args.name} v{latest.version} already covers {', '.join(paths)}")
+        return
+    changed = [col for col, spec in registered.columns.items() if latest is None or latest.columns.get(col) != spec]
+    print(f"Registered schema {args.name} v{registered.version} in {registry.directory} "
+          f"({len(changed)} column(s) new or changed: {', '.join(changed)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,154 @@
 import pandas as pd
 import logging
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import CLEANED, RAW, PartitionCatalog
+from common.delta_index import RowIndex, compute_delta, fingerprint_frame
+from common.instrumentation import start_stage, traced
+from common.schema import load_schema
+from common.storage import copy_partition_file, read_file, write_partition
+from common.transforms import load_rules, preparation_plan
+
 # Load environment variables
 load_dotenv()
 log_path = os.path.join(os.getenv("LOG_BASE_PATH"), "05_data_preparation.log")
 
 logging.basicConfig(filename=log_path, level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+stage = start_stage("Data Preparation")
 logging.info("Starting data preparation...")
 
-# === Dynamically Find Latest Partition Folder ===
-base_data_dir = os.getenv("OUTPUT_FOLDER_BASE", r"C:\Users\adity\Mtech\DMML\DMML_Assignment\customer_churn_pipeline\data\raw_ingested_data")
+# Rows per batch of the streamed cleaning scan (0 = the default of common/transforms.py)
+CHUNK_ROWS = int(os.getenv("PREPARATION_CHUNK_ROWS", 0))
+DEDUP_MEMORY_MB = int(os.getenv("DEDUP_MEMORY_MB", 256))
+DEDUP_SPILL_DIR = os.getenv("DEDUP_SPILL_DIR")  # defaults to the system temp folder
+
+# "incremental" only cleans rows that are new or changed since the previous cleaned partition
+PREPARATION_MODE = os.getenv("PREPARATION_MODE", "full").lower()
+ROW_INDEX_DIR = os.getenv("ROW_INDEX_DIR")  # defaults to <processed>/_row_index
+
+# Raw and cleaned rows are loaded with the registered schema (None: pandas' inferred dtypes)
+schema = load_schema()
+
+# Cleaning rules (filters, duplicate removal) from the transformation config, see common/transforms.py
+RULES = load_rules()
+
+
+def clean_rows(df):
+    """Cleaning rules applied to a set of rows; the kept rows keep their index."""
+    return preparation_plan(df, RULES).collect()
+
+
+@traced("clean")
+def clean_partition(input_path, output_partition):
+    """Run the cleaning plan as one streamed scan of the partition, written batch by batch."""
+    plan = preparation_plan(input_path, RULES)
+    logging.info(plan.explain())
+    result = plan.sink(output_partition, "customer_churn_cleaned", batch_rows=CHUNK_ROWS or None, schema=schema,
+                       dedup_memory_mb=DEDUP_MEMORY_MB, spill_dir=DEDUP_SPILL_DIR)
+    logging.info(f"Scanned {result['rows_scanned']} rows, removed {result['duplicates']} duplicates")
+    return result["path"], result["rows"]
+
+
+def previous_cleaned(row_index):
+    """Catalog entry of the cleaned partition the row index reflects, if any."""
+    meta = row_index.load_meta()
+    return catalog.get(CLEANED, meta["cleaned_partition"]) if meta else None
+
 
-# Get all date folders
-partition_folders = [
-    f for f in os.listdir(base_data_dir)
-    if os.path.isdir(os.path.join(base_data_dir, f)) and f[:4].isdigit()
-]
+@traced("clean_incrementally")
+def clean_incrementally(raw_entry, output_partition, row_index, previous):
+    """Clean only the rows that changed since the partition the row index reflects.
 
-if not partition_folders:
-    logging.error("No partitioned date folders found in raw_ingested_data.")
-    raise Exception("No partition folders found.")
+    Returns the output path, its row count, the raw fingerprints of the
+    output rows (in output order) and the delta counts.
+    """
+    meta = row_index.load_meta()
+    usable = (
+        previous is not None and previous["status"] == "complete"
+        and previous["checksum"] == meta["cleaned_checksum"]
+    )
 
-# Sort and get the latest one
-latest_partition = sorted(partition_folders)[-1]
-latest_data_path = os.path.join(base_data_dir, latest_partition, "customer_churn_raw.csv")
+    if not usable:
+        logging.info("No usable row index, cleaning the full partition to build it")
+        raw = read_file(raw_entry["path"], schema=schema)
+        raw_fps = fingerprint_frame(raw)
+        df = clean_rows(raw)
+        output_file = write_partition(df, output_partition, "customer_churn_cleaned")
+        counts = {"inserted": len(df), "updated": 0, "deleted": 0, "unchanged": 0}
+        return output_file, len(df), raw_fps.loc[df.index].reset_index(drop=True), counts
 
-if not os.path.exists(latest_data_path):
-    logging.error(f"No CSV file found at expected location: {latest_data_path}")
-    raise FileNotFoundError(f"CSV not found: {latest_data_path}")
+    if meta["raw_checksum"] == raw_entry["checksum"]:
+        # Byte-identical raw partition: nothing to clean, carry the previous output over
+        logging.info(f"Raw partition unchanged since {meta['raw_partition']}, reusing {previous['path']}")
+        output_file = copy_partition_file(previous["path"], output_partition, "customer_churn_cleaned")
+        counts = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": meta["rows"]}
+        return output_file, meta["rows"], row_index.load(), counts
+
+    raw = read_file(raw_entry["path"], schema=schema)
+    raw_fps = fingerprint_frame(raw)
+    index_fps = row_index.load()
+    keep_mask, new_mask, counts = compute_delta(index_fps, raw_fps)
+    logging.info(f"Delta against {meta['raw_partition']}: {counts}")
+
+    cleaned_new = clean_rows(raw[new_mask])
+    carried = read_file(previous["path"], schema=schema)[keep_mask]
+    df = pd.concat([carried, cleaned_new], ignore_index=True)
+    if schema is not None:
+        # Categoricals whose categories differ concatenate as object
+        df = schema.apply(df)
+    fps = pd.concat([index_fps[keep_mask], raw_fps.loc[cleaned_new.index]], ignore_index=True)
+    output_file = write_partition(df, output_partition, "customer_churn_cleaned")
+    return output_file, len(df), fps, counts
+
+
+# === Find Latest Complete Partition ===
+base_data_dir = os.getenv("OUTPUT_FOLDER_BASE", r"C:\Users\adity\Mtech\DMML\DMML_Assignment\customer_churn_pipeline\data\raw_ingested_data")
+
+# The catalog only returns partitions whose write was committed
+catalog = PartitionCatalog()
+latest = catalog.latest(RAW, base_dir=base_data_dir)
+
+if latest is None:
+    logging.error("No complete partition found in raw_ingested_data.")
+    raise Exception("No complete partition found.")
+
+latest_partition = latest["partition_date"]
+latest_data_path = latest["path"]
 
 try:
-    df = pd.read_csv(latest_data_path)
-    logging.info(f"Loaded dataset with {df.shape[0]} rows and {df.shape[1]} columns")
-    logging.info("Cleaning data...")
-    df.drop_duplicates(inplace=True)
-    logging.info(f"Duplicates removed if any. New shape: {df.shape}")
-    logging.info(f"Data cleaned. New shape: {df.shape}")
     processed_path = os.getenv("PROCESSED_DATA_PATH_BASE")
     output_partition = os.path.join(processed_path, latest_partition)
-    os.makedirs(output_partition, exist_ok=True)
-    output_file = os.path.join(output_partition, "customer_churn_cleaned.csv")
-    df.to_csv(output_file, index=False)
+    if PREPARATION_MODE == "incremental":
+        row_index = RowIndex(ROW_INDEX_DIR or os.path.join(processed_path, "_row_index"))
+        # Looked up before begin() marks a re-run of the same partition as pending
+        previous = previous_cleaned(row_index)
+    catalog.begin(CLEANED, latest_partition, base_dir=processed_path)
+
+    if PREPARATION_MODE == "incremental":
+        output_file, row_count, row_fps, delta = clean_incrementally(latest, output_partition, row_index, previous)
+        logging.info(f"Incremental cleaning: {delta}")
+    else:
+        logging.info("Cleaning data...")
+        output_file, row_count = clean_partition(latest_data_path, output_partition)
+        logging.info(f"Data cleaned. New row count: {row_count}")
+
+    catalog.commit(CLEANED, latest_partition, output_file, row_count=row_count)
+    stage.add(rows_in=latest["row_count"], rows_out=row_count)
     logging.info(f"Cleaned data saved to: {output_file}")
+
+    if PREPARATION_MODE == "incremental":
+        row_index.save(
+            row_fps,
+            raw_partition=latest_partition,
+            raw_checksum=latest["checksum"],
+            cleaned_partition=latest_partition,
+            cleaned_checksum=catalog.get(CLEANED, latest_partition)["checksum"]
+        )
 except Exception as e:
+    catalog.fail(CLEANED, latest_partition)
     logging.error(f"Error in data preparation: {e}")
+    raise
@@ -1,10 +1,14 @@
-import pandas as pd
 import logging
 import os
+import sys
 from dotenv import load_dotenv
-from sklearn.preprocessing import StandardScaler
-import snowflake.connector
-from snowflake.connector.pandas_tools import write_pandas
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.bulk_loader import BulkLoader
+from common.catalog import CLEANED, TRANSFORMED, PartitionCatalog
+from common.instrumentation import span, start_stage
+from common.schema import SchemaRegistry, load_schema
+from common.transforms import derived_descriptions, load_rules, transformation_plan
 
 # Load env
 load_dotenv()
@@ -12,82 +16,99 @@ log_path = os.path.join(os.getenv("LOG_BASE_PATH"), "06_data_transformation.log"
 
 
 logging.basicConfig(filename=log_path, level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+stage = start_stage("Data Transformation")
 
-# === Dynamically Find Latest Partition Folder ===
+# === Find Latest Complete Partition ===
 base_data_dir = os.getenv("PROCESSED_DATA_PATH_BASE") #base path for processed data
 
-# Get all date folders
-partition_folders = [
-    f for f in os.listdir(base_data_dir)
-    if os.path.isdir(os.path.join(base_data_dir, f)) and f[:4].isdigit()
-]
-
-if not partition_folders:
-    logging.error("No partitioned date folders found in raw_ingested_data.")
-    raise Exception("No partition folders found.")
+# The catalog only returns partitions whose write was committed
+catalog = PartitionCatalog()
+latest = catalog.latest(CLEANED, base_dir=base_data_dir)
 
-# Sort and get the latest one
-latest_partition = sorted(partition_folders)[-1]
-latest_data_path = os.path.join(base_data_dir, latest_partition, "customer_churn_cleaned.csv")
+if latest is None:
+    logging.error("No complete partition found in processed.")
+    raise Exception("No complete partition found.")
 
-if not os.path.exists(latest_data_path):
-    logging.error(f"No CSV file found at expected location: {latest_data_path}")
-    raise FileNotFoundError(f"CSV not found: {latest_data_path}")
+latest_partition = latest["partition_date"]
+latest_data_path = latest["path"]
 
 logging.info("Starting data transformation...")
 
+# Leakage columns (future info) to drop and derived features, from the transformation config
+RULES = load_rules()
+schema = load_schema()
+
+# === Upload to Snowflake ===
+# Customer ID is not a feature but is the merge key of the warehouse table. The plan keeps it
+# and the transformed frames are staged while the partition is written (the key is not
+# written), then merged once the partition is committed
+LOAD_KEY = "Customer ID"
+LOAD_TABLE = "customer_churn_transformed"
+LOAD_CHUNK_ROWS = int(os.getenv("LOAD_CHUNK_ROWS", 50000))
+LOAD_MAX_WORKERS = int(os.getenv("LOAD_MAX_WORKERS", 4))
+upload_errors = []
+
+try:
+    loader = BulkLoader(chunk_rows=LOAD_CHUNK_ROWS, max_workers=LOAD_MAX_WORKERS)
+    upload = loader.start(LOAD_TABLE, key=LOAD_KEY)
+except Exception as e:
+    loader = upload = None
+    upload_errors.append(e)
+
+
+def stage_upload(frame):
+    """Stage a transformed frame; an upload failure stops the upload, not the transformation."""
+    if upload is None or upload_errors:
+        return
+    try:
+        frame = frame[[LOAD_KEY] + [col for col in frame.columns if col != LOAD_KEY]]
+        # The warehouse table keeps its int64/float64/text columns
+        upload.add(schema.widen(frame) if schema is not None else frame)
+    except Exception as e:
+        upload_errors.append(e)
+
+
 try:
-    df = pd.read_csv(latest_data_path)
-    
-    # Drop leakage columns (future info)
-    leakage_cols = [
-        'Customer Status', 'CLTV', 'Total Revenue', 'Total Charges',
-        'Churn Category', 'Churn Reason', 'Churn Score', 'Lat Long', 'Customer ID'
-    ]
-    df.drop(columns=leakage_cols, inplace=True, errors='ignore')
-    logging.info(f"Data transformed. New shape: {df.shape}")
+    # One lazy plan: the leakage columns are pruned from the scan, so never read
+    plan = transformation_plan(latest_data_path, RULES, keep=[LOAD_KEY])
+    logging.info(plan.explain())
 
     transformed_path = os.getenv("TRANSFORMED_DATA_PATH_BASE")
     output_partition = os.path.join(transformed_path, latest_partition)
-    os.makedirs(output_partition, exist_ok=True)
-    output_file = os.path.join(output_partition, "customer_churn_transformed.csv")
-    df.to_csv(output_file, index=False)
+    catalog.begin(TRANSFORMED, latest_partition, base_dir=transformed_path)
+    with span("transform"):
+        result = plan.sink(output_partition, "customer_churn_transformed", schema=schema,
+                           descriptions=derived_descriptions(RULES), on_frame=stage_upload, exclude=[LOAD_KEY])
+    output_file = result["path"]
+    if schema is not None and result["schema"].columns != schema.columns:
+        # Derived features are loaded with the schema downstream, register their dtypes
+        schema = SchemaRegistry().register(result["schema"])
+        logging.info(f"Registered schema {schema.name} v{schema.version} with the derived features")
+    catalog.commit(TRANSFORMED, latest_partition, output_file, row_count=result["rows"])
+    stage.add(rows_in=latest["row_count"], rows_out=result["rows"])
     logging.info(f"Transformed data saved to: {output_file}")
     logging.info("Transformation complete and saved.")
 except Exception as e:
+    catalog.fail(TRANSFORMED, latest_partition)
     logging.error(f"Transformation failed: {e}")
+    if upload is not None:
+        upload.abort()
+    raise
 
-
-# === Upload to Snowflake ===
 try:
-    conn = snowflake.connector.connect(
-        user="admin",
-        password="Aditya@9705064197",  # Use secrets manager in production
-        account="jerzgki-ye33911",
-        warehouse="COMPUTE_WH",
-        database="CUSTOMER_DB",
-        schema="TELECOM"
-    )
-    logging.info("Connected to Snowflake")
-
-    success, nchunks, nrows, _ = write_pandas(
-        conn=conn,
-        df=df,
-        table_name="customer_churn_transformed",
-        auto_create_table=True,
-        overwrite=True
+    if upload_errors:
+        raise upload_errors[0]
+    with span("warehouse_load"), loader:
+        result = upload.finish()
+
+    print(f"Upserted {result['rows']} rows into '{LOAD_TABLE}' in {loader.backend.name}.")
+    logging.info(
+        f"Upserted {result['rows']} rows into '{LOAD_TABLE}' "
+        f"({result['inserted']} inserted, {result['updated']} updated, {result['rows_per_sec']} rows/s)."
     )
 
-    if success:
-        print(f"Uploaded {nrows} rows to 'customer_churn_transformed' in Snowflake.")
-        logging.info(f"Uploaded {nrows} rows to 'customer_churn_transformed' in Snowflake.")
-    else:
-        print("Upload failed.")
-        logging.error("Upload to Snowflake failed.")
-
-    conn.close()
-    logging.info("Closed Snowflake connection.")
-
 except Exception as e:
+    if upload is not None:
+        upload.abort()
     logging.error(f"Snowflake upload error: {e}")
     print(f"Error uploading to Snowflake: {e}")
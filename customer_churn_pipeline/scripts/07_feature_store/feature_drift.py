@@ -0,0 +1,57 @@
+"""Print the feature drift between sketched partitions of the feature store.
+
+Reads only the per-partition feature sketches the feature store stage
+writes (see common/drift.py), never the partitions themselves.
+
+    python feature_drift.py                                  # latest partition against the previous one
+    python feature_drift.py --current 2025-09-01 --reference 2025-08-25
+    python feature_drift.py --window 7                       # latest against the 7 partitions before it
+    python feature_drift.py --list
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.drift import SketchStore
+from common.feature_store import default_store_path
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sketches", default=None, help="sketch directory, defaults to <feature store>/sketches")
+    parser.add_argument("--current", default=None, help="partition date, defaults to the latest sketched one")
+    parser.add_argument("--reference", nargs="+", default=None, help="partition dates to compare against, merged")
+    parser.add_argument("--window", type=int, default=1, help="compare against this many preceding partitions")
+    parser.add_argument("--top", type=int, default=20, help="features to print, most drifted first")
+    parser.add_argument("--list", action="store_true", help="list the sketched partition dates")
+    args = parser.parse_args()
+
+    store = SketchStore(args.sketches or os.path.join(default_store_path(), "sketches"))
+    dates = store.dates()
+    if not dates:
+        sys.exit(f"No feature sketches in {store.directory}")
+    if args.list:
+        print("\n".join(dates))
+        return
+
+    current = args.current or dates[-1]
+    reference = args.reference or store.previous(current, args.window)
+    if not reference:
+        sys.exit(f"No sketched partition before {current}")
+    start = time.perf_counter()
+    report = store.compare(reference, current)
+    seconds = time.perf_counter() - start
+    print(f"{current} against {', '.join(reference)} ({len(report)} features, {seconds * 1000:.1f} ms)")
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(report.head(args.top).round(4).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
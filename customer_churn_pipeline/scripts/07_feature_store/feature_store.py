@@ -2,43 +2,48 @@ import pandas as pd
 import os
 import json
 import logging
-import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import CLEANED, COMPLETE, TRANSFORMED, PartitionCatalog
+from common.drift import SketchStore
+from common.feature_store import KEY_COLUMN, FeatureStore
+from common.instrumentation import span, start_stage
+from common.schema import FEATURE_DESCRIPTIONS, load_schema
+from common.storage import count_rows, read_file
+
 load_dotenv()
 log_path = os.path.join(os.getenv("LOG_BASE_PATH"), "07_feature_store.log")
-feature_store_path = os.getenv("FEATURE_STORE_PATH")
+# Drift is measured against the previous partition and the last DRIFT_WINDOW partitions merged
+DRIFT_WINDOW = int(os.getenv("DRIFT_WINDOW", 7))
+DRIFT_PSI_ALERT = float(os.getenv("DRIFT_PSI_ALERT", 0.2))
 
 logging.basicConfig(filename=log_path, level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+stage = start_stage("Feature Store")
 
 logging.info("Storing features...")
 
-# === Dynamically Find Latest Partition Folder ===
+# === Find Latest Complete Partition ===
 base_data_dir = os.getenv("TRANSFORMED_DATA_PATH_BASE") #base path for transformed data
 
-# Get all date folders
-partition_folders = [
-    f for f in os.listdir(base_data_dir)
-    if os.path.isdir(os.path.join(base_data_dir, f)) and f[:4].isdigit()
-]
-
-if not partition_folders:
-    logging.error("No partitioned date folders found in raw_ingested_data.")
-    raise Exception("No partition folders found.")
+# The catalog only returns partitions whose write was committed
+catalog = PartitionCatalog()
+latest = catalog.latest(TRANSFORMED, base_dir=base_data_dir)
 
-# Sort and get the latest one
-latest_partition = sorted(partition_folders)[-1]
-latest_data_path = os.path.join(base_data_dir, latest_partition, "customer_churn_transformed.csv")
+if latest is None:
+    logging.error("No complete partition found in transformed.")
+    raise Exception("No complete partition found.")
 
-if not os.path.exists(latest_data_path):
-    logging.error(f"No CSV file found at expected location: {latest_data_path}")
-    raise FileNotFoundError(f"CSV not found: {latest_data_path}")
+latest_partition = latest["partition_date"]
+latest_data_path = latest["path"]
 
 
 
 # === File Paths ===
-feature_store_path = r"C:\Users\adity\Mtech\DMML\DMML_Assignment\customer_churn_pipeline\data\processed\feature_store.csv"
-meta_output_dir = r"C:\Users\adity\Mtech\DMML\DMML_Assignment\customer_churn_pipeline\data\feature_metadata"
+# Offline snapshots, online lookups and feature metadata (see common/feature_store.py)
+feature_store = FeatureStore()
+meta_output_dir = os.path.join(feature_store.directory, "metadata")
 os.makedirs(meta_output_dir, exist_ok=True)
 
 feature_with_date_csv = f"{latest_partition}_customer_churn_feature.csv"
@@ -46,82 +51,32 @@ feature_with_date_json = f"{latest_partition}_customer_churn_feature.json"
 json_output_path = os.path.join(meta_output_dir, feature_with_date_json)
 csv_output_path = os.path.join(meta_output_dir, feature_with_date_csv)
 
-# === Descriptions Dictionary (add as needed) ===
-feature_descriptions = {
-    "Age": "The customer's age in years.",
-    "Avg Monthly GB Download": "Average monthly data download in GB.",
-    "Avg Monthly Long Distance Charges": "Average monthly long distance call charges.",
-    "Churn": "1 if the customer churned, 0 otherwise.",
-    "Churn Category": "High-level category for customer's reason for churning.",
-    "Churn Reason": "Specific reason why the customer churned.",
-    "Churn Score": "Score between 0-100 indicating churn risk.",
-    "City": "Customer's city of residence.",
-    "CLTV": "Customer Lifetime Value — predicted revenue over customer's lifetime.",
-    "Contract": "Contract type (Month-to-Month, One year, Two year).",
-    "Country": "Country where the customer resides.",
-    "Customer ID": "Unique identifier for each customer.",
-    "Customer Status": "Current status (Stayed, Churned, Joined).",
-    "Dependents": "1 if the customer has dependents, 0 otherwise.",
-    "Device Protection Plan": "1 if the customer has a device protection plan.",
-    "Gender": "The customer's gender.",
-    "Internet Service": "1 if the customer has internet service, 0 otherwise.",
-    "Internet Type": "Type of internet connection (e.g., DSL, Fiber, Cable).",
-    "Lat Long": "Combined latitude and longitude of customer's residence.",
-    "Latitude": "Geographical latitude of the customer.",
-    "Longitude": "Geographical longitude of the customer.",
-    "Married": "1 if married, 0 otherwise.",
-    "Monthly Charge": "Monthly bill for the customer.",
-    "Multiple Lines": "1 if the customer has multiple phone lines.",
-    "Number of Dependents": "Total number of dependents for the customer.",
-    "Number of Referrals": "Number of people the customer referred.",
-    "Offer": "Last marketing offer accepted by the customer.",
-    "Online Backup": "1 if the customer has online backup service.",
-    "Online Security": "1 if the customer has online security service.",
-    "Paperless Billing": "1 if the customer uses paperless billing.",
-    "Partner": "1 if the customer has a partner.",
-    "Payment Method": "Customer’s chosen method of payment.",
-    "Phone Service": "1 if the customer has phone service.",
-    "Population": "Estimated population in the customer's ZIP code.",
-    "Premium Tech Support": "1 if the customer has premium tech support.",
-    "Quarter": "Fiscal quarter (e.g., Q1, Q2, etc.).",
-    "Referred a Friend": "1 if the customer referred a friend.",
-    "Satisfaction Score": "Customer satisfaction rating from 1 to 5.",
-    "Senior Citizen": "1 if customer is aged 65 or older.",
-    "State": "State where the customer lives.",
-    "Streaming Movies": "1 if the customer subscribes to movie streaming.",
-    "Streaming Music": "1 if the customer subscribes to music streaming.",
-    "Streaming TV": "1 if the customer subscribes to TV streaming.",
-    "Tenure in Months": "Number of months the customer has stayed.",
-    "Total Charges": "Total amount charged to the customer.",
-    "Total Extra Data Charges": "Total charges incurred for extra data.",
-    "Total Long Distance Charges": "Total long distance call charges.",
-    "Total Refunds": "Total amount refunded to the customer.",
-    "Total Revenue": "Total revenue generated from the customer.",
-    "Under 30": "1 if the customer is under 30 years old.",
-    "Unlimited Data": "1 if the customer has unlimited data plan.",
-    "Zip Code": "ZIP code of the customer’s residence."
-}
-
-
 # === Load Feature Store ===
 print("Loading feature store...")
-df = pd.read_csv(latest_data_path)
+schema = load_schema()
+df = read_file(latest_data_path, schema=schema)
+stage.add(rows_in=len(df))
 
 # === Extract Metadata ===
 print("Extracting feature metadata...")
 meta_store = []
 
-for col in df.columns:
-    metadata = {
-        "feature_name": col,
-        "data_type": str(df[col].dtype),
-        "num_unique_values": int(df[col].nunique()),
-        "num_missing_values": int(df[col].isnull().sum()),
-        "percentage_missing": float((df[col].isnull().mean()) * 100),
-        "description": feature_descriptions.get(col, "No description available."),
-        "version_info": latest_partition
-    }
-    meta_store.append(metadata)
+# Derived features are described in the transformation rules, registered with the schema
+descriptions = {col: spec.get("description") for col, spec in (schema.columns.items() if schema is not None else [])}
+descriptions.update(FEATURE_DESCRIPTIONS)
+
+with span("extract_metadata"):
+    for col in df.columns:
+        metadata = {
+            "feature_name": col,
+            "data_type": str(df[col].dtype),
+            "num_unique_values": int(df[col].nunique()),
+            "num_missing_values": int(df[col].isnull().sum()),
+            "percentage_missing": float((df[col].isnull().mean()) * 100),
+            "description": descriptions.get(col) or "No description available.",
+            "version_info": latest_partition
+        }
+        meta_store.append(metadata)
 
 # === Save Metadata as JSON ===
 print("Saving feature metadata as JSON...")
@@ -136,5 +91,51 @@ pd.DataFrame(meta_store).to_csv(csv_output_path, index=False)
 print("Feature metadata successfully stored.")
 print(f"JSON file saved to: {json_output_path}")
 print(f"CSV file saved to: {csv_output_path}")
-logging.info(f"Features stored to: {feature_store_path}")
 
+# === Materialize Features ===
+# Transformed rows carry no Customer ID; it is taken from the cleaned partition
+# they were derived from, row for row, as model scoring does
+cleaned = catalog.get(CLEANED, latest_partition)
+if cleaned is None or cleaned["status"] != COMPLETE or count_rows(cleaned["path"]) != len(df):
+    logging.error(f"No cleaned partition {latest_partition} matching the transformed rows; cannot key the features.")
+    raise Exception("No Customer ID for the transformed rows.")
+if schema is not None:
+    # Snapshots and sketches keep the int64/float64/object dtypes of the earlier partitions
+    df = schema.widen(df)
+df.insert(0, KEY_COLUMN, read_file(cleaned["path"], columns=[KEY_COLUMN])[KEY_COLUMN].to_numpy())
+
+# Only customers that are new or changed since the previous snapshot are written
+with span("materialize"):
+    snapshot = feature_store.materialize(df, latest_partition, source_checksum=latest["checksum"])
+stage.add(rows_out=0 if snapshot.get("skipped") else snapshot["rows"])
+
+print(f"Feature snapshot version {snapshot['version']} of {latest_partition}: "
+      f"{snapshot['inserted']} inserted, {snapshot['updated']} updated, {snapshot['deleted']} deleted, "
+      f"{snapshot['unchanged']} unchanged")
+logging.info(f"Features stored to: {feature_store.directory} (version {snapshot['version']}, {snapshot['rows']} rows)")
+
+
+# === Feature Drift ===
+# Every feature is sketched once per partition (see common/drift.py); drift
+# against earlier partitions is computed from the stored sketches only
+sketch_store = SketchStore(os.path.join(feature_store.directory, "sketches"))
+with span("sketch"):
+    sketch_store.sketch_partition(df.drop(columns=KEY_COLUMN), latest_partition)
+
+reference_dates = sketch_store.previous(latest_partition, DRIFT_WINDOW)
+if reference_dates:
+    with span("drift"):
+        drift_report = pd.concat([
+            sketch_store.compare(reference_dates[-1:], latest_partition).assign(reference=reference_dates[-1]),
+            sketch_store.compare(reference_dates, latest_partition).assign(
+                reference=f"{reference_dates[0]}..{reference_dates[-1]}"),
+        ], ignore_index=True)
+    drift_csv = os.path.join(meta_output_dir, f"{latest_partition}_feature_drift.csv")
+    drift_report.to_csv(drift_csv, index=False)
+    drifted = drift_report[drift_report["psi"] > DRIFT_PSI_ALERT]
+    for row in drifted.itertuples():
+        logging.warning(f"Feature drift in {row.feature} against {row.reference}: PSI {row.psi:.3f}, "
+                        f"JS {row.js_divergence:.3f}, KS {row.ks if row.ks == row.ks else '-'}")
+    print(f"Feature drift report saved to: {drift_csv} ({drifted['feature'].nunique()} features above PSI {DRIFT_PSI_ALERT})")
+else:
+    logging.info("No earlier feature sketches to measure drift against.")
@@ -1,22 +1,34 @@
-import pandas as pd
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
-from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
-from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import f1_score
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.ensemble import RandomForestClassifier
 import mlflow
 import mlflow.sklearn
 import mlflow.models.signature as signature
 import logging
+from datetime import datetime
 from dotenv import load_dotenv
 import sys
-import io
 import os
 
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import TRANSFORMED, PartitionCatalog
+from common.delta_index import compute_delta, fingerprint_frame, fingerprint_split
+from common.evaluation import SEGMENT_COLUMNS, EvaluationEngine, log_evaluation
+from common.incremental_training import (
+    ModelState, incremental_gate, population_stability, reference_distribution, update_model
+)
+from common.instrumentation import span, start_stage, traced
+from common.preprocessing_cache import PreprocessingCache, config_hash
+from common.schema import load_schema
+from common.scoring import ModelStore
+from common.training_engine import TrainingEngine, log_trials
+from common.storage import read_file
+
+sys.stdout.reconfigure(encoding='utf-8')
 
 # Load env
 load_dotenv()
@@ -29,31 +41,26 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
+stage = start_stage("Model Building")
 logging.info("Started model training for Logistic Regression and Random Forest")
 
-# === Dynamically Find Latest Partition Folder ===
+# === Find Latest Complete Partition ===
 base_data_dir = os.getenv("TRANSFORMED_DATA_PATH_BASE") #base path for processed data
 
-# Get all date folders
-partition_folders = [
-    f for f in os.listdir(base_data_dir)
-    if os.path.isdir(os.path.join(base_data_dir, f)) and f[:4].isdigit()
-]
-
-if not partition_folders:
-    logging.error("No partitioned date folders found in raw_ingested_data.")
-    raise Exception("No partition folders found.")
+# The catalog only returns partitions whose write was committed
+catalog = PartitionCatalog()
+latest = catalog.latest(TRANSFORMED, base_dir=base_data_dir)
 
-# Sort and get the latest one
-latest_partition = sorted(partition_folders)[-1]
-latest_data_path = os.path.join(base_data_dir, latest_partition, "customer_churn_transformed.csv")
+if latest is None:
+    logging.error("No complete partition found in transformed.")
+    raise Exception("No complete partition found.")
 
-if not os.path.exists(latest_data_path):
-    logging.error(f"No CSV file found at expected location: {latest_data_path}")
-    raise FileNotFoundError(f"CSV not found: {latest_data_path}")
+latest_partition = latest["partition_date"]
+latest_data_path = latest["path"]
 
 # === Load data (replace with your Snowflake or CSV loading logic) ===
-df = pd.read_csv(latest_data_path)
+df = read_file(latest_data_path, schema=load_schema())
+stage.add(rows_in=len(df))
 
 # === Drop leakage columns ===
 # leakage_cols = [
@@ -68,16 +75,20 @@ X = df.drop(columns=[target])
 y = df[target]
 
 # Fill missing categorical values
-for col in X.select_dtypes(include='object').columns:
-    X[col] = X[col].fillna('Missing')
+# (enum columns are loaded as category; the encoder and the scorer work on plain strings)
+for col in X.select_dtypes(include=['object', 'category']).columns:
+    X[col] = X[col].astype(object).fillna('Missing')
 
 # === Train-test split ===
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=42, stratify=y
-)
+# Split on the rows' content fingerprints rather than their positions: a row keeps its side
+# from one partition to the next, so the test rows never include rows a previous model trained on
+TEST_SIZE = 0.2
+fingerprints = fingerprint_frame(df)
+test_mask = fingerprint_split(fingerprints, TEST_SIZE)
+X_train, X_test, y_train, y_test = X[~test_mask], X[test_mask], y[~test_mask], y[test_mask]
 
 # === Preprocessing ===
-numeric_features = X_train.select_dtypes(include=['int64', 'float64']).columns.tolist()
+numeric_features = X_train.select_dtypes(include=['number', 'bool']).columns.tolist()
 categorical_features = X_train.select_dtypes(include=['object']).columns.tolist()
 
 numeric_transformer = Pipeline([
@@ -101,36 +112,195 @@ models = {
     "LogisticRegression": LogisticRegression(max_iter=1000)
 }
 
+# "incremental" updates the previous run's models with the new or changed rows
+# only (see common/incremental_training.py), "full" retrains from scratch
+TRAINING_MODE = os.getenv("TRAINING_MODE", "full").lower()
+if TRAINING_MODE == "incremental":
+    # LogisticRegression has no partial_fit; SGD on the log loss fits the same kind of model
+    models.pop("LogisticRegression")
+    models["SGDLogisticRegression"] = SGDClassifier(loss="log_loss", alpha=1e-4, random_state=42)
+
+# Hyperparameter grids searched when TRAINING_SEARCH is "grid" or "halving";
+# "fixed" trains the models above as they are
+param_grids = {
+    "RandomForest": {"n_estimators": [100, 200, 400], "max_depth": [None, 10, 20], "min_samples_leaf": [1, 5]},
+    "LogisticRegression": {"C": [0.1, 1.0, 10.0], "class_weight": [None, "balanced"]},
+    "SGDLogisticRegression": {"alpha": [1e-5, 1e-4, 1e-3], "class_weight": [None, "balanced"]}
+}
+TRAINING_SEARCH = os.getenv("TRAINING_SEARCH", "fixed").lower()
+TRAINING_N_JOBS = int(os.getenv("TRAINING_N_JOBS", 0)) or os.cpu_count()  # core budget
+TRAINING_SCORING = os.getenv("TRAINING_SCORING", "f1")
+TRAINING_HALVING_FACTOR = int(os.getenv("TRAINING_HALVING_FACTOR", 3))
+
+engine = TrainingEngine(
+    n_jobs=TRAINING_N_JOBS,
+    scoring=TRAINING_SCORING,
+    method="grid" if TRAINING_SEARCH == "fixed" else TRAINING_SEARCH,
+    factor=TRAINING_HALVING_FACTOR
+)
+
 # === MLflow setup ===
 mlflow.set_tracking_uri("http://localhost:5000")
 mlflow.set_experiment("CHURN_PREDICTION_EXPERIMENT")
 
-# === Model training and logging ===
-for model_name, model in models.items():
-    logging.info(f"Training {model_name}...")
 
-    pipeline = Pipeline([
-        ('preprocessor', preprocessor),
-        ('classifier', model)
-    ])
+@traced("train_full")
+def train_from_scratch():
+    """Fit the preprocessor and every model on the full training set."""
+    # === Fit preprocessing once, shared by every model ===
+    # Fitted transformer and memory-mapped train/test matrices are cached per partition
+    # and preprocessing config, so extra models and re-runs add no preprocessing cost
+    preprocessing_cache = PreprocessingCache(
+        os.getenv("PREPROCESSING_CACHE_DIR", os.path.join(base_data_dir, "_preprocessing_cache")),
+        keep=int(os.getenv("PREPROCESSING_CACHE_KEEP", 3))
+    )
+    preprocessing_key = config_hash(
+        preprocessor,
+        data_checksum=latest["checksum"],
+        numeric_features=numeric_features,
+        categorical_features=categorical_features,
+        test_size=TEST_SIZE,
+        split="fingerprint"
+    )
+    fitted_preprocessor, X_train_t, X_test_t = preprocessing_cache.get_or_fit(
+        latest_partition, preprocessing_key, preprocessor, X_train, X_test
+    )
+    logging.info(f"Preprocessed matrices: train {X_train_t.shape}, test {X_test_t.shape}")
+
+    # === Hyperparameter search (one parent run, one nested run per trial) ===
+    if TRAINING_SEARCH == "fixed":
+        best = {model_name: {"params": {}} for model_name in models}
+    else:
+        candidates = {model_name: (model, param_grids.get(model_name, {})) for model_name, model in models.items()}
+        with mlflow.start_run(run_name="hyperparameter_search"):
+            mlflow.log_params({"search_method": TRAINING_SEARCH, "core_budget": TRAINING_N_JOBS, "scoring": TRAINING_SCORING})
+            trials = engine.search(candidates, X_train_t, y_train)
+            log_trials(trials, TRAINING_SCORING)
+            best = engine.best_per_model(trials)
+            for model_name, trial in best.items():
+                mlflow.log_metric(f"best_{model_name}_validation_{TRAINING_SCORING}", trial["score"])
+                logging.info(f"Best {model_name}: {trial['params']} ({TRAINING_SCORING} {trial['score']:.4f})")
+
+    # === Fit the selected configurations on the full training set, in parallel ===
+    logging.info(f"Training {', '.join(models)} on {TRAINING_N_JOBS} cores...")
+    fitted_models = engine.refit({name: (model, {}) for name, model in models.items()}, best, X_train_t, y_train)
+
+    return fitted_preprocessor, X_test_t, fitted_models, best
 
-    with mlflow.start_run(run_name=model_name):
-        pipeline.fit(X_train, y_train)
-        y_pred = pipeline.predict(X_test)
 
-        acc = accuracy_score(y_test, y_pred)
-        report = classification_report(y_test, y_pred, output_dict=True)
-        conf_matrix = confusion_matrix(y_test, y_pred)
+@traced("train_incremental")
+def train_incrementally(previous, delta_index):
+    """Update the previous run's models with the new or changed training rows.
+
+    Returns the same tuple as ``train_from_scratch``, or None when the gate
+    asks for a full retrain.
+    """
+    meta, previous_preprocessor, previous_models, _ = previous or (None, None, {}, None)
+    reason = incremental_gate(
+        meta, model_config_key,
+        delta_rows=len(delta_index), total_rows=len(df),
+        delta_classes=y_train.loc[delta_index].unique(), classes=y.unique(),
+        psi=population_stability(meta["reference"], X) if meta else {},
+        models=previous_models,
+        max_delta_fraction=INCREMENTAL_MAX_DELTA, max_psi=INCREMENTAL_MAX_PSI, max_trees=INCREMENTAL_MAX_TREES
+    )
+    if reason:
+        logging.info(f"Full retrain: {reason}")
+        return None
+
+    X_test_t = previous_preprocessor.transform(X_test)
+    if len(delta_index) == 0:
+        logging.info("No new or changed training rows, keeping the previous models")
+        return previous_preprocessor, X_test_t, previous_models, {name: {"params": {}} for name in previous_models}
+
+    X_delta_t = previous_preprocessor.transform(X_train.loc[delta_index])
+    y_delta = y_train.loc[delta_index].to_numpy()
+    updated = {}
+    for model_name, model in previous_models.items():
+        # New trees in proportion to the new rows, so a forest grows with its data
+        extra_trees = max(1, round(getattr(model, "n_estimators", 0) * len(delta_index) / meta["train_rows"]))
+        updated[model_name] = update_model(model, X_delta_t, y_delta, extra_trees=extra_trees)
+        score = f1_score(y_test, updated[model_name].predict(X_test_t))
+        previous_score = f1_score(y_test, model.predict(X_test_t))
+        logging.info(f"{model_name} updated on {len(delta_index)} rows: f1 {previous_score:.4f} -> {score:.4f}")
+        if score < previous_score - INCREMENTAL_MAX_DEGRADATION:
+            logging.info(f"Full retrain: {model_name} lost more than {INCREMENTAL_MAX_DEGRADATION} f1 after the update")
+            return None
+    return previous_preprocessor, X_test_t, updated, {name: {"params": {}} for name in updated}
+
+
+# === Train (incrementally when the gate allows it) ===
+INCREMENTAL_MAX_DELTA = float(os.getenv("INCREMENTAL_MAX_DELTA", 0.3))
+INCREMENTAL_MAX_PSI = float(os.getenv("INCREMENTAL_MAX_PSI", 0.2))
+INCREMENTAL_MAX_TREES = int(os.getenv("INCREMENTAL_MAX_TREES", 1000))
+INCREMENTAL_MAX_DEGRADATION = float(os.getenv("INCREMENTAL_MAX_DEGRADATION", 0.02))
+
+trained = None
+if TRAINING_MODE == "incremental":
+    model_state = ModelState(os.getenv("MODEL_STATE_DIR", os.path.join(base_data_dir, "_model_state")))
+    model_config_key = config_hash(
+        preprocessor,
+        numeric_features=numeric_features,
+        categorical_features=categorical_features,
+        models={name: repr(model.get_params()) for name, model in models.items()},
+        # Models of a state saved with another split trained on today's test rows
+        split="fingerprint"
+    )
+    previous_state = model_state.load()
+    delta_index = X_train.index[:0]
+    if previous_state is not None:
+        _, new_mask, counts = compute_delta(previous_state[3], fingerprints)
+        # Only training rows may update the models; new test rows stay unseen
+        delta_index = df.index[new_mask].intersection(X_train.index)
+        logging.info(f"Rows changed since partition {previous_state[0]['partition']}: {counts}")
+    trained = train_incrementally(previous_state, delta_index)
+    training_kind = "incremental" if trained is not None else "full"
+else:
+    training_kind = "full"
+if trained is None:
+    trained = train_from_scratch()
+fitted_preprocessor, X_test_t, fitted_models, best = trained
+logging.info(f"Training mode: {training_kind}")
+
+# === Model evaluation and logging ===
+# Threshold curves, per-segment metrics and bootstrap confidence intervals
+# (see common/evaluation.py); the segments are columns of the test rows
+EVALUATION_SEGMENTS = [col.strip() for col in os.getenv("EVALUATION_SEGMENTS", ",".join(SEGMENT_COLUMNS)).split(",") if col.strip()]
+evaluator = EvaluationEngine(
+    segments=EVALUATION_SEGMENTS,
+    n_resamples=int(os.getenv("EVALUATION_BOOTSTRAP_RESAMPLES", 1000)),
+    confidence=float(os.getenv("EVALUATION_CONFIDENCE", 0.95)),
+    n_jobs=TRAINING_N_JOBS
+)
+segment_frame = df.loc[X_test.index, [col for col in EVALUATION_SEGMENTS if col in df.columns]]
+
+test_scores = {}
+for model_name, model in fitted_models.items():
+    with span(f"evaluate {model_name}"), mlflow.start_run(run_name=model_name):
+        y_pred = model.predict(X_test_t)
+        y_score = model.predict_proba(X_test_t)[:, list(model.classes_).index(1)]
+        evaluation = evaluator.evaluate(y_test, y_score, y_pred, frame=segment_frame)
+        metrics = evaluation["metrics"]
+
+        # Servable pipeline made of the already fitted steps (raw features in, prediction out)
+        pipeline = Pipeline([
+            ('preprocessor', fitted_preprocessor),
+            ('classifier', model)
+        ])
 
         print(f"Model: {model_name}")
-        print("Confusion Matrix:\n", conf_matrix)
-        print("Classification Report:\n", classification_report(y_test, y_pred))
+        print(f"Confusion Matrix:\n [[{metrics['tn']} {metrics['fp']}]\n [{metrics['fn']} {metrics['tp']}]]")
+        print(f"Best f1 {metrics['best_f1']:.4f} at threshold {metrics['best_f1_threshold']:.4f}")
+        if evaluation["intervals"] is not None:
+            print("Metrics with bootstrap intervals:\n", evaluation["intervals"].round(4).to_string(index=False))
 
         mlflow.log_param("model_type", model_name)
-        mlflow.log_metric("accuracy", acc)
-        mlflow.log_metric("precision_class_1", report['1']['precision'])
-        mlflow.log_metric("recall_class_1", report['1']['recall'])
-        mlflow.log_metric("f1_score_class_1", report['1']['f1-score'])
+        mlflow.log_params(best[model_name]["params"])
+        log_evaluation(evaluation)
+        mlflow.log_metric("precision_class_1", metrics["precision"])
+        mlflow.log_metric("recall_class_1", metrics["recall"])
+        mlflow.log_metric("f1_score_class_1", metrics["f1"])
+        test_scores[model_name] = metrics["f1"]
 
         input_example = X_train.head(3)
         model_signature = signature.infer_signature(input_example, pipeline.predict(input_example))
@@ -145,3 +315,37 @@ for model_name, model in models.items():
         # joblib.dump(pipeline, model_path)
         # logging.info(f"{model_name} model saved to {model_path}")
 
+# === Publish the best model for the scoring service ===
+serving_model = max(test_scores, key=test_scores.get)
+with span("publish"):
+    ModelStore(os.getenv("SERVING_MODEL_DIR", os.path.join(base_data_dir, "_serving"))).publish(
+        fitted_preprocessor, fitted_models[serving_model],
+        version=f"{latest_partition}_{serving_model}_{datetime.now().strftime('%Y%m%dT%H%M%S')}",
+        features={col: str(X_train[col].dtype) for col in numeric_features + categorical_features},
+        sample=X_test,
+        model_type=serving_model,
+        partition=latest_partition,
+        training=training_kind,
+        f1_score_class_1=test_scores[serving_model]
+    )
+logging.info(f"Published {serving_model} (f1 {test_scores[serving_model]:.4f}) for scoring")
+
+# === Keep the state the next incremental run starts from ===
+if TRAINING_MODE == "incremental":
+    if training_kind == "full":
+        state_train_rows = len(X_train)
+        state_reference = reference_distribution(X_train, numeric_features)
+    else:
+        # Drift keeps being measured against the last full retrain
+        state_train_rows = previous_state[0]["train_rows"] + len(delta_index)
+        state_reference = previous_state[0]["reference"]
+    model_state.save(
+        fitted_preprocessor, fitted_models, fingerprints,
+        partition=latest_partition,
+        config_key=model_config_key,
+        training=training_kind,
+        train_rows=state_train_rows,
+        reference=state_reference,
+        test_scores={name: float(score) for name, score in test_scores.items()}
+    )
+    logging.info(f"Saved model state for partition {latest_partition} to {model_state.directory}")
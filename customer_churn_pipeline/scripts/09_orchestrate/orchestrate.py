@@ -1,10 +1,23 @@
 import os
+import sys
 import subprocess
+import threading
 import logging
 from datetime import datetime
 from prefect import flow, get_run_logger, task
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.instrumentation import finish_stage, load_events, log_to_mlflow, span, start_stage, timeline
+from common.stage_cache import StageCache, run_cached
+from common.stage_runner import PIPELINE, run_stage_inprocess, run_stage_subprocess, topological_order, upstream
+
+try:
+    from prefect.task_runners import ThreadPoolTaskRunner
+except ImportError:  # Prefect 2 has no worker limit on its runner; the stage slots below enforce it
+    from prefect.task_runners import ConcurrentTaskRunner
+    ThreadPoolTaskRunner = None
+
 load_dotenv()
  
 # === Logging Setup ===
@@ -31,47 +44,134 @@ root_logger.addHandler(console_handler)
 logging.info("Orchestration script started.")
  
 PYTHON_EXECUTABLE = os.getenv("PYTHON_EXECUTABLE")
+# "subprocess" runs every stage in its own interpreter (isolation), "inprocess"
+# runs them as functions of this process and hands partitions over in memory
+ORCHESTRATION_MODE = os.getenv("ORCHESTRATION_MODE", "subprocess").lower()
+# Stages whose inputs are ready run concurrently, at most this many at once
+# (in-process stages share the interpreter's logging and stdout, so they still run one by one)
+PIPELINE_MAX_PARALLEL = int(os.getenv("PIPELINE_MAX_PARALLEL", 2))
+_stage_slots = threading.BoundedSemaphore(PIPELINE_MAX_PARALLEL)
+# Stages whose inputs, code and config match an earlier run reuse its outputs (common/stage_cache.py)
+PIPELINE_CACHE = os.getenv("PIPELINE_CACHE", "true").lower() == "true"
+PIPELINE_CACHE_MAX_AGE_DAYS = float(os.getenv("PIPELINE_CACHE_MAX_AGE_DAYS", 30))
+PIPELINE_CACHE_MAX_MB = int(os.getenv("PIPELINE_CACHE_MAX_MB", 2048))
+# "all" or comma-separated stage names that run even on a cache hit
+PIPELINE_FORCE_RERUN = os.getenv("PIPELINE_FORCE_RERUN", "")
+# A retried flow resumes at the failed stage (see flow_run_stage_key)
+PIPELINE_FLOW_RETRIES = int(os.getenv("PIPELINE_FLOW_RETRIES", 1))
+STAGES = {stage.name: stage for stage in PIPELINE}
+stage_cache = StageCache(max_age_days=PIPELINE_CACHE_MAX_AGE_DAYS,
+                         max_bytes=PIPELINE_CACHE_MAX_MB << 20) if PIPELINE_CACHE else None
+# Per-stage performance events (common/instrumentation.py) are also logged to MLflow after the run
+PIPELINE_EVENTS_MLFLOW = os.getenv("PIPELINE_EVENTS_MLFLOW", "true").lower() == "true"
+PIPELINE_EVENTS_EXPERIMENT = os.getenv("PIPELINE_EVENTS_EXPERIMENT", "churn_pipeline_runs")
+# Span of the running flow; task spans nest under it whichever thread runs them
+flow_span = None
  
-@task(retries=2, retry_delay_seconds=30, name="{script_name}")
-def run_script(script_path: str, script_name: str) -> str:
+
+def flow_run_stage_key(context, parameters):
+    # A retried flow run does not repeat the stages it already finished, cacheable or not
+    return f"{context.task_run.flow_run_id}-{parameters['script_name']}"
+
+
+@task(retries=2, retry_delay_seconds=30, name="{script_name}", cache_key_fn=flow_run_stage_key, persist_result=True)
+def run_script(script_path: str, script_name: str, mode: str = "subprocess", force: bool = False) -> str:
     logger = get_run_logger()
-    logging.info(f"Starting {script_name} ({script_path})")
+
+    def run():
+        with _stage_slots:
+            return _run_stage(logger, script_path, script_name, mode)
+
+    with span(script_name, parent=flow_span, mode=mode) as task_span:
+        result, key = run_cached(stage_cache, STAGES[script_name], script_path, run, force=force)
+        task_span.set(cache="off" if key is None else "hit" if result is None else "miss")
+    if result is None:
+        logger.info(f"{script_name} skipped: inputs unchanged, reused cached outputs {key[:12]}.")
+        logging.info(f"{script_name} skipped: inputs unchanged, reused cached outputs {key[:12]}.")
+    return script_name
+
+
+def _run_stage(logger, script_path, script_name, mode):
+    logging.info(f"Starting {script_name} ({script_path}, {mode})")
     try:
-        result = subprocess.run([PYTHON_EXECUTABLE, script_path], capture_output=True, text=True,encoding="utf-8",
-        errors="replace")
-        if result.returncode == 0:
-            logger.info(f"{script_path} completed successfully.")
-            logging.info(f"{script_path} completed successfully.")
+        if mode == "inprocess":
+            result = run_stage_inprocess(script_name, script_path)
         else:
-            logger.error(f"{script_path} failed:\n{result.stderr}")
-            logging.error(f"{script_path} failed:\n{result.stderr}")
-            raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+            result = run_stage_subprocess(script_name, script_path, python=PYTHON_EXECUTABLE)
+        logger.info(f"{script_path} completed successfully in {result['seconds']}s.")
+        logging.info(f"{script_path} completed successfully in {result['seconds']}s.")
+    except subprocess.CalledProcessError as e:
+        logger.error(f"{script_path} failed:\n{e.stderr}")
+        logging.error(f"{script_path} failed:\n{e.stderr}")
+        raise
     except Exception as e:
         logger.exception(f"Error running {script_path}: {e}")
         logging.exception(f"Error running {script_path}: {e}")
         raise
- 
-   
-    return script_name
+    return result
  
  
-@flow(name="Churn_Pipeline_Orchestration")
-def churn_pipeline_flow():
+def pipeline_task_runner():
+    if ThreadPoolTaskRunner is None:
+        return ConcurrentTaskRunner()
+    return ThreadPoolTaskRunner(max_workers=PIPELINE_MAX_PARALLEL)
+
+
+def publish_run_report(run_id):
+    """Log the run's timeline, attach it to the flow run and send its spans to MLflow."""
+    events = load_events(run=run_id)
+    report = timeline(events)
+    logging.info(f"Pipeline run {run_id} timeline:\n{report}")
+    try:
+        from prefect.artifacts import create_markdown_artifact
+        create_markdown_artifact(f"```\n{report}\n```", key="pipeline-timeline",
+                                 description=f"Per-stage timings of pipeline run {run_id}")
+    except Exception as e:
+        logging.warning(f"Could not create the timeline artifact: {e}")
+    if PIPELINE_EVENTS_MLFLOW:
+        try:
+            log_to_mlflow(events, experiment=PIPELINE_EVENTS_EXPERIMENT)
+        except Exception as e:
+            logging.warning(f"Could not log run {run_id} to MLflow: {e}")
+
+
+def forced(stage_name, force):
+    names = force if force is not None else PIPELINE_FORCE_RERUN
+    if isinstance(names, bool):
+        return names
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(",") if name.strip()]
+    return "all" in names or stage_name in names
+
+
+@flow(name="Churn_Pipeline_Orchestration", task_runner=pipeline_task_runner(),
+      retries=PIPELINE_FLOW_RETRIES, retry_delay_seconds=30)
+def churn_pipeline_flow(force=None):
+    """``force``: True or a list of stage names to run even when cached (default PIPELINE_FORCE_RERUN)."""
+    global flow_span
     base_path = os.getenv("BASE_PATH")  
+    # Stage subprocesses inherit the run id and tag their events with it
+    run_id = f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+    os.environ["PIPELINE_RUN_ID"] = run_id
+    flow_span = start_stage("Orchestration", mode=ORCHESTRATION_MODE, max_parallel=PIPELINE_MAX_PARALLEL)
  
-    scripts = [
-        ("Data Fetching", os.path.join(base_path, "01_data_fetching", "data_fetch.py")),
-        ("Data Ingestion", os.path.join(base_path, "02_data_ingestion", "data_ingest.py")),
-        ("Raw Data Storage", os.path.join(base_path, "03_raw_data_storage", "data_storage.py")),
-        ("Data Validation", os.path.join(base_path, "04_data_validation", "data_validation.py")),
-        ("Data Preparation", os.path.join(base_path, "05_data_preparation", "data_preparation.py")),
-        ("Data Transformation", os.path.join(base_path, "06_data_transformation_and_storage", "data_transform.py")),
-        ("Feature Store", os.path.join(base_path, "07_feature_store", "feature_store.py")),
-        ("Model Building", os.path.join(base_path, "08_model_building", "model_building.py")),
-    ]
- 
-    for script_name, script_path in scripts:
-        run_script.with_options(name=script_name)(script_path, script_name=script_name)
+    # Stages declare the datasets they read and write (common/stage_runner.py); each one
+    # is submitted as soon as the stages producing its inputs are, and waits for them
+    parents = upstream(PIPELINE)
+    futures = {}
+    for stage in topological_order(PIPELINE):
+        script_path = os.path.join(base_path, stage.script)
+        futures[stage.name] = run_script.with_options(name=stage.name).submit(
+            script_path, script_name=stage.name, mode=ORCHESTRATION_MODE, force=forced(stage.name, force),
+            wait_for=[futures[name] for name in parents[stage.name]]
+        )
+    for future in futures.values():
+        future.wait()
+    failed = any(event["status"] != "ok" for event in load_events(run=run_id))
+    finish_stage("error" if failed else "ok")
+    publish_run_report(run_id)
+    # Returning the futures makes the flow fail when any stage failed
+    return list(futures.values())
  
  
 if __name__ == "__main__":
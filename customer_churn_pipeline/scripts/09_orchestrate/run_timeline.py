@@ -0,0 +1,48 @@
+"""Print the per-stage timeline of a pipeline run, or compare two runs.
+
+Reads the performance events the stages append to PIPELINE_EVENTS_PATH
+(see common/instrumentation.py).
+
+    python run_timeline.py                  # latest run
+    python run_timeline.py --run <id>
+    python run_timeline.py --compare <id A> <id B>
+    python run_timeline.py --list
+"""
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.instrumentation import compare, events_path, load_events, run_ids, timeline
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", default=None, help="events file, defaults to PIPELINE_EVENTS_PATH")
+    parser.add_argument("--run", default=None, help="run id, defaults to the latest run")
+    parser.add_argument("--compare", nargs=2, metavar=("RUN_A", "RUN_B"))
+    parser.add_argument("--list", action="store_true", help="list the run ids in the events file")
+    parser.add_argument("--width", type=int, default=40)
+    args = parser.parse_args()
+
+    events = load_events(args.events or events_path())
+    runs = run_ids(events)
+    if not runs:
+        sys.exit(f"No events in {args.events or events_path()}")
+    if args.list:
+        for run in runs:
+            print(run, sum(event["run_id"] == run for event in events), "spans")
+    elif args.compare:
+        before, after = ([event for event in events if event["run_id"] == run] for run in args.compare)
+        print(compare(before, after))
+    else:
+        run = args.run or runs[-1]
+        print(timeline([event for event in events if event["run_id"] == run], width=args.width))
+
+
+if __name__ == "__main__":
+    main()
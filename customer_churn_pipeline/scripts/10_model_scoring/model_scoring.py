@@ -0,0 +1,94 @@
+import os
+import sys
+import json
+import logging
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import CLEANED, COMPLETE, DATASET_FILES, SCORED, TRANSFORMED, PartitionCatalog
+from common.feature_store import FeatureStore
+from common.instrumentation import span, start_stage
+from common.scoring import MicroBatcher, ModelStore, score_partition, serve
+from common.storage import count_rows, read_file
+
+load_dotenv()
+log_path = os.path.join(os.getenv("LOG_BASE_PATH"), "10_model_scoring.log")
+
+logging.basicConfig(filename=log_path, level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+stage = start_stage("Model Scoring")
+
+# "batch" scores the latest transformed partition, "serve" answers single
+# requests over HTTP (POST /score, GET /metrics, GET /health)
+SCORING_MODE = os.getenv("SCORING_MODE", "batch").lower()
+SCORING_CHUNK_ROWS = int(os.getenv("SCORING_CHUNK_ROWS", 50000))
+SCORING_THRESHOLD = float(os.getenv("SCORING_THRESHOLD", 0.5))
+SCORING_HOST = os.getenv("SCORING_HOST", "127.0.0.1")
+SCORING_PORT = int(os.getenv("SCORING_PORT", 8080))
+SCORING_MAX_BATCH = int(os.getenv("SCORING_MAX_BATCH", 64))
+SCORING_MAX_WAIT_MS = float(os.getenv("SCORING_MAX_WAIT_MS", 2))
+# "false" scores through the sklearn pipeline instead of the compiled NumPy predictor
+SCORING_COMPILED = os.getenv("SCORING_COMPILED", "true").lower() == "true"
+# "true" lets serve requests give only a Customer ID; its features come from the online feature store
+SCORING_FEATURE_LOOKUP = os.getenv("SCORING_FEATURE_LOOKUP", "true").lower() == "true"
+KEY_COLUMN = "Customer ID"
+
+base_data_dir = os.getenv("TRANSFORMED_DATA_PATH_BASE") #base path for transformed data
+
+# === Load the latest published model once ===
+model_store = ModelStore(os.getenv("SERVING_MODEL_DIR", os.path.join(base_data_dir, "_serving")))
+with span("load_model"):
+    scorer = model_store.load(os.getenv("SCORING_MODEL_VERSION") or None, compiled=SCORING_COMPILED)
+logging.info(f"Loaded model {scorer.version} ({scorer.meta.get('model_type')}, "
+             f"{'compiled' if scorer.compiled is not None else 'sklearn'})")
+
+if SCORING_MODE == "serve":
+    batcher = MicroBatcher(scorer, max_batch=SCORING_MAX_BATCH, max_wait_ms=SCORING_MAX_WAIT_MS,
+                           threshold=SCORING_THRESHOLD)
+    lookup = None
+    if SCORING_FEATURE_LOOKUP:
+        online = FeatureStore().online
+        if os.path.exists(online.path) and online.count():
+            lookup = online.get_many
+            logging.info(f"Serving features of {online.count()} customers from {online.path}")
+    print(f"Scoring model {scorer.version} on http://{SCORING_HOST}:{SCORING_PORT}")
+    serve(batcher, host=SCORING_HOST, port=SCORING_PORT, lookup=lookup)
+    sys.exit(0)
+
+# === Find Latest Complete Partition ===
+# The catalog only returns partitions whose write was committed
+catalog = PartitionCatalog()
+latest = catalog.latest(TRANSFORMED, base_dir=base_data_dir)
+
+if latest is None:
+    logging.error("No complete partition found in transformed.")
+    raise Exception("No complete partition found.")
+
+latest_partition = latest["partition_date"]
+latest_data_path = latest["path"]
+
+# Transformed rows carry no Customer ID; it is taken from the cleaned partition
+# they were derived from, row for row, as the warehouse upload does
+keys = None
+cleaned = catalog.get(CLEANED, latest_partition)
+if cleaned is not None and cleaned["status"] == COMPLETE and count_rows(cleaned["path"]) == count_rows(latest_data_path):
+    keys = read_file(cleaned["path"], columns=[KEY_COLUMN])[KEY_COLUMN].to_numpy()
+
+scored_base = os.getenv("SCORED_DATA_PATH_BASE", os.path.join(os.path.dirname(base_data_dir), "scored"))
+output_partition = os.path.join(scored_base, latest_partition)
+
+try:
+    catalog.begin(SCORED, latest_partition, base_dir=scored_base)
+    with span("score"):
+        summary = score_partition(
+            scorer, latest_data_path, output_partition, DATASET_FILES[SCORED],
+            chunk_rows=SCORING_CHUNK_ROWS, keys=keys, key_column=KEY_COLUMN, threshold=SCORING_THRESHOLD
+        )
+    catalog.commit(SCORED, latest_partition, summary["path"], row_count=summary["rows"])
+    stage.add(rows_in=latest["row_count"], rows_out=summary["rows"])
+except Exception as e:
+    catalog.fail(SCORED, latest_partition)
+    logging.error(f"Batch scoring failed: {e}")
+    raise
+
+print(json.dumps(summary, indent=2))
+logging.info(f"Scored partition {latest_partition}: {summary}")
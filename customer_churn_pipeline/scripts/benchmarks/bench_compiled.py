@@ -0,0 +1,117 @@
+"""Parity check and benchmark of the compiled predictor against the sklearn pipeline.
+
+A logistic regression, an SGD log-loss classifier and a random forest are
+fitted on the latest transformed partition with the preprocessing of
+model_building.py, then compiled. For each model:
+
+* parity: the compiled probabilities must equal ``Pipeline.predict_proba``
+  bit for bit on every held-out row, scored as one batch and row by row,
+  from a DataFrame and from JSON-style records. Any mismatch exits non-zero.
+* speed: median latency of a 1-row call and of a ``--batch-rows`` call
+  (rows resampled from the partition), sklearn vs compiled.
+
+    python bench_compiled.py --batch-rows 10000 --repeat 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import TRANSFORMED, PartitionCatalog
+from common.compiled_predictor import compile_pipeline
+from common.storage import read_file
+
+MODELS = {
+    "LogisticRegression": LogisticRegression(max_iter=1000),
+    "SGDLogisticRegression": SGDClassifier(loss="log_loss", alpha=1e-4, random_state=42),
+    "RandomForest": RandomForestClassifier(n_estimators=100, random_state=42),
+}
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--parity-rows", type=int, default=200, help="held-out rows also checked one at a time")
+    args = parser.parse_args()
+
+    latest = PartitionCatalog().latest(TRANSFORMED, base_dir=os.getenv("TRANSFORMED_DATA_PATH_BASE"))
+    df = read_file(latest["path"])
+    X, y = df.drop(columns=["Churn"]), df["Churn"]
+    for col in X.select_dtypes(include="object").columns:
+        X[col] = X[col].fillna("Missing")
+    X_train, X_test, y_train, _ = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+    numeric = X_train.select_dtypes(include=["int64", "float64"]).columns.tolist()
+    categorical = X_train.select_dtypes(include=["object"]).columns.tolist()
+    preprocessor = ColumnTransformer([
+        ("num", Pipeline([("imputer", SimpleImputer(strategy="median")), ("scaler", StandardScaler())]), numeric),
+        ("cat", Pipeline([("imputer", SimpleImputer(strategy="constant", fill_value="Missing")),
+                          ("onehot", OneHotEncoder(handle_unknown="ignore"))]), categorical),
+    ]).fit(X_train)
+    X_train_t = preprocessor.transform(X_train)
+
+    records = X_test.astype(object).where(X_test.notna(), None).to_dict("records")
+    batch = X_test.sample(args.batch_rows, replace=len(X_test) < args.batch_rows, random_state=42)
+    one_row, one_record = X_test.iloc[:1], records[:1]
+
+    rows = []
+    failures = 0
+    for name, model in MODELS.items():
+        model.fit(X_train_t, y_train)
+        pipeline = Pipeline([("preprocessor", preprocessor), ("classifier", model)])
+        compiled = compile_pipeline(preprocessor, model)
+
+        expected = pipeline.predict_proba(X_test)
+        checks = {
+            "frame": np.array_equal(compiled.predict_proba(X_test), expected),
+            "records": np.array_equal(compiled.predict_proba(records), expected),
+            "row_by_row": all(
+                np.array_equal(compiled.predict_proba(records[i:i + 1]), pipeline.predict_proba(X_test.iloc[i:i + 1]))
+                for i in range(min(args.parity_rows, len(records)))
+            ),
+            "predict": np.array_equal(compiled.predict(X_test), pipeline.predict(X_test)),
+        }
+        failures += not all(checks.values())
+
+        sklearn_1 = median_ms(lambda: pipeline.predict_proba(one_row), args.repeat)
+        compiled_1 = median_ms(lambda: compiled.predict_proba(one_record), args.repeat)
+        sklearn_n = median_ms(lambda: pipeline.predict_proba(batch), max(3, args.repeat // 10))
+        compiled_n = median_ms(lambda: compiled.predict_proba(batch), max(3, args.repeat // 10))
+        rows.append({
+            "model": name,
+            "parity": "ok" if all(checks.values()) else ",".join(k for k, ok in checks.items() if not ok),
+            "sklearn_1_ms": round(sklearn_1, 3),
+            "compiled_1_ms": round(compiled_1, 3),
+            "speedup_1": round(sklearn_1 / compiled_1, 1),
+            f"sklearn_{args.batch_rows}_ms": round(sklearn_n, 1),
+            f"compiled_{args.batch_rows}_ms": round(compiled_n, 1),
+            f"speedup_{args.batch_rows}": round(sklearn_n / compiled_n, 1),
+        })
+
+    print(pd.DataFrame(rows).to_string(index=False))
+    if failures:
+        sys.exit(f"{failures} model(s) do not match the sklearn pipeline bit for bit")
+
+
+if __name__ == "__main__":
+    main()
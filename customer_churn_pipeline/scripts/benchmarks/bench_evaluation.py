@@ -0,0 +1,116 @@
+"""Compare common/evaluation.py with per-metric sklearn calls on synthetic scored rows.
+
+For every ``--rows`` size, labels, churn probabilities, predictions and the
+segment columns (State, Contract, Internet Type, Offer, as categoricals)
+are generated, and the script times:
+
+* curve: ``threshold_curve`` vs sklearn's ``precision_recall_curve``,
+  ``roc_curve``, ``roc_auc_score`` and ``average_precision_score``,
+* segments: ``segment_metrics`` vs a pandas ``groupby().apply`` of the
+  sklearn metrics,
+* bootstrap: ``bootstrap_intervals`` with ``--resamples`` resamples vs a
+  loop of sklearn metrics over index resamples. The loop runs
+  ``--baseline-resamples`` resamples and is scaled to ``--resamples``.
+
+    python bench_evaluation.py --rows 10000 1000000 --resamples 1000 --cores 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import (
+    accuracy_score, average_precision_score, f1_score, precision_recall_curve, precision_score, recall_score,
+    roc_auc_score, roc_curve
+)
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.evaluation import SEGMENT_COLUMNS, bootstrap_intervals, segment_metrics, threshold_curve
+
+SEGMENT_SIZES = {"State": 50, "Contract": 3, "Internet Type": 4, "Offer": 6}
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def scored_rows(n_rows, seed=42):
+    rng = np.random.default_rng(seed)
+    y_true = rng.random(n_rows) < 0.27
+    scores = np.clip(0.3 * y_true + 0.8 * rng.random(n_rows), 0, 1)
+    frame = pd.DataFrame({
+        col: pd.Categorical(rng.choice([f"{col} {i}" for i in range(size)], n_rows))
+        for col, size in SEGMENT_SIZES.items()
+    })
+    return y_true, scores, scores >= 0.5, frame
+
+
+def sklearn_metrics(y_true, y_pred, scores):
+    return {
+        "accuracy": accuracy_score(y_true, y_pred),
+        "precision": precision_score(y_true, y_pred, zero_division=0),
+        "recall": recall_score(y_true, y_pred, zero_division=0),
+        "f1": f1_score(y_true, y_pred, zero_division=0),
+        "roc_auc": roc_auc_score(y_true, scores) if 0 < y_true.sum() < len(y_true) else np.nan,
+        "average_precision": average_precision_score(y_true, scores),
+    }
+
+
+def sklearn_curve(y_true, scores):
+    precision_recall_curve(y_true, scores)
+    roc_curve(y_true, scores)
+    roc_auc_score(y_true, scores)
+    average_precision_score(y_true, scores)
+
+
+def sklearn_segments(y_true, y_pred, scores, frame):
+    rows = frame.assign(y_true=y_true, y_pred=y_pred, score=scores)
+    for col in SEGMENT_COLUMNS:
+        rows.groupby(col, observed=True).apply(
+            lambda g: pd.Series(sklearn_metrics(g["y_true"].to_numpy(), g["y_pred"].to_numpy(), g["score"].to_numpy())),
+            include_groups=False
+        )
+
+
+def sklearn_bootstrap(y_true, y_pred, scores, n_resamples):
+    rng = np.random.default_rng(42)
+    for _ in range(n_resamples):
+        rows = rng.integers(0, len(y_true), len(y_true))
+        sklearn_metrics(y_true[rows], y_pred[rows], scores[rows])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000])
+    parser.add_argument("--resamples", type=int, default=1000)
+    parser.add_argument("--baseline-resamples", type=int, default=5)
+    parser.add_argument("--cores", type=int, default=None, help="bootstrap workers, defaults to every core")
+    args = parser.parse_args()
+
+    rows = []
+    for n_rows in args.rows:
+        y_true, scores, y_pred, frame = scored_rows(n_rows)
+        baseline_bootstrap = timed(lambda: sklearn_bootstrap(y_true, y_pred, scores, args.baseline_resamples))
+        timings = {
+            "curve": (timed(lambda: sklearn_curve(y_true, scores)), timed(lambda: threshold_curve(y_true, scores))),
+            "segments": (timed(lambda: sklearn_segments(y_true, y_pred, scores, frame)),
+                         timed(lambda: segment_metrics(y_true, y_pred, scores, frame))),
+            "bootstrap": (baseline_bootstrap * args.resamples / args.baseline_resamples,
+                          timed(lambda: bootstrap_intervals(y_true, y_pred, scores, args.resamples, n_jobs=args.cores))),
+        }
+        for step, (sklearn_s, engine_s) in timings.items():
+            rows.append({"rows": n_rows, "step": step, "sklearn_s": sklearn_s, "engine_s": engine_s})
+
+    report = pd.DataFrame(rows)
+    report["speedup"] = report["sklearn_s"] / report["engine_s"]
+    pd.set_option("display.width", 200)
+    print(f"{args.resamples} bootstrap resamples (sklearn extrapolated from {args.baseline_resamples})")
+    print(report.round(3).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
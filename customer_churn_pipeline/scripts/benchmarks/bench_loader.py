@@ -0,0 +1,72 @@
+"""Benchmark the bulk loader against a local SQLite warehouse.
+
+The raw CSV is scaled up ``--scale`` times (with distinct Customer IDs) and
+upserted with different chunk sizes and worker counts. Every configuration
+runs twice on a fresh database: the first load inserts every row, the second
+updates every row, which is the steady state of a daily re-ingest.
+
+    python bench_loader.py --scale 20 --workers 1 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.bulk_loader import BulkLoader
+from common.warehouse import SQLiteBackend
+
+DEFAULT_CSV = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "raw_data_from_API", "telco_customer_churn.csv"
+)
+
+
+def scale_up(df, scale):
+    copies = []
+    for i in range(scale):
+        copy = df.copy()
+        copy["Customer ID"] = copy["Customer ID"] + f"-{i}"
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=os.getenv("CSV_DATA_FROM_API", DEFAULT_CSV))
+    parser.add_argument("--scale", type=int, default=20)
+    parser.add_argument("--chunk-rows", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    df = scale_up(pd.read_csv(args.csv), args.scale)
+    print(f"Loading {len(df):,} rows x {df.shape[1]} columns")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for chunk_rows in args.chunk_rows:
+            for workers in args.workers:
+                backend = SQLiteBackend(os.path.join(tmp, f"wh_{chunk_rows}_{workers}.db"))
+                with BulkLoader(backend, chunk_rows=chunk_rows, max_workers=workers) as loader:
+                    for run in ("insert", "update"):
+                        start = time.perf_counter()
+                        result = loader.load(df, table="customer_churn", key="Customer ID")
+                        seconds = time.perf_counter() - start
+                        chunk_rate = pd.Series([c["rows_per_sec"] for c in result["chunk_stats"]])
+                        rows.append({
+                            "chunk_rows": chunk_rows,
+                            "workers": workers,
+                            "run": run,
+                            "seconds": round(seconds, 3),
+                            "rows_per_sec": round(len(df) / seconds),
+                            "median_chunk_rows_per_sec": round(chunk_rate.median()),
+                            "inserted": result["inserted"],
+                            "updated": result["updated"],
+                        })
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Benchmark end-to-end wall time of the pipeline in subprocess and in-process mode.
+
+The selected stages (by default those that only need local data: 04-06, 08
+and 10) run in dependency order:
+
+* subprocess: one fresh interpreter per stage, one stage after the other,
+* parallel: one fresh interpreter per stage, each stage started as soon as
+  its upstream stages finished, at most ``--parallel`` at once,
+* inprocess: one fresh interpreter for the whole run, every stage executed
+  in it with partitions handed over in memory,
+* cached (``--cache``): sequential subprocess runs through a stage cache in a
+  scratch directory, once cold (every stage runs and is stored) and once
+  warm (every cacheable stage's outputs are restored instead).
+
+All totals include interpreter start-up. The critical path (the longest
+dependency chain, from the sequential stage timings) is the lower bound of
+the parallel total. The environment (.env) is the one the stages normally
+use, so point it at a scratch data directory.
+
+    python bench_orchestration.py --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SCRIPTS_DIR)
+from common.stage_cache import StageCache, run_cached
+from common.stage_runner import (
+    PIPELINE, critical_path, run_dag, run_stage_inprocess, run_stage_subprocess, topological_order
+)
+
+DEFAULT_STAGES = ["Data Validation", "Data Preparation", "Data Transformation", "Model Building", "Model Scoring"]
+
+
+def selected(names):
+    unknown = set(names) - {stage.name for stage in PIPELINE}
+    if unknown:
+        sys.exit(f"Unknown stages: {sorted(unknown)}")
+    return [stage for stage in topological_order(PIPELINE) if stage.name in names]
+
+
+def run_inprocess_worker(names):
+    results = [run_stage_inprocess(stage.name, os.path.join(SCRIPTS_DIR, stage.script)) for stage in selected(names)]
+    print(json.dumps(results))
+
+
+def run_through_cache(cache, stages, mode):
+    rows = []
+    for stage in stages:
+        script_path = os.path.join(SCRIPTS_DIR, stage.script)
+        start = time.perf_counter()
+        result, _ = run_cached(cache, stage, script_path, lambda: run_stage_subprocess(stage.name, script_path))
+        rows.append({"stage": stage.name, "mode": mode, "seconds": round(time.perf_counter() - start, 3),
+                     "hit": result is None})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", nargs="+", default=DEFAULT_STAGES)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--parallel", type=int, default=2, help="stages run at once in parallel mode")
+    parser.add_argument("--cache", action="store_true", help="also time cold and warm stage-cache runs")
+    parser.add_argument("--inprocess-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.inprocess_worker:
+        run_inprocess_worker(args.stages)
+        return
+
+    stages = selected(args.stages)
+    print("Stages:", " -> ".join(stage.name for stage in stages))
+    rows = []
+    for repeat in range(args.repeat):
+        start = time.perf_counter()
+        for stage in stages:
+            result = run_stage_subprocess(stage.name, os.path.join(SCRIPTS_DIR, stage.script))
+            rows.append({"repeat": repeat, **result})
+        rows.append({"repeat": repeat, "stage": "TOTAL", "mode": "subprocess",
+                     "seconds": round(time.perf_counter() - start, 3)})
+        sequential = {row["stage"]: row["seconds"] for row in rows if row["repeat"] == repeat}
+        path_seconds, path = critical_path(stages, sequential)
+        rows.append({"repeat": repeat, "stage": "CRITICAL PATH", "mode": "subprocess", "seconds": path_seconds})
+
+        start = time.perf_counter()
+        results = run_dag(
+            stages, lambda stage: run_stage_subprocess(stage.name, os.path.join(SCRIPTS_DIR, stage.script)),
+            max_parallel=args.parallel
+        )
+        rows.extend({"repeat": repeat, **result, "mode": "parallel"} for result in results.values())
+        rows.append({"repeat": repeat, "stage": "TOTAL", "mode": "parallel",
+                     "seconds": round(time.perf_counter() - start, 3)})
+
+        start = time.perf_counter()
+        worker = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--inprocess-worker", "--stages", *args.stages],
+            capture_output=True, text=True, check=True
+        )
+        total = time.perf_counter() - start
+        rows.extend({"repeat": repeat, **result} for result in json.loads(worker.stdout.strip().splitlines()[-1]))
+        rows.append({"repeat": repeat, "stage": "TOTAL", "mode": "inprocess", "seconds": round(total, 3)})
+
+        if args.cache:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                cache = StageCache(cache_dir)
+                for mode in ("cached_cold", "cached_warm"):
+                    start = time.perf_counter()
+                    results = run_through_cache(cache, stages, mode)
+                    rows.extend({"repeat": repeat, **result} for result in results)
+                    rows.append({"repeat": repeat, "stage": "TOTAL", "mode": mode,
+                                 "seconds": round(time.perf_counter() - start, 3)})
+                    print(f"{mode}: cache hits {[r['stage'] for r in results if r['hit']]}")
+
+    df = pd.DataFrame(rows).drop(columns="hit", errors="ignore")
+    table = df.groupby(["stage", "mode"], sort=False)["seconds"].median().unstack("mode")
+    for mode in ("parallel", "inprocess", "cached_warm"):
+        if mode not in table:
+            continue
+        table[f"{mode}_speedup"] = (table["subprocess"] / table[mode]).round(2)
+    print(table.to_string())
+    print("Critical path:", " -> ".join(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Benchmark the pipeline stages at several data sizes and flag regressions.
+
+A synthetic data profile (common/synthetic.py) is learned from a raw
+partition, by default the latest one in the catalog. Then, for each scale,
+a raw partition of that many rows is generated into a scratch lake and the
+selected stages run on it, each in its own interpreter as in production.
+Every data path, the catalog, the model directories and the warehouse
+(SQLite) point into the scratch lake, so the real data is never touched.
+
+For each stage and scale it records:
+
+* seconds and throughput (raw rows per second, interpreter start-up included),
+* peak resident memory, from the stage's performance event (common/instrumentation.py).
+
+With ``--baseline`` the results are compared to a stored baseline of the
+same stages and scales. A stage whose throughput dropped, or whose peak
+memory grew, by more than ``--tolerance`` is reported as a regression and
+the script exits with status 1. ``--update-baseline`` stores the results as
+the new baseline. Baselines are machine specific; record them on the
+machine that runs the comparison.
+
+    python bench_pipeline_scale.py --rows 10000 100000 1000000
+    python bench_pipeline_scale.py --rows 100000 --baseline baseline.json --update-baseline
+    python bench_pipeline_scale.py --rows 100000 --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import pandas as pd
+from dotenv import load_dotenv
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SCRIPTS_DIR)
+from common.catalog import RAW, PartitionCatalog
+from common.instrumentation import load_events
+from common.stage_runner import PIPELINE, run_stage_subprocess, topological_order
+from common.storage import count_rows, read_file
+from common.synthetic import learn_profile, load_profile, save_profile, write_synthetic_partition
+
+load_dotenv()
+
+DEFAULT_STAGES = ["Data Validation", "Data Preparation", "Data Transformation", "Model Building", "Model Scoring"]
+PARTITION_DATE = "2000-01-01"
+GENERATION = "Synthetic Generation"
+
+
+def selected(names):
+    unknown = set(names) - {stage.name for stage in PIPELINE}
+    if unknown:
+        sys.exit(f"Unknown stages: {sorted(unknown)}")
+    return [stage for stage in topological_order(PIPELINE) if stage.name in names]
+
+
+def source_profile(args):
+    if args.profile and os.path.exists(args.profile):
+        return load_profile(args.profile)
+    path = args.source
+    if path is None:
+        latest = PartitionCatalog().latest(RAW, base_dir=os.getenv("OUTPUT_FOLDER_BASE"))
+        if latest is None:
+            sys.exit("No raw partition to learn the synthetic data from; pass --source")
+        path = latest["path"]
+    profile = learn_profile(read_file(path), source={"path": path})
+    if args.profile:
+        save_profile(profile, args.profile)
+    return profile
+
+
+def scratch_env(lake, run_id):
+    """Environment pointing every stage input and output into ``lake``."""
+    paths = {
+        "OUTPUT_FOLDER_BASE": "raw",
+        "PROCESSED_DATA_PATH_BASE": "processed",
+        "TRANSFORMED_DATA_PATH_BASE": "transformed",
+        "SCORED_DATA_PATH_BASE": "scored",
+        "DATA_VALIDATION_REPORT_PATH": "validation",
+        "FEATURE_STORE_PATH": "feature_store",
+        "LOG_BASE_PATH": "logs",
+        "LOG_DIR": "logs",
+        "PARTITION_CATALOG_PATH": "catalog.db",
+        "PIPELINE_EVENTS_PATH": "logs/pipeline_events.jsonl",
+        "WAREHOUSE_SQLITE_PATH": "warehouse.db",
+        "WAREHOUSE_CACHE_DIR": "_warehouse_cache",
+        "SERVING_MODEL_DIR": "transformed/_serving",
+        "MODEL_STATE_DIR": "transformed/_model_state",
+        "PREPROCESSING_CACHE_DIR": "transformed/_preprocessing_cache",
+        "ROW_INDEX_DIR": "processed/_row_index",
+        "DEDUP_SPILL_DIR": "processed/_dedup_spill",
+        "PIPELINE_CACHE_DIR": "_stage_cache",
+    }
+    env = {name: os.path.join(lake, path) for name, path in paths.items()}
+    for name in ("raw", "processed", "transformed", "scored", "validation", "feature_store", "logs"):
+        os.makedirs(os.path.join(lake, name), exist_ok=True)
+    return {**env, "WAREHOUSE_BACKEND": "sqlite", "PIPELINE_RUN_ID": run_id}
+
+
+def run_scale(profile, stages, rows, workdir, chunk_rows, seed):
+    lake = os.path.join(workdir, f"rows_{rows}")
+    shutil.rmtree(lake, ignore_errors=True)
+    run_id = f"scale-{rows}-{uuid.uuid4().hex[:8]}"
+    env = scratch_env(lake, run_id)
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        start = time.perf_counter()
+        path = write_synthetic_partition(profile, rows, os.path.join(env["OUTPUT_FOLDER_BASE"], PARTITION_DATE),
+                                         "customer_churn_raw", chunk_rows=chunk_rows, seed=seed)
+        seconds = time.perf_counter() - start
+        catalog = PartitionCatalog(env["PARTITION_CATALOG_PATH"])
+        catalog.commit(RAW, PARTITION_DATE, path, row_count=count_rows(path))
+        catalog.close()
+        results = [{"stage": GENERATION, "seconds": seconds, "peak_rss_mb": None}]
+
+        for stage in stages:
+            result = run_stage_subprocess(stage.name, os.path.join(SCRIPTS_DIR, stage.script))
+            results.append({"stage": stage.name, "seconds": result["seconds"]})
+        peaks = {
+            event["stage"]: event["peak_rss_mb"]
+            for event in load_events(env["PIPELINE_EVENTS_PATH"], run=run_id) if event["span"] == event["stage"]
+        }
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    for result in results:
+        result.update(rows=rows, rows_per_sec=round(rows / result["seconds"], 1), seconds=round(result["seconds"], 3))
+        result.setdefault("peak_rss_mb", peaks.get(result["stage"]))
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """Results that are slower, or use more memory, than the baseline by more than ``tolerance``."""
+    reference = {(row["stage"], row["rows"]): row for row in baseline["results"]}
+    found = []
+    for row in results:
+        base = reference.get((row["stage"], row["rows"]))
+        if base is None:
+            continue
+        if row["rows_per_sec"] < base["rows_per_sec"] * (1 - tolerance):
+            found.append(f"{row['stage']} @ {row['rows']} rows: {row['rows_per_sec']} rows/s "
+                         f"(baseline {base['rows_per_sec']})")
+        if row["peak_rss_mb"] and base.get("peak_rss_mb") and row["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            found.append(f"{row['stage']} @ {row['rows']} rows: peak RSS {row['peak_rss_mb']} MB "
+                         f"(baseline {base['peak_rss_mb']})")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", nargs="+", type=int, default=[10_000, 100_000], help="scale factors, in raw rows")
+    parser.add_argument("--stages", nargs="+", default=DEFAULT_STAGES)
+    parser.add_argument("--source", default=None, help="partition to learn from, defaults to the latest raw one")
+    parser.add_argument("--profile", default=None, help="synthetic profile JSON to reuse (created if missing)")
+    parser.add_argument("--workdir", default=None, help="scratch lake directory, defaults to a temporary one")
+    parser.add_argument("--chunk-rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=None, help="baseline JSON to compare with")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown or memory growth")
+    args = parser.parse_args()
+
+    stages = selected(args.stages)
+    profile = source_profile(args)
+    print("Stages:", " -> ".join(stage.name for stage in stages))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="churn_scale_")
+    results = []
+    try:
+        for rows in sorted(args.rows):
+            results.extend(run_scale(profile, stages, rows, workdir, args.chunk_rows, args.seed))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    df = pd.DataFrame(results)
+    for metric in ("seconds", "rows_per_sec", "peak_rss_mb"):
+        print(f"\n{metric}")
+        print(df.pivot(index="stage", columns="rows", values=metric).loc[df["stage"].unique()].to_string())
+
+    if args.baseline and args.update_baseline:
+        baseline = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "cpu_count": os.cpu_count(), "results": results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print("REGRESSION:", line)
+        if found:
+            sys.exit(1)
+        print(f"\nNo regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
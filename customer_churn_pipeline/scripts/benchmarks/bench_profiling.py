@@ -0,0 +1,101 @@
+"""Benchmark the column profiler of 04_data_validation against the original loop.
+
+The latest raw partition is scaled up ``--scale`` times (Customer ID and the
+continuous columns are perturbed so the copies are not exact duplicates)
+and profiled with:
+
+* the original per-column loop (isnull/nunique/is_unique/mode),
+* the single-pass exact profiler, serial and with ``--jobs`` workers,
+* the approximate (HyperLogLog + heavy hitters) profiler.
+
+    python bench_profiling.py --scale 50 --jobs 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import profile_frame
+from common.storage import find_partition_file, read_file
+
+DEFAULT_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "raw_ingested_data")
+
+
+def legacy_profile(df):
+    """The loop data_validation.py used before the profiler (statistics only)."""
+    report = []
+    for col in df.columns:
+        data = df[col]
+        n_unique = data.nunique()
+        report.append({
+            "Column": col,
+            "Data Type": str(data.dtype),
+            "Missing (%)": round(data.isnull().mean() * 100, 2),
+            "Unique Values": n_unique,
+            "Is Constant": n_unique == 1,
+            "Is Unique": data.is_unique,
+            "Most Frequent Value": data.mode().iloc[0] if not data.mode().empty else None
+        })
+    return report
+
+
+def scale_up(df, scale, seed=42):
+    rng = np.random.default_rng(seed)
+    copies = []
+    for i in range(scale):
+        copy = df.copy()
+        if "Customer ID" in copy.columns:
+            copy["Customer ID"] = copy["Customer ID"] + f"-{i}"
+        for col in copy.select_dtypes(include="float64").columns:
+            copy[col] = (copy[col] * rng.uniform(0.95, 1.05, len(copy))).round(2)
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", default=os.getenv("OUTPUT_FOLDER_BASE", DEFAULT_BASE))
+    parser.add_argument("--scale", type=int, default=50)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    latest = sorted(f for f in os.listdir(args.base) if f[:4].isdigit())[-1]
+    df = scale_up(read_file(find_partition_file(os.path.join(args.base, latest), "customer_churn_raw")), args.scale)
+    print(f"Profiling {len(df):,} rows x {df.shape[1]} columns (partition {latest} x{args.scale})")
+
+    legacy_time, legacy = timed(lambda: legacy_profile(df))
+    runs = [
+        ("legacy loop", legacy_time, legacy),
+        ("exact, 1 job", *timed(lambda: profile_frame(df))),
+        (f"exact, {args.jobs} jobs", *timed(lambda: profile_frame(df, n_jobs=args.jobs))),
+        ("approximate, 1 job", *timed(lambda: profile_frame(df, approximate=True))),
+        (f"approximate, {args.jobs} jobs", *timed(lambda: profile_frame(df, n_jobs=args.jobs, approximate=True))),
+    ]
+
+    expected = pd.DataFrame(legacy)
+    rows = []
+    for name, seconds, result in runs:
+        result = pd.DataFrame(result)
+        unique_error = (result["Unique Values"] - expected["Unique Values"]).abs() / expected["Unique Values"].clip(lower=1)
+        rows.append({
+            "profiler": name,
+            "seconds": round(seconds, 3),
+            "speedup": round(legacy_time / seconds, 2),
+            "matches_legacy": result.astype(str).equals(expected.astype(str)),
+            "max_unique_error_%": round(unique_error.max() * 100, 2)
+        })
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
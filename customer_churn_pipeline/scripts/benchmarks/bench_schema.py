@@ -0,0 +1,117 @@
+"""Compare loading the partitions with pandas' inferred dtypes and with the registered schema.
+
+For every raw, processed and transformed partition under ``--data`` (default
+``customer_churn_pipeline/data``) the script reports, for CSV and for
+Parquet written from each load:
+
+* load time (parse, plus validation and casting for the schema load),
+* in-memory size (``memory_usage(deep=True)``),
+* size on disk (Parquet only; the CSV file is the same for both).
+
+Timings are the best of ``--repeat`` runs. Partitions that do not conform
+to the schema (the 2025-08-16/17 extracts have another layout) are listed
+with their first violation and skipped.
+
+    python bench_schema.py --repeat 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.schema import SchemaRegistry
+from common.storage import find_partition_file, read_file, write_partition
+
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data")
+LAYERS = {
+    "raw": ("raw_ingested_data", "customer_churn_raw"),
+    "processed": ("processed", "customer_churn_cleaned"),
+    "transformed": ("transformed", "customer_churn_transformed"),
+}
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+def partitions(data):
+    for layer, (folder, name) in LAYERS.items():
+        base = os.path.join(data, folder)
+        if not os.path.isdir(base):
+            continue
+        for partition in sorted(f for f in os.listdir(base) if f[:4].isdigit()):
+            path = find_partition_file(os.path.join(base, partition), name)
+            if path is not None:
+                yield layer, partition, path
+
+
+def bench_partition(path, schema, workdir, repeat):
+    inferred = read_file(path)
+    compact = read_file(path, schema=schema)
+    results = [{
+        "format": "csv",
+        "inferred_load_s": best_of(repeat, lambda: read_file(path)),
+        "schema_load_s": best_of(repeat, lambda: read_file(path, schema=schema)),
+        "inferred_mb": memory_mb(inferred),
+        "schema_mb": memory_mb(compact),
+    }]
+    inferred_path = write_partition(inferred, os.path.join(workdir, "inferred"), "bench", fmt="parquet", export_csv=False)
+    compact_path = write_partition(compact, os.path.join(workdir, "schema"), "bench", fmt="parquet", export_csv=False)
+    results.append({
+        "format": "parquet",
+        # Parquet keeps the compact dtypes, so the schema load only validates
+        "inferred_load_s": best_of(repeat, lambda: read_file(inferred_path)),
+        "schema_load_s": best_of(repeat, lambda: read_file(compact_path, schema=schema)),
+        "inferred_mb": memory_mb(read_file(inferred_path)),
+        "schema_mb": memory_mb(read_file(compact_path)),
+        "inferred_kb": os.path.getsize(inferred_path) / 1024,
+        "schema_kb": os.path.getsize(compact_path) / 1024,
+    })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DEFAULT_DATA)
+    parser.add_argument("--registry", default=None, help="schema registry directory, defaults to SCHEMA_REGISTRY_PATH")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    schema = SchemaRegistry(args.registry).get()
+    if schema is None:
+        sys.exit("No schema registered; run 04_data_validation/register_schema.py first")
+    print(f"Schema {schema.name} v{schema.version}")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for layer, partition, path in partitions(args.data):
+            violations = schema.validate(read_file(path))
+            if violations:
+                print(f"Skipping {layer} {partition}: {len(violations)} violation(s), e.g. {violations[0]}")
+                continue
+            folder = os.path.join(workdir, layer, partition)
+            for result in bench_partition(path, schema, folder, args.repeat):
+                rows.append({"layer": layer, "partition": partition, **result})
+
+    report = pd.DataFrame(rows)
+    report["memory_ratio"] = report["schema_mb"] / report["inferred_mb"]
+    report["load_ratio"] = report["schema_load_s"] / report["inferred_load_s"]
+    pd.set_option("display.width", 200)
+    print(report.round(4).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark batch and online scoring with the latest published model.
+
+Batch: the latest transformed partition is scored with ``score_partition``
+at several chunk sizes. Online: single-record requests are sent by
+``--clients`` concurrent threads, once scored one call per request and once
+through the ``MicroBatcher``. Each run reports p50/p99 latency and rows per
+second.
+
+    python bench_scoring.py --requests 2000 --clients 1 8 32
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import TRANSFORMED, PartitionCatalog
+from common.scoring import LatencyStats, MicroBatcher, ModelStore, score_partition
+from common.storage import read_file
+
+
+def run_clients(score_one, records, clients):
+    stats = LatencyStats()
+
+    def request(record):
+        start = time.perf_counter()
+        score_one(record)
+        stats.record(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(request, records))
+    seconds = time.perf_counter() - start
+    snapshot = stats.snapshot()
+    return {"p50_ms": snapshot["p50_ms"], "p99_ms": snapshot["p99_ms"], "rows_per_sec": round(len(records) / seconds, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default=None, help="defaults to <TRANSFORMED_DATA_PATH_BASE>/_serving")
+    parser.add_argument("--chunk-rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--sklearn", action="store_true", help="score through sklearn, not the compiled predictor")
+    args = parser.parse_args()
+
+    base = os.getenv("TRANSFORMED_DATA_PATH_BASE")
+    start = time.perf_counter()
+    scorer = ModelStore(args.model_dir or os.path.join(base, "_serving")).load(compiled=not args.sklearn)
+    print(f"Loaded model {scorer.version} ({'sklearn' if scorer.compiled is None else 'compiled'}) in {time.perf_counter() - start:.3f}s")
+    latest = PartitionCatalog().latest(TRANSFORMED, base_dir=base)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for chunk_rows in args.chunk_rows:
+            summary = score_partition(scorer, latest["path"], out_dir, "scores", chunk_rows=chunk_rows)
+            rows.append({"mode": f"batch chunk={chunk_rows}", "clients": 1, "p50_ms": summary["p50_ms"],
+                         "p99_ms": summary["p99_ms"], "rows_per_sec": summary["busy_rows_per_sec"]})
+
+    df = read_file(latest["path"]).drop(columns=["Churn"], errors="ignore")
+    sample = df.sample(args.requests, replace=len(df) < args.requests, random_state=42)
+    records = sample.astype(object).where(sample.notna(), None).to_dict("records")
+
+    for clients in args.clients:
+        direct = run_clients(lambda r: scorer.score_records([r]), records, clients)
+        rows.append({"mode": "online direct", "clients": clients, **direct})
+        batcher = MicroBatcher(scorer, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+        batched = run_clients(lambda r: batcher.score([r]), records, clients)
+        batch_sizes = batcher.batch_stats.snapshot()
+        batcher.close()
+        rows.append({"mode": "online micro-batched", "clients": clients, **batched,
+                     "mean_batch": round(batch_sizes["rows"] / batch_sizes["calls"], 1)})
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare CSV with the columnar partition formats on the raw ingested partitions.
+
+For every partition under ``OUTPUT_FOLDER_BASE`` (default
+``data/raw_ingested_data``) the script writes the data once per format and
+reports write time, full load time, projected load time (a handful of
+columns) and size on disk. Timings are the best of ``--repeat`` runs.
+
+    python bench_storage.py --repeat 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.storage import find_partition_file, read_file, write_partition
+
+DEFAULT_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "raw_ingested_data")
+PROJECTED_COLUMNS = ["Customer ID", "Contract", "Monthly Charge", "Tenure in Months", "Churn"]
+FORMATS = ["csv", "parquet", "feather"]
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_partition(df, workdir, repeat):
+    columns = [col for col in PROJECTED_COLUMNS if col in df.columns]
+    results = []
+    for fmt in FORMATS:
+        folder = os.path.join(workdir, fmt)
+        write_time = best_of(repeat, lambda: write_partition(df, folder, "bench", fmt=fmt, export_csv=False))
+        path = find_partition_file(folder, "bench")
+        results.append({
+            "format": fmt,
+            "write_s": write_time,
+            "load_s": best_of(repeat, lambda: read_file(path)),
+            "load_projected_s": best_of(repeat, lambda: read_file(path, columns=columns)),
+            "size_kb": os.path.getsize(path) / 1024
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", default=os.getenv("OUTPUT_FOLDER_BASE", DEFAULT_BASE))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    partitions = sorted(
+        f for f in os.listdir(args.base)
+        if os.path.isdir(os.path.join(args.base, f)) and f[:4].isdigit()
+    )
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for partition in partitions:
+            path = find_partition_file(os.path.join(args.base, partition), "customer_churn_raw")
+            if path is None:
+                continue
+            df = read_file(path)
+            for result in bench_partition(df, os.path.join(workdir, partition), args.repeat):
+                rows.append({"partition": partition, "rows": len(df), **result})
+
+    report = pd.DataFrame(rows)
+    csv_baseline = report[report["format"] == "csv"].set_index("partition")
+    for metric in ["load_s", "size_kb"]:
+        report[f"{metric}_vs_csv"] = report[metric] / report["partition"].map(csv_baseline[metric])
+    pd.set_option("display.width", 200)
+    print(report.round(4).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
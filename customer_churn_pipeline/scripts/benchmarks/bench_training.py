@@ -0,0 +1,83 @@
+"""Benchmark the training engine's grid and halving search across core budgets.
+
+The latest transformed partition is preprocessed the way model_building.py
+does it, then the same candidate grid is swept with every ``--cores`` budget,
+with both the exhaustive grid and successive halving. Wall-clock time should
+drop as the budget grows, up to the number of trials or physical cores.
+
+    python bench_training.py --cores 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import TRANSFORMED, PartitionCatalog
+from common.storage import read_file
+from common.training_engine import TrainingEngine, expand_grid
+
+CANDIDATES = {
+    "RandomForest": (
+        RandomForestClassifier(random_state=42),
+        {"n_estimators": [100, 200], "max_depth": [None, 10, 20], "min_samples_leaf": [1, 5]},
+    ),
+    "LogisticRegression": (LogisticRegression(max_iter=1000), {"C": [0.1, 1.0, 10.0], "class_weight": [None, "balanced"]}),
+}
+
+
+def load_matrices():
+    latest = PartitionCatalog().latest(TRANSFORMED, base_dir=os.getenv("TRANSFORMED_DATA_PATH_BASE"))
+    df = read_file(latest["path"])
+    X, y = df.drop(columns=["Churn"]), df["Churn"]
+    numeric = X.select_dtypes(include=["int64", "float64"]).columns.tolist()
+    categorical = X.select_dtypes(include=["object"]).columns.tolist()
+    preprocessor = ColumnTransformer([
+        ("num", Pipeline([("imputer", SimpleImputer(strategy="median")), ("scaler", StandardScaler())]), numeric),
+        ("cat", Pipeline([("imputer", SimpleImputer(strategy="constant", fill_value="Missing")),
+                          ("onehot", OneHotEncoder(handle_unknown="ignore"))]), categorical),
+    ])
+    return preprocessor.fit_transform(X), y.to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cores", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--methods", nargs="+", default=["grid", "halving"])
+    args = parser.parse_args()
+
+    X, y = load_matrices()
+    n_trials = sum(len(expand_grid(grid)) for _, grid in CANDIDATES.values())
+    print(f"Sweeping {n_trials} configurations on {X.shape[0]:,} rows")
+    rows = []
+    for method in args.methods:
+        baseline = None
+        for cores in args.cores:
+            engine = TrainingEngine(n_jobs=cores, method=method)
+            start = time.perf_counter()
+            trials = engine.search(CANDIDATES, X, y)
+            seconds = time.perf_counter() - start
+            baseline = baseline or seconds
+            best = engine.best_per_model(trials)
+            rows.append({
+                "method": method,
+                "cores": cores,
+                "trials": len(trials),
+                "fits": sum(len(t["rounds"]) for t in trials),
+                "seconds": round(seconds, 2),
+                "speedup": round(baseline / seconds, 2),
+                **{f"best_{name}_f1": round(trial["score"], 4) for name, trial in best.items()},
+            })
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Compare the eager pandas steps of stages 05/06 with the lazy plans of common/transforms.py.
+
+The latest raw partition (or ``--source``) is replicated ``--scale`` times
+and written once per format. Then, for both stages' steps, the script times:
+
+* eager: load the whole file, ``drop_duplicates`` (05) or drop the leakage
+  columns after loading only the kept ones (06), write the partition,
+* plan: the rules' plan streamed into the partition (``Plan.sink``).
+
+Timings are the best of ``--repeat`` runs and include writing the output.
+
+    python bench_transforms.py --scale 1 10 50 --formats csv parquet
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import RAW, PartitionCatalog
+from common.schema import load_schema
+from common.storage import read_columns, read_file, write_partition
+from common.transforms import load_rules, preparation_plan, transformation_plan
+
+load_dotenv()
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def eager_preparation(path, out, schema):
+    write_partition(read_file(path, schema=schema).drop_duplicates(), out, "cleaned")
+
+
+def eager_transformation(path, out, schema, rules):
+    leakage = rules["transformation"]["drop"]
+    keep = [col for col in read_columns(path) if col not in leakage]
+    write_partition(read_file(path, columns=keep, schema=schema), out, "transformed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=None, help="partition to replicate, defaults to the latest raw one")
+    parser.add_argument("--scale", nargs="+", type=int, default=[1, 10])
+    parser.add_argument("--formats", nargs="+", default=["csv", "parquet"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    path = args.source
+    if path is None:
+        latest = PartitionCatalog().latest(RAW, base_dir=os.getenv("OUTPUT_FOLDER_BASE"))
+        if latest is None:
+            sys.exit("No raw partition to benchmark; pass --source")
+        path = latest["path"]
+    df = read_file(path)
+    schema = load_schema()
+    rules = load_rules()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in args.scale:
+            data = pd.concat([df] * scale, ignore_index=True)
+            for fmt in args.formats:
+                source = write_partition(data, os.path.join(workdir, f"{scale}_{fmt}"), "source", fmt=fmt, export_csv=False)
+                out = os.path.join(workdir, "out")
+                timings = {
+                    ("05 preparation", "eager"): lambda: eager_preparation(source, out, schema),
+                    ("05 preparation", "plan"): lambda: preparation_plan(source, rules).sink(out, "cleaned", schema=schema),
+                    ("06 transformation", "eager"): lambda: eager_transformation(source, out, schema, rules),
+                    ("06 transformation", "plan"): lambda: transformation_plan(source, rules).sink(out, "transformed", schema=schema),
+                }
+                for (step, engine), func in timings.items():
+                    rows.append({"rows": len(data), "format": fmt, "step": step, "engine": engine,
+                                 "seconds": best_of(args.repeat, func)})
+
+    report = pd.DataFrame(rows).pivot_table(index=["step", "format", "rows"], columns="engine", values="seconds")
+    report["speedup"] = report["eager"] / report["plan"]
+    pd.set_option("display.width", 200)
+    print(report.round(4).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Local stand-in for the Hugging Face datasets-server ``/rows`` endpoint.
+
+Serves the rows of a CSV file in the same JSON shape as the real endpoint so
+the fetcher in 01_data_fetching can be exercised offline:
+
+    python local_rows_server.py --csv ../../data/raw_data_from_API/telco_customer_churn.csv --port 8765
+
+and then run data_fetch.py with BASE_URL=http://127.0.0.1:8765/rows.
+``--latency`` and ``--fail-rate`` simulate a slow or flaky upstream.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+
+def load_records(csv_path):
+    df = pd.read_csv(csv_path)
+    # NaN is not valid JSON, the real endpoint sends null
+    return json.loads(df.to_json(orient="records"))
+
+
+def make_server(records, host="127.0.0.1", port=0, max_length=100, latency=0.0, fail_rate=0.0):
+    """Build (but do not start) a server answering ``/rows`` requests from ``records``."""
+
+    class RowsHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/rows":
+                self._send(404, {"error": "Not found"})
+                return
+            query = parse_qs(url.query)
+            offset = int(query.get("offset", ["0"])[0])
+            length = int(query.get("length", ["100"])[0])
+            if length > max_length:
+                self._send(422, {"error": f"length must be <= {max_length}"})
+                return
+
+            if latency:
+                time.sleep(latency)
+            if fail_rate and random.random() < fail_rate:
+                self._send(503, {"error": "Service temporarily unavailable"})
+                return
+
+            page = records[offset:offset + length]
+            self._send(200, {
+                "features": [{"feature_idx": i, "name": name} for i, name in enumerate(records[0] if records else [])],
+                "rows": [
+                    {"row_idx": offset + i, "row": row, "truncated_cells": []}
+                    for i, row in enumerate(page)
+                ],
+                "num_rows_total": len(records),
+                "num_rows_per_page": max_length,
+                "partial": False
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), RowsHandler)
+
+
+def serve_in_thread(records, **kwargs):
+    """Start a server on a free port in a daemon thread and return ``(server, base_url)``."""
+    server = make_server(records, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/rows"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", required=True, help="CSV file whose rows are served")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-length", type=int, default=100, help="Largest page the server accepts")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    server = make_server(
+        load_records(args.csv), args.host, args.port,
+        max_length=args.max_length, latency=args.latency, fail_rate=args.fail_rate
+    )
+    print(f"Serving {args.csv} on http://{args.host}:{args.port}/rows")
+    server.serve_forever()
@@ -0,0 +1 @@
+"""Shared helpers used by the numbered pipeline stage scripts."""
@@ -0,0 +1,246 @@
+"""Parallel bulk upsert of a DataFrame into a warehouse table.
+
+The frame is split into chunks of ``chunk_rows`` rows. Each chunk is written
+to a local Parquet file and staged by a worker thread on a pooled
+connection. Once every chunk is staged, the staging table is merged into
+the target on ``key`` (insert new keys, update existing ones) in one
+statement, so the target is never truncated and a failed load leaves it
+untouched. The exception is a target that cannot be merged into, because
+it has no key column or rows without a key (a table written before the key
+was loaded): the first load replaces its rows instead, in one statement.
+Per-chunk rows, bytes and throughput are logged and returned.
+``BulkLoader.start`` stages a stream of frames the same way, without
+holding the whole result in memory.
+
+Works with any backend from ``common.warehouse``.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from common.warehouse import ConnectionPool, frame_columns, get_client, quote_identifier
+
+logger = logging.getLogger(__name__)
+
+
+class BulkLoader:
+
+    def __init__(self, backend=None, pool=None, chunk_rows=50000, max_workers=4, compression="snappy", tmp_dir=None):
+        if backend is None and pool is None:
+            # Share the process-wide client's sessions with the other stages
+            client = get_client()
+            backend, pool = client.backend, client.pool
+        self.backend = backend
+        self._owns_pool = pool is None
+        self.pool = pool or ConnectionPool(self.backend, size=max_workers)
+        self.chunk_rows = chunk_rows
+        self.max_workers = max_workers
+        self.compression = compression
+        self.tmp_dir = tmp_dir
+
+    def _needs_replace(self, conn, table, key):
+        """True when ``table`` exists but its rows cannot be merged on ``key``.
+
+        A table created before the key was loaded (or by another writer) has
+        no key column, or rows without a key; MERGE would never match those
+        rows and every load would add a second copy next to them.
+        """
+        existing = self.backend.table_columns(conn, table)
+        if existing is None:
+            return False
+        if key not in existing:
+            return True
+        cur = self.backend.execute(
+            conn, f"SELECT COUNT(*) FROM {quote_identifier(table)} WHERE {quote_identifier(key)} IS NULL"
+        )
+        return cur.fetchone()[0] > 0
+
+    def _prepare_target(self, conn, df, table):
+        columns = frame_columns(self.backend, df)
+        existing = self.backend.table_columns(conn, table)
+        if existing is None:
+            self.backend.create_table(conn, table, columns)
+            logger.info("Created table %s with %d columns", table, len(columns))
+            return
+        missing = [(name, sql_type) for name, sql_type in columns if name not in existing]
+        if missing:
+            self.backend.add_columns(conn, table, missing)
+            logger.info("Added columns %s to %s", [name for name, _ in missing], table)
+
+    def _stage_chunk(self, number, chunk, work_dir, staging_table, load_id):
+        start = time.perf_counter()
+        path = os.path.join(work_dir, f"chunk_{number:05d}.parquet")
+        pq.write_table(pa.Table.from_pandas(chunk, preserve_index=False), path, compression=self.compression)
+        size = os.path.getsize(path)
+        with self.pool.connection() as conn:
+            self.backend.stage_chunk(conn, path, staging_table, load_id)
+        os.remove(path)
+        seconds = time.perf_counter() - start
+        stats = {
+            "chunk": number,
+            "rows": len(chunk),
+            "bytes": size,
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(len(chunk) / seconds, 1) if seconds else None,
+            "mb_per_sec": round(size / 1024 / 1024 / seconds, 2) if seconds else None,
+        }
+        logger.info("Staged chunk %d: %d rows, %d bytes in %.3fs (%.0f rows/s)",
+                    number, len(chunk), size, seconds, stats["rows_per_sec"] or 0)
+        return stats
+
+    def start(self, table, key):
+        """A ``BulkLoad`` into ``table`` on ``key``, to feed frame by frame."""
+        return BulkLoad(self, table, key)
+
+    def load(self, df, table, key):
+        """Upsert ``df`` into ``table`` on ``key`` and return a summary of the load."""
+        if key not in df.columns:
+            raise ValueError(f"Merge key '{key}' is not a column of the frame")
+        duplicates = int(df[key].duplicated(keep="last").sum())
+        if duplicates:
+            # MERGE needs one source row per key, the last one wins
+            logger.warning("Dropping %d rows with a repeated %s before loading", duplicates, key)
+            df = df.drop_duplicates(subset=key, keep="last")
+        load = self.start(table, key)
+        try:
+            load.add(df)
+        except Exception:
+            load.abort()
+            raise
+        return load.finish()
+
+    def close(self):
+        if self._owns_pool:
+            self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BulkLoad:
+    """One upsert, staged frame by frame as the frames arrive.
+
+    ``add`` splits each frame into chunks that the loader's workers stage
+    while the caller produces the next frame (at most ``max_workers`` chunks
+    are pending, so memory stays bounded). ``finish`` merges the staging
+    table into the target; ``abort`` drops it and leaves the target
+    untouched. A key repeated within a frame keeps its last row; a key
+    already staged from an earlier frame keeps the staged row. A target
+    without the key column, or with rows without a key, is replaced by the
+    load instead (once; later loads merge).
+    """
+
+    def __init__(self, loader, table, key):
+        self.loader = loader
+        self.table = table
+        self.key = key
+        self.load_id = uuid.uuid4().hex[:12]
+        self.staging_table = f"{table}__stage_{self.load_id}"
+        self.columns = None
+        self.replace = False
+        self.rows = 0
+        self._keys = set()
+        self._pending = []
+        self._chunk_stats = []
+        self._work_dir = None
+        self._executor = None
+        self._start = None
+
+    def _open(self, df):
+        loader = self.loader
+        self._start = time.perf_counter()
+        with loader.pool.connection() as conn:
+            self.replace = loader._needs_replace(conn, self.table, self.key)
+            if self.replace:
+                # One-time migration: the load replaces the table instead of merging into it
+                logger.warning("%s has rows without a %s merge key, this load replaces its rows", self.table, self.key)
+                loader.backend.create_staging(conn, self.table, self.staging_table,
+                                              columns=frame_columns(loader.backend, df))
+            else:
+                loader._prepare_target(conn, df, self.table)
+                loader.backend.create_staging(conn, self.table, self.staging_table)
+        self._work_dir = tempfile.mkdtemp(prefix="bulk_load_", dir=loader.tmp_dir)
+        self._executor = ThreadPoolExecutor(max_workers=loader.max_workers)
+        self.columns = list(df.columns)
+
+    def add(self, df):
+        """Stage the rows of ``df`` (same columns on every call)."""
+        if self.key not in df.columns:
+            raise ValueError(f"Merge key '{self.key}' is not a column of the frame")
+        if self.columns is None:
+            self._open(df)
+        elif list(df.columns) != self.columns:
+            raise ValueError(f"Frame columns differ from the first frame of the load into {self.table}")
+        keys = df[self.key]
+        repeated = keys.duplicated(keep="last") | keys.isin(self._keys)
+        if repeated.any():
+            # MERGE needs one source row per key
+            logger.warning("Dropping %d rows with a repeated %s before loading", int(repeated.sum()), self.key)
+            df = df[~repeated.to_numpy()]
+        self._keys.update(df[self.key].tolist())
+        chunk_rows = self.loader.chunk_rows
+        for i in range(0, len(df), chunk_rows):
+            if len(self._pending) >= self.loader.max_workers:
+                self._chunk_stats.append(self._pending.pop(0).result())
+            number = len(self._chunk_stats) + len(self._pending)
+            self._pending.append(self._executor.submit(
+                self.loader._stage_chunk, number, df.iloc[i:i + chunk_rows], self._work_dir,
+                self.staging_table, self.load_id
+            ))
+        self.rows += len(df)
+
+    def finish(self):
+        """Merge the staged rows into the target and return a summary of the load."""
+        if self.columns is None:
+            raise ValueError(f"Nothing was added to the load into {self.table}")
+        loader = self.loader
+        try:
+            self._chunk_stats.extend(future.result() for future in self._pending)
+            self._pending = []
+            with loader.pool.connection() as conn:
+                loader.backend.finish_staging(conn, self.staging_table, self.load_id)
+                if self.replace:
+                    merged = loader.backend.replace(conn, self.table, self.staging_table, self.columns)
+                else:
+                    merged = loader.backend.merge(conn, self.table, self.staging_table, self.key, self.columns)
+        finally:
+            self.abort()
+
+        seconds = time.perf_counter() - self._start
+        summary = {
+            "table": self.table,
+            "rows": self.rows,
+            "chunks": len(self._chunk_stats),
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(self.rows / seconds, 1) if seconds else None,
+            **merged,
+            "chunk_stats": self._chunk_stats,
+        }
+        logger.info("Loaded %d rows into %s in %.3fs (%d inserted, %d updated)",
+                    self.rows, self.table, seconds, merged["inserted"], merged["updated"])
+        return summary
+
+    def abort(self):
+        """Drop the staged rows (the target is untouched unless ``finish`` merged them)."""
+        if self.columns is None:
+            return
+        for future in self._pending:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        try:
+            with self.loader.pool.connection() as conn:
+                self.loader.backend.drop_staging(conn, self.staging_table, self.load_id)
+        except Exception as e:
+            logger.warning("Could not drop staging table %s: %s", self.staging_table, e)
+        shutil.rmtree(self._work_dir, ignore_errors=True)
+        self.columns = None
@@ -0,0 +1,232 @@
+"""Catalog of the date partitions written by the pipeline stages.
+
+Instead of listing the partition folders and taking the last one, stages ask
+the catalog for the latest *complete* partition of a dataset. Each entry
+records the partition date, the stage dataset it belongs to, the file path,
+row count, a schema hash, a content checksum and a status.
+
+Writers register a partition as ``pending`` before writing it and flip it to
+``complete`` in one transaction after the file is in place, so readers never
+pick up a partition that is still being written or whose write failed.
+
+A partition can also carry named watermarks, such as the high-water mark of
+an incremental extraction, which the next run reads back from the latest
+complete partition.
+
+The catalog is a single SQLite file (``PARTITION_CATALOG_PATH``, by default
+``partition_catalog.db`` next to the raw partitions). Partitions written
+before the catalog existed are registered from disk the first time a dataset
+is looked up.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+
+from common.storage import count_rows, file_checksum, find_partition_file, read_schema
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+COMPLETE = "complete"
+FAILED = "failed"
+
+# Dataset written by each stage and the file name it uses inside a partition folder
+RAW = "raw"
+CLEANED = "cleaned"
+TRANSFORMED = "transformed"
+SCORED = "scored"
+DATASET_FILES = {
+    RAW: "customer_churn_raw",
+    CLEANED: "customer_churn_cleaned",
+    TRANSFORMED: "customer_churn_transformed",
+    SCORED: "customer_churn_scores",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS partitions (
+    stage TEXT NOT NULL,
+    partition_date TEXT NOT NULL,
+    path TEXT NOT NULL,
+    row_count INTEGER,
+    schema_hash TEXT,
+    checksum TEXT,
+    status TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (stage, partition_date)
+);
+CREATE INDEX IF NOT EXISTS idx_partitions_status_date
+    ON partitions (stage, status, partition_date);
+CREATE TABLE IF NOT EXISTS watermarks (
+    stage TEXT NOT NULL,
+    partition_date TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (stage, partition_date, name)
+);
+"""
+
+
+def default_catalog_path():
+    path = os.getenv("PARTITION_CATALOG_PATH")
+    if path:
+        return path
+    raw_base = os.getenv("OUTPUT_FOLDER_BASE", ".")
+    return os.path.join(os.path.dirname(os.path.normpath(raw_base)), "partition_catalog.db")
+
+
+def schema_hash(path):
+    signature = json.dumps(read_schema(path))
+    return hashlib.sha256(signature.encode("utf-8")).hexdigest()
+
+
+class PartitionCatalog:
+
+    def __init__(self, path=None):
+        self.path = path or default_catalog_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _now(self):
+        return datetime.now().isoformat(timespec="seconds")
+
+    # === Writers ===
+    def begin(self, stage, partition_date, path="", base_dir=None):
+        """Mark a partition as being written; readers skip it until ``commit``.
+
+        ``base_dir`` lets the first write of a stage register the partitions
+        that were already on disk before the catalog existed.
+        """
+        if base_dir and not self._has_stage(stage):
+            self.register_existing(stage, base_dir)
+        with self.conn:
+            self.conn.execute(
+                """INSERT INTO partitions (stage, partition_date, path, status, updated_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (stage, partition_date) DO UPDATE SET
+                       path = excluded.path, row_count = NULL, schema_hash = NULL,
+                       checksum = NULL, status = excluded.status, updated_at = excluded.updated_at""",
+                (stage, partition_date, path, PENDING, self._now())
+            )
+
+    def commit(self, stage, partition_date, path, row_count=None):
+        """Record the written file's metadata and make the partition visible."""
+        if row_count is None:
+            row_count = count_rows(path)
+        with self.conn:
+            self.conn.execute(
+                """INSERT INTO partitions
+                       (stage, partition_date, path, row_count, schema_hash, checksum, status, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (stage, partition_date) DO UPDATE SET
+                       path = excluded.path, row_count = excluded.row_count,
+                       schema_hash = excluded.schema_hash, checksum = excluded.checksum,
+                       status = excluded.status, updated_at = excluded.updated_at""",
+                (stage, partition_date, path, int(row_count), schema_hash(path),
+                 file_checksum(path), COMPLETE, self._now())
+            )
+        logger.info("Committed %s partition %s (%d rows)", stage, partition_date, row_count)
+
+    def fail(self, stage, partition_date):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE partitions SET status = ?, updated_at = ? WHERE stage = ? AND partition_date = ?",
+                (FAILED, self._now(), stage, partition_date)
+            )
+
+    def set_watermark(self, stage, partition_date, name, value):
+        """Attach a JSON-serialisable watermark to a partition (typically before ``commit``)."""
+        with self.conn:
+            self.conn.execute(
+                """INSERT INTO watermarks (stage, partition_date, name, value) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (stage, partition_date, name) DO UPDATE SET value = excluded.value""",
+                (stage, partition_date, name, json.dumps(value, default=str))
+            )
+
+    # === Readers ===
+    def latest(self, stage, base_dir=None):
+        """Latest complete partition of ``stage`` as a dict, or None.
+
+        If the catalog knows nothing about ``stage`` yet and ``base_dir`` is
+        given, the partitions already on disk are registered first.
+        """
+        row = self._latest(stage)
+        if row is None and base_dir and not self._has_stage(stage):
+            self.register_existing(stage, base_dir)
+            row = self._latest(stage)
+        return row
+
+    def _latest(self, stage):
+        row = self.conn.execute(
+            """SELECT * FROM partitions WHERE stage = ? AND status = ?
+               ORDER BY partition_date DESC LIMIT 1""",
+            (stage, COMPLETE)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def _has_stage(self, stage):
+        return self.conn.execute("SELECT 1 FROM partitions WHERE stage = ? LIMIT 1", (stage,)).fetchone() is not None
+
+    def get(self, stage, partition_date):
+        row = self.conn.execute(
+            "SELECT * FROM partitions WHERE stage = ? AND partition_date = ?",
+            (stage, partition_date)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def partitions(self, stage, start=None, end=None, status=COMPLETE):
+        """Partitions of ``stage`` with ``start <= date <= end`` (both optional), oldest first."""
+        query = "SELECT * FROM partitions WHERE stage = ?"
+        params = [stage]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        if start is not None:
+            query += " AND partition_date >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND partition_date <= ?"
+            params.append(end)
+        query += " ORDER BY partition_date"
+        return [dict(row) for row in self.conn.execute(query, params)]
+
+    def previous(self, stage, partition_date):
+        """Latest complete partition of ``stage`` strictly before ``partition_date``."""
+        row = self.conn.execute(
+            """SELECT * FROM partitions WHERE stage = ? AND status = ? AND partition_date < ?
+               ORDER BY partition_date DESC LIMIT 1""",
+            (stage, COMPLETE, partition_date)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def watermark(self, stage, partition_date, name):
+        row = self.conn.execute(
+            "SELECT value FROM watermarks WHERE stage = ? AND partition_date = ? AND name = ?",
+            (stage, partition_date, name)
+        ).fetchone()
+        return json.loads(row["value"]) if row else None
+
+    def register_existing(self, stage, base_dir):
+        """Register partitions of ``stage`` found under ``base_dir`` as complete."""
+        name = DATASET_FILES[stage]
+        if not os.path.isdir(base_dir):
+            return
+        folders = [
+            f for f in os.listdir(base_dir)
+            if os.path.isdir(os.path.join(base_dir, f)) and f[:4].isdigit()
+        ]
+        registered = 0
+        for partition_date in sorted(folders):
+            path = find_partition_file(os.path.join(base_dir, partition_date), name)
+            if path is not None and self.get(stage, partition_date) is None:
+                self.commit(stage, partition_date, path)
+                registered += 1
+        logger.info("Registered %d existing %s partitions from %s", registered, stage, base_dir)
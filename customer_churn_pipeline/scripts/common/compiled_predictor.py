@@ -0,0 +1,275 @@
+"""Compile the fitted preprocessing + model pipeline into plain NumPy arrays.
+
+Scoring a few rows through the sklearn ``Pipeline`` is dominated by pandas
+frame construction and by ``ColumnTransformer``/``SimpleImputer``/
+``OneHotEncoder`` dispatch, not by the model. ``compile_pipeline`` reads the
+fitted parameters out once:
+
+* numeric blocks become an imputation vector and the scaler's mean and
+  scale vectors, applied to the whole block in two array operations,
+* one-hot blocks become a ``{category: output column}`` table per input
+  column, so a row is encoded as the index of its active column,
+* linear models keep their coefficient vector and intercept,
+* forests are flattened into single node arrays (feature, threshold,
+  children, leaf values) and traversed for every tree and row at once.
+
+The arithmetic follows sklearn operation for operation, so the
+probabilities are identical to ``Pipeline.predict_proba``, not merely close:
+the scaled values are the same float64 numbers, the trees compare their
+float32 copies against the same thresholds, linear scores are summed in the
+same order as the sparse matrix product, and forest votes are added tree by
+tree as sklearn does with ``n_jobs=1``. ``parity`` checks this on a sample.
+Numeric values that are not numbers (``"abc"`` in a JSON record) are
+missing and imputed, as ``Scorer.frame`` makes them for sklearn.
+
+Only the transformers and models the pipeline uses are supported; anything
+else raises ``ValueError`` and the caller falls back to sklearn. On large
+batches the array-based forest walk is slower than sklearn's Cython tree
+traversal, so the scoring service only uses it for small forest batches.
+"""
+import numpy as np
+import pandas as pd
+from scipy.special import expit
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+
+def _steps(transformer):
+    return [step for _, step in transformer.steps] if isinstance(transformer, Pipeline) else [transformer]
+
+
+def _compile_numeric(columns, steps):
+    n = len(columns)
+    fill, mean, scale = np.full(n, np.nan), np.zeros(n), np.ones(n)
+    keep = np.arange(n)
+    for step in steps:
+        if isinstance(step, SimpleImputer):
+            if step.keep_empty_features or not np.isnan(step.missing_values):
+                raise ValueError("Only SimpleImputer with missing_values=nan is supported")
+            statistics = step.statistics_.astype(np.float64)
+            # Like sklearn, columns without a statistic (all missing in training) are dropped
+            keep = np.flatnonzero(~np.isnan(statistics))
+            fill = statistics[keep]
+        elif isinstance(step, StandardScaler):
+            if len(keep) != n:
+                raise ValueError("StandardScaler after a dropped imputer column is not supported")
+            mean = step.mean_ if step.with_mean else None
+            scale = step.scale_ if step.with_std else None
+        else:
+            raise ValueError(f"Cannot compile numeric step {type(step).__name__}")
+    return {"kind": "numeric", "columns": list(columns), "keep": keep, "fill": fill,
+            "mean": None if mean is None else mean[keep], "scale": None if scale is None else scale[keep]}
+
+
+def _compile_onehot(columns, steps, offset):
+    fill_value = None
+    encoder = None
+    for step in steps:
+        if isinstance(step, SimpleImputer) and step.strategy == "constant":
+            fill_value = step.fill_value
+        elif isinstance(step, OneHotEncoder):
+            encoder = step
+        else:
+            raise ValueError(f"Cannot compile categorical step {type(step).__name__}")
+    if encoder is None or encoder.drop is not None or encoder.handle_unknown != "ignore" \
+            or getattr(encoder, "_infrequent_enabled", False):
+        raise ValueError("Only OneHotEncoder(handle_unknown='ignore') without drop or infrequent categories is supported")
+    lookups = []
+    for categories in encoder.categories_:
+        lookups.append({value: offset + i for i, value in enumerate(categories.tolist())})
+        offset += len(categories)
+    return {"kind": "onehot", "columns": list(columns), "fill_value": fill_value, "lookups": lookups}, offset
+
+
+def _flatten_forest(forest):
+    """Concatenated node arrays of every tree, with each tree's root offset."""
+    trees = [estimator.tree_ for estimator in forest.estimators_]
+    sizes = np.array([tree.node_count for tree in trees])
+    roots = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    left = np.concatenate([np.where(t.children_left >= 0, t.children_left + r, -1) for t, r in zip(trees, roots)])
+    right = np.concatenate([np.where(t.children_right >= 0, t.children_right + r, -1) for t, r in zip(trees, roots)])
+    return {
+        "roots": roots,
+        "feature": np.concatenate([t.feature for t in trees]),
+        "threshold": np.concatenate([t.threshold for t in trees]),
+        "left": left,
+        "right": right,
+        "leaf": left < 0,
+        # Same values as DecisionTreeClassifier.predict_proba reads from the tree
+        "value": np.concatenate([t.value[:, 0, :forest.n_classes_] for t in trees]),
+        "max_depth": max(t.max_depth for t in trees),
+    }
+
+
+class CompiledPredictor:
+
+    def __init__(self, blocks, n_features, sparse_output, model_kind, params, classes):
+        self.blocks = blocks
+        self.n_features = n_features
+        self.sparse_output = sparse_output
+        self.model_kind = model_kind
+        self.params = params
+        self.classes_ = classes
+        self.columns = [col for block in blocks for col in block["columns"]]
+        # ColumnTransformer stacks several blocks row-major (np.hstack); a lone numeric
+        # block keeps the column-major layout of the imputed pandas columns
+        self.dense_order = "F" if len(blocks) == 1 and blocks[0]["kind"] == "numeric" else "C"
+
+    # === Preprocessing ===
+    @staticmethod
+    def _coerced(data, columns):
+        """Block values as floats where a value that is not a number is missing, as in ``Scorer.frame``."""
+        if isinstance(data, list):
+            data = pd.DataFrame.from_records(data, columns=columns)
+        return np.column_stack([pd.to_numeric(data[col], errors="coerce").astype(np.float64) for col in columns]) \
+            if columns else np.empty((len(data), 0))
+
+    def _numeric(self, block, data):
+        try:
+            if isinstance(data, list):
+                values = np.array([[record.get(col) for col in block["columns"]] for record in data], dtype=np.float64)
+                values = values.reshape(len(data), len(block["columns"]))
+            else:
+                values = data[block["columns"]].to_numpy(dtype=np.float64)
+        except (TypeError, ValueError):
+            values = self._coerced(data, block["columns"])
+        values = values[:, block["keep"]]
+        missing = np.isnan(values)
+        if missing.any():
+            values = np.where(missing, block["fill"], values)
+        if block["mean"] is not None:
+            values -= block["mean"]
+        if block["scale"] is not None:
+            values /= block["scale"]
+        return values
+
+    def _onehot(self, block, data):
+        """Output column of each row's category per input column, -1 for unknown."""
+        fill = block["fill_value"]
+        active = np.empty((len(data), len(block["columns"])), dtype=np.int64)
+        for j, (col, lookup) in enumerate(zip(block["columns"], block["lookups"])):
+            values = (record.get(col) for record in data) if isinstance(data, list) else data[col].to_numpy(dtype=object)
+            active[:, j] = [lookup.get(fill if v is None or v != v else v, -1) for v in values]
+        return active
+
+    def transform(self, data):
+        """``[(block, values)]``: scaled numeric blocks and active one-hot columns."""
+        return [(block, self._numeric(block, data) if block["kind"] == "numeric" else self._onehot(block, data))
+                for block in self.blocks]
+
+    def dense(self, parts, dtype=np.float64, order=None):
+        """The preprocessor's output as a dense matrix.
+
+        In the ColumnTransformer's layout by default (``dense_order``); the
+        layout decides the summation order of a BLAS product.
+        """
+        n_rows = len(parts[0][1]) if parts else 0
+        X = np.zeros((n_rows, self.n_features), dtype=dtype, order=order or getattr(self, "dense_order", "F"))
+        offset = 0
+        for block, values in parts:
+            if block["kind"] == "numeric":
+                X[:, offset:offset + values.shape[1]] = values
+                offset += values.shape[1]
+            else:
+                rows, cols = np.nonzero(values >= 0)
+                X[rows, values[rows, cols]] = 1.0
+                offset += sum(len(lookup) for lookup in block["lookups"])
+        return X
+
+    # === Models ===
+    def _linear_scores(self, parts):
+        coef, intercept = self.params["coef"], self.params["intercept"]
+        if not self.sparse_output:
+            # Dense output goes through the same matrix product sklearn uses
+            return (self.dense(parts) @ coef.T + intercept).reshape(-1)
+        # Sparse output: CSR @ dense adds the row's non-zero terms left to right from 0
+        n_rows = len(parts[0][1])
+        scores = np.zeros(n_rows)
+        offset = 0
+        coef_with_unknown = np.append(coef[0], 0.0)
+        for block, values in parts:
+            if block["kind"] == "numeric":
+                for j in range(values.shape[1]):
+                    scores += values[:, j] * coef[0, offset + j]
+                offset += values.shape[1]
+            else:
+                for j in range(values.shape[1]):
+                    scores += coef_with_unknown[values[:, j]]
+        return scores + intercept
+
+    def _forest_proba(self, parts, chunk_rows=2048):
+        forest = self.params
+        n_rows = len(parts[0][1])
+        n_trees = len(forest["roots"])
+        proba = np.zeros((n_rows, forest["value"].shape[1]))
+        for start in range(0, n_rows, chunk_rows):
+            # Trees see float32 copies of the features, as sklearn's tree input validation makes them
+            X = self.dense([(block, values[start:start + chunk_rows]) for block, values in parts],
+                           dtype=np.float32, order="C")
+            nodes = np.tile(forest["roots"], len(X))
+            rows = np.repeat(np.arange(len(X)), n_trees)
+            # Walk every (row, tree) pair down at once, dropping pairs that reached a leaf
+            walking = np.flatnonzero(~forest["leaf"][nodes])
+            while len(walking):
+                current = nodes[walking]
+                go_left = X[rows[walking], forest["feature"][current]] <= forest["threshold"][current]
+                nodes[walking] = np.where(go_left, forest["left"][current], forest["right"][current])
+                walking = walking[~forest["leaf"][nodes[walking]]]
+            leaf_values = forest["value"][nodes].reshape(len(X), n_trees, -1)
+            # Added tree by tree, in the order RandomForestClassifier accumulates them
+            chunk = proba[start:start + len(X)]
+            for t in range(n_trees):
+                chunk += leaf_values[:, t]
+        proba /= n_trees
+        return proba
+
+    def predict_proba(self, data):
+        """Class probabilities for a DataFrame or a list of ``{column: value}`` records."""
+        parts = self.transform(data)
+        if self.model_kind == "forest":
+            return self._forest_proba(parts)
+        prob = expit(self._linear_scores(parts))
+        return np.stack([1 - prob, prob], axis=1)
+
+    def predict(self, data):
+        parts = self.transform(data)
+        if self.model_kind == "forest":
+            return self.classes_.take(np.argmax(self._forest_proba(parts), axis=1), axis=0)
+        return self.classes_.take((self._linear_scores(parts) > 0).astype(np.int64), axis=0)
+
+
+def compile_pipeline(preprocessor, model):
+    """``CompiledPredictor`` equivalent to ``Pipeline([preprocessor, model])``."""
+    blocks = []
+    offset = 0
+    for name, transformer, columns in preprocessor.transformers_:
+        if transformer == "drop" or name == "remainder" and transformer == "drop":
+            continue
+        if transformer == "passthrough":
+            raise ValueError("Passthrough columns are not supported")
+        steps = _steps(transformer)
+        if any(isinstance(step, OneHotEncoder) for step in steps):
+            block, offset = _compile_onehot(columns, steps, offset)
+        else:
+            block = _compile_numeric(columns, steps)
+            offset += len(block["keep"])
+        blocks.append(block)
+
+    if len(model.classes_) != 2:
+        raise ValueError("Only binary classifiers are supported")
+    if isinstance(model, RandomForestClassifier):
+        model_kind, params = "forest", _flatten_forest(model)
+    elif isinstance(model, LogisticRegression) or (isinstance(model, SGDClassifier) and model.loss == "log_loss"):
+        model_kind, params = "linear", {"coef": model.coef_, "intercept": model.intercept_}
+    else:
+        raise ValueError(f"Cannot compile model {type(model).__name__}")
+    return CompiledPredictor(blocks, offset, preprocessor.sparse_output_, model_kind, params, model.classes_)
+
+
+def parity(compiled, preprocessor, model, X):
+    """True when the compiled and the sklearn probabilities of ``X`` are bit for bit equal."""
+    expected = model.predict_proba(preprocessor.transform(X))
+    return np.array_equal(compiled.predict_proba(X), expected)
@@ -0,0 +1,201 @@
+"""Streaming duplicate-row removal with a bounded memory footprint.
+
+Rows are reduced to 128-bit fingerprints (two differently keyed 64-bit
+hashes of all column values). Chunks are filtered against the set of
+fingerprints seen so far, keeping the first occurrence of every row exactly
+like ``DataFrame.drop_duplicates()`` does on the whole frame.
+
+Chunks are fingerprinted after casting them to one dtype map taken from the
+first chunk (numbers as float64, flags as bool, everything else as object),
+so that a column parsed as integers in one chunk and as floats in another (a
+chunk with a missing value) gives a row the same fingerprint in both.
+
+In memory the set is a few sorted runs of fingerprints, merged as they
+grow, and each chunk is checked against every run with ``searchsorted``.
+It stays there until it would exceed ``memory_budget_mb``. After that it is
+spilled to an on-disk SQLite index whose page cache is capped at
+the same budget, so memory use does not grow with the partition size.
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# hash_pandas_object takes 16-character keys
+HASH_KEYS = ("churn-rows-hi-01", "churn-rows-lo-02")
+# One fingerprint in the sorted runs (two int64), plus the copy made by a merge
+BYTES_PER_FINGERPRINT = 32
+
+
+def row_fingerprints(df):
+    """Two int64 arrays that together form a 128-bit fingerprint of each row."""
+    high = pd.util.hash_pandas_object(df, index=False, hash_key=HASH_KEYS[0]).to_numpy()
+    low = pd.util.hash_pandas_object(df, index=False, hash_key=HASH_KEYS[1]).to_numpy()
+    # SQLite integers are signed
+    return high.view(np.int64), low.view(np.int64)
+
+
+def fingerprint_dtypes(df):
+    """Dtype map that makes a row's fingerprint independent of how its chunk was parsed."""
+    dtypes = {}
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            dtypes[col] = np.dtype(bool)
+        elif pd.api.types.is_numeric_dtype(dtype):
+            dtypes[col] = np.dtype(np.float64)
+        else:
+            dtypes[col] = np.dtype(object)
+    return dtypes
+
+
+def _cast(chunk, dtypes):
+    # Categorical and string columns hash like their object values, so only numbers and flags are cast
+    changed = {col: dtype for col, dtype in dtypes.items()
+               if chunk[col].dtype != dtype and (dtype != object or pd.api.types.is_numeric_dtype(chunk[col].dtype))}
+    return chunk.astype(changed) if changed else chunk
+
+
+def _contains(run_high, run_low, high, low):
+    """Mask of the fingerprints in one sorted run; ``high`` must be sorted too."""
+    left = np.minimum(np.searchsorted(run_high, high), len(run_high) - 1)
+    same_high = run_high[left] == high
+    found = same_high & (run_low[left] == low)
+    # Several fingerprints sharing their high half: a 64-bit collision, practically never
+    shared = np.flatnonzero(same_high & ~found & (left + 1 < len(run_high)))
+    for i in shared[run_high[left[shared] + 1] == high[shared]]:
+        right = np.searchsorted(run_high, high[i], side="right")
+        found[i] = bool(np.any(run_low[left[i]:right] == low[i]))
+    return found
+
+
+class FingerprintSet:
+    """Set of row fingerprints that spills to disk past a memory budget."""
+
+    def __init__(self, memory_budget_mb=256, spill_dir=None):
+        self.memory_budget_mb = memory_budget_mb
+        self.max_in_memory = int(memory_budget_mb * 1024 * 1024 / BYTES_PER_FINGERPRINT)
+        self.spill_dir = spill_dir
+        self._runs = []
+        self._db = None
+        self._db_path = None
+        self.size = 0
+
+    @property
+    def spilled(self):
+        return self._db is not None
+
+    def _spill(self):
+        fd, self._db_path = tempfile.mkstemp(prefix="dedup_", suffix=".sqlite", dir=self.spill_dir)
+        os.close(fd)
+        self._db = sqlite3.connect(self._db_path)
+        self._db.execute("PRAGMA journal_mode = OFF")
+        self._db.execute("PRAGMA synchronous = OFF")
+        # Negative cache_size is in KiB
+        self._db.execute(f"PRAGMA cache_size = -{self.memory_budget_mb * 1024}")
+        self._db.execute("CREATE TABLE seen (high INTEGER, low INTEGER, PRIMARY KEY (high, low)) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE chunk (pos INTEGER, high INTEGER, low INTEGER)")
+        for run_high, run_low in self._runs:
+            self._db.executemany("INSERT INTO seen (high, low) VALUES (?, ?)", zip(run_high.tolist(), run_low.tolist()))
+        self._db.commit()
+        logger.info("Fingerprint set exceeded %d MB, spilled %d fingerprints to %s",
+                    self.memory_budget_mb, self.size, self._db_path)
+        self._runs = []
+
+    def add_new(self, high, low):
+        """Add the fingerprints and return a mask of those not seen before.
+
+        Within the given arrays only the first occurrence counts as new.
+        """
+        if self.spilled:
+            return self._add_new_on_disk(high, low)
+
+        mask = ~pd.DataFrame({"high": high, "low": low}).duplicated().to_numpy()
+        # Sorted lookups walk each run in order instead of jumping around it
+        order = np.flatnonzero(mask)
+        order = order[np.argsort(high[order], kind="stable")]
+        new = np.ones(len(order), dtype=bool)
+        for run_high, run_low in self._runs:
+            new[new] = ~_contains(run_high, run_low, high[order[new]], low[order[new]])
+        mask[order[~new]] = False
+        if new.any():
+            self._add_run(high[order[new]], low[order[new]])
+        self.size += int(new.sum())
+        if self.size > self.max_in_memory:
+            self._spill()
+        return mask
+
+    def _add_run(self, high, low):
+        """Add fingerprints sorted by their high half as a new run."""
+        self._runs.append((high, low))
+        # Merge while the previous run is at most twice as large, so there are O(log n) runs
+        while len(self._runs) > 1 and len(self._runs[-2][0]) <= 2 * len(self._runs[-1][0]):
+            (high_a, low_a), (high_b, low_b) = self._runs.pop(-2), self._runs.pop()
+            high, low = np.concatenate([high_a, high_b]), np.concatenate([low_a, low_b])
+            order = np.argsort(high, kind="stable")
+            self._runs.append((high[order], low[order]))
+
+    def _add_new_on_disk(self, high, low):
+        keys = pd.DataFrame({"high": high, "low": low})
+        mask = ~keys.duplicated().to_numpy()
+        positions = np.flatnonzero(mask)
+
+        cur = self._db.cursor()
+        cur.execute("DELETE FROM chunk")
+        cur.executemany(
+            "INSERT INTO chunk (pos, high, low) VALUES (?, ?, ?)",
+            zip(positions.tolist(), high[positions].tolist(), low[positions].tolist())
+        )
+        existing = [pos for (pos,) in cur.execute(
+            "SELECT c.pos FROM chunk c JOIN seen s ON s.high = c.high AND s.low = c.low"
+        )]
+        cur.execute("INSERT OR IGNORE INTO seen (high, low) SELECT high, low FROM chunk")
+        self._db.commit()
+
+        mask[existing] = False
+        self.size += int(mask.sum())
+        return mask
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            os.remove(self._db_path)
+            self._db = None
+        self._runs = []
+
+
+class StreamingDeduplicator:
+    """Drop duplicate rows from a stream of chunks, keeping first occurrences."""
+
+    def __init__(self, memory_budget_mb=256, spill_dir=None, dtypes=None):
+        self.fingerprints = FingerprintSet(memory_budget_mb, spill_dir)
+        # Fixed on the first chunk unless given
+        self.dtypes = dtypes
+        self.rows_in = 0
+        self.rows_out = 0
+
+    def filter(self, chunk):
+        if self.dtypes is None:
+            self.dtypes = fingerprint_dtypes(chunk)
+        high, low = row_fingerprints(_cast(chunk, self.dtypes))
+        mask = self.fingerprints.add_new(high, low)
+        self.rows_in += len(chunk)
+        self.rows_out += int(mask.sum())
+        return chunk[mask]
+
+    @property
+    def duplicates(self):
+        return self.rows_in - self.rows_out
+
+    def close(self):
+        self.fingerprints.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,106 @@
+"""Persistent row-fingerprint index for incremental data preparation.
+
+The index holds one entry per row of the latest cleaned partition, in the
+same order: the ``Customer ID`` key plus the 128-bit content fingerprint of
+the row (see ``common.dedup.row_fingerprints``). Comparing a new raw
+partition against it tells which rows are new or changed and which
+disappeared, so only those rows need cleaning and the unchanged ones are
+carried over from the previous cleaned partition.
+
+The index lives in a directory as ``row_index.parquet`` plus a small
+``row_index.json`` describing which partitions it reflects. The JSON is
+written last and acts as the commit marker.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.dedup import row_fingerprints
+
+KEY_COLUMN = "Customer ID"
+
+
+def fingerprint_frame(df, key_column=KEY_COLUMN):
+    """DataFrame of ``[key, fp_high, fp_low]``, one row per row of ``df``."""
+    high, low = row_fingerprints(df)
+    return pd.DataFrame({
+        "key": df[key_column].to_numpy() if key_column in df.columns else np.arange(len(df)).astype(str),
+        "fp_high": high,
+        "fp_low": low
+    })
+
+
+def fingerprint_split(fps, test_size, buckets=10_000):
+    """Boolean mask of the test rows of ``fps`` (from ``fingerprint_frame``), about ``test_size`` of them.
+
+    A row's side follows from its content fingerprint instead of its
+    position, so a row carried over to a later partition stays on the same
+    side of the split whatever was inserted or deleted around it.
+    """
+    bucket = fps["fp_low"].to_numpy().view(np.uint64) % np.uint64(buckets)
+    return bucket < np.uint64(round(test_size * buckets))
+
+
+def _pairs(fps):
+    return pd.MultiIndex.from_arrays([fps["fp_high"].to_numpy(), fps["fp_low"].to_numpy()])
+
+
+def compute_delta(index_fps, new_fps):
+    """Compare the indexed rows with the fingerprints of a new partition.
+
+    Returns ``(keep_mask, new_mask, counts)``: ``keep_mask`` selects the
+    indexed rows still present, ``new_mask`` selects the first occurrence of
+    every row of the new partition that is not indexed yet. A key whose
+    content changed shows up once as ``updated`` instead of as an insert and
+    a delete.
+    """
+    new_pairs = _pairs(new_fps)
+    index_pairs = _pairs(index_fps)
+
+    first_occurrence = ~new_pairs.duplicated()
+    keep_mask = index_pairs.isin(new_pairs)
+    new_mask = first_occurrence & ~new_pairs.isin(index_pairs)
+
+    added_keys = set(new_fps["key"].to_numpy()[new_mask])
+    removed_keys = set(index_fps["key"].to_numpy()[~keep_mask])
+    updated = len(added_keys & removed_keys)
+    counts = {
+        "inserted": int(new_mask.sum()) - updated,
+        "updated": updated,
+        "deleted": int((~keep_mask).sum()) - updated,
+        "unchanged": int(keep_mask.sum())
+    }
+    return keep_mask, new_mask, counts
+
+
+class RowIndex:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "row_index.parquet")
+        self.meta_path = os.path.join(directory, "row_index.json")
+
+    def load_meta(self):
+        if not (os.path.exists(self.meta_path) and os.path.exists(self.index_path)):
+            return None
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load(self):
+        return pd.read_parquet(self.index_path)
+
+    def save(self, fps, **meta):
+        os.makedirs(self.directory, exist_ok=True)
+        # Invalidate first so a crash mid-save never leaves meta pointing at the wrong rows
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+        tmp_index = self.index_path + ".tmp"
+        fps.to_parquet(tmp_index, index=False)
+        os.replace(tmp_index, self.index_path)
+
+        tmp_meta = self.meta_path + ".tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({**meta, "rows": len(fps)}, f, indent=2)
+        os.replace(tmp_meta, self.meta_path)
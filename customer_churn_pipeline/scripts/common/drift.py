@@ -0,0 +1,384 @@
+"""Mergeable per-partition feature sketches and drift metrics computed from them.
+
+The feature store stage sketches every feature of a partition once and
+stores the result as a small JSON file (``SketchStore``). Drift between
+any two partitions, or between a partition and the merge of a rolling
+window of earlier ones, is then computed from the sketches alone, without
+reading the partitions again.
+
+Each feature gets its row and missing counts, plus:
+
+* numeric features: a histogram over fixed bin edges, chosen once per
+  feature from the first sketched partition (33 quantiles) and reused for
+  every later one, so histograms of different partitions add up bin by
+  bin; and a relative-error quantile sketch (``QuantileSketch``, a
+  DDSketch: logarithmic buckets, 1% relative accuracy),
+* categorical features (Contract, Offer, Internet Type, ...): the value
+  frequencies, capped at ``max_values`` values with the rest counted under
+  ``OTHER``.
+
+``drift`` reports per feature the population stability index and the
+Jensen-Shannon divergence (base 2, between 0 and 1) of the histograms or
+frequency tables, and for numeric features the Kolmogorov-Smirnov
+statistic from the quantile sketches.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SKETCH_VERSION = 1
+HISTOGRAM_QUANTILES = 33
+OTHER = "__other__"
+NUMERIC, CATEGORICAL = "numeric", "categorical"
+
+
+class Counts:
+    """Counts per key, as a sorted key array and an aligned count array."""
+
+    def __init__(self, keys=(), counts=(), dtype=None):
+        self.keys = np.asarray(keys, dtype=dtype)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def of(cls, values):
+        keys, counts = np.unique(values, return_counts=True)
+        return cls(keys, counts)
+
+    def add(self, other):
+        if not len(other.keys):
+            return self
+        if not len(self.keys):
+            return Counts(other.keys, other.counts)
+        keys, inverse = np.unique(np.concatenate((self.keys, other.keys)), return_inverse=True)
+        return Counts(keys, np.bincount(inverse, weights=np.concatenate((self.counts, other.counts)),
+                                        minlength=len(keys)).astype(np.int64))
+
+    def total(self):
+        return int(self.counts.sum())
+
+    def to_dict(self):
+        return {"keys": self.keys.tolist(), "counts": self.counts.tolist()}
+
+    @classmethod
+    def from_dict(cls, data, dtype=None):
+        return cls(data["keys"], data["counts"], dtype=dtype)
+
+
+def _aligned(left, right):
+    """Proportions of two ``Counts`` over the union of their keys."""
+    keys = np.union1d(left.keys, right.keys)
+    p = np.zeros(len(keys))
+    q = np.zeros(len(keys))
+    p[np.searchsorted(keys, left.keys)] = left.counts
+    q[np.searchsorted(keys, right.keys)] = right.counts
+    return p / max(p.sum(), 1), q / max(q.sum(), 1)
+
+
+# === Sketches ===
+
+class QuantileSketch:
+    """Mergeable quantile sketch whose quantiles are within ``relative_accuracy`` of the true values."""
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.positive = Counts(dtype=np.int64)
+        self.negative = Counts(dtype=np.int64)
+        self.zero = 0
+
+    def _bucket_counts(self, magnitudes):
+        return Counts.of(np.ceil(np.log(magnitudes) / np.log(self.gamma)).astype(np.int64))
+
+    def update(self, values):
+        values = values[~np.isnan(values)]
+        tiny = np.abs(values) < 1e-12
+        self.zero += int(tiny.sum())
+        self.positive = self.positive.add(self._bucket_counts(values[~tiny & (values > 0)]))
+        self.negative = self.negative.add(self._bucket_counts(-values[~tiny & (values < 0)]))
+        return self
+
+    def merge(self, other):
+        self.positive = self.positive.add(other.positive)
+        self.negative = self.negative.add(other.negative)
+        self.zero += other.zero
+        return self
+
+    @property
+    def count(self):
+        return self.positive.total() + self.negative.total() + self.zero
+
+    def distribution(self):
+        """Sorted representative value of every bucket and its count."""
+        scale = 2 / (1 + self.gamma)
+        values = np.concatenate((
+            -scale * self.gamma ** self.negative.keys[::-1].astype(float),
+            [0.0] if self.zero else [],
+            scale * self.gamma ** self.positive.keys.astype(float),
+        ))
+        counts = np.concatenate((self.negative.counts[::-1], [self.zero] if self.zero else [], self.positive.counts))
+        return values, counts.astype(np.int64)
+
+    def quantile(self, q):
+        values, counts = self.distribution()
+        if not len(values):
+            return None
+        rank = np.searchsorted(np.cumsum(counts), q * (counts.sum() - 1), side="right")
+        return float(values[min(rank, len(values) - 1)])
+
+    def to_dict(self):
+        return {"relative_accuracy": self.relative_accuracy, "zero": self.zero,
+                "positive": self.positive.to_dict(), "negative": self.negative.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"])
+        sketch.zero = data["zero"]
+        sketch.positive = Counts.from_dict(data["positive"], np.int64)
+        sketch.negative = Counts.from_dict(data["negative"], np.int64)
+        return sketch
+
+
+class FeatureSketch:
+    """Counts, histogram or frequencies, and quantile sketch of one feature in one or more partitions."""
+
+    def __init__(self, name, kind, edges=None, max_values=1000):
+        self.name = name
+        self.kind = kind
+        self.rows = 0
+        self.missing = 0
+        self.max_values = max_values
+        self.edges = None if edges is None else np.asarray(edges, dtype=float)
+        if kind == NUMERIC:
+            self.histogram = np.zeros(len(self.edges) + 1, dtype=np.int64)
+            self.quantiles = QuantileSketch()
+        else:
+            self.frequencies = Counts(dtype=object)
+
+    def _cap(self):
+        if len(self.frequencies.keys) > self.max_values:
+            other = self.frequencies.keys == OTHER
+            keys, counts = self.frequencies.keys[~other], self.frequencies.counts[~other]
+            top = np.sort(np.argsort(-counts, kind="stable")[:self.max_values - 1])
+            rest = np.ones(len(keys), dtype=bool)
+            rest[top] = False
+            self.frequencies = Counts(keys[top], counts[top], dtype=object).add(
+                Counts([OTHER], [counts[rest].sum() + self.frequencies.counts[other].sum()], dtype=object))
+
+    def update(self, series):
+        self.rows += len(series)
+        if self.kind == NUMERIC:
+            values = series.to_numpy(dtype=float, na_value=np.nan)
+            present = values[~np.isnan(values)]
+            self.missing += len(values) - len(present)
+            # Bin i holds edges[i-1] <= x < edges[i]; the first and last bins are open ended
+            self.histogram += np.bincount(np.searchsorted(self.edges, present, side="right"),
+                                          minlength=len(self.histogram))
+            self.quantiles.update(present)
+        else:
+            self.missing += int(series.isna().sum())
+            self.frequencies = self.frequencies.add(Counts.of(series.dropna().astype(str).to_numpy(dtype=object)))
+            self._cap()
+        return self
+
+    def merge(self, other):
+        if other.kind != self.kind:
+            raise ValueError(f"Cannot merge {other.kind} and {self.kind} sketches of {self.name}")
+        self.rows += other.rows
+        self.missing += other.missing
+        if self.kind == NUMERIC:
+            if not np.array_equal(self.edges, other.edges):
+                raise ValueError(f"Histograms of {self.name} have different bin edges")
+            self.histogram = self.histogram + other.histogram
+            self.quantiles.merge(other.quantiles)
+        else:
+            self.frequencies = self.frequencies.add(other.frequencies)
+            self._cap()
+        return self
+
+    def counts(self):
+        """Counts of the non-missing values per histogram bin (numeric) or value (categorical)."""
+        if self.kind == NUMERIC:
+            return Counts(np.arange(len(self.histogram)), self.histogram)
+        return self.frequencies
+
+    def to_dict(self):
+        data = {"name": self.name, "kind": self.kind, "rows": self.rows, "missing": self.missing}
+        if self.kind == NUMERIC:
+            return {**data, "edges": self.edges.tolist(), "histogram": self.histogram.tolist(),
+                    "quantiles": self.quantiles.to_dict()}
+        return {**data, "max_values": self.max_values, "frequencies": self.frequencies.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["name"], data["kind"], data.get("edges"), data.get("max_values", 1000))
+        sketch.rows, sketch.missing = data["rows"], data["missing"]
+        if sketch.kind == NUMERIC:
+            sketch.histogram = np.asarray(data["histogram"], dtype=np.int64)
+            sketch.quantiles = QuantileSketch.from_dict(data["quantiles"])
+        else:
+            sketch.frequencies = Counts.from_dict(data["frequencies"], object)
+        return sketch
+
+
+def bin_edges(series, quantiles=HISTOGRAM_QUANTILES):
+    values = series.dropna().to_numpy(dtype=float)
+    if not len(values):
+        return [0.0]
+    return np.unique(np.quantile(values, np.linspace(0, 1, quantiles))).tolist()
+
+
+def is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
+def sketch_frame(df, edges, max_values=1000):
+    """``{feature: FeatureSketch}`` of every column of ``df``; ``edges`` holds the histogram bins of numeric ones."""
+    return {
+        col: FeatureSketch(col, NUMERIC, edges[col]).update(df[col]) if is_numeric(df[col]) and col in edges
+        else FeatureSketch(col, CATEGORICAL, max_values=max_values).update(df[col])
+        for col in df.columns
+    }
+
+
+def merge_sketches(sketch_sets):
+    """Merge several ``{feature: FeatureSketch}`` sets (e.g. the partitions of a window) into one."""
+    merged = {}
+    for sketches in sketch_sets:
+        for name, sketch in sketches.items():
+            if name in merged:
+                merged[name].merge(sketch)
+            else:
+                merged[name] = FeatureSketch.from_dict(sketch.to_dict())
+    return merged
+
+
+# === Drift Metrics ===
+
+def psi(expected, actual, eps=1e-4):
+    """Population stability index of two aligned proportion arrays."""
+    expected, actual = np.clip(expected, eps, None), np.clip(actual, eps, None)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def js_divergence(p, q):
+    """Jensen-Shannon divergence (base 2) of two aligned proportion arrays."""
+    m = (p + q) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        left = np.where(p > 0, p * np.log2(p / m), 0.0)
+        right = np.where(q > 0, q * np.log2(q / m), 0.0)
+    return float(0.5 * left.sum() + 0.5 * right.sum())
+
+
+def ks_statistic(reference, current):
+    """Largest gap between the CDFs of two quantile sketches, evaluated at every bucket."""
+    ref_values, ref_counts = reference.distribution()
+    cur_values, cur_counts = current.distribution()
+    if not ref_counts.sum() or not cur_counts.sum():
+        return None
+    points = np.union1d(ref_values, cur_values)
+    ref_cdf = np.concatenate(([0], np.cumsum(ref_counts) / ref_counts.sum()))[np.searchsorted(ref_values, points, side="right")]
+    cur_cdf = np.concatenate(([0], np.cumsum(cur_counts) / cur_counts.sum()))[np.searchsorted(cur_values, points, side="right")]
+    return float(np.max(np.abs(ref_cdf - cur_cdf)))
+
+
+def feature_drift(reference, current):
+    p, q = _aligned(reference.counts(), current.counts())
+    result = {
+        "feature": current.name,
+        "kind": current.kind,
+        "psi": psi(p, q),
+        "js_divergence": js_divergence(p, q),
+        "ks": ks_statistic(reference.quantiles, current.quantiles) if current.kind == NUMERIC else None,
+        "missing_rate_reference": reference.missing / reference.rows if reference.rows else None,
+        "missing_rate_current": current.missing / current.rows if current.rows else None,
+    }
+    if current.kind == NUMERIC:
+        result.update(median_reference=reference.quantiles.quantile(0.5), median_current=current.quantiles.quantile(0.5))
+    return result
+
+
+def drift(reference, current):
+    """Drift of every feature sketched in both ``reference`` and ``current``, most drifted (PSI) first."""
+    rows = [
+        feature_drift(reference[name], sketch)
+        for name, sketch in current.items()
+        if name in reference and reference[name].kind == sketch.kind
+        and (sketch.kind != NUMERIC or np.array_equal(reference[name].edges, sketch.edges))
+    ]
+    return pd.DataFrame(rows).sort_values("psi", ascending=False, ignore_index=True)
+
+
+# === Sketch Store ===
+
+class SketchStore:
+    """One JSON file of feature sketches per partition date, plus the shared histogram bin edges."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.edges_path = os.path.join(directory, "bin_edges.json")
+
+    def _path(self, partition_date):
+        return os.path.join(self.directory, f"{partition_date}.json")
+
+    def _write_json(self, path, data):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def edges(self, df=None):
+        """Histogram bin edges per numeric feature; features of ``df`` seen for the first time get theirs now."""
+        edges = {}
+        if os.path.exists(self.edges_path):
+            with open(self.edges_path, "r", encoding="utf-8") as f:
+                edges = json.load(f)
+        new = {} if df is None else {col: bin_edges(df[col]) for col in df.columns if is_numeric(df[col]) and col not in edges}
+        if new:
+            edges.update(new)
+            self._write_json(self.edges_path, edges)
+        return edges
+
+    def dates(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len(".json")] for name in os.listdir(self.directory)
+                      if name.endswith(".json") and name != os.path.basename(self.edges_path))
+
+    def save(self, partition_date, sketches):
+        self._write_json(self._path(partition_date), {
+            "version": SKETCH_VERSION,
+            "partition_date": partition_date,
+            "features": [sketch.to_dict() for sketch in sketches.values()],
+        })
+
+    def sketch_partition(self, df, partition_date, max_values=1000):
+        """Sketch every column of ``df`` and store the result as ``partition_date``'s sketches."""
+        sketches = sketch_frame(df, self.edges(df), max_values=max_values)
+        self.save(partition_date, sketches)
+        return sketches
+
+    def load(self, partition_date):
+        with open(self._path(partition_date), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != SKETCH_VERSION:
+            raise ValueError(f"Unsupported sketch version {data.get('version')} for {partition_date}")
+        return {feature["name"]: FeatureSketch.from_dict(feature) for feature in data["features"]}
+
+    def previous(self, partition_date, count=1):
+        """The ``count`` sketched partition dates before ``partition_date``, oldest first."""
+        earlier = [date for date in self.dates() if date < partition_date]
+        return earlier[-count:] if count else []
+
+    def window(self, dates):
+        """The merged sketches of ``dates``."""
+        return merge_sketches(self.load(date) for date in dates)
+
+    def compare(self, reference_dates, partition_date):
+        """Drift of ``partition_date`` against the merged sketches of ``reference_dates``."""
+        return drift(self.window(reference_dates), self.load(partition_date))
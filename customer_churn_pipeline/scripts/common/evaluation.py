@@ -0,0 +1,350 @@
+"""Vectorized evaluation of a binary classifier's scores for the model building stage.
+
+``EvaluationEngine.evaluate`` takes the true labels, the churn probabilities
+and the predictions of a model on the test rows (and optionally the test
+frame for segments) and returns:
+
+* ``metrics``: accuracy, precision, recall and f1 of the predictions, ROC
+  AUC, average precision and the threshold with the best f1,
+* ``curve``: true/false positives and negatives, precision, recall, false
+  positive rate and f1 at every distinct score (``threshold_curve``). The
+  scores are sorted once and the confusion matrices of all thresholds are
+  cumulative sums over the sorted labels,
+* ``segments``: the same metrics per value of each segment column (State,
+  Contract, Internet Type, Offer), from one grouped aggregation of the
+  per-row confusion indicators. The per-segment ROC AUC is the
+  Mann-Whitney statistic of grouped ranks,
+* ``intervals``: percentile bootstrap confidence intervals of every metric.
+
+The bootstrap never copies rows. Each row is reduced to a cell (score
+bucket, label, prediction); a resample is a vector of row positions, mapped
+to cells and counted with one ``bincount`` per batch of resamples. Every
+metric of every resample in the batch is then computed from those counts
+at once. The buckets (``score_buckets``) merge neighbouring scores so their
+number, and the cost of each resample's curve, stays bounded on millions of
+rows. Resamples are split into tasks of ``RESAMPLES_PER_TASK``, each with
+its own seed (``numpy.random.SeedSequence.spawn``), and the tasks run on a
+joblib process pool, so the intervals depend on ``random_state`` only, not
+on the number of workers.
+
+``log_evaluation`` logs the metrics, the interval bounds and the tables
+(curve, segments, intervals) to the active MLflow run.
+"""
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_COLUMNS = ["State", "Contract", "Internet Type", "Offer"]
+METRICS = ["accuracy", "precision", "recall", "f1", "roc_auc", "average_precision"]
+# Row positions drawn per batch of resamples, bounding the batch's memory
+BATCH_POSITIONS = 8_000_000
+RESAMPLES_PER_TASK = 50
+
+
+def _divide(numerator, denominator):
+    """Elementwise ratio that is 0 where the denominator is 0."""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape),
+                     where=denominator != 0)
+
+
+def confusion_rates(tp, fp, fn, tn):
+    """Accuracy, precision, recall, false positive rate and f1 of (arrays of) confusion counts."""
+    precision = _divide(tp, tp + fp)
+    recall = _divide(tp, tp + fn)
+    return {
+        "accuracy": _divide(tp + tn, tp + fp + fn + tn),
+        "precision": precision,
+        "recall": recall,
+        "fpr": _divide(fp, fp + tn),
+        "f1": _divide(2 * precision * recall, precision + recall),
+    }
+
+
+# === Threshold curve (one sorted pass) ===
+
+def threshold_curve(y_true, scores):
+    """Confusion counts and rates at every distinct score, highest threshold first.
+
+    Row ``k`` predicts churn for every score ``>= threshold``. The first row
+    (threshold ``inf``) predicts nobody churns.
+    """
+    y_true = np.asarray(y_true).astype(bool)
+    scores = np.asarray(scores, dtype=np.float64)
+    order = np.argsort(-scores, kind="stable")
+    sorted_scores, sorted_true = scores[order], y_true[order]
+    # Last position of each run of equal scores
+    ends = np.r_[np.flatnonzero(np.diff(sorted_scores)), len(sorted_scores) - 1]
+    tp = np.r_[0, np.cumsum(sorted_true)[ends]]
+    fp = np.r_[0, ends + 1] - tp
+    positives, negatives = tp[-1], fp[-1]
+    curve = pd.DataFrame({
+        "threshold": np.r_[np.inf, sorted_scores[ends]],
+        "tp": tp, "fp": fp, "fn": positives - tp, "tn": negatives - fp,
+    })
+    rates = confusion_rates(curve["tp"], curve["fp"], curve["fn"], curve["tn"])
+    for name in ("precision", "recall", "fpr", "f1"):
+        curve[name] = rates[name]
+    return curve
+
+
+def curve_areas(curve):
+    """``(roc_auc, average_precision)`` of a ``threshold_curve``."""
+    positives = curve["tp"].iloc[-1]
+    negatives = curve["fp"].iloc[-1]
+    if positives == 0 or negatives == 0:
+        return np.nan, np.nan
+    tpr, fpr = curve["recall"].to_numpy(), curve["fpr"].to_numpy()
+    roc_auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+    average_precision = float(np.sum(np.diff(tpr) * curve["precision"].to_numpy()[1:]))
+    return roc_auc, average_precision
+
+
+def thin_curve(curve, max_points=1000):
+    """At most ``max_points`` rows of a curve, evenly spaced, keeping both ends and the best f1."""
+    if len(curve) <= max_points:
+        return curve
+    rows = np.unique(np.r_[np.linspace(0, len(curve) - 1, max_points - 1).astype(int), curve["f1"].to_numpy().argmax()])
+    return curve.iloc[rows].reset_index(drop=True)
+
+
+# === Segment metrics (grouped aggregation) ===
+
+def _score_ranks(scores):
+    """``(dense rank of every score in descending order, number of distinct scores)``."""
+    distinct, inverse = np.unique(-np.asarray(scores, dtype=np.float64), return_inverse=True)
+    return inverse.reshape(-1), len(distinct)
+
+
+def _group_auc(codes, n_groups, y_true, ranks, n_scores):
+    """ROC AUC of every group, as the Mann-Whitney statistic of the ranks within the group."""
+    # One sort of (group, score) pairs; the rows below a pair within its group give its rank
+    pairs, inverse, counts = np.unique(codes * np.int64(n_scores) + (n_scores - 1 - ranks),
+                                       return_inverse=True, return_counts=True)
+    positives = np.bincount(inverse.reshape(-1), weights=y_true, minlength=len(pairs))
+    group = pairs // n_scores
+    before = np.cumsum(counts) - counts
+    first = np.r_[True, group[1:] != group[:-1]]
+    below = before - np.maximum.accumulate(np.where(first, before, 0))
+    rank_sum = np.bincount(group, weights=positives * (below + (counts + 1) / 2), minlength=n_groups)
+    n_pos = np.bincount(codes, weights=y_true, minlength=n_groups)
+    n_neg = np.bincount(codes, minlength=n_groups) - n_pos
+    with np.errstate(divide="ignore", invalid="ignore"):
+        auc = (rank_sum - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+    return np.where((n_pos > 0) & (n_neg > 0), auc, np.nan)
+
+
+def segment_metrics(y_true, y_pred, scores, frame, columns=SEGMENT_COLUMNS, ranks=None):
+    """Confusion counts and metrics per value of each segment column of ``frame``.
+
+    ``frame`` is aligned with the labels by position. Columns it does not
+    have are skipped. Missing values form their own segment. ``ranks`` are
+    the ``(ranks, n_scores)`` of the scores when the caller has them.
+    """
+    y_true = np.asarray(y_true).astype(bool)
+    y_pred = np.asarray(y_pred).astype(bool)
+    ranks, n_scores = ranks or _score_ranks(scores)
+    # Confusion cell of every row: 2 * label + prediction
+    cells = y_true.astype(np.int64) * 2 + y_pred
+    tables = []
+    for column in columns:
+        if column not in frame.columns:
+            logger.warning("Segment column '%s' is not in the evaluation frame", column)
+            continue
+        codes, values = pd.factorize(frame[column], sort=True, use_na_sentinel=False)
+        codes = codes.astype(np.int64)
+        n_groups = len(values)
+        counts = np.bincount(codes * 4 + cells, minlength=4 * n_groups).reshape(n_groups, 4)
+        tn, fp, fn, tp = counts.T
+        table = pd.DataFrame({
+            "segment": column,
+            "value": pd.Series(values, dtype=object).where(pd.notna(values), "Missing").astype(str).to_numpy(),
+            "rows": counts.sum(axis=1), "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+            "roc_auc": _group_auc(codes, n_groups, y_true, ranks, n_scores),
+            "positive_rate": _divide(tp + fn, counts.sum(axis=1)),
+        })
+        for name, value in confusion_rates(tp, fp, fn, tn).items():
+            if name != "fpr":
+                table[name] = value
+        tables.append(table)
+    if not tables:
+        return pd.DataFrame(columns=["segment", "value", "rows"])
+    return pd.concat(tables, ignore_index=True)
+
+
+# === Bootstrap confidence intervals (batched resampling) ===
+
+def score_buckets(ranks, n_scores, max_buckets):
+    """Dense score ranks merged into at most ``max_buckets`` buckets of about equal row counts.
+
+    Buckets keep the score order and never split equal scores; returns
+    ``(bucket of every row, number of buckets)``.
+    """
+    if n_scores <= max_buckets:
+        return ranks, n_scores
+    rows_before = np.cumsum(np.bincount(ranks, minlength=n_scores)) - np.bincount(ranks, minlength=n_scores)
+    _, bucket_of_score = np.unique(rows_before * max_buckets // len(ranks), return_inverse=True)
+    bucket_of_score = bucket_of_score.reshape(-1)
+    return bucket_of_score[ranks], int(bucket_of_score[-1]) + 1
+
+
+def resample_metrics(counts):
+    """Every metric of ``METRICS`` for a batch of resamples.
+
+    ``counts`` has shape ``(resamples, scores, 2, 2)``: the rows drawn per
+    score (highest first), label and prediction.
+    """
+    (tn, fp), (fn, tp) = counts.sum(axis=1).transpose(1, 2, 0)
+    metrics = confusion_rates(tp, fp, fn, tn)
+    del metrics["fpr"]
+
+    per_score = counts.sum(axis=3)
+    negatives_at, positives_at = per_score[:, :, 0], per_score[:, :, 1]
+    cum_fp = np.cumsum(negatives_at, axis=1)
+    cum_tp = np.cumsum(positives_at, axis=1)
+    positives, negatives = cum_tp[:, -1].astype(np.float64), cum_fp[:, -1].astype(np.float64)
+    # Pairs ranked correctly: each positive beats the negatives below its score, and half the ties
+    correct = positives * negatives - np.einsum("ij,ij->i", positives_at, cum_fp - negatives_at / 2)
+    roc_auc = _divide(correct, positives * negatives)
+    average_precision = _divide(np.einsum("ij,ij->i", positives_at, _divide(cum_tp, cum_tp + cum_fp)), positives)
+    valid = (positives > 0) & (negatives > 0)
+    metrics["roc_auc"] = np.where(valid, roc_auc, np.nan)
+    metrics["average_precision"] = np.where(valid, average_precision, np.nan)
+    return metrics
+
+
+def _bootstrap_batch(cells, n_buckets, n_resamples, seed):
+    """Metrics of ``n_resamples`` resamples, drawn in batches of at most BATCH_POSITIONS row positions."""
+    rng = np.random.default_rng(seed)
+    n_rows = len(cells)
+    n_cells = 4 * n_buckets
+    batch = max(1, min(n_resamples, BATCH_POSITIONS // max(1, n_rows)))
+    results = {name: [] for name in METRICS}
+    for start in range(0, n_resamples, batch):
+        size = min(batch, n_resamples - start)
+        positions = rng.integers(0, n_rows, size=(size, n_rows), dtype=np.int32 if n_rows < 2 ** 31 else np.int64)
+        # Offset each resample's cells so one bincount counts the whole batch
+        drawn = cells[positions] + (np.arange(size, dtype=np.int64) * n_cells)[:, None]
+        counts = np.bincount(drawn.ravel(), minlength=size * n_cells).reshape(size, n_buckets, 2, 2)
+        for name, values in resample_metrics(counts).items():
+            results[name].append(values)
+    return {name: np.concatenate(values) for name, values in results.items()}
+
+
+def bootstrap_intervals(y_true, y_pred, scores, n_resamples=1000, confidence=0.95, n_jobs=None, random_state=42,
+                        max_buckets=10_000, ranks=None):
+    """Percentile bootstrap interval of every metric, as a frame with metric, estimate, lower and upper.
+
+    The estimates use every distinct score. Resamples rank the scores in
+    at most ``max_buckets`` buckets (``score_buckets``): pairs within a
+    bucket count as ties, which moves the AUC of a resample by less than
+    about ``1 / (2 * max_buckets)``, far inside any interval.
+    """
+    y_true = np.asarray(y_true).astype(np.int64)
+    y_pred = np.asarray(y_pred).astype(np.int64)
+    ranks, n_scores = ranks or _score_ranks(scores)
+    estimate = resample_metrics(
+        np.bincount((ranks * 2 + y_true) * 2 + y_pred, minlength=4 * n_scores).reshape(1, n_scores, 2, 2)
+    )
+    buckets, n_buckets = score_buckets(ranks, n_scores, max_buckets)
+    # A row is reduced to its (score bucket, label, prediction) cell
+    cells = (buckets * 2 + y_true) * 2 + y_pred
+    cells = cells.astype(np.int32 if 4 * n_buckets < 2 ** 31 else np.int64)
+    shares = [min(RESAMPLES_PER_TASK, n_resamples - start) for start in range(0, n_resamples, RESAMPLES_PER_TASK)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(shares))
+    workers = max(1, min(n_jobs or os.cpu_count(), len(shares)))
+    parts = Parallel(n_jobs=workers)(
+        delayed(_bootstrap_batch)(cells, n_buckets, share, seed) for share, seed in zip(shares, seeds)
+    )
+    alpha = (1 - confidence) / 2
+    rows = []
+    for name in METRICS:
+        values = np.concatenate([part[name] for part in parts])
+        finite = np.isfinite(values)
+        lower, upper = np.quantile(values[finite], [alpha, 1 - alpha]) if finite.any() else (np.nan, np.nan)
+        rows.append({"metric": name, "estimate": float(estimate[name][0]), "lower": float(lower),
+                     "upper": float(upper), "resamples": int(finite.sum())})
+    return pd.DataFrame(rows)
+
+
+# === Engine ===
+
+class EvaluationEngine:
+
+    def __init__(self, segments=SEGMENT_COLUMNS, n_resamples=1000, confidence=0.95, n_jobs=None, random_state=42):
+        self.segments = list(segments)
+        self.n_resamples = n_resamples
+        self.confidence = confidence
+        self.n_jobs = n_jobs or os.cpu_count()
+        self.random_state = random_state
+
+    def evaluate(self, y_true, scores, y_pred=None, frame=None, threshold=0.5):
+        """Metrics, threshold curve, segment metrics and bootstrap intervals of one model's test scores.
+
+        ``y_pred`` defaults to ``scores >= threshold``; ``frame`` holds the
+        segment columns, aligned with the labels by position.
+        """
+        y_true = np.asarray(y_true).astype(bool)
+        scores = np.asarray(scores, dtype=np.float64)
+        y_pred = scores >= threshold if y_pred is None else np.asarray(y_pred).astype(bool)
+        timings = {}
+
+        start = time.perf_counter()
+        curve = threshold_curve(y_true, scores)
+        roc_auc, average_precision = curve_areas(curve)
+        best = curve.iloc[int(curve["f1"].to_numpy().argmax())]
+        tp, fp = int(np.sum(y_true & y_pred)), int(np.sum(~y_true & y_pred))
+        fn, tn = int(np.sum(y_true & ~y_pred)), int(np.sum(~y_true & ~y_pred))
+        metrics = {name: float(value) for name, value in confusion_rates(tp, fp, fn, tn).items() if name != "fpr"}
+        metrics.update({
+            "roc_auc": roc_auc, "average_precision": average_precision,
+            "best_f1": float(best["f1"]), "best_f1_threshold": float(best["threshold"]),
+            "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+        })
+        timings["curve_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ranks = _score_ranks(scores)
+        segments = segment_metrics(y_true, y_pred, scores, frame, self.segments, ranks) if frame is not None else None
+        timings["segments_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        intervals = None
+        if self.n_resamples:
+            intervals = bootstrap_intervals(
+                y_true, y_pred, scores,
+                n_resamples=self.n_resamples, confidence=self.confidence,
+                n_jobs=self.n_jobs, random_state=self.random_state, ranks=ranks
+            )
+        timings["bootstrap_s"] = time.perf_counter() - start
+        logger.info(
+            "Evaluated %d rows: curve %.3fs, segments %.3fs, %d bootstrap resamples %.3fs",
+            len(y_true), timings["curve_s"], timings["segments_s"], self.n_resamples, timings["bootstrap_s"]
+        )
+        return {"metrics": metrics, "curve": curve, "segments": segments, "intervals": intervals, "timings": timings}
+
+
+def log_evaluation(evaluation, prefix="evaluation", curve_points=1000):
+    """Log an ``evaluate`` result to the active MLflow run: metrics, interval bounds and tables."""
+    import mlflow
+
+    metrics = evaluation["metrics"]
+    mlflow.log_metrics({name: value for name, value in metrics.items() if np.isfinite(value)})
+    mlflow.log_table(data=thin_curve(evaluation["curve"], curve_points).replace(np.inf, np.nan),
+                     artifact_file=f"{prefix}/threshold_curve.json")
+    if evaluation["segments"] is not None:
+        mlflow.log_table(data=evaluation["segments"], artifact_file=f"{prefix}/segment_metrics.json")
+    if evaluation["intervals"] is not None:
+        intervals = evaluation["intervals"]
+        for row in intervals.itertuples():
+            if np.isfinite(row.lower):
+                mlflow.log_metrics({f"{row.metric}_ci_lower": row.lower, f"{row.metric}_ci_upper": row.upper})
+        mlflow.log_table(data=intervals, artifact_file=f"{prefix}/bootstrap_intervals.json")
+    mlflow.log_dict({"metrics": metrics, "timings": evaluation["timings"]}, f"{prefix}/summary.json")
@@ -0,0 +1,161 @@
+"""Streaming, optionally parallel extraction of a warehouse table.
+
+Instead of materialising ``SELECT *`` in one DataFrame, the result is pulled
+in batches (Arrow batches where the backend supports them, ``fetchmany``
+otherwise) and handed to the caller one batch at a time.
+
+The table can be split on a key column into ``parts`` sub-queries that run
+in parallel on pooled connections:
+
+* ``hash``: rows whose hashed key falls into bucket ``i`` of ``parts``,
+* ``range``: contiguous key ranges with boundaries at evenly spaced ranks.
+
+Batches from the sub-queries are interleaved through a bounded queue, so
+memory stays at a few batches regardless of the table size. A ``where``
+clause with parameters restricts the pull, e.g. to rows above a high-water
+mark for incremental extraction.
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common.warehouse import ConnectionPool, get_client, quote_identifier
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class Extractor:
+
+    def __init__(self, backend=None, pool=None, batch_rows=50000, max_workers=4):
+        if backend is None and pool is None:
+            # Share the process-wide client's sessions with the other stages
+            client = get_client()
+            backend, pool = client.backend, client.pool
+        self.backend = backend
+        self._owns_pool = pool is None
+        self.pool = pool or ConnectionPool(self.backend, size=max_workers)
+        self.batch_rows = batch_rows
+        self.max_workers = max_workers
+
+    def build_query(self, table, columns=None, where=None):
+        projection = ", ".join(quote_identifier(c) for c in columns) if columns else "*"
+        sql = f"SELECT {projection} FROM {quote_identifier(table)}"
+        if where:
+            sql += f" WHERE {where}"
+        return sql
+
+    def _range_boundaries(self, conn, table, key, parts, where, params):
+        key_sql = quote_identifier(key)
+        filter_sql = f" WHERE {where}" if where else ""
+        total = next(self.backend.iter_batches(
+            conn, f"SELECT COUNT(*) FROM {quote_identifier(table)}{filter_sql}", params
+        )).iloc[0, 0]
+        total = int(total)
+        boundaries = []
+        for i in range(1, parts):
+            sql = (f"SELECT {key_sql} FROM {quote_identifier(table)}{filter_sql} "
+                   f"ORDER BY {key_sql} LIMIT 1 OFFSET {int(total * i / parts)}")
+            batch = next(self.backend.iter_batches(conn, sql, params), None)
+            if batch is not None and len(batch):
+                value = batch.iloc[0, 0]
+                # Drivers cannot bind numpy scalars
+                boundaries.append(value.item() if hasattr(value, "item") else value)
+        # Duplicate keys can make neighbouring boundaries equal
+        return sorted(set(boundaries))
+
+    def split(self, table, key, parts, method="hash", where=None, params=()):
+        """``[(where, params)]`` predicates that together cover the table exactly once."""
+        key_sql = quote_identifier(key)
+        p = self.backend.placeholder
+        if method == "hash":
+            bucket = self.backend.hash_bucket(key_sql, parts)
+            predicates = [(f"{bucket} = {i}", ()) for i in range(parts)]
+        elif method == "range":
+            with self.pool.connection() as conn:
+                bounds = self._range_boundaries(conn, table, key, parts, where, params)
+            if not bounds:
+                predicates = [("1 = 1", ())]
+            else:
+                predicates = [(f"({key_sql} IS NULL OR {key_sql} < {p})", (bounds[0],))]
+                for low, high in zip(bounds, bounds[1:]):
+                    predicates.append((f"{key_sql} >= {p} AND {key_sql} < {p}", (low, high)))
+                predicates.append((f"{key_sql} >= {p}", (bounds[-1],)))
+        else:
+            raise ValueError(f"Unknown split method '{method}', expected 'hash' or 'range'")
+
+        if where:
+            predicates = [(f"({where}) AND ({pred})", tuple(params) + pred_params) for pred, pred_params in predicates]
+        return predicates
+
+    def iter_query(self, sql, params=()):
+        """Stream one query on one pooled connection."""
+        with self.pool.connection() as conn:
+            yield from self.backend.iter_batches(conn, sql, params, self.batch_rows)
+
+    def iter_batches(self, table, columns=None, key=None, parts=1, method="hash", where=None, params=()):
+        """Stream ``table`` as DataFrame batches, split into ``parts`` parallel sub-queries on ``key``."""
+        if parts <= 1 or key is None:
+            sql = self.build_query(table, columns, where)
+            logger.info("Extracting with one query: %s", sql)
+            yield from self.iter_query(sql, params)
+            return
+
+        queries = [
+            (self.build_query(table, columns, pred), pred_params)
+            for pred, pred_params in self.split(table, key, parts, method, where, params)
+        ]
+        logger.info("Extracting %s with %d %s-partitioned sub-queries on %s", table, len(queries), method, key)
+        yield from self._parallel(queries)
+
+    def _parallel(self, queries):
+        batches = queue.Queue(maxsize=2 * self.max_workers)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def run(sql, params):
+            try:
+                for batch in self.iter_query(sql, params):
+                    if stop.is_set():
+                        return
+                    put(batch)
+            except Exception as e:
+                put(e)
+            finally:
+                put(_DONE)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for sql, params in queries:
+                executor.submit(run, sql, params)
+            remaining = len(queries)
+            try:
+                while remaining:
+                    item = batches.get()
+                    if item is _DONE:
+                        remaining -= 1
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        yield item
+            finally:
+                # Unblocks the workers if the consumer stopped early or a query failed
+                stop.set()
+
+    def close(self):
+        if self._owns_pool:
+            self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
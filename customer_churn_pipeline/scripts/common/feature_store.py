@@ -0,0 +1,306 @@
+"""Feature store keyed by ``Customer ID`` and partition date.
+
+Offline, the store keeps one columnar snapshot per materialized partition
+under ``<directory>/offline/<partition_date>/``. A snapshot only holds the
+customers that are new or whose features changed since the previous
+snapshot, found by comparing 128-bit row fingerprints
+(``common.dedup.row_fingerprints``), plus a ``_deleted`` row for every
+customer that disappeared. ``event_date`` is the partition date. A change
+of the feature columns writes a full snapshot instead (``full`` in the
+manifest) with every customer, which supersedes all earlier snapshots. The
+features of a customer at date ``d`` are therefore its row in the latest
+snapshot on or before ``d``, counting only the snapshots since the latest
+full one on or before ``d``:
+
+* ``as_of(d)`` rebuilds the full feature table as it was on ``d``,
+* ``point_in_time(entities)`` joins to each ``(Customer ID, date)`` row the
+  features known at that date and never later ones, for training sets
+  whose labels come from different dates.
+
+``manifest.json`` lists the snapshots as numbered versions, with their
+change counts and the checksum of the partition they came from. It is
+written last, so a snapshot is only visible once it is complete.
+
+Online, ``online.db`` (SQLite) holds the latest features of every
+customer in a ``WITHOUT ROWID`` table keyed by customer id, one JSON row
+per customer. A single-customer lookup is one B-tree seek. Every
+materialization applies the same delta to it in one transaction.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from common.dedup import row_fingerprints
+from common.storage import read_file, write_partition
+
+logger = logging.getLogger(__name__)
+
+KEY_COLUMN = "Customer ID"
+EVENT_DATE = "event_date"
+DELETED = "_deleted"
+FP_HIGH, FP_LOW = "_fp_high", "_fp_low"
+SNAPSHOT_NAME = "features"
+# SQLite's default limit of host parameters per statement is 999
+LOOKUP_BATCH = 500
+
+
+def default_store_path():
+    transformed = os.getenv("TRANSFORMED_DATA_PATH_BASE")
+    return os.getenv("FEATURE_STORE_PATH") or os.path.join(os.path.dirname(transformed), "feature_store")
+
+
+def _restore_dtypes(df, dtypes):
+    """Undo the float upcast of integer columns that tombstone rows cause in a snapshot."""
+    for col, dtype in dtypes.items():
+        if col in df.columns and str(df[col].dtype) != dtype and df[col].notna().all():
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def _is_full(snapshot, position):
+    return snapshot.get("full", position == 0)
+
+
+def _chain(snapshots):
+    """The snapshots from the latest full one on; a full snapshot supersedes everything before it."""
+    start = max((i for i, s in enumerate(snapshots) if _is_full(s, i)), default=0)
+    return snapshots[start:]
+
+
+# === Online Store ===
+
+class OnlineStore:
+    """Latest features of every customer in SQLite, for single-customer lookups."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._columns = None
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode = WAL")
+            with conn:
+                conn.execute("""CREATE TABLE IF NOT EXISTS features (
+                                    customer_id TEXT PRIMARY KEY, event_date TEXT NOT NULL, payload TEXT NOT NULL
+                                ) WITHOUT ROWID""")
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def meta(self):
+        return {name: json.loads(value) for name, value in self._conn().execute("SELECT name, value FROM meta")}
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = self.meta().get("columns", [])
+        return self._columns
+
+    def apply(self, upserts, deleted_keys, partition_date, columns, replace=False):
+        """Upsert the rows of ``upserts`` and delete ``deleted_keys``, in one transaction."""
+        values = upserts[columns].astype(object).where(upserts[columns].notna(), None).to_numpy().tolist()
+        rows = (
+            (key, partition_date, json.dumps(row, separators=(",", ":"), default=str))
+            for key, row in zip(upserts[KEY_COLUMN].astype(str), values)
+        )
+        conn = self._conn()
+        with conn:
+            if replace:
+                conn.execute("DELETE FROM features")
+            conn.executemany(
+                """INSERT INTO features (customer_id, event_date, payload) VALUES (?, ?, ?)
+                   ON CONFLICT (customer_id) DO UPDATE SET
+                       event_date = excluded.event_date, payload = excluded.payload""",
+                rows
+            )
+            conn.executemany("DELETE FROM features WHERE customer_id = ?", ((str(key),) for key in deleted_keys))
+            conn.executemany(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                [("columns", json.dumps(columns)), ("partition_date", json.dumps(partition_date))]
+            )
+        self._columns = None
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM features").fetchone()[0]
+
+    def get(self, customer_id):
+        """Features of one customer as a ``{column: value}`` dict, or None."""
+        row = self._conn().execute(
+            "SELECT payload FROM features WHERE customer_id = ?", (str(customer_id),)
+        ).fetchone()
+        return None if row is None else dict(zip(self.columns, json.loads(row[0])))
+
+    def get_many(self, customer_ids):
+        """``{customer id: features}`` of the customers that are in the store."""
+        ids = [str(key) for key in customer_ids]
+        found = {}
+        conn = self._conn()
+        for start in range(0, len(ids), LOOKUP_BATCH):
+            batch = ids[start:start + LOOKUP_BATCH]
+            found.update(
+                (key, dict(zip(self.columns, json.loads(payload))))
+                for key, payload in conn.execute(
+                    f"SELECT customer_id, payload FROM features WHERE customer_id IN ({','.join('?' * len(batch))})",
+                    batch
+                )
+            )
+        return found
+
+
+# === Feature Store ===
+
+class FeatureStore:
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_store_path()
+        self.offline_dir = os.path.join(self.directory, "offline")
+        self.manifest_path = os.path.join(self.directory, "manifest.json")
+        self.online = OnlineStore(os.path.join(self.directory, "online.db"))
+
+    def snapshots(self, until=None):
+        """Manifest entries of the snapshots, oldest first, up to ``until`` (a partition date) if given."""
+        if not os.path.exists(self.manifest_path):
+            return []
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            snapshots = json.load(f)["snapshots"]
+        return [s for s in snapshots if until is None or s["partition_date"] <= str(until)]
+
+    def _save_manifest(self, snapshots):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"snapshots": snapshots}, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _history(self, snapshots, columns):
+        """Rows of ``snapshots``; columns a snapshot does not have are missing in its rows."""
+        frames = []
+        for s in snapshots:
+            stored = {KEY_COLUMN, EVENT_DATE, DELETED, FP_HIGH, FP_LOW, *s["features"]}
+            frames.append(read_file(s["path"], columns=[col for col in columns if col in stored]).reindex(columns=columns))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def _live(self, snapshots, columns):
+        """Latest row of every customer not deleted after ``snapshots``."""
+        history = self._history(_chain(snapshots), [KEY_COLUMN, DELETED, *columns])
+        live = history.drop_duplicates(KEY_COLUMN, keep="last")
+        return live[~live[DELETED].astype(bool)].drop(columns=DELETED).reset_index(drop=True)
+
+    # === Materialization ===
+    def materialize(self, df, partition_date, source_checksum=None):
+        """Store the features of ``df`` (one row per customer) as the snapshot of ``partition_date``.
+
+        Only rows that changed since the previous snapshot are written. The
+        latest partition may be materialized again (it is replaced, or
+        skipped if ``source_checksum`` matches); older ones may not.
+        """
+        snapshots = self.snapshots()
+        previous, replaced = snapshots, None
+        if snapshots and partition_date < snapshots[-1]["partition_date"]:
+            raise ValueError(f"Feature store is at {snapshots[-1]['partition_date']}; "
+                             f"cannot materialize the older partition {partition_date}")
+        if snapshots and partition_date == snapshots[-1]["partition_date"]:
+            replaced = snapshots[-1]
+            if source_checksum is not None and replaced.get("source_checksum") == source_checksum:
+                logger.info("Feature snapshot %s is up to date", partition_date)
+                return {**replaced, "skipped": True}
+            previous = snapshots[:-1]
+
+        if df[KEY_COLUMN].duplicated().any():
+            logger.warning("%d duplicate %s values; keeping the last row of each",
+                           int(df[KEY_COLUMN].duplicated().sum()), KEY_COLUMN)
+            df = df.drop_duplicates(KEY_COLUMN, keep="last")
+        df = df.reset_index(drop=True)
+        features = [col for col in df.columns if col != KEY_COLUMN]
+        # A schema change starts a full snapshot instead of a delta
+        full = not previous or previous[-1]["features"] != features
+
+        high, low = row_fingerprints(df)
+        current = self._live(previous, [FP_HIGH, FP_LOW]) if not full else pd.DataFrame(
+            {KEY_COLUMN: [], FP_HIGH: [], FP_LOW: []})
+        changed = ~pd.MultiIndex.from_arrays([high, low]).isin(
+            pd.MultiIndex.from_arrays([current[FP_HIGH].to_numpy(np.int64), current[FP_LOW].to_numpy(np.int64)]))
+        removed = current.loc[~current[KEY_COLUMN].isin(df[KEY_COLUMN]), KEY_COLUMN]
+        updated = int(df.loc[changed, KEY_COLUMN].isin(current[KEY_COLUMN]).sum())
+        counts = {"inserted": int(changed.sum()) - updated, "updated": updated,
+                  "deleted": len(removed), "unchanged": int((~changed).sum())}
+
+        delta = df[changed].assign(**{EVENT_DATE: partition_date, DELETED: False,
+                                      FP_HIGH: high[changed], FP_LOW: low[changed]})
+        tombstones = pd.DataFrame({KEY_COLUMN: removed.to_numpy(), EVENT_DATE: partition_date, DELETED: True,
+                                   FP_HIGH: 0, FP_LOW: 0})
+        snapshot = pd.concat([delta, tombstones], ignore_index=True) if len(tombstones) else delta
+        path = write_partition(snapshot, os.path.join(self.offline_dir, partition_date), SNAPSHOT_NAME, export_csv=False)
+
+        # Rows the replaced snapshot had touched go back to their current values
+        touched = set(snapshot[KEY_COLUMN])
+        if replaced is not None:
+            touched |= set(read_file(replaced["path"], columns=[KEY_COLUMN])[KEY_COLUMN])
+        upserts = df[df[KEY_COLUMN].isin(touched)]
+        deleted_keys = (touched - set(df[KEY_COLUMN])) | set(removed)
+        self.online.apply(upserts, deleted_keys, partition_date, features, replace=full)
+
+        entry = {
+            "version": (previous[-1]["version"] + 1) if previous else 1,
+            "partition_date": partition_date,
+            "path": path,
+            "rows": len(snapshot),
+            "customers": len(df),
+            "full": full,
+            **counts,
+            "features": features,
+            "dtypes": {col: str(dtype) for col, dtype in df[features].dtypes.items()},
+            "source_checksum": source_checksum,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        self._save_manifest(previous + [entry])
+        logger.info("Materialized features of %s as version %d: %s", partition_date, entry["version"], counts)
+        return entry
+
+    # === Offline Reads ===
+    def as_of(self, partition_date=None, columns=None):
+        """Feature table (``Customer ID`` + features) as it was on ``partition_date`` (latest if None)."""
+        snapshots = self.snapshots(until=partition_date)
+        if not snapshots:
+            raise LookupError(f"No feature snapshot on or before {partition_date}")
+        columns = list(columns or snapshots[-1]["features"])
+        return _restore_dtypes(self._live(snapshots, columns), snapshots[-1]["dtypes"])
+
+    def point_in_time(self, entities, date_column=EVENT_DATE, columns=None):
+        """``entities`` with the features of each row's customer as of the row's date.
+
+        A row gets the customer's features from the latest snapshot on or
+        before its date. Rows with no snapshot on or before their date, and
+        customers that were deleted by then, get missing values.
+        """
+        dates = pd.to_datetime(entities[date_column])
+        snapshots = self.snapshots(until=dates.max().strftime("%Y-%m-%d"))
+        columns = list(columns or (snapshots[-1]["features"] if snapshots else []))
+        history = self._history(snapshots, [KEY_COLUMN, EVENT_DATE, DELETED, *columns])
+        history = history[history[KEY_COLUMN].isin(entities[KEY_COLUMN])]
+        history = history.assign(_as_of=pd.to_datetime(history[EVENT_DATE])).drop(columns=EVENT_DATE)
+
+        # A row only sees the snapshots since the latest full one on or before its date
+        chain_starts = pd.to_datetime([s["partition_date"] for i, s in enumerate(snapshots) if _is_full(s, i)])
+        history["_chain"] = chain_starts.searchsorted(history["_as_of"], side="right")
+        left = entities.assign(_as_of=dates, _row=np.arange(len(entities)),
+                               _chain=chain_starts.searchsorted(dates, side="right"))
+        joined = pd.merge_asof(
+            left.sort_values("_as_of"), history.sort_values("_as_of"),
+            on="_as_of", by=[KEY_COLUMN, "_chain"], direction="backward", suffixes=("", "_feature")
+        )
+        deleted = joined[DELETED].eq(True)
+        joined.loc[deleted, [col if col not in entities.columns else f"{col}_feature" for col in columns]] = np.nan
+        return joined.sort_values("_row").drop(columns=["_as_of", "_row", "_chain", DELETED]).reset_index(drop=True)
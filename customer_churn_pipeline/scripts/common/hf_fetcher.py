@@ -0,0 +1,230 @@
+"""Concurrent, resumable client for the Hugging Face datasets-server ``/rows`` endpoint.
+
+Pages are requested as offset windows over one pooled keep-alive session, with
+a bounded number of windows in flight at a time. Every window is retried with
+exponential backoff on its own, and pages are handed back strictly in offset
+order, so the caller can checkpoint a contiguous prefix of the dataset and
+resume from it later.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# The datasets-server rejects pages longer than this
+MAX_PAGE_SIZE = 100
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    """Raised when a page could not be fetched after all retries."""
+
+
+def build_session(pool_size=8):
+    """Return a ``requests.Session`` whose connection pool can serve ``pool_size`` threads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+class AdaptivePageSizer:
+    """Pick the length of the next window from the latency of the previous ones.
+
+    The size doubles while responses come back well under ``target_latency``
+    and halves when they are slower than that or fail, staying within
+    ``[min_size, max_size]``.
+    """
+
+    def __init__(self, initial, min_size=10, max_size=MAX_PAGE_SIZE, target_latency=1.0):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.size = max(min_size, min(initial, max_size))
+        self._lock = threading.Lock()
+
+    def record_success(self, latency):
+        with self._lock:
+            if latency < self.target_latency / 2:
+                self.size = min(self.max_size, self.size * 2)
+            elif latency > self.target_latency:
+                self.size = max(self.min_size, self.size // 2)
+
+    def record_failure(self):
+        with self._lock:
+            self.size = max(self.min_size, self.size // 2)
+
+
+class FetchCheckpoint:
+    """Small JSON file recording how far a download got.
+
+    ``key`` identifies the dataset/config/split being downloaded so that a
+    checkpoint left behind by a different download is never resumed.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("key") != self.key:
+            logger.warning("Ignoring checkpoint %s written for %s", self.path, state.get("key"))
+            return None
+        return state
+
+    def save(self, **state):
+        state["key"] = self.key
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class PaginatedFetcher:
+    """Fetch the rows of one dataset split as concurrent offset windows."""
+
+    def __init__(self, base_url, dataset, config="default", split="train", session=None,
+                 max_workers=4, page_size=MAX_PAGE_SIZE, min_page_size=10,
+                 max_page_size=MAX_PAGE_SIZE, max_retries=5, backoff_base=0.5,
+                 backoff_max=30.0, timeout=30, target_latency=1.0):
+        self.base_url = base_url
+        self.dataset = dataset
+        self.config = config
+        self.split = split
+        self.max_workers = max(1, max_workers)
+        self.session = session or build_session(self.max_workers)
+        self.sizer = AdaptivePageSizer(page_size, min_page_size, max_page_size, target_latency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.num_rows_total = None
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(self.backoff_max, float(retry_after))
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def fetch_page(self, offset, length):
+        """Return ``(rows, num_rows_total)`` for one window, retrying transient failures."""
+        params = {
+            "dataset": self.dataset,
+            "config": self.config,
+            "split": self.split,
+            "offset": offset,
+            "length": length
+        }
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            response = None
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+                if response.status_code not in RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    payload = response.json()
+                    break
+                error = f"HTTP {response.status_code}"
+            except requests.HTTPError as e:
+                # 4xx other than the retryable ones will not get better by asking again
+                raise FetchError(f"HTTP error at offset {offset}: {e}") from e
+            except (requests.RequestException, ValueError) as e:
+                error = str(e)
+
+            self.sizer.record_failure()
+            if attempt == self.max_retries:
+                raise FetchError(f"Giving up on offset {offset} after {attempt + 1} attempts: {error}")
+            delay = self._backoff(attempt, response)
+            logger.warning("Offset %d failed (%s), retry %d/%d in %.1fs",
+                           offset, error, attempt + 1, self.max_retries, delay)
+            time.sleep(delay)
+
+        self.sizer.record_success(time.perf_counter() - start)
+        rows = [row["row"] for row in payload.get("rows", [])]
+        total = payload.get("num_rows_total")
+        if total is not None:
+            self.num_rows_total = total
+        return rows, total
+
+    def iter_pages(self, start_offset=0, num_rows_total=None):
+        """Yield ``(offset, rows)`` in offset order, starting at ``start_offset``.
+
+        At most ``max_workers`` windows are in flight, and completed windows
+        waiting for an earlier one are capped at the same number, so memory
+        stays bounded even when one window is stuck retrying.
+        """
+        if num_rows_total is not None:
+            self.num_rows_total = num_rows_total
+        offset = start_offset
+
+        # The first window tells us the total size of the split
+        if self.num_rows_total is None:
+            length = self.sizer.size
+            rows, _ = self.fetch_page(offset, length)
+            if not rows:
+                return
+            yield offset, rows
+            offset += len(rows)
+            if len(rows) < length:
+                return
+
+        next_offset = offset
+        in_flight = {}
+        completed = {}
+        exhausted = False
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while True:
+                while (not exhausted and len(in_flight) < self.max_workers
+                       and len(in_flight) + len(completed) < 2 * self.max_workers):
+                    length = self.sizer.size
+                    if self.num_rows_total is not None:
+                        if next_offset >= self.num_rows_total:
+                            exhausted = True
+                            break
+                        length = min(length, self.num_rows_total - next_offset)
+                    future = pool.submit(self.fetch_page, next_offset, length)
+                    in_flight[future] = (next_offset, length)
+                    next_offset += length
+
+                if not in_flight and not completed:
+                    return
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window_offset, length = in_flight.pop(future)
+                    rows, _ = future.result()
+                    completed[window_offset] = (length, rows)
+                    if len(rows) < length:
+                        exhausted = True
+
+                while offset in completed:
+                    length, rows = completed.pop(offset)
+                    if rows:
+                        yield offset, rows
+                    if len(rows) < length:
+                        return
+                    offset += length
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
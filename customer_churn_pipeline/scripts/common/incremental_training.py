@@ -0,0 +1,143 @@
+"""Warm-start retraining of the churn models from one partition to the next.
+
+``ModelState`` keeps what the previous run produced: the fitted
+preprocessor, the fitted models, the row fingerprints of the partition they
+were trained on (see ``common.delta_index``), a reference distribution of
+the numeric features, and the models' test scores. The next partition is
+diffed against those fingerprints. Only its new or changed training rows
+update the models (the train/test split follows the row fingerprints, see
+``common.delta_index.fingerprint_split``, so rows keep their side):
+
+* models with ``partial_fit`` (SGD) take a few passes over the delta rows,
+* forests with ``warm_start`` grow extra trees fitted on the delta rows.
+
+The preprocessor is kept as it was, so the feature space does not move.
+
+``incremental_gate`` decides when this is not good enough and a full
+retrain is needed: no usable previous state, a changed configuration, a
+delta that is too large, feature drift (population stability index) above a
+threshold, a delta missing one of the classes, or a forest that already has
+too many trees. The caller also falls back to a full retrain when an updated
+model scores worse on the test rows than the previous one did.
+"""
+import copy
+import json
+import logging
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def reference_distribution(X, numeric_features, bins=10):
+    """Decile edges and proportions of each numeric feature, for later drift checks."""
+    reference = {}
+    for col in numeric_features:
+        values = X[col].dropna().to_numpy(dtype=float)
+        if len(values) == 0:
+            continue
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)))
+        counts = np.histogram(values, bins=np.concatenate(([-np.inf], edges[1:-1], [np.inf])))[0]
+        reference[col] = {"edges": edges.tolist(), "proportions": (counts / counts.sum()).tolist()}
+    return reference
+
+
+def population_stability(reference, X, eps=1e-4):
+    """PSI of each referenced numeric feature of ``X`` against its stored distribution."""
+    psi = {}
+    for col, ref in reference.items():
+        if col not in X.columns:
+            continue
+        values = X[col].dropna().to_numpy(dtype=float)
+        if len(values) == 0:
+            continue
+        edges = np.array(ref["edges"])
+        counts = np.histogram(values, bins=np.concatenate(([-np.inf], edges[1:-1], [np.inf])))[0]
+        actual = np.clip(counts / counts.sum(), eps, None)
+        expected = np.clip(np.array(ref["proportions"]), eps, None)
+        psi[col] = float(np.sum((actual - expected) * np.log(actual / expected)))
+    return psi
+
+
+def supports_incremental(model):
+    return hasattr(model, "partial_fit") or hasattr(model, "warm_start")
+
+
+def update_model(model, X_delta, y_delta, extra_trees=10, epochs=5, random_state=42):
+    """Copy of ``model`` updated with the delta rows only."""
+    model = copy.deepcopy(model)
+    if hasattr(model, "partial_fit"):
+        rng = np.random.default_rng(random_state)
+        for _ in range(epochs):
+            order = rng.permutation(X_delta.shape[0])
+            model.partial_fit(X_delta[order], y_delta[order], classes=model.classes_)
+    elif hasattr(model, "warm_start"):
+        model.set_params(warm_start=True, n_estimators=model.n_estimators + extra_trees)
+        model.fit(X_delta, y_delta)
+        model.set_params(warm_start=False)
+    else:
+        raise ValueError(f"{type(model).__name__} cannot be updated incrementally")
+    return model
+
+
+def incremental_gate(meta, config_key, delta_rows, total_rows, delta_classes, classes, psi, models,
+                     max_delta_fraction=0.3, max_psi=0.2, max_trees=1000):
+    """``None`` if an incremental update is acceptable, else the reason for a full retrain."""
+    if meta is None:
+        return "no previous model state"
+    if meta["config_key"] != config_key:
+        return "preprocessing or model configuration changed"
+    if delta_rows / max(total_rows, 1) > max_delta_fraction:
+        return f"delta of {delta_rows} rows is over {max_delta_fraction:.0%} of the partition"
+    drifted = {col: round(value, 3) for col, value in psi.items() if value > max_psi}
+    if drifted:
+        return f"feature drift (PSI > {max_psi}): {drifted}"
+    if delta_rows and set(delta_classes) != set(classes):
+        return "delta rows do not contain every class"
+    for name, model in models.items():
+        if not supports_incremental(model):
+            return f"{name} cannot be updated incrementally"
+        if getattr(model, "n_estimators", 0) >= max_trees:
+            return f"{name} reached {max_trees} trees"
+    return None
+
+
+class ModelState:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "state.json")
+
+    def load_meta(self):
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load(self):
+        """``(meta, preprocessor, {name: model}, fingerprints)`` or None."""
+        meta = self.load_meta()
+        if meta is None:
+            return None
+        preprocessor = joblib.load(os.path.join(self.directory, "preprocessor.joblib"))
+        models = {name: joblib.load(os.path.join(self.directory, f"{name}.joblib")) for name in meta["models"]}
+        fingerprints = pd.read_parquet(os.path.join(self.directory, "fingerprints.parquet"))
+        return meta, preprocessor, models, fingerprints
+
+    def save(self, preprocessor, models, fingerprints, **meta):
+        os.makedirs(self.directory, exist_ok=True)
+        # Invalidate first so a crash mid-save never pairs new models with old metadata
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+        joblib.dump(preprocessor, os.path.join(self.directory, "preprocessor.joblib"))
+        for name, model in models.items():
+            joblib.dump(model, os.path.join(self.directory, f"{name}.joblib"))
+        fingerprints.to_parquet(os.path.join(self.directory, "fingerprints.parquet"), index=False)
+
+        tmp_meta = self.meta_path + ".tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({**meta, "models": list(models)}, f, indent=2)
+        os.replace(tmp_meta, self.meta_path)
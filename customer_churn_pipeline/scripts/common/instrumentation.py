@@ -0,0 +1,349 @@
+"""Structured per-stage performance events for the pipeline.
+
+Every stage opens a stage span when it starts (``start_stage``) and may
+nest named spans around its phases (``with span("clean"):`` or the
+``traced`` decorator). A span records:
+
+* wall time and CPU time of the process (all its threads),
+* peak RSS: the process's high-water mark when the span ends and how much
+  the span raised it,
+* rows in and out, as reported by the code with ``add``,
+* bytes and seconds of partition reads and writes. ``common.storage``
+  reports every read and write to the innermost open span, and a closed
+  span adds its I/O to its parent's.
+
+Closed spans are appended as one JSON object per line to
+``PIPELINE_EVENTS_PATH`` (default ``<LOG_BASE_PATH>/pipeline_events.jsonl``).
+Each is tagged with ``PIPELINE_RUN_ID``, which the orchestrator sets for
+its run, so the events of all the stage subprocesses of one run can be put
+back together. ``timeline`` renders a run as a span tree with bars on a
+shared time axis. ``compare`` puts two runs side by side, and
+``log_to_mlflow`` writes a run's spans as metrics.
+
+Peak RSS comes from ``resource`` on Unix. Where that module is missing
+(Windows), psutil's peak working set is used, and the field is left empty
+if psutil is not installed either.
+"""
+import atexit
+import functools
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ("rows_in", "rows_out", "bytes_read", "bytes_written", "io_read_s", "io_write_s")
+# I/O is rolled up into the parent span, rows are what the span itself reports
+IO_COUNTERS = ("bytes_read", "bytes_written", "io_read_s", "io_write_s")
+
+_local = threading.local()
+_emit_lock = threading.Lock()
+# Open stage spans, innermost last (in-process stages run inside the orchestrator's)
+_stages = []
+_atexit_registered = False
+_ROOT = object()
+_span_ids = itertools.count(1)
+_default_run_id = f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+
+
+def run_id():
+    return os.getenv("PIPELINE_RUN_ID") or _default_run_id
+
+
+def events_path():
+    path = os.getenv("PIPELINE_EVENTS_PATH")
+    if path:
+        return path
+    log_dir = os.getenv("LOG_BASE_PATH") or os.getenv("LOG_DIR") or "."
+    return os.path.join(log_dir, "pipeline_events.jsonl")
+
+
+def peak_rss_mb():
+    """High-water mark of the process's resident memory in MB, or None."""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return round(getattr(info, "peak_wset", info.rss) / (1 << 20), 1)
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+class Span:
+
+    def __init__(self, name, stage=None, parent=None, **attributes):
+        self.name = name
+        self.stage = stage
+        self.attributes = attributes
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.parent = parent
+        self.id = f"{os.getpid()}-{next(_span_ids)}"
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        """Add to the span's counters (``rows_in``, ``rows_out``, ...)."""
+        with self._lock:
+            for name, value in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+        return self
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def __enter__(self):
+        stack = _stack()
+        if self.parent is _ROOT:
+            self.parent = None
+        elif self.parent is None:
+            self.parent = current_span()
+        if self.stage is None:
+            self.stage = self.parent.stage if self.parent is not None else None
+        self.path = f"{self.parent.path}/{self.name}" if self.parent is not None else self.name
+        stack.append(self)
+        self.started_at = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._peak = peak_rss_mb()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.close("error" if exc_type is not None else "ok", exc)
+        return False
+
+    def close(self, status="ok", error=None):
+        peak = peak_rss_mb()
+        event = {
+            "run_id": run_id(),
+            "stage": self.stage,
+            "span": self.path,
+            "id": self.id,
+            "parent_id": self.parent.id if self.parent is not None else None,
+            "depth": self.path.count("/"),
+            "pid": os.getpid(),
+            "start": round(self.started_at, 4),
+            "wall_s": round(time.perf_counter() - self._wall, 4),
+            "cpu_s": round(time.process_time() - self._cpu, 4),
+            "peak_rss_mb": peak,
+            "rss_growth_mb": None if peak is None or self._peak is None else round(peak - self._peak, 1),
+            **{name: round(value, 4) if isinstance(value, float) else value for name, value in self.counts.items()},
+            "status": status,
+            **({"error": str(error)} if error is not None else {}),
+            **self.attributes,
+        }
+        if self.parent is not None:
+            self.parent.add(**{name: self.counts[name] for name in IO_COUNTERS})
+        emit(event)
+        return event
+
+
+def span(name, parent=None, **attributes):
+    """Context manager timing a phase, nested in the innermost open span unless ``parent`` is given."""
+    return Span(name, parent=parent, **attributes)
+
+
+def traced(name=None):
+    """Decorator running every call of the function in its own span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    # Threads the stage started itself (loader pools) report to the stage
+    stack = _stack()
+    return stack[-1] if stack else (_stages[-1] if _stages else None)
+
+
+def record_io(direction, nbytes, seconds):
+    """Attribute a partition read (``"read"``) or write (``"write"``) to the innermost open span."""
+    target = current_span()
+    if target is not None:
+        bytes_counter = "bytes_read" if direction == "read" else "bytes_written"
+        target.add(**{bytes_counter: nbytes, f"io_{direction}_s": seconds})
+
+
+def start_stage(name, **attributes):
+    """Open the span covering the whole stage; it is closed by ``finish_stage`` or at exit."""
+    global _atexit_registered
+    stage = Span(name, stage=name, parent=_ROOT, **attributes).__enter__()
+    _stages.append(stage)
+    if not _atexit_registered:
+        atexit.register(_finish_at_exit)
+        _atexit_registered = True
+    return stage
+
+
+def finish_stage(status="ok", error=None):
+    """Close the innermost stage span and return its event (None if no stage is open)."""
+    if not _stages:
+        return None
+    stage = _stages.pop()
+    stack = _stack()
+    if stage in stack:
+        del stack[stack.index(stage):]
+    return stage.close(status, error)
+
+
+def stage_depth():
+    return len(_stages)
+
+
+def _finish_at_exit():
+    # The interpreter keeps the exception that ended the script in sys.last_value
+    error = getattr(sys, "last_value", None)
+    while _stages:
+        finish_stage("error" if error is not None else "ok", error)
+
+
+def emit(event):
+    path = events_path()
+    line = json.dumps(event, default=str) + "\n"
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with _emit_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        logger.warning("Could not write performance event to %s: %s", path, e)
+
+
+# === Reports ===
+def load_events(path=None, run=None):
+    """Events of ``run`` (all runs if None) from the events file, in file order."""
+    path = path or events_path()
+    if not os.path.exists(path):
+        return []
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                if run is None or event["run_id"] == run:
+                    events.append(event)
+    return events
+
+
+def run_ids(events):
+    """Run ids in the order their first event was written."""
+    return list(dict.fromkeys(event["run_id"] for event in events))
+
+
+def _tree_order(events):
+    """Events ordered so every span follows its parent, siblings by start time."""
+    ids = {e["id"] for e in events}
+    children = {}
+    for e in sorted(events, key=lambda e: e["start"]):
+        # Spans whose parent never closed (a crashed stage) are shown as roots
+        parent = e["parent_id"] if e["parent_id"] in ids else None
+        children.setdefault(parent, []).append(e)
+    ordered = []
+
+    def visit(parent):
+        for e in children.get(parent, []):
+            ordered.append(e)
+            visit(e["id"])
+
+    visit(None)
+    return ordered
+
+
+def timeline(events, width=40):
+    """Text timeline of one run: a row per span with its metrics and a bar on the run's time axis."""
+    if not events:
+        return "No events."
+    origin = min(e["start"] for e in events)
+    total = max(e["start"] + e["wall_s"] for e in events) - origin or 1.0
+    lines = [
+        f"Run {events[0]['run_id']}: {total:.2f}s, {len(events)} spans",
+        f"{'span':<44}{'start':>7}{'wall':>8}{'cpu':>8}{'peakMB':>8}{'rows in/out':>16}"
+        f"{'readMB':>8}{'writeMB':>8}{'io s':>7}  timeline",
+    ]
+    for e in _tree_order(events):
+        offset = e["start"] - origin
+        left = int(offset / total * width)
+        bar = " " * left + "#" * max(1, round(e["wall_s"] / total * width))
+        label = "  " * e["depth"] + e["span"].rsplit("/", 1)[-1] + ("" if e["status"] == "ok" else " [FAILED]")
+        rows = f"{e['rows_in'] or '-'}/{e['rows_out'] or '-'}"
+        io_s = e["io_read_s"] + e["io_write_s"]
+        lines.append(
+            f"{label[:43]:<44}{offset:>7.2f}{e['wall_s']:>8.2f}{e['cpu_s']:>8.2f}"
+            f"{e['peak_rss_mb'] if e['peak_rss_mb'] is not None else '-':>8}{rows:>16}"
+            f"{e['bytes_read'] / (1 << 20):>8.2f}{e['bytes_written'] / (1 << 20):>8.2f}{io_s:>7.2f}  |{bar:<{width}}|"
+        )
+    return "\n".join(lines)
+
+
+def compare(before, after):
+    """Wall time, CPU and peak RSS of the spans of two runs side by side.
+
+    Spans that ran several times in a run (a phase per chunk) are summed,
+    with the highest peak.
+    """
+    def by_span(events):
+        totals = {}
+        for e in events:
+            total = totals.setdefault(e["span"], {"wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": None})
+            total["wall_s"] += e["wall_s"]
+            total["cpu_s"] += e["cpu_s"]
+            if e["peak_rss_mb"] is not None:
+                total["peak_rss_mb"] = max(total["peak_rss_mb"] or 0, e["peak_rss_mb"])
+        return totals
+
+    def field(total, key, fmt="{:.2f}"):
+        return fmt.format(total[key]) if total and total[key] is not None else "-"
+
+    a, b = by_span(before), by_span(after)
+    lines = [f"{'span':<44}{'wall A':>8}{'wall B':>8}{'B/A':>7}{'cpu A':>8}{'cpu B':>8}{'peakMB A':>10}{'peakMB B':>10}"]
+    for name in dict.fromkeys(e["span"] for e in _tree_order(before) + _tree_order(after)):
+        x, y = a.get(name), b.get(name)
+        ratio = f"{y['wall_s'] / x['wall_s']:.2f}" if x and y and x["wall_s"] else "-"
+        lines.append(f"{name[:43]:<44}{field(x, 'wall_s'):>8}{field(y, 'wall_s'):>8}{ratio:>7}"
+                     f"{field(x, 'cpu_s'):>8}{field(y, 'cpu_s'):>8}"
+                     f"{field(x, 'peak_rss_mb', '{}'):>10}{field(y, 'peak_rss_mb', '{}'):>10}")
+    return "\n".join(lines)
+
+
+def log_to_mlflow(events, experiment="churn_pipeline_runs"):
+    """Log a run's spans as metrics of one MLflow run named after the pipeline run id."""
+    import mlflow
+
+    if not events:
+        return None
+    mlflow.set_experiment(experiment)
+    with mlflow.start_run(run_name=f"pipeline_{events[0]['run_id']}") as run:
+        mlflow.set_tag("pipeline_run_id", events[0]["run_id"])
+        metrics = {}
+        for e in events:
+            key = e["span"].replace(" ", "_")
+            for name in ("wall_s", "cpu_s", "peak_rss_mb", *COUNTERS):
+                if e.get(name) is not None:
+                    # MLflow metric names allow letters, digits, _-./ and spaces
+                    metrics[f"{key}/{name}"] = e[name]
+        mlflow.log_metrics(metrics)
+        mlflow.log_text(timeline(events), "timeline.txt")
+    return run.info.run_id
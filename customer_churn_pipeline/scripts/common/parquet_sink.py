@@ -0,0 +1,112 @@
+"""Append-only Parquet sink for data that arrives one page at a time.
+
+Each page becomes one row group of the currently open part file, so only the
+page being written is ever held in memory. Part files are rolled every
+``rows_per_part`` rows; a part only counts as committed once it is closed,
+which is what makes the sink resumable after a crash.
+"""
+import glob
+import logging
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+
+class ParquetPageSink:
+    """Directory of ``part-NNNNN.parquet`` files sharing one fixed schema."""
+
+    def __init__(self, directory, rows_per_part=100_000, compression="snappy"):
+        self.directory = directory
+        self.rows_per_part = rows_per_part
+        self.compression = compression
+        self.schema = None
+        self.parts = []
+        self._writer = None
+        self._current_part = None
+        self._part_rows = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def resume(self, parts):
+        """Keep only the committed ``parts`` and drop anything half-written."""
+        self.parts = list(parts)
+        for path in glob.glob(os.path.join(self.directory, "part-*.parquet")):
+            if os.path.basename(path) not in self.parts:
+                logger.info("Removing uncommitted part %s", path)
+                os.remove(path)
+        if self.parts:
+            self.schema = pq.read_schema(os.path.join(self.directory, self.parts[0]))
+
+    @staticmethod
+    def infer_schema(rows):
+        schema = pa.Table.from_pylist(rows).schema
+        # A column that is empty on the first page would otherwise stay typed as null
+        return pa.schema([
+            pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+            for field in schema
+        ])
+
+    def write_page(self, rows):
+        """Append ``rows`` as one row group. Returns True if a part was committed."""
+        if not rows:
+            return False
+        if self.schema is None:
+            self.schema = self.infer_schema(rows)
+            logger.info("Fixed sink schema from first page: %s", self.schema.names)
+
+        unexpected = set(rows[0]) - set(self.schema.names)
+        if unexpected:
+            raise ValueError(f"Page has columns not in the sink schema: {sorted(unexpected)}")
+        table = pa.Table.from_pylist(rows, schema=self.schema)
+
+        if self._writer is None:
+            self._current_part = f"part-{len(self.parts):05d}.parquet"
+            self._writer = pq.ParquetWriter(
+                os.path.join(self.directory, self._current_part),
+                self.schema,
+                compression=self.compression
+            )
+        self._writer.write_table(table)
+        self._part_rows += table.num_rows
+
+        if self._part_rows >= self.rows_per_part:
+            self.close_part()
+            return True
+        return False
+
+    def close_part(self):
+        """Close the open part file, if any, and mark it committed."""
+        if self._writer is None:
+            return
+        self._writer.close()
+        self.parts.append(self._current_part)
+        logger.info("Committed %s (%d rows)", self._current_part, self._part_rows)
+        self._writer = None
+        self._current_part = None
+        self._part_rows = 0
+
+    def iter_batches(self, batch_size=65_536, columns=None):
+        for part in self.parts:
+            parquet_file = pq.ParquetFile(os.path.join(self.directory, part))
+            yield from parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+
+    def num_rows(self):
+        return sum(
+            pq.ParquetFile(os.path.join(self.directory, part)).metadata.num_rows
+            for part in self.parts
+        )
+
+    def to_csv(self, csv_path, batch_size=65_536):
+        """Export the committed parts to one CSV, one batch at a time. Returns the row count."""
+        tmp_path = csv_path + ".tmp"
+        rows = 0
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            for batch in self.iter_batches(batch_size=batch_size):
+                batch.to_pandas().to_csv(f, header=rows == 0, index=False)
+                rows += batch.num_rows
+            if rows == 0 and self.schema is not None:
+                f.write(",".join(self.schema.names) + "\n")
+        os.replace(tmp_path, csv_path)
+        return rows
@@ -0,0 +1,114 @@
+"""On-disk cache of the fitted preprocessor and the matrices it produces.
+
+Model building fits the same ``ColumnTransformer`` for every classifier.
+The cache fits it once per partition and preprocessing configuration and
+stores the fitted transformer next to the transformed train and test
+matrices. Dense matrices are kept as ``.npy`` files and sparse ones as the
+three CSR arrays. Either way they are opened memory-mapped, so later models
+and re-runs neither refit nor copy them into memory.
+
+An entry lives in ``<cache_dir>/<partition>_<key>/`` where ``key`` hashes
+the partition checksum, the feature lists, the transformer parameters and
+the split settings. ``meta.json`` is written last and marks the entry as
+complete. Only the ``keep`` most recently written entries are kept.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+import sklearn
+
+logger = logging.getLogger(__name__)
+
+
+def config_hash(preprocessor, **settings):
+    """Hash of the unfitted preprocessor's parameters plus any extra settings."""
+    params = {name: repr(value) for name, value in preprocessor.get_params(deep=True).items()}
+    payload = json.dumps({"params": params, "settings": settings, "sklearn": sklearn.__version__},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _save_matrix(directory, name, matrix):
+    if sp.issparse(matrix):
+        matrix = matrix.tocsr()
+        for part in ("data", "indices", "indptr"):
+            np.save(os.path.join(directory, f"{name}_{part}.npy"), getattr(matrix, part))
+        return {"sparse": True, "shape": list(matrix.shape)}
+    np.save(os.path.join(directory, f"{name}.npy"), np.asarray(matrix))
+    return {"sparse": False, "shape": list(matrix.shape)}
+
+
+def _load_matrix(directory, name, info):
+    if info["sparse"]:
+        parts = [np.load(os.path.join(directory, f"{name}_{part}.npy"), mmap_mode="r")
+                 for part in ("data", "indices", "indptr")]
+        return sp.csr_matrix(tuple(parts), shape=tuple(info["shape"]), copy=False)
+    return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+
+class PreprocessingCache:
+
+    def __init__(self, cache_dir, keep=3):
+        self.cache_dir = cache_dir
+        self.keep = keep
+
+    def entry_dir(self, partition, key):
+        return os.path.join(self.cache_dir, f"{partition}_{key}")
+
+    def load(self, partition, key):
+        """``(preprocessor, X_train, X_test)`` from the cache, or None."""
+        directory = self.entry_dir(partition, key)
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        preprocessor = joblib.load(os.path.join(directory, "preprocessor.joblib"))
+        return (
+            preprocessor,
+            _load_matrix(directory, "X_train", meta["X_train"]),
+            _load_matrix(directory, "X_test", meta["X_test"]),
+        )
+
+    def get_or_fit(self, partition, key, preprocessor, X_train, X_test):
+        """Fit ``preprocessor`` on ``X_train`` unless the entry exists; returns the cached triple."""
+        cached = self.load(partition, key)
+        if cached is not None:
+            logger.info("Preprocessing cache hit for partition %s (%s)", partition, key)
+            return cached
+
+        logger.info("Preprocessing cache miss for partition %s (%s), fitting", partition, key)
+        directory = self.entry_dir(partition, key)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+        train = preprocessor.fit_transform(X_train)
+        test = preprocessor.transform(X_test)
+        joblib.dump(preprocessor, os.path.join(directory, "preprocessor.joblib"))
+        meta = {
+            "partition": partition,
+            "key": key,
+            "X_train": _save_matrix(directory, "X_train", train),
+            "X_test": _save_matrix(directory, "X_test", test),
+        }
+        tmp_meta = os.path.join(directory, "meta.json.tmp")
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_meta, os.path.join(directory, "meta.json"))
+        self._evict()
+        return self.load(partition, key)
+
+    def _evict(self):
+        entries = sorted(
+            (os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)),
+            key=os.path.getmtime, reverse=True
+        )
+        for directory in entries[self.keep:]:
+            logger.info("Evicting preprocessing cache entry %s", directory)
+            shutil.rmtree(directory, ignore_errors=True)
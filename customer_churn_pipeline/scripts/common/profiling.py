@@ -0,0 +1,287 @@
+"""Column profiling for the data validation stage.
+
+Every column is profiled by one accumulator that sees the data once: a
+single ``pd.factorize`` hash pass gives the missing count, the distinct
+values and their frequencies, from which the unique count, uniqueness and
+most frequent value all follow. Groups of columns can be profiled in
+parallel worker processes.
+
+Accumulators are mergeable, so a column can be profiled chunk by chunk and
+the partial results combined. ``approximate=True`` swaps the exact value
+counts for a HyperLogLog distinct counter and a Misra-Gries heavy-hitter
+summary, which keep memory fixed for wide or very large partitions. With
+``max_exact_values`` an exact accumulator switches to the sketches on its
+own once a column has more distinct values than that, which bounds memory
+for chunked validation of partitions larger than RAM. Sketches cannot prove
+that a column is unique, so there "Is Unique" is False when they see a
+duplicate and None (unknown) otherwise.
+"""
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+
+def _hash_values(series):
+    """64-bit hash of every non-null value, consistent across chunks."""
+    values = series.dropna()
+    return pd.util.hash_pandas_object(values, index=False).to_numpy(dtype=np.uint64)
+
+
+def _common_dtype(left, right):
+    if left is None or left == right:
+        return right
+    try:
+        return np.result_type(left, right)
+    except TypeError:
+        return np.dtype(object)
+
+
+def _first_of_most_frequent(values, counts):
+    """Mirror ``Series.mode().iloc[0]``: the smallest of the most frequent values."""
+    if len(counts) == 0:
+        return None
+    top = values[counts == counts.max()]
+    try:
+        return min(top)
+    except TypeError:
+        return top[0]
+
+
+def _smallest(series):
+    """Smallest non-null value of ``series`` (its first one if they do not compare), None if empty."""
+    values = series.dropna()
+    if values.empty:
+        return None
+    try:
+        return values.min()
+    except TypeError:
+        return values.iloc[0]
+
+
+class HyperLogLog:
+    """Mergeable distinct-count sketch with ``2 ** precision`` registers."""
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update_hashes(self, hashes):
+        if len(hashes) == 0:
+            return
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        # Position of the leftmost 1-bit in the remaining 64 - p bits
+        _, exponent = np.frexp(remainder.astype(np.float64))
+        rank = np.where(remainder == 0, 64 - self.precision + 1, 64 - self.precision - exponent + 1)
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def update(self, series):
+        self.update_hashes(_hash_values(series))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        # Linear counting is more accurate while many registers are still empty
+        if raw <= 2.5 * m and zeros:
+            return m * np.log(m / zeros)
+        return raw
+
+
+class HeavyHitters:
+    """Mergeable Misra-Gries summary keeping at most ``k`` candidate values.
+
+    Any value occurring more than ``n / (k + 1)`` times is guaranteed to be
+    kept, and stored counts underestimate true counts by at most that much.
+    """
+
+    def __init__(self, k=64):
+        self.k = k
+        self.counts = pd.Series(dtype=np.int64)
+        # Returned when no value is frequent enough to be kept, e.g. when every value is distinct
+        self.smallest = None
+
+    def _keep_smallest(self, value):
+        if self.smallest is None:
+            self.smallest = value
+        elif value is not None:
+            try:
+                self.smallest = min(self.smallest, value)
+            except TypeError:
+                pass
+
+    def _reduce(self, counts):
+        if len(counts) > self.k:
+            counts = counts.sort_values(ascending=False, kind="stable")
+            threshold = counts.iloc[self.k]
+            counts = counts.iloc[:self.k] - threshold
+            counts = counts[counts > 0]
+        return counts
+
+    def update(self, series):
+        chunk_counts = series.value_counts(dropna=True)
+        self.counts = self._reduce(self.counts.add(chunk_counts, fill_value=0).astype(np.int64))
+        self._keep_smallest(_smallest(series))
+
+    def merge(self, other):
+        self.counts = self._reduce(self.counts.add(other.counts, fill_value=0).astype(np.int64))
+        self._keep_smallest(other.smallest)
+        return self
+
+    def has_duplicates(self):
+        """True when some value is known to occur more than once (stored counts never overcount)."""
+        return bool((self.counts > 1).any())
+
+    def most_frequent(self):
+        if self.counts.empty:
+            # Like Series.mode() when every value occurs once: the smallest value
+            return self.smallest
+        return _first_of_most_frequent(self.counts.index.to_numpy(), self.counts.to_numpy())
+
+
+class ColumnProfile:
+    """Statistics of one column, built from one or more chunks of it."""
+
+    def __init__(self, name, approximate=False, hll_precision=14, top_k=64, max_exact_values=None):
+        self.name = name
+        self.approximate = approximate
+        self.hll_precision = hll_precision
+        self.top_k = top_k
+        self.max_exact_values = max_exact_values
+        self.dtype = None
+        self.rows = 0
+        self.missing = 0
+        if approximate:
+            self.distinct = HyperLogLog(hll_precision)
+            self.heavy_hitters = HeavyHitters(top_k)
+        else:
+            self.value_counts = pd.Series(dtype=np.int64)
+
+    def _to_sketches(self):
+        """Replace the exact value counts with sketches built from them."""
+        self.distinct = HyperLogLog(self.hll_precision)
+        self.distinct.update(self.value_counts.index.to_series())
+        self.heavy_hitters = HeavyHitters(self.top_k)
+        self.heavy_hitters.counts = self.heavy_hitters._reduce(self.value_counts)
+        self.heavy_hitters.smallest = _smallest(self.value_counts.index.to_series())
+        del self.value_counts
+        self.approximate = True
+
+    def _check_budget(self):
+        if self.max_exact_values and len(self.value_counts) > self.max_exact_values:
+            self._to_sketches()
+
+    def update(self, series, missing=None):
+        """Fold one chunk of the column in. ``missing`` may be precomputed for the whole frame."""
+        self.dtype = _common_dtype(self.dtype, series.dtype)
+        self.rows += len(series)
+        if self.approximate:
+            self.missing += int(series.isna().sum()) if missing is None else int(missing)
+            self.distinct.update(series)
+            self.heavy_hitters.update(series)
+            return self
+
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        valid = codes[codes >= 0]
+        self.missing += len(codes) - len(valid)
+        counts = pd.Series(np.bincount(valid, minlength=len(uniques)), index=uniques)
+        if self.value_counts.empty:
+            self.value_counts = counts
+        else:
+            self.value_counts = self.value_counts.add(counts, fill_value=0).astype(np.int64)
+        self._check_budget()
+        return self
+
+    def merge(self, other):
+        self.dtype = _common_dtype(self.dtype, other.dtype)
+        self.rows += other.rows
+        self.missing += other.missing
+        if self.approximate and not other.approximate:
+            other._to_sketches()
+        elif other.approximate and not self.approximate:
+            self._to_sketches()
+
+        if self.approximate:
+            self.distinct.merge(other.distinct)
+            self.heavy_hitters.merge(other.heavy_hitters)
+        else:
+            self.value_counts = self.value_counts.add(other.value_counts, fill_value=0).astype(np.int64)
+            self._check_budget()
+        return self
+
+    def result(self):
+        non_null = self.rows - self.missing
+        if self.approximate:
+            n_unique = int(round(self.distinct.estimate())) if non_null else 0
+            n_unique = min(n_unique, non_null)
+            most_frequent = self.heavy_hitters.most_frequent()
+            # The sketches can only prove duplicates; without one, uniqueness is unknown
+            is_unique = False if self.missing > 1 or self.heavy_hitters.has_duplicates() else None
+        else:
+            n_unique = len(self.value_counts)
+            most_frequent = _first_of_most_frequent(self.value_counts.index.to_numpy(), self.value_counts.to_numpy())
+            # Same definition as Series.is_unique, which counts NaN as a value
+            is_unique = self.missing <= 1 and n_unique + (self.missing > 0) == self.rows
+        return {
+            "Column": self.name,
+            "Data Type": str(self.dtype),
+            "Missing (%)": round(self.missing / self.rows * 100, 2) if self.rows else 0.0,
+            "Unique Values": n_unique,
+            "Is Constant": n_unique == 1,
+            "Is Unique": None if is_unique is None else bool(is_unique),
+            "Most Frequent Value": most_frequent
+        }
+
+
+def _profile_columns(frame, missing, approximate, max_exact_values=None):
+    return [
+        ColumnProfile(col, approximate=approximate, max_exact_values=max_exact_values).update(
+            frame[col], None if missing is None else missing[col]
+        )
+        for col in frame.columns
+    ]
+
+
+def profile_chunk(df, n_jobs=1, approximate=False, max_exact_values=None):
+    """Build one ``ColumnProfile`` per column of ``df`` (mergeable with other chunks)."""
+    # The exact path gets missing counts for free from factorize
+    missing = df.isna().sum() if approximate else None
+    if n_jobs == 1 or df.shape[1] < 2:
+        return _profile_columns(df, missing, approximate, max_exact_values)
+
+    n_jobs = min(df.shape[1], n_jobs if n_jobs > 0 else df.shape[1])
+    groups = np.array_split(np.arange(df.shape[1]), n_jobs)
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_profile_columns)(
+            df.iloc[:, group], None if missing is None else missing.iloc[group], approximate, max_exact_values
+        )
+        for group in groups
+    )
+    return [profile for group in results for profile in group]
+
+
+def profile_frame(df, n_jobs=1, approximate=False):
+    """Profile every column of ``df`` and return one dict of statistics per column."""
+    return [profile.result() for profile in profile_chunk(df, n_jobs=n_jobs, approximate=approximate)]
+
+
+def profile_chunks(chunks, n_jobs=1, approximate=False, max_exact_values=None):
+    """Profile a frame delivered as an iterable of chunks, merging per-chunk results.
+
+    Only one chunk and the per-column accumulators are in memory at a time.
+    """
+    profiles = None
+    for chunk in chunks:
+        chunk_profiles = profile_chunk(chunk, n_jobs=n_jobs, approximate=approximate, max_exact_values=max_exact_values)
+        if profiles is None:
+            profiles = chunk_profiles
+        else:
+            for profile, chunk_profile in zip(profiles, chunk_profiles):
+                profile.merge(chunk_profile)
+    return [profile.result() for profile in profiles or []]
@@ -0,0 +1,403 @@
+"""Versioned schema registry for the customer churn datasets.
+
+A schema maps every column to a compact pandas dtype and a kind:
+
+* ``flag``: 0/1 columns (``Married``, ``Phone Service``, ``Under 30``, ...),
+  loaded as ``bool``,
+* ``enum``: strings with few distinct values (``Contract``, ``Offer``,
+  ``Payment Method``, ...), loaded as ``category`` with the registered
+  categories. An enum is closed when its description lists its values
+  ("Contract type (Month-to-Month, One year, Two year)"): other values are
+  violations. Values an open enum has not seen yet (a new ``Quarter``)
+  are added as categories of that load, and ``infer_schema`` registers them,
+* ``integer``: loaded as the smallest of int8/int16/int32/int64 that holds
+  the observed range with 50% headroom (``Age``, ``Satisfaction Score``,
+  ``Zip Code``, ...),
+* ``float``: loaded as float32 when float32 keeps every value exact to its
+  observed number of decimals, float64 otherwise,
+* ``string``: open-ended strings (``Customer ID``, ``City``), kept as object.
+
+``infer_schema`` derives a schema from a partition and ``FEATURE_DESCRIPTIONS``
+("1 if ..." marks a flag). Given the previous version, it widens that
+version instead: enum values are unioned and integer ranges extended.
+``SchemaRegistry`` stores each distinct schema as
+``<directory>/<name>/v<version>.json``.
+
+``Schema.apply`` validates a frame and casts it in one pass, and the
+storage readers take a ``schema`` to apply it at load time. A column with
+values the schema does not allow (unknown enum values, non-0/1 flags,
+integers out of the dtype's range, unexpected missing values, columns the
+schema does not know) is a violation. In ``warn`` mode, the default, the
+violations are logged and the offending column is left uncast; in
+``strict`` mode they raise ``SchemaError`` with every violation found.
+``SCHEMA_VALIDATION`` sets the mode for the stages: warn, strict, or off to
+load with pandas' inferred dtypes as before. The data validation stage
+reports the violations instead (``Schema.validate``).
+"""
+import json
+import logging
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+DATASET = "customer_churn"
+MAX_ENUM_VALUES = 32
+INTEGER_HEADROOM = 1.5
+# float32 has a 24-bit significand; below 2**24 every value is exact to the decimals it was scaled by
+FLOAT32_EXACT = 1 << 24
+INTEGER_DTYPES = ("int8", "int16", "int32", "int64")
+# Columns kept as plain integers even though they are 0/1 (model targets)
+TARGETS = ("Churn",)
+# "(A, B, C)" in a description lists the only allowed values; "(e.g., A, B)" does not
+LISTED_VALUES = re.compile(r"\((?!e\.g\.)[^)]*,[^)]*\)")
+
+FEATURE_DESCRIPTIONS = {
+    "Age": "The customer's age in years.",
+    "Avg Monthly GB Download": "Average monthly data download in GB.",
+    "Avg Monthly Long Distance Charges": "Average monthly long distance call charges.",
+    "Churn": "1 if the customer churned, 0 otherwise.",
+    "Churn Category": "High-level category for customer's reason for churning.",
+    "Churn Reason": "Specific reason why the customer churned.",
+    "Churn Score": "Score between 0-100 indicating churn risk.",
+    "City": "Customer's city of residence.",
+    "CLTV": "Customer Lifetime Value — predicted revenue over customer's lifetime.",
+    "Contract": "Contract type (Month-to-Month, One year, Two year).",
+    "Country": "Country where the customer resides.",
+    "Customer ID": "Unique identifier for each customer.",
+    "Customer Status": "Current status (Stayed, Churned, Joined).",
+    "Dependents": "1 if the customer has dependents, 0 otherwise.",
+    "Device Protection Plan": "1 if the customer has a device protection plan.",
+    "Gender": "The customer's gender.",
+    "Internet Service": "1 if the customer has internet service, 0 otherwise.",
+    "Internet Type": "Type of internet connection (e.g., DSL, Fiber, Cable).",
+    "Lat Long": "Combined latitude and longitude of customer's residence.",
+    "Latitude": "Geographical latitude of the customer.",
+    "Longitude": "Geographical longitude of the customer.",
+    "Married": "1 if married, 0 otherwise.",
+    "Monthly Charge": "Monthly bill for the customer.",
+    "Multiple Lines": "1 if the customer has multiple phone lines.",
+    "Number of Dependents": "Total number of dependents for the customer.",
+    "Number of Referrals": "Number of people the customer referred.",
+    "Offer": "Last marketing offer accepted by the customer.",
+    "Online Backup": "1 if the customer has online backup service.",
+    "Online Security": "1 if the customer has online security service.",
+    "Paperless Billing": "1 if the customer uses paperless billing.",
+    "Partner": "1 if the customer has a partner.",
+    "Payment Method": "Customer’s chosen method of payment.",
+    "Phone Service": "1 if the customer has phone service.",
+    "Population": "Estimated population in the customer's ZIP code.",
+    "Premium Tech Support": "1 if the customer has premium tech support.",
+    "Quarter": "Fiscal quarter (e.g., Q1, Q2, etc.).",
+    "Referred a Friend": "1 if the customer referred a friend.",
+    "Satisfaction Score": "Customer satisfaction rating from 1 to 5.",
+    "Senior Citizen": "1 if customer is aged 65 or older.",
+    "State": "State where the customer lives.",
+    "Streaming Movies": "1 if the customer subscribes to movie streaming.",
+    "Streaming Music": "1 if the customer subscribes to music streaming.",
+    "Streaming TV": "1 if the customer subscribes to TV streaming.",
+    "Tenure in Months": "Number of months the customer has stayed.",
+    "Total Charges": "Total amount charged to the customer.",
+    "Total Extra Data Charges": "Total charges incurred for extra data.",
+    "Total Long Distance Charges": "Total long distance call charges.",
+    "Total Refunds": "Total amount refunded to the customer.",
+    "Total Revenue": "Total revenue generated from the customer.",
+    "Under 30": "1 if the customer is under 30 years old.",
+    "Unlimited Data": "1 if the customer has unlimited data plan.",
+    "Zip Code": "ZIP code of the customer’s residence."
+}
+
+
+class SchemaError(ValueError):
+    """Raised when a frame does not conform to its schema."""
+
+    def __init__(self, schema, violations):
+        self.violations = violations
+        super().__init__(f"{len(violations)} violation(s) of schema {schema.name} v{schema.version}: "
+                         + "; ".join(violations))
+
+
+def default_registry_path():
+    scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.getenv("SCHEMA_REGISTRY_PATH") or os.path.join(os.path.dirname(scripts_dir), "schemas")
+
+
+# === Inference ===
+
+def _integer_dtype(low, high):
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low * INTEGER_HEADROOM and high * INTEGER_HEADROOM <= info.max:
+            return dtype
+    return "int64"
+
+
+def _decimals(values, max_decimals=6):
+    for decimals in range(max_decimals + 1):
+        if np.allclose(values, np.round(values, decimals), rtol=0, atol=1e-9):
+            return decimals
+    return None
+
+
+def _float_dtype(magnitude, decimals):
+    exact = decimals is not None and magnitude * 10 ** decimals < FLOAT32_EXACT
+    return "float32" if exact else "float64"
+
+
+def infer_column(name, series, description="", previous=None):
+    """Schema entry of one column from its values, widened to cover ``previous`` if given."""
+    present = series.dropna()
+    nullable = bool(series.isna().any() or (previous or {}).get("nullable", False))
+    spec = {"nullable": nullable, **({"description": description} if description else {})}
+    prev_kind = (previous or {}).get("kind")
+
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        values = present.to_numpy(dtype=float)
+        is_flag = (description.startswith("1 if") or pd.api.types.is_bool_dtype(series)) and name not in TARGETS
+        if is_flag and np.isin(values, (0, 1)).all() and prev_kind in (None, "flag"):
+            return {**spec, "kind": "flag", "dtype": "boolean" if nullable else "bool"}
+        bounds = [values.min(), values.max()] if len(values) else []
+        if previous is not None and "min" in previous:
+            bounds += [previous["min"], previous["max"]]
+        low, high = (min(bounds), max(bounds)) if bounds else (0, 0)
+        integral = np.array_equal(values, np.round(values)) and prev_kind in (None, "flag", "integer")
+        if integral and not nullable:
+            return {**spec, "kind": "integer", "dtype": _integer_dtype(low, high), "min": int(low), "max": int(high)}
+        decimals = 0 if integral else _decimals(values)
+        prev_decimals = (previous or {}).get("decimals", 0)
+        if decimals is not None and prev_decimals is not None:
+            decimals = max(decimals, prev_decimals)
+        else:
+            decimals = None
+        magnitude = max(abs(low), abs(high))
+        return {**spec, "kind": "float", "dtype": _float_dtype(magnitude, decimals),
+                "min": float(low), "max": float(high), "decimals": decimals}
+
+    values = pd.unique(present.astype(str))
+    known = (previous or {}).get("categories", [])
+    categories = known + sorted(set(values) - set(known))
+    is_key = len(values) == len(present) and len(present) > MAX_ENUM_VALUES
+    if prev_kind in (None, "enum") and len(categories) <= MAX_ENUM_VALUES and not is_key:
+        closed = (previous or {}).get("closed", bool(LISTED_VALUES.search(description)))
+        return {**spec, "kind": "enum", "dtype": "category", "categories": categories, "closed": closed}
+    return {**spec, "kind": "string", "dtype": "object"}
+
+
+def infer_schema(df, name=DATASET, descriptions=None, previous=None, source=None):
+    """Schema of ``df``; with ``previous``, a widened copy of it that ``df`` also conforms to."""
+    descriptions = FEATURE_DESCRIPTIONS if descriptions is None else descriptions
+    columns = dict(previous.columns) if previous is not None else {}
+    for col in df.columns:
+        columns[col] = infer_column(col, df[col], descriptions.get(col, ""), columns.get(col))
+    return Schema(name, columns, source=source)
+
+
+# === Schema ===
+
+class Schema:
+
+    def __init__(self, name, columns, version=None, created_at=None, source=None, validation="strict"):
+        self.name = name
+        self.columns = columns
+        self.version = version
+        self.created_at = created_at
+        self.source = source
+        self.validation = validation
+
+    def dtypes(self, columns=None):
+        return {col: self.columns[col]["dtype"] for col in (columns or self.columns) if col in self.columns}
+
+    def csv_dtypes(self, columns=None):
+        """``read_csv`` dtypes that save work while parsing; the other columns are cast by ``apply``."""
+        return {col: "category" for col, spec in self.columns.items()
+                if spec["kind"] == "enum" and (columns is None or col in columns)}
+
+    def arrow_csv_types(self, columns=None):
+        """Arrow types to convert CSV columns to when scanning them with Arrow (``storage.open_dataset``)."""
+        # Integers and flags are read as floats: a missing value must reach ``apply`` as NaN
+        # (to be reported or cast there), not fail the scan
+        types = {"flag": pa.float64(), "integer": pa.float64(), "float": pa.float64(),
+                 "enum": pa.dictionary(pa.int32(), pa.string()), "string": pa.string()}
+        return {col: types[spec["kind"]] for col, spec in self.columns.items() if columns is None or col in columns}
+
+    def _violations(self, col, series):
+        spec = self.columns.get(col)
+        if spec is None:
+            return [f"{col}: not in the schema"]
+        found = []
+        # numpy bool and integer columns cannot hold missing values
+        missing = 0 if series.dtype.kind in "biu" else int(series.isna().sum())
+        if missing and not spec["nullable"]:
+            found.append(f"{col}: {missing} missing values")
+        if spec["kind"] in ("flag", "integer", "float") and str(series.dtype) == spec["dtype"]:
+            # Already compact (a Parquet partition): the dtype bounds the values
+            return found
+        if spec["kind"] in ("flag", "integer", "float"):
+            numbers = self._numbers(col, series, found)
+            if spec["kind"] == "flag" and not ((numbers == 0) | (numbers == 1)).all():
+                found.append(f"{col}: values other than 0/1 {np.unique(numbers[(numbers != 0) & (numbers != 1)])[:5].tolist()}")
+            elif spec["kind"] == "integer" and len(numbers):
+                if not np.array_equal(numbers, np.round(numbers)):
+                    found.append(f"{col}: non-integer values")
+                info = np.iinfo(spec["dtype"])
+                if numbers.min() < info.min or numbers.max() > info.max:
+                    found.append(f"{col}: values outside {spec['dtype']} [{numbers.min():g}, {numbers.max():g}]")
+        elif spec["kind"] == "enum" and spec["closed"]:
+            unknown = self._unknown(series, spec)
+            if len(unknown):
+                found.append(f"{col}: unknown values {list(unknown[:5])}")
+        return found
+
+    @staticmethod
+    def _numbers(col, series, found):
+        """Non-missing values of ``series`` as floats; non-numeric values are added to ``found``."""
+        if pd.api.types.is_numeric_dtype(series.dtype):
+            numbers = series.to_numpy(dtype=float, na_value=np.nan)
+            return numbers[~np.isnan(numbers)]
+        present = series.dropna()
+        numbers = pd.to_numeric(present, errors="coerce")
+        if numbers.isna().any():
+            found.append(f"{col}: non-numeric values {list(pd.unique(present[numbers.isna()])[:5])}")
+        return numbers.dropna().to_numpy(dtype=float)
+
+    @staticmethod
+    def _unknown(series, spec):
+        """Non-missing values of ``series`` that are not categories of ``spec``."""
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Only the categories in use, without converting every row to str
+            codes = series.cat.codes.to_numpy()
+            values = pd.Series(series.cat.categories[np.unique(codes[codes >= 0])].astype(str))
+        else:
+            values = series.dropna().astype(str)
+        return pd.unique(values[~values.isin(spec["categories"])])
+
+    def validate(self, df):
+        """Every violation of the schema in ``df``, as readable strings (empty if it conforms)."""
+        return [violation for col in df.columns for violation in self._violations(col, df[col])]
+
+    def _cast(self, series, spec):
+        if spec["kind"] == "enum":
+            unknown = self._unknown(series, spec)
+            if len(unknown):
+                logger.info("%s: values not in schema %s v%s yet: %s", series.name, self.name, self.version, list(unknown[:5]))
+            categories = spec["categories"] + sorted(unknown)
+            if isinstance(series.dtype, pd.CategoricalDtype) and series.cat.categories.dtype == object:
+                return series.cat.set_categories(categories)
+            return series.astype(str).where(series.notna()).astype(pd.CategoricalDtype(categories))
+        if spec["kind"] == "string":
+            return series.astype(object)
+        return series.astype(spec["dtype"])
+
+    @staticmethod
+    def _conforms(series, spec):
+        if spec["kind"] == "enum":
+            # read_csv's categories are the ones of the file, in order of appearance
+            return (isinstance(series.dtype, pd.CategoricalDtype)
+                    and list(series.cat.categories[:len(spec["categories"])]) == spec["categories"])
+        return str(series.dtype) == spec["dtype"]
+
+    def apply(self, df, validation=None):
+        """``df`` validated and cast to the schema's dtypes; ``validation`` is strict or warn (default: the schema's)."""
+        validation = validation or self.validation
+        cast = {}
+        violations = []
+        for col in df.columns:
+            found = self._violations(col, df[col])
+            violations.extend(found)
+            if not found and col in self.columns and not self._conforms(df[col], self.columns[col]):
+                cast[col] = self._cast(df[col], self.columns[col])
+        if violations:
+            if validation == "strict":
+                raise SchemaError(self, violations)
+            logger.warning("Schema %s v%s: %s", self.name, self.version, "; ".join(violations))
+        if not cast:
+            return df
+        # One frame built from the columns, instead of replacing them one by one
+        return pd.DataFrame({col: cast.get(col, df[col]) for col in df.columns}, index=df.index)
+
+    def widen(self, df):
+        """``df`` with the compact dtypes widened back (int64, float64, object) for external systems."""
+        wide = {}
+        for col, spec in self.columns.items():
+            if col not in df.columns:
+                continue
+            if spec["kind"] == "flag" or spec["kind"] == "integer" and not df[col].isna().any():
+                wide[col] = df[col].astype("int64") if not df[col].isna().any() else df[col].astype("float64")
+            elif spec["kind"] == "float":
+                series = df[col].astype("float64")
+                # Drop the float32 representation error, e.g. 89.80000305 -> 89.8
+                wide[col] = series.round(spec["decimals"]) if spec["decimals"] is not None else series
+            elif spec["kind"] == "enum":
+                wide[col] = df[col].astype(object)
+        return df.assign(**wide)
+
+    def to_dict(self):
+        return {"name": self.name, "version": self.version, "created_at": self.created_at,
+                "source": self.source, "columns": self.columns}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data["columns"], data.get("version"), data.get("created_at"), data.get("source"))
+
+
+# === Registry ===
+
+class SchemaRegistry:
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_registry_path()
+
+    def _path(self, name, version):
+        return os.path.join(self.directory, name, f"v{version}.json")
+
+    def versions(self, name=DATASET):
+        folder = os.path.join(self.directory, name)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(int(f[1:-len(".json")]) for f in os.listdir(folder) if f.startswith("v") and f.endswith(".json"))
+
+    def get(self, name=DATASET, version=None):
+        """Schema ``version`` of ``name`` (the latest if None), or None if none is registered."""
+        versions = self.versions(name)
+        if not versions:
+            return None
+        version = version or versions[-1]
+        with open(self._path(name, version), "r", encoding="utf-8") as f:
+            return Schema.from_dict(json.load(f))
+
+    def register(self, schema):
+        """Store ``schema`` as a new version unless it equals the latest one; returns the stored schema."""
+        latest = self.get(schema.name)
+        if latest is not None and latest.columns == schema.columns:
+            return latest
+        schema.version = (latest.version + 1) if latest is not None else 1
+        schema.created_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        path = self._path(schema.name, schema.version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(schema.to_dict(), f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        logger.info("Registered schema %s v%d", schema.name, schema.version)
+        return schema
+
+
+def validation_mode():
+    return os.getenv("SCHEMA_VALIDATION", "warn").lower()
+
+
+def load_schema(name=DATASET):
+    """Latest registered schema of ``name`` for the stages to load with, or None (none registered, or validation off)."""
+    if validation_mode() == "off":
+        return None
+    schema = SchemaRegistry().get(name)
+    if schema is None:
+        logger.info("No schema registered for %s; loading with inferred dtypes", name)
+        return None
+    schema.validation = validation_mode()
+    return schema
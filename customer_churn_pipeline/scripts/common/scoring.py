@@ -0,0 +1,463 @@
+"""Batch and online scoring with the model published by model building.
+
+``ModelStore`` holds the servable models. Model building publishes the
+fitted preprocessor and its best classifier as ``<directory>/<version>/``
+and points ``LATEST`` at it once the files are in place. ``ModelStore.load``
+deserializes a version once per process and keeps the ``Scorer``, so
+repeated requests never touch the disk.
+
+A ``Scorer`` keeps the preprocessor and the classifier apart. When the
+model could be compiled at publish time (``common.compiled_predictor``,
+checked bit for bit against sklearn on the test rows), requests are scored
+by the NumPy-only predictor straight from their records. Otherwise they are
+turned into a frame with the training columns and dtypes and go through
+sklearn. Either way each batch is one vectorized call:
+
+* ``score_partition`` streams a partition file in chunks and writes the
+  churn probabilities and predictions as a columnar partition.
+* ``MicroBatcher`` collects concurrent single-customer requests for up to
+  ``max_wait_ms`` (or ``max_batch`` requests) and scores them together, so
+  the per-call overhead of the transformers is paid once per batch.
+  Requests are checked before they join a batch, and a batch that still
+  fails is scored request by request, so only the failing request fails.
+* ``serve`` exposes the batcher over HTTP: ``POST /score`` takes one record
+  or a list of records (400 when a value cannot be scored), ``GET /metrics``
+  returns p50/p99 latency and rows per second, ``GET /health`` the loaded
+  model version. With a ``lookup``
+  (such as the online feature store's ``get_many``), a record may only
+  give its ``Customer ID``: the stored features are filled in, and any
+  feature the record does give overrides the stored one.
+"""
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from common.compiled_predictor import compile_pipeline, parity
+from common.storage import PartitionWriter, iter_file_chunks
+
+logger = logging.getLogger(__name__)
+
+LATEST_FILE = "LATEST"
+# The compiled forest walks every (row, tree) pair with array operations, which
+# beats sklearn's per-call overhead on small batches but not its Cython tree
+# traversal on large ones; bigger forest batches go through sklearn
+FOREST_COMPILED_MAX_ROWS = 512
+
+
+class InvalidRecords(ValueError):
+    """Records that cannot be scored, e.g. a word where a number is expected."""
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("; ".join(problems[:10]) + (f" (and {len(problems) - 10} more)" if len(problems) > 10 else ""))
+
+
+class Scorer:
+
+    def __init__(self, preprocessor, model, meta, compiled=None):
+        self.preprocessor = preprocessor
+        self.model = model
+        self.compiled = compiled
+        self.meta = meta
+        self.version = meta["version"]
+        self.columns = list(meta["features"])
+        self.dtypes = meta["features"]
+        self.categorical = [col for col, dtype in self.dtypes.items() if dtype == "object"]
+        self.positive = list(model.classes_).index(meta.get("positive_class", 1))
+
+    def frame(self, records):
+        """Feature frame from a list of ``{column: value}`` records; unknown keys are ignored."""
+        df = pd.DataFrame.from_records(records, columns=self.columns)
+        for col, dtype in self.dtypes.items():
+            if dtype != "object":
+                # Missing values in JSON requests make integer columns float; the imputer handles them
+                df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+        return df
+
+    def check_records(self, records):
+        """``records`` with their features coerced for scoring; raises ``InvalidRecords`` for values that do not fit.
+
+        Numbers and numeric strings become floats, other scalars of
+        categorical features strings; NaN and None are missing.
+        """
+        checked, problems = [], []
+        for i, record in enumerate(records):
+            row = dict(record)
+            for col, dtype in self.dtypes.items():
+                value = row.get(col)
+                if value is None:
+                    continue
+                if isinstance(value, (dict, list)):
+                    problems.append(f"record {i}: {col} must be a single value, got {type(value).__name__}")
+                elif dtype == "object":
+                    row[col] = value if isinstance(value, str) else str(value)
+                else:
+                    try:
+                        number = float(value)
+                    except (TypeError, ValueError):
+                        problems.append(f"record {i}: {col} must be a number, got {value!r}")
+                        continue
+                    if math.isinf(number):
+                        problems.append(f"record {i}: {col} must be finite, got {value!r}")
+                    row[col] = None if math.isnan(number) else number
+            checked.append(row)
+        if problems:
+            raise InvalidRecords(problems)
+        return checked
+
+    def predict_proba(self, df):
+        """Churn probability of every row of ``df``."""
+        X = df.reindex(columns=self.columns)
+        if self._use_compiled(len(X)):
+            return self.compiled.predict_proba(X)[:, self.positive]
+        if self.categorical:
+            X[self.categorical] = X[self.categorical].astype(object).fillna("Missing")
+        return self.model.predict_proba(self.preprocessor.transform(X))[:, self.positive]
+
+    def score(self, df, threshold=0.5):
+        """``(probabilities, predicted classes)`` of every row of ``df``."""
+        return self._label(self.predict_proba(df), threshold)
+
+    def score_records(self, records, threshold=0.5):
+        """``score`` for a list of ``{column: value}`` records."""
+        if self._use_compiled(len(records)):
+            return self._label(self.compiled.predict_proba(records)[:, self.positive], threshold)
+        return self.score(self.frame(records), threshold)
+
+    def _use_compiled(self, n_rows):
+        if self.compiled is None:
+            return False
+        return self.compiled.model_kind != "forest" or n_rows <= FOREST_COMPILED_MAX_ROWS
+
+    def _label(self, proba, threshold):
+        classes = self.model.classes_
+        return proba, np.where(proba >= threshold, classes[self.positive], classes[1 - self.positive])
+
+
+class ModelStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def publish(self, preprocessor, model, version, features, sample=None, **meta):
+        """Write a servable model as ``version`` and make it the latest one.
+
+        The compiled predictor is only kept when its probabilities on
+        ``sample`` (a feature frame) match sklearn's exactly.
+        """
+        path = os.path.join(self.directory, version)
+        os.makedirs(path, exist_ok=True)
+        joblib.dump(preprocessor, os.path.join(path, "preprocessor.joblib"))
+        joblib.dump(model, os.path.join(path, "model.joblib"))
+
+        compiled = None
+        try:
+            compiled = compile_pipeline(preprocessor, model)
+        except ValueError as e:
+            logger.warning("Model %s not compiled, scoring will use sklearn: %s", version, e)
+        if compiled is not None and sample is not None and not parity(compiled, preprocessor, model, sample):
+            logger.warning("Compiled model %s does not match sklearn on the sample, not using it", version)
+            compiled = None
+        compiled_path = os.path.join(path, "compiled.joblib")
+        if compiled is not None:
+            joblib.dump(compiled, compiled_path)
+        elif os.path.exists(compiled_path):
+            os.remove(compiled_path)
+
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({**meta, "version": version, "features": features, "compiled": compiled is not None},
+                      f, indent=2, default=str)
+
+        # The pointer moves last, so readers only ever see a fully written version
+        tmp_latest = os.path.join(self.directory, LATEST_FILE + ".tmp")
+        with open(tmp_latest, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_latest, os.path.join(self.directory, LATEST_FILE))
+        logger.info("Published model version %s to %s", version, path)
+        return path
+
+    def latest_version(self):
+        latest = os.path.join(self.directory, LATEST_FILE)
+        if not os.path.exists(latest):
+            return None
+        with open(latest, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    def load(self, version=None, compiled=True):
+        """The ``Scorer`` of ``version`` (the latest by default), deserialized once per process.
+
+        ``compiled=False`` scores through sklearn even when a compiled predictor exists.
+        """
+        version = version or self.latest_version()
+        if version is None:
+            raise FileNotFoundError(f"No published model in {self.directory}")
+        with self._lock:
+            if (version, compiled) not in self._loaded:
+                path = os.path.join(self.directory, version)
+                start = time.perf_counter()
+                with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                compiled_path = os.path.join(path, "compiled.joblib")
+                scorer = Scorer(
+                    joblib.load(os.path.join(path, "preprocessor.joblib")),
+                    joblib.load(os.path.join(path, "model.joblib")),
+                    meta,
+                    joblib.load(compiled_path) if compiled and os.path.exists(compiled_path) else None
+                )
+                # One throwaway call so lazily built state is ready before the first request
+                scorer.score_records([{}])
+                logger.info("Loaded model version %s (%s) in %.3fs", version,
+                            "compiled" if scorer.compiled is not None else "sklearn", time.perf_counter() - start)
+                self._loaded[(version, compiled)] = scorer
+            return self._loaded[(version, compiled)]
+
+
+class LatencyStats:
+    """Latency percentiles and throughput over the last ``window`` calls."""
+
+    def __init__(self, window=10000):
+        self._calls = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.total_calls = 0
+        self.total_rows = 0
+
+    def record(self, seconds, rows=1):
+        with self._lock:
+            self._calls.append((seconds, rows))
+            self.total_calls += 1
+            self.total_rows += rows
+
+    def snapshot(self):
+        with self._lock:
+            calls = list(self._calls)
+            total_calls, total_rows = self.total_calls, self.total_rows
+        uptime = time.perf_counter() - self.started
+        stats = {"calls": total_calls, "rows": total_rows, "uptime_seconds": round(uptime, 3),
+                 "rows_per_sec": round(total_rows / uptime, 1) if uptime else None}
+        if calls:
+            seconds = np.array([c[0] for c in calls])
+            busy = seconds.sum()
+            stats.update({
+                "p50_ms": round(float(np.percentile(seconds, 50)) * 1000, 3),
+                "p99_ms": round(float(np.percentile(seconds, 99)) * 1000, 3),
+                "max_ms": round(float(seconds.max()) * 1000, 3),
+                "busy_rows_per_sec": round(sum(c[1] for c in calls) / busy, 1) if busy else None,
+            })
+        return stats
+
+
+class MicroBatcher:
+    """Score concurrent single requests together on one background thread."""
+
+    def __init__(self, scorer, max_batch=64, max_wait_ms=2.0, threshold=0.5):
+        self.scorer = scorer
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.threshold = threshold
+        self.request_stats = LatencyStats()
+        self.batch_stats = LatencyStats()
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, records):
+        """Future of ``[(probability, prediction)]`` for a list of records.
+
+        Raises ``InvalidRecords`` right away for records that cannot be
+        scored, so they never join (and fail) a batch.
+        """
+        records = self.scorer.check_records(records)
+        future = Future()
+        self._queue.put((records, future, time.perf_counter()))
+        return future
+
+    def score(self, records, timeout=None):
+        return self.submit(records).result(timeout)
+
+    def _collect(self):
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        pending = [first]
+        rows = len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.append(item)
+            rows += len(item[0])
+        return pending
+
+    def _loop(self):
+        while not self._stop.is_set():
+            pending = self._collect()
+            if pending:
+                self._score(pending)
+
+    def _score(self, pending):
+        start = time.perf_counter()
+        try:
+            records = [record for item in pending for record in item[0]]
+            proba, predictions = self.scorer.score_records(records, self.threshold)
+        except Exception as e:
+            if len(pending) == 1:
+                pending[0][1].set_exception(e)
+                return
+            # One bad request must not fail the others batched with it
+            logger.warning("Batch of %d requests failed (%s), scoring them one by one", len(pending), e)
+            for item in pending:
+                self._score([item])
+            return
+        done = time.perf_counter()
+        self.batch_stats.record(done - start, len(records))
+        offset = 0
+        for items, future, submitted in pending:
+            end = offset + len(items)
+            future.set_result(list(zip(proba[offset:end].tolist(), predictions[offset:end].tolist())))
+            self.request_stats.record(done - submitted, len(items))
+            offset = end
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def score_partition(scorer, source_path, folder, name, chunk_rows=50000, keys=None, key_column="Customer ID",
+                    threshold=0.5):
+    """Score every row of a partition file chunk by chunk into dataset ``name`` in ``folder``.
+
+    ``keys`` optionally holds one identifier per source row, written as
+    ``key_column`` next to the scores.
+    """
+    stats = LatencyStats()
+    writer = PartitionWriter(folder, name)
+    offset = 0
+    try:
+        for chunk in iter_file_chunks(source_path, chunk_rows=chunk_rows):
+            start = time.perf_counter()
+            proba, predictions = scorer.score(chunk, threshold)
+            scored = pd.DataFrame({
+                "row_number": np.arange(offset, offset + len(chunk), dtype=np.int64),
+                "churn_probability": proba,
+                "churn_prediction": predictions,
+            })
+            if keys is not None:
+                scored.insert(0, key_column, keys[offset:offset + len(chunk)])
+            writer.write(scored)
+            stats.record(time.perf_counter() - start, len(chunk))
+            offset += len(chunk)
+        path = writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    summary = {"path": path, "rows": offset, "model_version": scorer.version, **stats.snapshot()}
+    logger.info("Scored %d rows of %s with model %s (%.0f rows/s)",
+                offset, source_path, scorer.version, summary.get("busy_rows_per_sec") or 0)
+    return summary
+
+
+def _with_features(records, lookup, key_column):
+    """``records`` with the looked-up features of their keys filled in, and the keys that were not found."""
+    keys = [record[key_column] for record in records if key_column in record]
+    if not keys:
+        return records, []
+    found = lookup(keys)
+    missing = [key for key in keys if str(key) not in found]
+    return [{**found.get(str(record.get(key_column)), {}), **record} for record in records], missing
+
+
+def _handler(batcher, timeout, lookup=None, key_column="Customer ID"):
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                self._reply(200, {"model_version": batcher.scorer.version,
+                                  "requests": batcher.request_stats.snapshot(),
+                                  "batches": batcher.batch_stats.snapshot()})
+            elif self.path == "/health":
+                self._reply(200, {"status": "ok", "model_version": batcher.scorer.version})
+            else:
+                self._reply(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/score":
+                self._reply(404, {"error": f"Unknown path {self.path}"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+            except ValueError as e:
+                self._reply(400, {"error": f"Invalid JSON: {e}"})
+                return
+            single = isinstance(body, dict)
+            records = [body] if single else body
+            if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+                self._reply(400, {"error": "Expected a JSON object or a list of objects"})
+                return
+            if lookup is not None:
+                records, missing = _with_features(records, lookup, key_column)
+                if missing:
+                    self._reply(404, {"error": f"Unknown {key_column}: {', '.join(map(str, missing[:10]))}"})
+                    return
+            try:
+                results = batcher.score(records, timeout=timeout)
+            except InvalidRecords as e:
+                self._reply(400, {"error": str(e)})
+                return
+            except Exception as e:
+                logger.exception("Scoring failed")
+                self._reply(500, {"error": str(e)})
+                return
+            scores = [{"churn_probability": p, "churn_prediction": c} for p, c in results]
+            self._reply(200, {"model_version": batcher.scorer.version, **({"score": scores[0]} if single else {"scores": scores})})
+
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return ScoringHandler
+
+
+def make_server(batcher, host="127.0.0.1", port=8080, timeout=30, lookup=None):
+    server = ThreadingHTTPServer((host, port), _handler(batcher, timeout, lookup))
+    server.daemon_threads = True
+    return server
+
+
+def serve(batcher, host="127.0.0.1", port=8080, timeout=30, lookup=None):
+    """Serve ``batcher`` over HTTP until interrupted."""
+    server = make_server(batcher, host, port, timeout, lookup)
+    logger.info("Scoring model %s on http://%s:%d", batcher.scorer.version, host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
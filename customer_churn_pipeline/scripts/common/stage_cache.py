@@ -0,0 +1,408 @@
+"""Content-addressed cache of pipeline stage results.
+
+A stage whose inputs, code and configuration are unchanged writes the same
+outputs again, so the orchestrator reuses the stored ones instead of running
+it. The cache key of a stage run is the SHA-256 of:
+
+* the content of every input dataset: the catalog checksum of its latest
+  complete partition (not its date, so a new partition holding the same
+  bytes as an old one hits), or the files of the latest published model,
+* the source of the stage script and of every ``common`` module it imports,
+* the values of the environment variables that code reads, the versions
+  of the packages the results depend on, the latest registered schema
+  version (common/schema.py), which sets the dtypes the stages load with,
+  and the content of the transformation rules (common/transforms.py).
+
+After a stage succeeds, its output files are copied to ``objects/`` under
+their SHA-256 and ``entries/<key>.json`` lists them. On a hit the files are
+put back where the stage would have written them: partition folders take
+the date of the current input partition, as the stages name them, catalog
+partitions are committed again and the model pointer is moved. Restoring an
+output that is already in place costs a checksum.
+
+Stages with an input the cache cannot fingerprint (the download, warehouse
+tables) or an output it cannot restore always run. Warehouse tables a stage
+loads are not copied: a hit is only taken while the table still holds that
+entry's load, i.e. no run with other inputs has loaded it since
+(``current.json`` tracks the entry that last wrote each output).
+
+Entries unused for ``max_age_days`` are evicted, then the least recently
+used ones until the stored objects fit in ``max_bytes``.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from importlib import metadata
+
+from common.catalog import CLEANED, COMPLETE, RAW, SCORED, TRANSFORMED, PartitionCatalog
+from common.schema import SchemaRegistry
+from common.transforms import default_rules_path
+from common.storage import file_checksum
+
+logger = logging.getLogger(__name__)
+
+MODEL = "model"
+VALIDATION_REPORT = "validation_report"
+CATALOG_DATASETS = (RAW, CLEANED, TRANSFORMED, SCORED)
+# Datasets stored as one folder per partition date under their base directory
+PARTITIONED_DATASETS = CATALOG_DATASETS + (VALIDATION_REPORT,)
+WAREHOUSE_PREFIX = "warehouse."
+# Model pointer file of common.scoring.ModelStore
+LATEST_FILE = "LATEST"
+MODEL_FILES = ("preprocessor.joblib", "model.joblib")
+PACKAGES = ("numpy", "pandas", "pyarrow", "scikit-learn")
+
+_COMMON_IMPORT = re.compile(r"^\s*(?:from\s+common\.(\w+)\s+import|import\s+common\.(\w+))", re.MULTILINE)
+_ENV_READ = re.compile(r"os\.(?:getenv|environ\.get|environ\[)\(?\s*['\"]([A-Za-z0-9_]+)['\"]")
+
+
+def default_cache_path():
+    path = os.getenv("PIPELINE_CACHE_DIR")
+    if path:
+        return path
+    raw_base = os.getenv("OUTPUT_FOLDER_BASE", ".")
+    return os.path.join(os.path.dirname(os.path.normpath(raw_base)), "_stage_cache")
+
+
+def dataset_locations():
+    """Base directory of every dataset the cache can fingerprint or restore, as the stages resolve it."""
+    transformed = os.getenv("TRANSFORMED_DATA_PATH_BASE")
+    return {
+        RAW: os.getenv("OUTPUT_FOLDER_BASE"),
+        CLEANED: os.getenv("PROCESSED_DATA_PATH_BASE"),
+        TRANSFORMED: transformed,
+        SCORED: os.getenv("SCORED_DATA_PATH_BASE", transformed and os.path.join(os.path.dirname(transformed), "scored")),
+        VALIDATION_REPORT: os.getenv("DATA_VALIDATION_REPORT_PATH"),
+        MODEL: os.getenv("SERVING_MODEL_DIR", transformed and os.path.join(transformed, "_serving")),
+    }
+
+
+def code_files(script_path):
+    """The script and the ``common`` modules it imports, directly or through each other."""
+    common_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(script_path))), "common")
+    files, pending = [], [os.path.abspath(script_path)]
+    while pending:
+        path = pending.pop()
+        if path in files or not os.path.exists(path):
+            continue
+        files.append(path)
+        with open(path, "r", encoding="utf-8") as f:
+            source = f.read()
+        for match in _COMMON_IMPORT.finditer(source):
+            pending.append(os.path.join(common_dir, (match.group(1) or match.group(2)) + ".py"))
+    return sorted(files)
+
+
+def rules_checksum():
+    path = default_rules_path()
+    return file_checksum(path) if os.path.exists(path) else None
+
+
+def code_fingerprint(script_path):
+    """``(sha256 of the code, {env var: value})`` for a stage script."""
+    digest = hashlib.sha256()
+    env_names = set()
+    for path in code_files(script_path):
+        with open(path, "rb") as f:
+            source = f.read()
+        digest.update(os.path.basename(path).encode("utf-8") + b"\0" + source)
+        env_names.update(_ENV_READ.findall(source.decode("utf-8")))
+    return digest.hexdigest(), {name: os.environ.get(name) for name in sorted(env_names)}
+
+
+def package_versions():
+    versions = {"python": "%d.%d" % sys.version_info[:2]}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def _read_latest_model(model_dir):
+    latest = os.path.join(model_dir, LATEST_FILE)
+    if not os.path.exists(latest):
+        return None
+    with open(latest, "r", encoding="utf-8") as f:
+        return f.read().strip() or None
+
+
+def _write_json(path, payload):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def _copy(source, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = target + ".tmp"
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+class StageCache:
+
+    def __init__(self, directory=None, max_age_days=30, max_bytes=2 << 30):
+        self.directory = directory or default_cache_path()
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.entries_dir = os.path.join(self.directory, "entries")
+        self.objects_dir = os.path.join(self.directory, "objects")
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.locations = dataset_locations()
+        # Stages of one flow run store and restore from several threads; eviction
+        # must not delete objects an entry being written or restored refers to
+        self._lock = threading.RLock()
+
+    # === Keys ===
+    def cacheable(self, stage):
+        inputs_ok = all(d in CATALOG_DATASETS or d == MODEL for d in stage.inputs)
+        outputs_ok = all(d in PARTITIONED_DATASETS or d == MODEL or d.startswith(WAREHOUSE_PREFIX)
+                         for d in stage.outputs)
+        return bool(stage.inputs) and inputs_ok and outputs_ok
+
+    def fingerprint(self, stage, script_path):
+        """``{"key", "partition_date", "inputs"}`` of running ``stage`` now, or None if it cannot be cached."""
+        if not self.cacheable(stage):
+            return None
+        inputs, partition_date = {}, None
+        catalog = PartitionCatalog()
+        try:
+            for dataset in stage.inputs:
+                if dataset == MODEL:
+                    inputs[dataset] = self._model_checksum()
+                else:
+                    latest = catalog.latest(dataset, base_dir=self.locations[dataset])
+                    inputs[dataset] = latest and latest["checksum"]
+                    partition_date = partition_date or (latest and latest["partition_date"])
+        finally:
+            catalog.close()
+        if any(checksum is None for checksum in inputs.values()) or partition_date is None:
+            return None
+        code, env = code_fingerprint(script_path)
+        payload = {"stage": stage.name, "inputs": inputs, "code": code, "env": env, "packages": package_versions(),
+                   "schema": (SchemaRegistry().versions() or [None])[-1], "rules": rules_checksum()}
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+        return {"key": key, "partition_date": partition_date, "inputs": inputs}
+
+    def _model_checksum(self):
+        version = _read_latest_model(self.locations[MODEL])
+        if version is None:
+            return None
+        digest = hashlib.sha256()
+        for name in MODEL_FILES:
+            path = os.path.join(self.locations[MODEL], version, name)
+            if not os.path.exists(path):
+                return None
+            digest.update(file_checksum(path).encode("utf-8"))
+        return digest.hexdigest()
+
+    # === Objects ===
+    def _object_path(self, checksum):
+        return os.path.join(self.objects_dir, checksum[:2], checksum)
+
+    def _put(self, path):
+        checksum = file_checksum(path)
+        target = self._object_path(checksum)
+        if not os.path.exists(target):
+            _copy(path, target)
+        return checksum
+
+    def _place(self, checksum, target):
+        """Put object ``checksum`` at ``target`` unless the file there already has that content."""
+        if os.path.exists(target) and file_checksum(target) == checksum:
+            return
+        _copy(self._object_path(checksum), target)
+
+    # === Entries ===
+    def _entry_path(self, key):
+        return os.path.join(self.entries_dir, key + ".json")
+
+    def _load_entry(self, key):
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _current(self):
+        path = os.path.join(self.directory, "current.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _set_current(self, outputs, key):
+        with self._lock:
+            current = self._current()
+            for dataset in outputs:
+                if key is None:
+                    current.pop(dataset, None)
+                else:
+                    current[dataset] = key
+            _write_json(os.path.join(self.directory, "current.json"), current)
+
+    def invalidate(self, stage):
+        """Forget which entry wrote ``stage``'s outputs; called before the stage runs."""
+        self._set_current(stage.outputs, None)
+
+    def store(self, stage, fingerprint):
+        """Copy the outputs ``stage`` just wrote into the cache under ``fingerprint``."""
+        with self._lock:
+            entry = self._store(stage, fingerprint)
+        if entry is not None:
+            self.evict()
+        return entry
+
+    def _store(self, stage, fingerprint):
+        partition_date = fingerprint["partition_date"]
+        outputs = []
+        catalog = PartitionCatalog()
+        try:
+            for dataset in stage.outputs:
+                output = {"dataset": dataset}
+                if dataset in PARTITIONED_DATASETS:
+                    folder = os.path.join(self.locations[dataset], partition_date)
+                    if dataset in CATALOG_DATASETS:
+                        entry = catalog.get(dataset, partition_date)
+                        if entry is None or entry["status"] != COMPLETE:
+                            logger.warning("%s wrote no complete %s partition %s, not caching it",
+                                           stage.name, dataset, partition_date)
+                            return None
+                        output.update(file=os.path.basename(entry["path"]), row_count=entry["row_count"])
+                    names = sorted(n for n in os.listdir(folder)
+                                   if os.path.isfile(os.path.join(folder, n)) and not n.endswith(".tmp"))
+                    output["files"] = {name: self._put(os.path.join(folder, name)) for name in names}
+                elif dataset == MODEL:
+                    version = _read_latest_model(self.locations[MODEL])
+                    folder = os.path.join(self.locations[MODEL], version)
+                    output["version"] = version
+                    output["files"] = {name: self._put(os.path.join(folder, name)) for name in sorted(os.listdir(folder))}
+                outputs.append(output)
+        finally:
+            catalog.close()
+
+        now = time.time()
+        sizes = {checksum: os.path.getsize(self._object_path(checksum))
+                 for output in outputs for checksum in output.get("files", {}).values()}
+        entry = {"key": fingerprint["key"], "stage": stage.name, "created": now, "last_used": now,
+                 "partition_date": partition_date, "inputs": fingerprint["inputs"], "outputs": outputs,
+                 "bytes": sum(sizes.values())}
+        _write_json(self._entry_path(fingerprint["key"]), entry)
+        self._set_current(stage.outputs, fingerprint["key"])
+        logger.info("Cached %s outputs as %s (%d files, %d bytes)",
+                    stage.name, fingerprint["key"][:12], len(sizes), entry["bytes"])
+        return entry
+
+    def restore(self, stage, fingerprint):
+        """Put the cached outputs of ``fingerprint`` in place; False on a miss."""
+        with self._lock:
+            return self._restore(stage, fingerprint)
+
+    def _restore(self, stage, fingerprint):
+        key = fingerprint["key"]
+        entry = self._load_entry(key)
+        if entry is None:
+            return False
+        current = self._current()
+        for output in entry["outputs"]:
+            if output["dataset"].startswith(WAREHOUSE_PREFIX) and current.get(output["dataset"]) != key:
+                logger.info("%s was loaded by another run since %s, not reusing it", output["dataset"], key[:12])
+                return False
+            if any(not os.path.exists(self._object_path(c)) for c in output.get("files", {}).values()):
+                logger.warning("Cache entry %s lost objects, dropping it", key[:12])
+                os.remove(self._entry_path(key))
+                return False
+
+        partition_date = fingerprint["partition_date"]
+        catalog = PartitionCatalog()
+        try:
+            for output in entry["outputs"]:
+                dataset = output["dataset"]
+                if dataset in PARTITIONED_DATASETS:
+                    folder = os.path.join(self.locations[dataset], partition_date)
+                    for name, checksum in output["files"].items():
+                        self._place(checksum, os.path.join(folder, name))
+                    if dataset in CATALOG_DATASETS:
+                        path = os.path.join(folder, output["file"])
+                        existing = catalog.get(dataset, partition_date)
+                        if not existing or existing["status"] != COMPLETE or existing["path"] != path \
+                                or existing["checksum"] != output["files"][output["file"]]:
+                            catalog.begin(dataset, partition_date, base_dir=self.locations[dataset])
+                            catalog.commit(dataset, partition_date, path, row_count=output["row_count"])
+                elif dataset == MODEL:
+                    model_dir = self.locations[MODEL]
+                    for name, checksum in output["files"].items():
+                        self._place(checksum, os.path.join(model_dir, output["version"], name))
+                    if _read_latest_model(model_dir) != output["version"]:
+                        tmp_latest = os.path.join(model_dir, LATEST_FILE + ".tmp")
+                        with open(tmp_latest, "w", encoding="utf-8") as f:
+                            f.write(output["version"])
+                        os.replace(tmp_latest, os.path.join(model_dir, LATEST_FILE))
+        finally:
+            catalog.close()
+
+        entry["last_used"] = time.time()
+        _write_json(self._entry_path(key), entry)
+        self._set_current(stage.outputs, key)
+        logger.info("Reused cached %s outputs %s for partition %s", stage.name, key[:12], partition_date)
+        return True
+
+    # === Eviction ===
+    def evict(self):
+        """Drop entries unused for ``max_age_days``, then the least recently used beyond ``max_bytes``."""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.entries_dir):
+                if name.endswith(".json"):
+                    with open(os.path.join(self.entries_dir, name), "r", encoding="utf-8") as f:
+                        entries.append(json.load(f))
+            cutoff = time.time() - self.max_age_days * 86400
+            kept, referenced, total = [], set(), 0
+            for entry in sorted(entries, key=lambda e: e["last_used"], reverse=True):
+                objects = {c for output in entry["outputs"] for c in output.get("files", {}).values()}
+                added = sum(os.path.getsize(self._object_path(c)) for c in objects - referenced
+                            if os.path.exists(self._object_path(c)))
+                if entry["last_used"] >= cutoff and total + added <= self.max_bytes:
+                    kept.append(entry)
+                    referenced |= objects
+                    total += added
+                else:
+                    os.remove(self._entry_path(entry["key"]))
+                    logger.info("Evicted cache entry %s of %s (last used %s)", entry["key"][:12], entry["stage"],
+                                datetime.fromtimestamp(entry["last_used"]).isoformat(timespec="seconds"))
+            for prefix in os.listdir(self.objects_dir):
+                folder = os.path.join(self.objects_dir, prefix)
+                for checksum in os.listdir(folder):
+                    if checksum not in referenced:
+                        os.remove(os.path.join(folder, checksum))
+                if not os.listdir(folder):
+                    os.rmdir(folder)
+            return {"entries": len(kept), "bytes": total}
+
+
+def run_cached(cache, stage, script_path, run, force=False):
+    """``run()`` unless ``cache`` holds ``stage``'s outputs for its current inputs.
+
+    Returns ``(result, key)``, ``result`` None when the outputs were reused.
+    ``force`` runs the stage anyway and replaces the entry.
+    """
+    fingerprint = cache.fingerprint(stage, script_path) if cache is not None else None
+    if fingerprint is not None and not force and cache.restore(stage, fingerprint):
+        return None, fingerprint["key"]
+    if cache is not None:
+        cache.invalidate(stage)
+    result = run()
+    if fingerprint is not None:
+        cache.store(stage, fingerprint)
+    return result, fingerprint and fingerprint["key"]
@@ -0,0 +1,186 @@
+"""Run the pipeline stage scripts as a DAG, in subprocesses or in-process.
+
+Every stage is declared in ``PIPELINE`` with the datasets it reads and
+writes. ``topological_order`` derives a sequential run order from those
+declarations, ``upstream`` the stages each one waits for. ``run_dag``
+starts every stage as soon as its upstream stages have succeeded, with at
+most ``max_parallel`` running at once, so the wall time shrinks towards the
+longest dependency chain (``critical_path``). A stage runs in one of two
+ways:
+
+* ``run_stage_subprocess``: a fresh interpreter per stage, as before. This
+  gives full isolation, but every stage pays interpreter start-up, imports
+  pandas/sklearn/mlflow again, and decodes the previous stage's partition
+  from disk.
+* ``run_stage_inprocess``: the script runs as a function of the current
+  process (``runpy``, as ``__main__``). Imported modules, the pooled
+  warehouse client and the in-memory partition tables of
+  ``common.storage`` stay alive between stages. A partition written by one
+  stage is then handed to the next as the same Arrow table, without
+  re-reading the file. Each stage still writes its own log file. Logging
+  handlers, ``sys.stdout`` and ``sys.argv`` are restored after the stage.
+  Those are process-wide, so in-process stages run one at a time even
+  when the DAG would allow more; parallel stages need subprocess mode.
+
+Both return ``{"stage", "mode", "seconds"}`` and raise on failure.
+"""
+import logging
+import os
+import runpy
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from common.instrumentation import finish_stage, stage_depth
+from common.storage import memory_cache_enabled, set_memory_cache
+
+logger = logging.getLogger(__name__)
+
+_inprocess_lock = threading.Lock()
+
+Stage = namedtuple("Stage", ["name", "script", "inputs", "outputs"])
+
+# Datasets are named after what the stage writes: catalog datasets (raw,
+# cleaned, transformed, scored), warehouse tables and local artifacts
+PIPELINE = [
+    Stage("Data Fetching", os.path.join("01_data_fetching", "data_fetch.py"), (), ("source_csv",)),
+    Stage("Data Ingestion", os.path.join("02_data_ingestion", "data_ingest.py"),
+          ("source_csv",), ("warehouse.customer_churn",)),
+    Stage("Raw Data Storage", os.path.join("03_raw_data_storage", "data_storage.py"),
+          ("warehouse.customer_churn",), ("raw",)),
+    Stage("Data Validation", os.path.join("04_data_validation", "data_validation.py"), ("raw",), ("validation_report",)),
+    Stage("Data Preparation", os.path.join("05_data_preparation", "data_preparation.py"), ("raw",), ("cleaned",)),
+    Stage("Data Transformation", os.path.join("06_data_transformation_and_storage", "data_transform.py"),
+          ("cleaned",), ("transformed", "warehouse.customer_churn_transformed")),
+    Stage("Feature Store", os.path.join("07_feature_store", "feature_store.py"),
+          ("cleaned", "transformed"), ("feature_store",)),
+    Stage("Model Building", os.path.join("08_model_building", "model_building.py"), ("transformed",), ("model",)),
+    Stage("Model Scoring", os.path.join("10_model_scoring", "model_scoring.py"), ("transformed", "model"), ("scored",)),
+]
+
+
+def topological_order(stages):
+    """Stages ordered so every stage runs after the producers of its inputs.
+
+    Inputs no stage produces are external. Ties keep the declared order.
+    """
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(f"Dataset '{output}' is produced by both {producers[output]} and {stage.name}")
+            producers[output] = stage.name
+    depends = {stage.name: {producers[i] for i in stage.inputs if i in producers} for stage in stages}
+    ordered, done = [], set()
+    while len(ordered) < len(stages):
+        ready = [s for s in stages if s.name not in done and depends[s.name] <= done]
+        if not ready:
+            raise ValueError(f"Stage dependencies form a cycle: {sorted(set(depends) - done)}")
+        ordered.append(ready[0])
+        done.add(ready[0].name)
+    return ordered
+
+
+def upstream(stages):
+    """``{stage name: [names of the stages producing its inputs]}``."""
+    producers = {output: stage.name for stage in topological_order(stages) for output in stage.outputs}
+    return {stage.name: sorted({producers[i] for i in stage.inputs if i in producers}) for stage in stages}
+
+
+def critical_path(stages, seconds):
+    """``(total seconds, [stage names])`` of the longest dependency chain given per-stage ``seconds``."""
+    parents = upstream(stages)
+    finish, chain = {}, {}
+    for stage in topological_order(stages):
+        before = max(parents[stage.name], key=lambda name: finish[name], default=None)
+        finish[stage.name] = seconds.get(stage.name, 0) + (finish[before] if before else 0)
+        chain[stage.name] = (chain[before] if before else []) + [stage.name]
+    last = max(finish, key=finish.get)
+    return finish[last], chain[last]
+
+
+def run_dag(stages, run, max_parallel=2):
+    """Call ``run(stage)`` for every stage once its upstream stages succeeded.
+
+    At most ``max_parallel`` stages run at once. Returns ``{name: result}``.
+    After a failure no new stage starts; the running ones finish and the
+    first error is raised.
+    """
+    parents = upstream(stages)
+    order = topological_order(stages)
+    results, running, error = {}, {}, None
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        while True:
+            if error is None:
+                for stage in order:
+                    if len(running) >= max_parallel:
+                        break
+                    if stage.name not in results and stage.name not in running.values() \
+                            and all(parent in results for parent in parents[stage.name]):
+                        logger.info("Starting %s", stage.name)
+                        running[executor.submit(run, stage)] = stage.name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    logger.error("%s failed: %s", name, e)
+                    error = error or e
+    if error is not None:
+        raise error
+    return results
+
+
+def run_stage_subprocess(name, script_path, python=None):
+    start = time.perf_counter()
+    result = subprocess.run([python or sys.executable, script_path], capture_output=True, text=True,
+                            encoding="utf-8", errors="replace")
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+    return {"stage": name, "mode": "subprocess", "seconds": round(time.perf_counter() - start, 3)}
+
+
+def run_stage_inprocess(name, script_path, memory_entries=8):
+    # Partitions stay in memory for the next stage
+    if not memory_cache_enabled():
+        set_memory_cache(entries=memory_entries)
+
+    with _inprocess_lock:
+        return _run_inprocess(name, script_path)
+
+
+def _run_inprocess(name, script_path):
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    saved_stdout, saved_stderr, saved_argv = sys.stdout, sys.stderr, sys.argv
+    # The stage's own logging.basicConfig only applies to a root logger without handlers
+    root.handlers = []
+    sys.argv = [script_path]
+    depth = stage_depth()
+    status, error = "ok", None
+    start = time.perf_counter()
+    try:
+        runpy.run_path(script_path, run_name="__main__")
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            status, error = "error", e
+            raise RuntimeError(f"{script_path} exited with status {e.code}") from e
+    except BaseException as e:
+        status, error = "error", e
+        raise
+    finally:
+        # The stage span the script opened ends with it, not at interpreter exit
+        while stage_depth() > depth:
+            finish_stage(status, error)
+        for handler in root.handlers:
+            handler.close()
+        root.handlers = saved_handlers
+        root.setLevel(saved_level)
+        sys.stdout, sys.stderr, sys.argv = saved_stdout, saved_stderr, saved_argv
+    return {"stage": name, "mode": "inprocess", "seconds": round(time.perf_counter() - start, 3)}
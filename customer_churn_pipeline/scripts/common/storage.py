@@ -0,0 +1,434 @@
+"""Read and write the date-partitioned data files shared by stages 03-08.
+
+Partitions are stored as compressed, typed columnar files (Parquet by
+default, Feather as a memory-mappable alternative) instead of CSV. Readers
+can ask for a subset of columns so a stage only decodes what it uses. Older
+partitions that only exist as CSV are still found and read, and CSV remains
+available as an export format next to the columnar file.
+
+The format is chosen with ``PARTITION_FORMAT`` (parquet, feather or csv) and
+``PARTITION_EXPORT_CSV=true`` writes a CSV copy alongside every partition.
+
+When several stages run in one process (``09_orchestrate`` in-process mode),
+``set_memory_cache`` keeps the Arrow tables of the partitions written or read
+in memory. A later read of the same file, as long as its size and mtime are
+unchanged, is served from that table instead of decoding the file again.
+Columns are selected and chunks sliced without copying. Partitions written
+chunk by chunk with ``PartitionWriter`` are not kept, since they are written
+that way to bound memory.
+
+Reads and writes of partition files are reported to the open
+``common.instrumentation`` span (file bytes and seconds spent); reads served
+from memory are not I/O and are not counted.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from common.instrumentation import record_io
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"parquet": ".parquet", "feather": ".feather", "csv": ".csv"}
+# Lookup order when reading: columnar formats first, CSV for older partitions
+READ_ORDER = ["parquet", "feather", "csv"]
+
+PARTITION_FORMAT = os.getenv("PARTITION_FORMAT", "parquet").lower()
+PARTITION_EXPORT_CSV = os.getenv("PARTITION_EXPORT_CSV", "false").lower() == "true"
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+FEATHER_COMPRESSION = os.getenv("FEATHER_COMPRESSION", "lz4")
+
+
+class _MemoryTables:
+    """Most recently used Arrow tables by file path, valid while the file is unchanged."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def put(self, path, table):
+        key = os.path.abspath(path)
+        stamp = self._stamp(path)
+        with self._lock:
+            self._tables[key] = (stamp, table)
+            self._tables.move_to_end(key)
+            while len(self._tables) > self.entries:
+                self._tables.popitem(last=False)
+
+    def get(self, path):
+        key = os.path.abspath(path)
+        stamp = self._stamp(path) if os.path.exists(path) else None
+        with self._lock:
+            entry = self._tables.get(key)
+            if entry is None:
+                return None
+            if entry[0] != stamp:
+                del self._tables[key]
+                return None
+            self._tables.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+
+_memory_tables = None
+
+
+def set_memory_cache(enabled=True, entries=8):
+    """Keep up to ``entries`` partition tables in memory for the rest of the process."""
+    global _memory_tables
+    _memory_tables = _MemoryTables(entries) if enabled else None
+
+
+def memory_cache_enabled():
+    return _memory_tables is not None
+
+
+if os.getenv("PARTITION_MEMORY_CACHE", "false").lower() == "true":
+    set_memory_cache(entries=int(os.getenv("PARTITION_MEMORY_CACHE_ENTRIES", 8)))
+
+
+def _cached_table(path, columns=None):
+    table = _memory_tables.get(path) if _memory_tables is not None else None
+    if table is None:
+        return None
+    logger.info("Serving %s from memory", path)
+    return table.select(columns) if columns is not None else table
+
+
+def find_partition_file(folder, name):
+    """Return the path of dataset ``name`` inside ``folder`` in whichever format exists, else None."""
+    for fmt in READ_ORDER:
+        path = os.path.join(folder, name + EXTENSIONS[fmt])
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def file_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    for fmt, fmt_ext in EXTENSIONS.items():
+        if ext == fmt_ext:
+            return fmt
+    raise ValueError(f"Unknown partition file format: {path}")
+
+
+def feather_schema(path):
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).schema
+
+
+def read_columns(path):
+    """Column names of a partition file without loading its data."""
+    fmt = file_format(path)
+    if fmt == "parquet":
+        return pq.read_schema(path).names
+    if fmt == "feather":
+        return feather_schema(path).names
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+
+def read_schema(path):
+    """``[(column, type), ...]`` of a partition file; CSV only knows its column names."""
+    fmt = file_format(path)
+    if fmt == "parquet":
+        return [(field.name, str(field.type)) for field in pq.read_schema(path)]
+    if fmt == "feather":
+        return [(field.name, str(field.type)) for field in feather_schema(path)]
+    return [(col, "") for col in read_columns(path)]
+
+
+def count_rows(path):
+    fmt = file_format(path)
+    if fmt == "parquet":
+        return pq.ParquetFile(path).metadata.num_rows
+    if fmt == "feather":
+        return feather.read_table(path, memory_map=True).num_rows
+    first_col = read_columns(path)[:1]
+    return len(pd.read_csv(path, usecols=first_col))
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """SHA-256 of the file contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_file(path, columns=None, schema=None):
+    """Load a partition file into a DataFrame, decoding only ``columns`` if given.
+
+    With a ``schema`` (see common/schema.py) the frame is validated and cast
+    to its compact dtypes.
+    """
+    cached = _cached_table(path, columns)
+    if cached is not None:
+        df = cached.to_pandas()
+    else:
+        start = time.perf_counter()
+        df = _read_file(path, columns, schema)
+        record_io("read", os.path.getsize(path), time.perf_counter() - start)
+    return schema.apply(df) if schema is not None else df
+
+
+def _read_file(path, columns, schema=None):
+    fmt = file_format(path)
+    if fmt == "csv":
+        return pd.read_csv(path, usecols=columns, dtype=schema.csv_dtypes(columns) if schema is not None else None)
+    read = pq.read_table if fmt == "parquet" else feather.read_table
+    if _memory_tables is not None and columns is not None:
+        # Keep the whole table, later stages usually read other columns of it
+        table = read(path, memory_map=True)
+        _memory_tables.put(path, table)
+        return table.select(columns).to_pandas()
+    table = read(path, columns=columns, memory_map=True)
+    if _memory_tables is not None:
+        _memory_tables.put(path, table)
+    return table.to_pandas()
+
+
+def read_partition(folder, name, columns=None):
+    path = find_partition_file(folder, name)
+    if path is None:
+        raise FileNotFoundError(f"No partition file for '{name}' in {folder}")
+    df = read_file(path, columns=columns)
+    logger.info("Loaded %s (%d rows, %d columns)", path, len(df), df.shape[1])
+    return df
+
+
+def iter_file_chunks(path, chunk_rows=100_000, columns=None, schema=None):
+    """Yield a partition file as DataFrames of at most ``chunk_rows`` rows, cast to ``schema`` if given."""
+    cached = _cached_table(path, columns)
+    if cached is not None:
+        for offset in range(0, cached.num_rows, chunk_rows):
+            chunk = cached.slice(offset, chunk_rows).to_pandas()
+            yield schema.apply(chunk) if schema is not None else chunk
+        return
+    # Only the time spent producing chunks counts as I/O, not the caller's work in between
+    seconds = 0.0
+    chunks = _iter_file_chunks(path, chunk_rows, columns, schema)
+    try:
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            seconds += time.perf_counter() - start
+            if chunk is None:
+                break
+            yield schema.apply(chunk) if schema is not None else chunk
+    finally:
+        record_io("read", os.path.getsize(path), seconds)
+
+
+def _iter_file_chunks(path, chunk_rows, columns, schema=None):
+    fmt = file_format(path)
+    if fmt == "parquet":
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    elif fmt == "feather":
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if columns is not None:
+                    batch = batch.select(columns)
+                for offset in range(0, batch.num_rows, chunk_rows):
+                    yield batch.slice(offset, chunk_rows).to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_rows,
+                               dtype=schema.csv_dtypes(columns) if schema is not None else None)
+
+
+def open_dataset(path, column_types=None):
+    """Arrow dataset over a partition file, for lazy scans (see common/transforms.py).
+
+    Nothing is read until the dataset is scanned, and a scan only decodes
+    the columns it projects. CSV columns listed in ``column_types`` are
+    converted to those Arrow types instead of inferred ones.
+    """
+    cached = _cached_table(path)
+    if cached is not None:
+        return ds.dataset(cached)
+    fmt = file_format(path)
+    if fmt == "csv":
+        # Empty fields are missing values, as in read_csv
+        options = pcsv.ConvertOptions(column_types=column_types or {}, strings_can_be_null=True)
+        return ds.dataset(path, format=ds.CsvFileFormat(convert_options=options))
+    return ds.dataset(path, format="parquet" if fmt == "parquet" else "ipc")
+
+
+def _remove_other_formats(folder, name, fmt, export_csv):
+    for other_fmt, ext in EXTENSIONS.items():
+        other = os.path.join(folder, name + ext)
+        if other_fmt != fmt and not (other_fmt == "csv" and export_csv) and os.path.exists(other):
+            os.remove(other)
+
+
+def write_partition(df, folder, name, fmt=None, export_csv=None):
+    """Write ``df`` as dataset ``name`` in ``folder`` and return the written path.
+
+    Files of the same dataset in other formats are removed so readers never
+    pick up a stale copy; the CSV export is kept when it is requested.
+    """
+    fmt = (fmt or PARTITION_FORMAT).lower()
+    export_csv = PARTITION_EXPORT_CSV if export_csv is None else export_csv
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Unsupported partition format: {fmt}")
+    os.makedirs(folder, exist_ok=True)
+
+    path = os.path.join(folder, name + EXTENSIONS[fmt])
+    tmp_path = path + ".tmp"
+    table = None
+    start = time.perf_counter()
+    if fmt == "csv":
+        df.to_csv(tmp_path, index=False)
+    else:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if fmt == "parquet":
+            pq.write_table(table, tmp_path, compression=PARQUET_COMPRESSION)
+        else:
+            feather.write_feather(table, tmp_path, compression=FEATHER_COMPRESSION)
+    os.replace(tmp_path, path)
+    record_io("write", os.path.getsize(path), time.perf_counter() - start)
+    if table is not None and _memory_tables is not None:
+        _memory_tables.put(path, table)
+
+    _remove_other_formats(folder, name, fmt, export_csv)
+    if export_csv and fmt != "csv":
+        export_partition_csv(folder, name, df)
+
+    logger.info("Saved %s (%d rows)", path, len(df))
+    return path
+
+
+def copy_partition_file(source, folder, name, export_csv=None):
+    """Carry an existing partition file over as dataset ``name`` in ``folder``, unchanged."""
+    fmt = file_format(source)
+    export_csv = PARTITION_EXPORT_CSV if export_csv is None else export_csv
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name + EXTENSIONS[fmt])
+    if os.path.abspath(source) != os.path.abspath(path):
+        cached = _cached_table(source)
+        tmp_path = path + ".tmp"
+        start = time.perf_counter()
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+        record_io("write", os.path.getsize(path), time.perf_counter() - start)
+        if cached is not None:
+            _memory_tables.put(path, cached)
+    _remove_other_formats(folder, name, fmt, export_csv)
+    logger.info("Carried %s over to %s", source, path)
+    return path
+
+
+class PartitionWriter:
+    """Write a partition chunk by chunk without holding it in memory.
+
+    The schema is fixed by the first chunk. The file is written under a
+    temporary name and only moved into place by ``close``, so a failed run
+    never leaves a truncated partition behind.
+    """
+
+    def __init__(self, folder, name, fmt=None, export_csv=None):
+        self.folder = folder
+        self.name = name
+        self.fmt = (fmt or PARTITION_FORMAT).lower()
+        self.export_csv = PARTITION_EXPORT_CSV if export_csv is None else export_csv
+        if self.fmt not in EXTENSIONS:
+            raise ValueError(f"Unsupported partition format: {self.fmt}")
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, name + EXTENSIONS[self.fmt])
+        self.tmp_path = self.path + ".tmp"
+        self.rows = 0
+        self.schema = None
+        self._writer = None
+        self._sink = None
+        self._seconds = 0.0
+
+    def write(self, df):
+        start = time.perf_counter()
+        try:
+            self._write(df)
+        finally:
+            self._seconds += time.perf_counter() - start
+
+    def _write(self, df):
+        if self.fmt == "csv":
+            df.to_csv(self.tmp_path, mode="w" if self.rows == 0 else "a", header=self.rows == 0, index=False)
+            self.rows += len(df)
+            return
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            self.schema = table.schema
+            if self.fmt == "parquet":
+                self._writer = pq.ParquetWriter(self.tmp_path, self.schema, compression=PARQUET_COMPRESSION)
+            else:
+                self._sink = pa.OSFile(self.tmp_path, "wb")
+                options = pa.ipc.IpcWriteOptions(compression=FEATHER_COMPRESSION)
+                self._writer = pa.ipc.new_file(self._sink, self.schema, options=options)
+        elif not table.schema.equals(self.schema, check_metadata=False):
+            table = table.cast(self.schema)
+        self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        """Finish the file, move it into place and return its path."""
+        start = time.perf_counter()
+        if self._writer is not None:
+            self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+        if not os.path.exists(self.tmp_path):
+            raise ValueError(f"Nothing was written to partition '{self.name}' in {self.folder}")
+        os.replace(self.tmp_path, self.path)
+        record_io("write", os.path.getsize(self.path), self._seconds + time.perf_counter() - start)
+
+        _remove_other_formats(self.folder, self.name, self.fmt, self.export_csv)
+        if self.export_csv and self.fmt != "csv":
+            export_partition_csv(self.folder, self.name)
+        logger.info("Saved %s (%d rows)", self.path, self.rows)
+        return self.path
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def export_partition_csv(folder, name, df=None):
+    """Write a CSV copy of dataset ``name`` next to its columnar file."""
+    path = os.path.join(folder, name + ".csv")
+    if df is not None:
+        df.to_csv(path, index=False)
+        return path
+
+    source = find_partition_file(folder, name)
+    if source is None or file_format(source) == "csv":
+        raise FileNotFoundError(f"No columnar partition file for '{name}' in {folder}")
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for i, chunk in enumerate(iter_file_chunks(source)):
+            chunk.to_csv(f, header=i == 0, index=False)
+    return path
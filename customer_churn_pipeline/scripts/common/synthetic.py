@@ -0,0 +1,200 @@
+"""Synthetic churn partitions of any size, learned from an existing partition.
+
+``learn_profile`` reads a partition (raw, cleaned or transformed) and keeps,
+per column:
+
+* its dtype and missing rate,
+* for categorical columns and numeric columns with few distinct values, the
+  value frequencies (``values``),
+* for other numeric columns, 1001 quantiles to sample from by inverse CDF,
+  rounded to the column's number of decimals (``quantiles``),
+* for identifier columns whose values are (almost) all distinct, a
+  generator of unique ids (``unique``).
+
+When the target column (``Churn``) is present, every column is profiled
+per class and rows are generated class by class with the learned class
+balance. The class-dependent columns, such as ``Churn Category`` (empty for
+customers who stayed) or ``Contract``, then keep their relation to the
+target, so models trained on the data have signal to learn. Other
+dependencies between columns are not kept. The share of fully duplicated
+rows is reproduced as well, for the deduplication in stage 05.
+
+``generate`` yields the rows in chunks. Chunk ``i`` only depends on the seed,
+``i`` and ``chunk_rows`` (the class split, the shuffle and the duplicates
+are drawn per chunk), so the output is reproducible for a given seed and
+chunk size, but changes with the chunk size. Memory stays bounded by one
+chunk. Categorical columns keep at most
+``max_values`` distinct values, so their cardinality does not grow with the
+row count. The profile is plain JSON (``save_profile``/``load_profile``).
+"""
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.storage import PartitionWriter
+
+logger = logging.getLogger(__name__)
+
+PROFILE_VERSION = 1
+QUANTILES = 1001
+MAX_EXACT_NUMERIC = 50
+UNIQUE_RATIO = 0.95
+
+
+def _decimals(values, max_decimals=6):
+    """Smallest number of decimals that represents every value exactly."""
+    for decimals in range(max_decimals + 1):
+        if np.allclose(values, np.round(values, decimals), rtol=0, atol=1e-9):
+            return decimals
+    return None
+
+
+def _column_spec(series, max_values, max_exact_numeric):
+    present = series.dropna()
+    spec = {"missing": round(float(series.isna().mean()), 6)}
+    if present.empty:
+        return {**spec, "kind": "values", "values": [], "weights": []}
+    is_datetime = pd.api.types.is_datetime64_any_dtype(series)
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series) or is_datetime:
+        numbers = present.astype("int64") if is_datetime else present
+        if numbers.nunique() > max_exact_numeric:
+            values = numbers.to_numpy(dtype=np.float64)
+            return {**spec, "kind": "quantiles",
+                    "quantiles": np.quantile(values, np.linspace(0, 1, QUANTILES)).tolist(),
+                    "decimals": 0 if is_datetime else _decimals(values)}
+    elif present.nunique() >= UNIQUE_RATIO * len(present) and len(present) > max_exact_numeric:
+        return {**spec, "kind": "unique", "prefix": "SYN-"}
+    counts = present.value_counts()
+    if len(counts) > max_values:
+        counts = counts.iloc[:max_values]
+    values = counts.index.astype("int64").tolist() if is_datetime else counts.index.tolist()
+    return {**spec, "kind": "values", "values": [v.item() if hasattr(v, "item") else v for v in values],
+            "weights": (counts / counts.sum()).round(8).tolist()}
+
+
+def learn_profile(df, target="Churn", max_values=5000, max_exact_numeric=MAX_EXACT_NUMERIC, source=None):
+    """Profile of ``df`` that ``generate`` samples from."""
+    columns = [col for col in df.columns if col != target]
+    dtypes = {col: str(dtype) for col, dtype in df.dtypes.items()}
+    groups = {None: df} if target not in df.columns else dict(tuple(df.groupby(target, sort=True)))
+    classes = []
+    for value, group in groups.items():
+        classes.append({
+            "value": value.item() if hasattr(value, "item") else value,
+            "weight": len(group) / len(df),
+            "columns": {col: _column_spec(group[col], max_values, max_exact_numeric) for col in columns},
+        })
+    return {
+        "version": PROFILE_VERSION,
+        "source": source or {},
+        "rows": len(df),
+        "columns": list(df.columns),
+        "dtypes": dtypes,
+        "target": target if target in df.columns else None,
+        "classes": classes,
+        "duplicate_rate": float(df.duplicated().mean()),
+    }
+
+
+def save_profile(profile, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_profile(path):
+    with open(path, "r", encoding="utf-8") as f:
+        profile = json.load(f)
+    if profile.get("version") != PROFILE_VERSION:
+        raise ValueError(f"Unsupported synthetic profile version {profile.get('version')} in {path}")
+    return profile
+
+
+def _sample(spec, n, rng, first_row):
+    kind = spec["kind"]
+    if kind == "unique":
+        values = np.array([f"{spec['prefix']}{i:010d}" for i in range(first_row, first_row + n)], dtype=object)
+    elif kind == "quantiles":
+        quantiles = np.asarray(spec["quantiles"])
+        values = np.interp(rng.random(n), np.linspace(0, 1, len(quantiles)), quantiles)
+        if spec["decimals"] is not None:
+            values = np.round(values, spec["decimals"])
+    elif spec["values"]:
+        table = np.array(spec["values"], dtype=object if isinstance(spec["values"][0], str) else None)
+        values = table[rng.choice(len(table), size=n, p=np.asarray(spec["weights"]) / sum(spec["weights"]))]
+    else:
+        values = np.full(n, np.nan)
+    if spec["missing"] > 0:
+        missing = rng.random(n) < spec["missing"]
+        if missing.any():
+            values = values.astype(object if values.dtype == object else np.float64)
+            values[missing] = None if values.dtype == object else np.nan
+    return values
+
+
+def _cast(values, dtype):
+    if dtype.startswith("datetime64"):
+        return pd.to_datetime(pd.Series(values, dtype="float64").round().astype("Int64"), unit="ns")
+    series = pd.Series(values)
+    if dtype.startswith(("int", "uint")):
+        # Like pandas, integer columns with missing values become float
+        return series.astype(dtype) if not series.isna().any() else series.astype("float64")
+    if dtype == "bool":
+        return series.astype("bool") if not series.isna().any() else series.astype(object)
+    if dtype.startswith("float"):
+        return series.astype(dtype)
+    return series.astype(object)
+
+
+def generate_chunk(profile, n, seed, chunk_index, first_row):
+    rng = np.random.default_rng([seed, chunk_index])
+    classes = profile["classes"]
+    counts = rng.multinomial(n, [c["weight"] for c in classes])
+    first_rows = first_row + np.concatenate(([0], np.cumsum(counts)[:-1]))
+    data = {}
+    for col in profile["columns"]:
+        if col == profile["target"]:
+            data[col] = np.repeat([c["value"] for c in classes], counts)
+        else:
+            data[col] = np.concatenate([
+                _sample(c["columns"][col], int(k), rng, int(start)) for c, k, start in zip(classes, counts, first_rows)
+            ]) if n else np.array([])
+    df = pd.DataFrame({col: _cast(values, profile["dtypes"][col]) for col, values in data.items()})
+    # Rows come out grouped by class; shuffle them as in a real extract
+    df = df.iloc[rng.permutation(n)].reset_index(drop=True)
+
+    duplicates = rng.binomial(n, profile["duplicate_rate"]) if n > 1 else 0
+    if duplicates:
+        # The last rows of the chunk become copies of earlier ones
+        source = rng.choice(n - duplicates, size=duplicates)
+        df.iloc[n - duplicates:] = df.iloc[source].to_numpy()
+        df = df.astype({col: df[col].dtype for col in df.columns})
+    return df
+
+
+def generate(profile, rows, chunk_rows=100_000, seed=0):
+    """Yield ``rows`` synthetic rows as DataFrames of at most ``chunk_rows`` rows.
+
+    The same ``seed`` and ``chunk_rows`` give the same rows.
+    """
+    for chunk_index, first_row in enumerate(range(0, rows, chunk_rows)):
+        yield generate_chunk(profile, min(chunk_rows, rows - first_row), seed, chunk_index, first_row)
+
+
+def write_synthetic_partition(profile, rows, folder, name, chunk_rows=100_000, seed=0):
+    """Write ``rows`` synthetic rows as dataset ``name`` in ``folder``; returns the path."""
+    writer = PartitionWriter(folder, name)
+    try:
+        for chunk in generate(profile, rows, chunk_rows=chunk_rows, seed=seed):
+            writer.write(chunk)
+        path = writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    logger.info("Generated %d synthetic rows in %s", rows, path)
+    return path
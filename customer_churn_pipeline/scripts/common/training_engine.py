@@ -0,0 +1,174 @@
+"""Parallel model and hyperparameter search for the model building stage.
+
+Candidates are ``{name: (estimator, param_grid)}``. Every point of every grid
+becomes a trial. Trials run on a joblib process pool, and the training rows
+are memory-mapped matrices that the workers share rather than copy. The
+core budget ``n_jobs`` is split between concurrent trials and the
+estimators' own ``n_jobs``, so the total never exceeds the budget.
+
+Trials are scored on a stratified validation split carved out of the
+training rows; the test set is left for the final evaluation. Two search
+methods:
+
+* ``grid``: every trial is fit once on all the search rows.
+* ``halving``: successive halving. All trials start on a small subsample,
+  and after each round only the best ``1 / factor`` move on to ``factor``
+  times more rows. Most of the budget goes to the promising configurations.
+
+The best configuration of each model is refit on the full training set.
+``log_trials`` records every trial as a nested MLflow run, with one score
+per round.
+"""
+import itertools
+import logging
+import math
+import os
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import train_test_split
+
+logger = logging.getLogger(__name__)
+
+
+def expand_grid(param_grid):
+    """All combinations of a ``{param: [values]}`` grid, as a list of dicts."""
+    if not param_grid:
+        return [{}]
+    names = sorted(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(param_grid[n] for n in names))]
+
+
+def _with_threads(estimator, n_jobs):
+    if "n_jobs" in estimator.get_params():
+        estimator.set_params(n_jobs=n_jobs)
+    return estimator
+
+
+def _fit_trial(trial, estimator, X, y, rows, X_val, y_val, scoring, threads):
+    """Fit one configuration on ``rows`` and score it on the validation rows."""
+    model = _with_threads(clone(estimator).set_params(**trial["params"]), threads)
+    start = time.perf_counter()
+    model.fit(X[rows], y[rows])
+    fit_seconds = time.perf_counter() - start
+    return {
+        "trial": trial["trial"],
+        "rows": len(rows),
+        "score": float(get_scorer(scoring)(model, X_val, y_val)),
+        "fit_seconds": round(fit_seconds, 3),
+    }
+
+
+def _fit_final(estimator, params, X, y, threads):
+    model = _with_threads(clone(estimator).set_params(**params), threads)
+    return model.fit(X, y)
+
+
+class TrainingEngine:
+
+    def __init__(self, n_jobs=None, scoring="f1", method="grid", factor=3, min_rows=500,
+                 validation_size=0.2, random_state=42):
+        self.n_jobs = n_jobs or os.cpu_count()
+        self.scoring = scoring
+        self.method = method
+        self.factor = factor
+        self.min_rows = min_rows
+        self.validation_size = validation_size
+        self.random_state = random_state
+
+    def _split_budget(self, n_tasks):
+        """``(parallel trials, threads per trial)`` within the core budget."""
+        workers = max(1, min(self.n_jobs, n_tasks))
+        return workers, max(1, self.n_jobs // workers)
+
+    def _run(self, tasks):
+        workers, threads = self._split_budget(len(tasks))
+        logger.info("Running %d fits on %d workers x %d threads", len(tasks), workers, threads)
+        return Parallel(n_jobs=workers)(delayed(func)(*args, threads) for func, args in tasks)
+
+    def _schedule(self, n_trials, n_rows):
+        """``[(round, rows, survivors)]`` for the configured search method."""
+        if self.method == "grid" or n_trials == 1:
+            return [(0, n_rows, n_trials)]
+        if self.method != "halving":
+            raise ValueError(f"Unknown search method '{self.method}', expected 'grid' or 'halving'")
+        rounds = 1 + int(math.floor(math.log(n_trials, self.factor)))
+        # Shrink the first round until it is no smaller than min_rows
+        while rounds > 1 and n_rows / self.factor ** (rounds - 1) < self.min_rows:
+            rounds -= 1
+        schedule = []
+        survivors = n_trials
+        for r in range(rounds):
+            rows = n_rows if r == rounds - 1 else int(n_rows / self.factor ** (rounds - 1 - r))
+            schedule.append((r, rows, survivors))
+            survivors = max(1, math.ceil(survivors / self.factor))
+        return schedule
+
+    def search(self, candidates, X, y):
+        """Evaluate every grid point of every candidate; returns the trials with their round scores."""
+        y = np.asarray(y)
+        trials = []
+        for name, (estimator, grid) in candidates.items():
+            for params in expand_grid(grid):
+                trials.append({"trial": len(trials), "model": name, "params": params, "rounds": []})
+        estimators = {name: estimator for name, (estimator, _) in candidates.items()}
+
+        search_rows, val_rows = train_test_split(
+            np.arange(len(y)), test_size=self.validation_size, stratify=y, random_state=self.random_state
+        )
+        X_val, y_val = X[val_rows], y[val_rows]
+        # A fixed random order so every round's subsample contains the previous one
+        order = np.random.default_rng(self.random_state).permutation(search_rows)
+
+        start = time.perf_counter()
+        alive = trials
+        for round_number, n_rows, n_alive in self._schedule(len(trials), len(order)):
+            alive = sorted(alive, key=lambda t: t["rounds"][-1]["score"] if t["rounds"] else 0, reverse=True)[:n_alive]
+            rows = np.sort(order[:n_rows])
+            results = self._run([
+                (_fit_trial, (trial, estimators[trial["model"]], X, y, rows, X_val, y_val, self.scoring))
+                for trial in alive
+            ])
+            for result in results:
+                trials[result["trial"]]["rounds"].append({"round": round_number, **result})
+            logger.info("Round %d: %d trials on %d rows", round_number, len(alive), n_rows)
+
+        for trial in trials:
+            trial["score"] = trial["rounds"][-1]["score"]
+            trial["reached_round"] = trial["rounds"][-1]["round"]
+        logger.info("Search over %d trials took %.2fs", len(trials), time.perf_counter() - start)
+        return trials
+
+    def best_per_model(self, trials):
+        """The best trial of each model among those that reached the last round they could."""
+        best = {}
+        for trial in trials:
+            current = best.get(trial["model"])
+            if current is None or (trial["reached_round"], trial["score"]) > (current["reached_round"], current["score"]):
+                best[trial["model"]] = trial
+        return best
+
+    def refit(self, candidates, best, X, y):
+        """Fit each model's best configuration on all of ``X`` in parallel; returns ``{name: model}``."""
+        names = list(best)
+        models = self._run([
+            (_fit_final, (candidates[name][0], best[name]["params"], X, np.asarray(y))) for name in names
+        ])
+        return dict(zip(names, models))
+
+
+def log_trials(trials, metric_name):
+    """Log each trial as a nested MLflow run under the active run."""
+    import mlflow
+
+    for trial in trials:
+        with mlflow.start_run(run_name=f"{trial['model']}-trial-{trial['trial']}", nested=True):
+            mlflow.log_param("model_type", trial["model"])
+            mlflow.log_params(trial["params"])
+            for result in trial["rounds"]:
+                mlflow.log_metric(f"validation_{metric_name}", result["score"], step=result["rows"])
+                mlflow.log_metric("fit_seconds", result["fit_seconds"], step=result["rows"])
+            mlflow.log_metric("reached_round", trial["reached_round"])
@@ -0,0 +1,443 @@
+"""Lazy, declarative transformations of a partition, run as one fused scan.
+
+A ``Plan`` records steps over a partition file (or a DataFrame) without
+reading anything:
+
+* ``select``/``drop``: the columns to keep,
+* ``derive``: a column computed from an expression over the others,
+* ``filter``: the rows to keep, as a boolean expression,
+* ``distinct``: drop duplicate rows, keeping first occurrences.
+
+``optimize`` folds the steps into a single scan. Every output column
+becomes an Arrow compute expression over the source columns, the filters
+become one predicate, and only the source columns these reference are
+read: columns a plan drops are never decoded (Parquet, Feather) or
+converted (CSV), and Parquet row groups the predicate rules out are
+skipped. The scan runs on Arrow's thread pool and yields record batches in
+file order. ``sink`` streams them into a ``PartitionWriter``, deduplicated
+with ``common.dedup.StreamingDeduplicator`` and cast to the registered
+schema (common/schema.py), so memory is bounded by one batch plus the
+duplicate fingerprints whatever the partition size.
+
+Expressions use Python syntax with column names in backticks, as in
+``DataFrame.query``::
+
+    `Total Charges` / `Tenure in Months`
+    if_else(`Tenure in Months` < 12, 1, 0)
+    `Monthly Charge` > 0 and not is_null(`Contract`)
+
+``/`` is float division and dividing by zero gives a missing value. The
+other operators are ``+ - *``, comparisons, ``and``/``or``/``not``, and the
+functions are those in ``FUNCTIONS``.
+
+The rules the stages run are kept in a JSON config
+(``TRANSFORMATION_RULES_PATH``, default
+``customer_churn_pipeline/config/transformations.json``)::
+
+    {
+      "preparation": {"filters": ["..."], "distinct": true},
+      "transformation": {
+        "drop": ["Customer Status", "CLTV", ...],
+        "derive": [{"name": "...", "expression": "...", "description": "..."}]
+      }
+    }
+
+``preparation_plan`` (stage 05) and ``transformation_plan`` (stage 06)
+build the plans from it, so a new derived feature is a config change.
+"""
+import ast
+import json
+import logging
+import os
+import re
+import time
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from common.dedup import StreamingDeduplicator
+from common.instrumentation import record_io
+from common.schema import infer_schema
+from common.storage import PartitionWriter, file_format, open_dataset, read_columns
+
+logger = logging.getLogger(__name__)
+
+BATCH_ROWS = 65_536
+# Position of each row of a DataFrame source, to give the result its index back
+ROW_NUMBER = "__row_number__"
+DISTINCT_PREFIX = "__distinct__"
+RULE_KEYS = {"preparation": {"filters", "distinct"}, "transformation": {"drop", "derive"}}
+
+
+# === Expressions ===
+
+def _float(expr):
+    return expr.cast(pa.float64())
+
+
+def _divide(left, right):
+    # A zero divisor gives a missing value rather than inf, which the imputers would not fill
+    return pc.if_else(pc.equal(right, 0), pc.scalar(pa.scalar(None, pa.float64())),
+                      pc.divide(_float(left), _float(right)))
+
+
+FUNCTIONS = {
+    "if_else": pc.if_else,
+    "is_null": lambda x: x.is_null(),
+    "fill_null": pc.coalesce,
+    "coalesce": pc.coalesce,
+    "abs": pc.abs,
+    "sqrt": lambda x: pc.sqrt(_float(x)),
+    "log1p": lambda x: pc.log1p(_float(x)),
+    "minimum": pc.min_element_wise,
+    "maximum": pc.max_element_wise,
+    # The second argument of these is a literal: digits, and a list of values
+    "round": lambda x, ndigits=0: pc.round(x, ndigits=ndigits),
+    "isin": lambda x, values: x.isin(values),
+}
+LITERAL_ARGUMENTS = {"round", "isin"}
+
+BINARY = {ast.Add: pc.add, ast.Sub: pc.subtract, ast.Mult: pc.multiply, ast.Div: _divide}
+COMPARE = {ast.Eq: pc.equal, ast.NotEq: pc.not_equal, ast.Lt: pc.less, ast.LtE: pc.less_equal,
+           ast.Gt: pc.greater, ast.GtE: pc.greater_equal}
+
+
+def compile_expression(text, columns):
+    """``(Arrow expression, source columns it reads)`` of expression ``text``.
+
+    ``columns`` maps every column visible at that step to its own
+    ``(expression, source columns)``, so an expression over derived columns
+    is expanded into one over the source columns.
+    """
+    names = {}
+
+    def placeholder(match):
+        names[f"_col{len(names)}"] = match.group(1)
+        return f"_col{len(names) - 1}"
+
+    try:
+        tree = ast.parse(re.sub(r"`([^`]+)`", placeholder, text).strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Invalid expression {text!r}: {e.msg}") from None
+    reads = set()
+
+    def visit(node):
+        if isinstance(node, ast.Name):
+            col = names.get(node.id, node.id)
+            if col not in columns:
+                raise ValueError(f"Unknown column {col!r} in expression {text!r}")
+            expr, sources = columns[col]
+            reads.update(sources)
+            return expr
+        if isinstance(node, ast.Constant):
+            return pc.scalar(node.value)
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY:
+            return BINARY[type(node.op)](visit(node.left), visit(node.right))
+        if isinstance(node, ast.UnaryOp):
+            if isinstance(node.op, ast.USub):
+                return pc.negate(visit(node.operand))
+            if isinstance(node.op, ast.Not):
+                return pc.invert(visit(node.operand))
+        if isinstance(node, ast.BoolOp):
+            combine = pc.and_kleene if isinstance(node.op, ast.And) else pc.or_kleene
+            return reduce(combine, [visit(value) for value in node.values])
+        if isinstance(node, ast.Compare) and all(type(op) in COMPARE for op in node.ops):
+            operands = [visit(node.left)] + [visit(value) for value in node.comparators]
+            return reduce(pc.and_kleene, [COMPARE[type(op)](left, right)
+                                          for op, left, right in zip(node.ops, operands, operands[1:])])
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS:
+            if node.keywords:
+                raise ValueError(f"Keyword arguments are not supported in expression {text!r}")
+            if node.func.id in LITERAL_ARGUMENTS:
+                args = [visit(arg) for arg in node.args[:1]] + [ast.literal_eval(arg) for arg in node.args[1:]]
+            else:
+                args = [visit(arg) for arg in node.args]
+            return FUNCTIONS[node.func.id](*args)
+        raise ValueError(f"Unsupported {type(node).__name__} in expression {text!r}")
+
+    return visit(tree.body), reads
+
+
+def _dictionary_encode(table, columns):
+    """String ``columns`` of ``table`` as Arrow dictionaries, so pandas gets categoricals without a per-value pass."""
+    for col in columns:
+        i = table.schema.get_field_index(col)
+        if i >= 0 and pa.types.is_string(table.schema.field(i).type):
+            table = table.set_column(i, col, pc.dictionary_encode(table.column(i)))
+    return table
+
+
+# === Plan ===
+
+class Plan:
+    """Lazy steps over a partition file or a DataFrame; nothing runs until the plan is consumed."""
+
+    def __init__(self, source, steps=()):
+        self.source = source
+        self.steps = tuple(steps)
+
+    def _then(self, *step):
+        return Plan(self.source, self.steps + (step,))
+
+    def on(self, source):
+        """The same steps over another source."""
+        return Plan(source, self.steps)
+
+    def select(self, columns):
+        return self._then("select", tuple(columns))
+
+    def drop(self, columns, errors="raise"):
+        """Drop ``columns``; with ``errors="ignore"`` columns the source lacks are skipped, as in pandas."""
+        return self._then("drop", tuple(columns), errors)
+
+    def derive(self, name, expression):
+        return self._then("derive", name, expression)
+
+    def filter(self, expression):
+        return self._then("filter", expression)
+
+    def distinct(self):
+        return self._then("distinct")
+
+    @property
+    def _frame_source(self):
+        return isinstance(self.source, pd.DataFrame)
+
+    def source_columns(self):
+        return list(self.source.columns) if self._frame_source else read_columns(self.source)
+
+    def optimize(self):
+        """The scan the steps fold into.
+
+        Returns a dict with the source columns to ``read``, the scan
+        ``projection`` (output columns, and the distinct key where it is not
+        an output, as expressions), the ``filter`` predicate (or None), the
+        ``distinct`` key columns (or None), the ``output`` and ``derived``
+        columns, and the ``pruned`` source columns that are never read.
+        """
+        source = self.source_columns()
+        columns = {col: (pc.field(col), {col}) for col in source}
+        derived, filters, distinct = [], [], None
+        for kind, *args in self.steps:
+            if kind in ("select", "drop"):
+                names, errors = args[0], args[1] if kind == "drop" else "raise"
+                missing = [col for col in names if col not in columns]
+                if missing and errors == "raise":
+                    raise KeyError(f"Columns not in the plan: {missing}")
+                keep = names if kind == "select" else [col for col in columns if col not in names]
+                columns = {col: columns[col] for col in keep}
+            elif kind == "derive":
+                name, expression = args
+                columns[name] = compile_expression(expression, columns)
+                derived.append(name)
+            elif kind == "filter":
+                filters.append(compile_expression(args[0], columns))
+            elif distinct is not None:
+                raise ValueError("A plan can only have one distinct step")
+            else:
+                # Deduplicate on the columns of this step; later filters only see
+                # these (or values derived from them), so they commute with it
+                distinct = dict(columns)
+
+        projection = {col: expr for col, (expr, _) in columns.items()}
+        distinct_key = None
+        if distinct is not None:
+            distinct_key = []
+            for col, (expr, _) in distinct.items():
+                if col in projection and projection[col].equals(expr):
+                    distinct_key.append(col)
+                else:
+                    projection[DISTINCT_PREFIX + col] = expr
+                    distinct_key.append(DISTINCT_PREFIX + col)
+        if self._frame_source:
+            projection[ROW_NUMBER] = pc.field(ROW_NUMBER)
+
+        reads = set()
+        for _, sources in list(columns.values()) + filters + list((distinct or {}).values()):
+            reads.update(sources)
+        return {
+            "read": [col for col in source if col in reads],
+            "projection": projection,
+            "filter": reduce(pc.and_kleene, [expr for expr, _ in filters]) if filters else None,
+            "distinct": distinct_key,
+            "output": list(columns),
+            "derived": [col for col in derived if col in columns],
+            "pruned": [col for col in source if col not in reads],
+        }
+
+    def explain(self):
+        """Readable summary of the optimized scan, for the logs."""
+        plan = self.optimize()
+        source = "DataFrame" if self._frame_source else f"{file_format(self.source)} {self.source}"
+        lines = [f"Scan {source}: {len(plan['read'])} of {len(plan['read']) + len(plan['pruned'])} columns read"]
+        if plan["pruned"]:
+            lines.append(f"  pruned: {', '.join(plan['pruned'])}")
+        for kind, *args in self.steps:
+            if kind == "filter":
+                lines.append(f"  filter: {args[0]}")
+            elif kind == "derive" and args[0] in plan["derived"]:
+                lines.append(f"  derive {args[0]} = {args[1]}")
+        if plan["distinct"] is not None:
+            lines.append(f"  distinct on {len(plan['distinct'])} columns")
+        lines.append(f"  output: {len(plan['output'])} columns")
+        return "\n".join(lines)
+
+    # === Execution ===
+
+    def _dataset(self, read, schema):
+        if self._frame_source:
+            table = pa.Table.from_pandas(self.source[read], preserve_index=False)
+            return ds.dataset(table.append_column(ROW_NUMBER, pa.array(np.arange(len(table)))))
+        return open_dataset(self.source, schema.arrow_csv_types(read) if schema is not None else None)
+
+    def _tables(self, scanner, batch_rows):
+        """The scanned batches as tables of about ``batch_rows`` rows, timing the scan as I/O.
+
+        CSV scans yield a batch per block (a few thousand rows); converting
+        and validating them one by one would cost more than the scan.
+        """
+        batches = scanner.to_batches()
+        pending, rows, seconds = [], 0, 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                batch = next(batches, None)
+                seconds += time.perf_counter() - start
+                if batch is not None and batch.num_rows:
+                    pending.append(batch)
+                    rows += batch.num_rows
+                if pending and (batch is None or rows >= batch_rows):
+                    yield pa.Table.from_batches(pending)
+                    pending, rows = [], 0
+                if batch is None:
+                    return
+        finally:
+            if not self._frame_source:
+                record_io("read", os.path.getsize(self.source), seconds)
+
+    def _frames(self, stats, batch_rows=None, schema=None, dedup_memory_mb=256, spill_dir=None):
+        plan = self.optimize()
+        batch_rows = batch_rows or BATCH_ROWS
+        scanner = self._dataset(plan["read"], schema).scanner(
+            columns=plan["projection"], filter=plan["filter"], batch_size=batch_rows, use_threads=True
+        )
+        # Derived and helper columns are not in the schema; the source columns are cast to it
+        cast_columns = [col for col in plan["projection"]
+                        if col not in plan["derived"] and col != ROW_NUMBER and not col.startswith(DISTINCT_PREFIX)]
+        enums = [col for col in cast_columns if schema is not None and schema.columns.get(col, {}).get("kind") == "enum"]
+        dedup = StreamingDeduplicator(dedup_memory_mb, spill_dir) if plan["distinct"] is not None else None
+        stats.update(rows_scanned=0, duplicates=0)
+        empty = True
+        try:
+            for table in self._tables(scanner, batch_rows):
+                frame = _dictionary_encode(table, enums).to_pandas()
+                stats["rows_scanned"] += len(frame)
+                if schema is not None and cast_columns:
+                    cast = schema.apply(frame[cast_columns])
+                    frame = pd.concat([cast, frame.drop(columns=cast_columns)], axis=1)
+                if dedup is not None:
+                    frame = frame.loc[dedup.filter(frame[plan["distinct"]]).index]
+                    stats["duplicates"] = dedup.duplicates
+                if self._frame_source:
+                    frame.index = self.source.index[frame[ROW_NUMBER].to_numpy()]
+                else:
+                    frame = frame.reset_index(drop=True)
+                empty = False
+                yield frame[plan["output"]]
+            if empty:
+                yield scanner.projected_schema.empty_table().to_pandas()[plan["output"]]
+        finally:
+            if dedup is not None:
+                dedup.close()
+
+    def iter_frames(self, batch_rows=None, schema=None, dedup_memory_mb=256, spill_dir=None):
+        """Yield the result as DataFrames of at most ``batch_rows`` rows, cast to ``schema`` if given."""
+        yield from self._frames({}, batch_rows, schema, dedup_memory_mb, spill_dir)
+
+    def collect(self, batch_rows=None, schema=None, dedup_memory_mb=256, spill_dir=None):
+        """The whole result as one DataFrame; a DataFrame source keeps its index."""
+        frames = list(self._frames({}, batch_rows, schema, dedup_memory_mb, spill_dir))
+        return pd.concat(frames, ignore_index=not self._frame_source) if len(frames) > 1 else frames[0]
+
+    def sink(self, folder, name, batch_rows=None, schema=None, descriptions=None, dedup_memory_mb=256,
+             spill_dir=None, fmt=None, on_frame=None, exclude=()):
+        """Stream the result into dataset ``name`` of ``folder``.
+
+        Returns a dict with the written ``path``, its ``rows``, the
+        ``rows_scanned`` after filtering and the ``duplicates`` removed.
+        With a ``schema``, ``schema`` is that schema widened to cover the
+        derived columns (described by ``descriptions``), to register.
+        ``on_frame`` is called with every result frame in the same pass;
+        columns in ``exclude`` reach it but are not written.
+        """
+        derived = [col for col in self.optimize()["derived"] if col not in exclude]
+        writer = PartitionWriter(folder, name, fmt=fmt)
+        stats, widened = {}, schema
+        try:
+            for frame in self._frames(stats, batch_rows, schema, dedup_memory_mb, spill_dir):
+                if widened is not None and derived:
+                    widened = infer_schema(frame[derived], name=schema.name, descriptions=descriptions or {},
+                                           previous=widened)
+                if on_frame is not None:
+                    on_frame(frame)
+                writer.write(frame.drop(columns=list(exclude)) if exclude else frame)
+            path = writer.close()
+        except Exception:
+            writer.abort()
+            raise
+        return {"path": path, "rows": writer.rows, **stats, "schema": widened}
+
+
+# === Rules ===
+
+def default_rules_path():
+    scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.getenv("TRANSFORMATION_RULES_PATH") or os.path.join(
+        os.path.dirname(scripts_dir), "config", "transformations.json"
+    )
+
+
+def load_rules(path=None):
+    """The preparation and transformation rules of the JSON config at ``path``."""
+    path = path or default_rules_path()
+    with open(path, "r", encoding="utf-8") as f:
+        rules = json.load(f)
+    for section, body in rules.items():
+        if section not in RULE_KEYS:
+            raise ValueError(f"Unknown section {section!r} in {path}")
+        unknown = set(body) - RULE_KEYS[section]
+        if unknown:
+            raise ValueError(f"Unknown keys {sorted(unknown)} in section {section!r} of {path}")
+    for rule in rules.get("transformation", {}).get("derive", []):
+        if not {"name", "expression"} <= set(rule):
+            raise ValueError(f"Derived feature rules need a name and an expression: {rule}")
+    return rules
+
+
+def preparation_plan(source, rules):
+    """Stage 05: the cleaning filters, then duplicate removal."""
+    section = rules.get("preparation", {})
+    plan = Plan(source)
+    for expression in section.get("filters", []):
+        plan = plan.filter(expression)
+    return plan.distinct() if section.get("distinct", True) else plan
+
+
+def transformation_plan(source, rules, keep=()):
+    """Stage 06: the leakage columns dropped (so never read), then the derived features.
+
+    Columns in ``keep`` are not dropped, e.g. the key the warehouse merges on.
+    """
+    section = rules.get("transformation", {})
+    plan = Plan(source).drop([col for col in section.get("drop", []) if col not in keep], errors="ignore")
+    for rule in section.get("derive", []):
+        plan = plan.derive(rule["name"], rule["expression"])
+    return plan
+
+
+def derived_descriptions(rules):
+    return {rule["name"]: rule.get("description", "") for rule in rules.get("transformation", {}).get("derive", [])}
@@ -0,0 +1,510 @@
+"""Warehouse backends and pooled connections for the pipeline stages.
+
+A backend wraps one warehouse (Snowflake, or a local SQLite file standing in
+for it) behind the handful of operations the bulk loader and the extractor
+need: creating the target and a staging table, staging Parquet chunk files,
+merging the staged rows into the target on a key, and streaming a query
+result back in batches. ``WAREHOUSE_BACKEND`` picks the
+backend (``snowflake`` by default, ``sqlite`` for local runs with the file
+at ``WAREHOUSE_SQLITE_PATH``).
+
+Connections are handed out by a ``ConnectionPool`` so parallel workers
+reuse a fixed set of sessions instead of opening one per upload.
+``get_client()`` returns one ``WarehouseClient`` per process, so stages run
+in the same process share the pool (and the login cost) instead of each
+connecting on its own. The client also caches query results keyed on the
+SQL text and the version of the tables the query reads.
+"""
+import logging
+import os
+import queue
+import sqlite3
+import atexit
+import hashlib
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+
+def quote_identifier(name):
+    """Quote a table or column name (tables were created with quoted, case-sensitive names)."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def fetchmany_batches(cur, batch_rows):
+    """Yield the rows of an executed cursor as DataFrames of up to ``batch_rows`` rows."""
+    columns = [col[0] for col in cur.description]
+    while True:
+        rows = cur.fetchmany(batch_rows)
+        if not rows:
+            break
+        yield pd.DataFrame.from_records(rows, columns=columns)
+
+
+def _bucket_hash(value):
+    return 0 if value is None else zlib.crc32(str(value).encode("utf-8"))
+
+
+class ConnectionPool:
+    """Fixed-size pool of connections created on demand by ``backend.connect``.
+
+    A connection that sat idle for more than ``health_check_after`` seconds
+    is pinged before it is handed out again and replaced if it is dead, so a
+    long-lived pool survives dropped sessions.
+    """
+
+    def __init__(self, backend, size=4, health_check_after=60):
+        self.backend = backend
+        self.size = size
+        self.health_check_after = health_check_after
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _checked(self, conn, idle_since):
+        if time.monotonic() - idle_since < self.health_check_after or self.backend.ping(conn):
+            return conn
+        logger.info("Replacing a dead %s connection", self.backend.name)
+        self._discard(conn)
+        return None
+
+    def _acquire(self):
+        while True:
+            try:
+                conn = self._checked(*self._idle.get_nowait())
+            except queue.Empty:
+                break
+            if conn is not None:
+                return conn
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if not create:
+            conn = self._checked(*self._idle.get())
+            return conn if conn is not None else self._acquire()
+        try:
+            return self.backend.connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except BaseException:
+            # The session may be in an unknown state (failed or abandoned mid-result), do not hand it out again
+            self._discard(conn)
+            raise
+        else:
+            self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SnowflakeBackend:
+    """Stages chunks with PUT into a named internal stage and loads them with one COPY."""
+
+    name = "snowflake"
+    stage = "customer_churn_load_stage"
+    placeholder = "%s"
+    sql_types = {"i": "NUMBER(38,0)", "u": "NUMBER(38,0)", "f": "FLOAT", "b": "BOOLEAN", "M": "TIMESTAMP_NTZ"}
+
+    def __init__(self, **config):
+        self.config = config or {
+            "user": os.getenv("user"),
+            "password": os.getenv("password"),
+            "account": os.getenv("account"),
+            "warehouse": os.getenv("warehouse"),
+            "database": os.getenv("database"),
+            "schema": os.getenv("schema"),
+            # Pooled sessions can sit idle between stages
+            "client_session_keep_alive": True,
+        }
+
+    def connect(self):
+        import snowflake.connector
+        return snowflake.connector.connect(**self.config)
+
+    def ping(self, conn):
+        try:
+            if conn.is_closed():
+                return False
+            conn.cursor().execute("SELECT 1").fetchone()
+            return True
+        except Exception:
+            return False
+
+    def table_version(self, conn, table):
+        """Last DDL/DML time of ``table``, which changes whenever its contents do."""
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT LAST_ALTERED FROM INFORMATION_SCHEMA.TABLES "
+            "WHERE TABLE_SCHEMA = CURRENT_SCHEMA() AND TABLE_NAME = %s",
+            (table,)
+        )
+        row = cur.fetchone()
+        return str(row[0]) if row else None
+
+    def sql_type(self, dtype):
+        return self.sql_types.get(dtype.kind, "VARCHAR")
+
+    def table_columns(self, conn, table):
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SHOW COLUMNS IN TABLE {quote_identifier(table)}")
+        except Exception:
+            return None
+        names = [col[0] for col in cur.description]
+        return [row[names.index("column_name")] for row in cur.fetchall()]
+
+    def execute(self, conn, sql, params=()):
+        cur = conn.cursor()
+        cur.execute(sql, params or None)
+        return cur
+
+    def create_table(self, conn, table, columns):
+        cols = ", ".join(f"{quote_identifier(name)} {sql_type}" for name, sql_type in columns)
+        self.execute(conn, f"CREATE TABLE IF NOT EXISTS {quote_identifier(table)} ({cols})")
+
+    def add_columns(self, conn, table, columns):
+        for name, sql_type in columns:
+            self.execute(conn, f"ALTER TABLE {quote_identifier(table)} ADD COLUMN {quote_identifier(name)} {sql_type}")
+
+    def create_staging(self, conn, table, staging_table, columns=None):
+        """Staging table shaped like ``table``, or with ``columns`` (``[(name, sql type)]``) when given."""
+        self.execute(conn, f"CREATE STAGE IF NOT EXISTS {quote_identifier(self.stage)}")
+        if columns is not None:
+            cols = ", ".join(f"{quote_identifier(name)} {sql_type}" for name, sql_type in columns)
+            self.execute(conn, f"CREATE OR REPLACE TRANSIENT TABLE {quote_identifier(staging_table)} ({cols})")
+            return
+        self.execute(
+            conn, f"CREATE OR REPLACE TRANSIENT TABLE {quote_identifier(staging_table)} LIKE {quote_identifier(table)}"
+        )
+
+    def stage_chunk(self, conn, path, staging_table, load_id):
+        location = f"@{quote_identifier(self.stage)}/{load_id}"
+        file_url = "file://" + os.path.abspath(path).replace("\\", "/")
+        self.execute(conn, f"PUT '{file_url}' '{location}' PARALLEL=4 AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
+
+    def finish_staging(self, conn, staging_table, load_id):
+        location = f"@{quote_identifier(self.stage)}/{load_id}/"
+        self.execute(
+            conn,
+            f"COPY INTO {quote_identifier(staging_table)} FROM '{location}' "
+            "FILE_FORMAT=(TYPE=PARQUET) MATCH_BY_COLUMN_NAME=CASE_SENSITIVE PURGE=TRUE"
+        )
+
+    def merge(self, conn, table, staging_table, key, columns):
+        target, source = quote_identifier(table), quote_identifier(staging_table)
+        on = f"t.{quote_identifier(key)} = s.{quote_identifier(key)}"
+        updates = ", ".join(f"t.{quote_identifier(c)} = s.{quote_identifier(c)}" for c in columns if c != key)
+        names = ", ".join(quote_identifier(c) for c in columns)
+        values = ", ".join(f"s.{quote_identifier(c)}" for c in columns)
+        cur = self.execute(
+            conn,
+            f"MERGE INTO {target} t USING {source} s ON {on} "
+            f"WHEN MATCHED THEN UPDATE SET {updates} "
+            f"WHEN NOT MATCHED THEN INSERT ({names}) VALUES ({values})"
+        )
+        inserted, updated = cur.fetchone()[:2]
+        return {"inserted": int(inserted), "updated": int(updated)}
+
+    def replace(self, conn, table, staging_table, columns):
+        """Replace every row of ``table`` (and its columns) with the staged rows, in one statement."""
+        target, source = quote_identifier(table), quote_identifier(staging_table)
+        names = ", ".join(quote_identifier(c) for c in columns)
+        replaced = self.execute(conn, f"SELECT COUNT(*) FROM {target}").fetchone()[0]
+        self.execute(conn, f"CREATE OR REPLACE TABLE {target} AS SELECT {names} FROM {source}")
+        staged = self.execute(conn, f"SELECT COUNT(*) FROM {target}").fetchone()[0]
+        return {"inserted": int(staged), "updated": 0, "replaced": int(replaced)}
+
+    def drop_staging(self, conn, staging_table, load_id):
+        self.execute(conn, f"DROP TABLE IF EXISTS {quote_identifier(staging_table)}")
+        self.execute(conn, f"REMOVE @{quote_identifier(self.stage)}/{load_id}/")
+
+    def hash_bucket(self, column_sql, buckets):
+        return f"MOD(ABS(HASH({column_sql})), {int(buckets)})"
+
+    def iter_batches(self, conn, sql, params=(), batch_rows=50000):
+        """Result batches as DataFrames, fetched as Arrow when the connector supports it."""
+        cur = conn.cursor()
+        cur.execute(sql, params or None)
+        try:
+            batches = cur.fetch_arrow_batches()
+        except Exception as e:
+            # Older connectors, or result sets Snowflake returns as JSON
+            logger.info("Arrow fetch unavailable (%s), falling back to fetchmany", e)
+            yield from fetchmany_batches(cur, batch_rows)
+            return
+        for table in batches:
+            yield table.to_pandas()
+
+
+class SQLiteBackend:
+    """Local stand-in: staging inserts each chunk's rows, MERGE becomes an upsert."""
+
+    name = "sqlite"
+    placeholder = "?"
+    sql_types = {"i": "INTEGER", "u": "INTEGER", "f": "REAL", "b": "INTEGER"}
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("WAREHOUSE_SQLITE_PATH", "warehouse.db")
+
+    def connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Rollback journal rather than WAL keeps the header change counter (see table_version) current
+        conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        # Stands in for Snowflake's HASH() when extracting hash-partitioned slices
+        conn.create_function("bucket_hash", 1, _bucket_hash, deterministic=True)
+        return conn
+
+    def ping(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def table_version(self, conn, table):
+        """SQLite keeps no per-table change time; use the database's file change counter.
+
+        The counter in the file header is bumped by every committed write, so
+        this version is per database rather than per table.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(24)
+            return str(int.from_bytes(f.read(4), "big"))
+
+    def sql_type(self, dtype):
+        return self.sql_types.get(dtype.kind, "TEXT")
+
+    def table_columns(self, conn, table):
+        rows = conn.execute(f"PRAGMA table_info({quote_identifier(table)})").fetchall()
+        return [row[1] for row in rows] or None
+
+    def execute(self, conn, sql, params=()):
+        with conn:
+            return conn.execute(sql, params)
+
+    def create_table(self, conn, table, columns):
+        cols = ", ".join(f"{quote_identifier(name)} {sql_type}" for name, sql_type in columns)
+        self.execute(conn, f"CREATE TABLE IF NOT EXISTS {quote_identifier(table)} ({cols})")
+
+    def add_columns(self, conn, table, columns):
+        for name, sql_type in columns:
+            self.execute(conn, f"ALTER TABLE {quote_identifier(table)} ADD COLUMN {quote_identifier(name)} {sql_type}")
+
+    def create_staging(self, conn, table, staging_table, columns=None):
+        """Staging table shaped like ``table``, or with ``columns`` (``[(name, sql type)]``) when given."""
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(staging_table)}")
+            if columns is not None:
+                cols = ", ".join(f"{quote_identifier(name)} {sql_type}" for name, sql_type in columns)
+                conn.execute(f"CREATE TABLE {quote_identifier(staging_table)} ({cols})")
+            else:
+                conn.execute(f"CREATE TABLE {quote_identifier(staging_table)} AS SELECT * FROM {quote_identifier(table)} WHERE 0")
+
+    def stage_chunk(self, conn, path, staging_table, load_id):
+        df = pq.read_table(path).to_pandas()
+        names = ", ".join(quote_identifier(c) for c in df.columns)
+        params = ", ".join("?" for _ in df.columns)
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        with conn:
+            conn.executemany(f"INSERT INTO {quote_identifier(staging_table)} ({names}) VALUES ({params})", rows)
+
+    def finish_staging(self, conn, staging_table, load_id):
+        pass
+
+    def merge(self, conn, table, staging_table, key, columns):
+        target, source, key_col = quote_identifier(table), quote_identifier(staging_table), quote_identifier(key)
+        names = ", ".join(quote_identifier(c) for c in columns)
+        updates = ", ".join(f"{quote_identifier(c)} = excluded.{quote_identifier(c)}" for c in columns if c != key)
+        with conn:
+            # ON CONFLICT needs a unique index on the merge key
+            conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {quote_identifier(table + '__key')} ON {target} ({key_col})")
+            inserted = conn.execute(
+                f"SELECT COUNT(*) FROM {source} s WHERE NOT EXISTS "
+                f"(SELECT 1 FROM {target} t WHERE t.{key_col} = s.{key_col})"
+            ).fetchone()[0]
+            staged = conn.execute(f"SELECT COUNT(*) FROM {source}").fetchone()[0]
+            # "WHERE true" keeps the parser from reading ON CONFLICT as a join constraint
+            conn.execute(
+                f"INSERT INTO {target} ({names}) SELECT {names} FROM {source} WHERE true "
+                f"ON CONFLICT ({key_col}) DO UPDATE SET {updates}"
+            )
+        return {"inserted": int(inserted), "updated": int(staged - inserted)}
+
+    def replace(self, conn, table, staging_table, columns):
+        """Replace ``table`` with the staging table, in one transaction."""
+        target, source = quote_identifier(table), quote_identifier(staging_table)
+        with conn:
+            # sqlite3 does not open a transaction for DDL by itself
+            conn.execute("BEGIN")
+            replaced = conn.execute(f"SELECT COUNT(*) FROM {target}").fetchone()[0]
+            staged = conn.execute(f"SELECT COUNT(*) FROM {source}").fetchone()[0]
+            conn.execute(f"DROP TABLE {target}")
+            conn.execute(f"ALTER TABLE {source} RENAME TO {target}")
+        return {"inserted": int(staged), "updated": 0, "replaced": int(replaced)}
+
+    def drop_staging(self, conn, staging_table, load_id):
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(staging_table)}")
+
+    def hash_bucket(self, column_sql, buckets):
+        return f"(bucket_hash({column_sql}) % {int(buckets)})"
+
+    def iter_batches(self, conn, sql, params=(), batch_rows=50000):
+        cur = conn.execute(sql, params)
+        yield from fetchmany_batches(cur, batch_rows)
+
+
+BACKENDS = {
+    SnowflakeBackend.name: SnowflakeBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+
+def get_backend(name=None, **kwargs):
+    name = (name or os.getenv("WAREHOUSE_BACKEND", SnowflakeBackend.name)).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown warehouse backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
+
+
+def frame_columns(backend, df):
+    """``[(name, sql type)]`` for the columns of ``df`` in the backend's dialect."""
+    return [(name, backend.sql_type(dtype)) for name, dtype in df.dtypes.items()]
+
+
+class WarehouseClient:
+    """Pooled access to one warehouse with a result cache for read queries.
+
+    ``query(sql, tables=[...])`` serves repeated reads from the cache for as
+    long as the listed tables keep the same version. Results are kept in
+    memory (the ``cache_entries`` most recent) and, when ``cache_dir`` is
+    set, as Parquet files so separate stage processes share them too.
+    """
+
+    def __init__(self, backend=None, pool_size=None, cache_entries=None, cache_dir=None):
+        self.backend = backend or get_backend()
+        pool_size = pool_size or int(os.getenv("WAREHOUSE_POOL_SIZE", 4))
+        self.pool = ConnectionPool(self.backend, size=pool_size)
+        self.cache_entries = cache_entries if cache_entries is not None else int(os.getenv("WAREHOUSE_CACHE_ENTRIES", 16))
+        self.cache_dir = cache_dir or os.getenv("WAREHOUSE_CACHE_DIR")
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def connection(self):
+        return self.pool.connection()
+
+    def execute(self, sql, params=()):
+        """Run a statement on a pooled connection (results are not cached)."""
+        with self.pool.connection() as conn:
+            return self.backend.execute(conn, sql, params)
+
+    def _cache_key(self, conn, sql, params, tables):
+        versions = {table: self.backend.table_version(conn, table) for table in tables}
+        if any(version is None for version in versions.values()):
+            return None
+        payload = json.dumps([self.backend.name, sql, list(params), versions], default=str, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _cached(self, key):
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, key + ".parquet")
+            if os.path.exists(path):
+                return pd.read_parquet(path)
+        return None
+
+    def _store(self, key, df):
+        with self._cache_lock:
+            self._cache[key] = df
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = os.path.join(self.cache_dir, key + ".parquet")
+            tmp_path = path + ".tmp"
+            try:
+                df.to_parquet(tmp_path, index=False)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                # Caching is best effort, e.g. mixed-type object columns
+                logger.warning("Could not cache query result on disk: %s", e)
+
+    def query(self, sql, params=(), tables=None):
+        """Run a read query and return a DataFrame, cached when ``tables`` are given."""
+        with self.pool.connection() as conn:
+            key = self._cache_key(conn, sql, params, tables) if tables and self.cache_entries else None
+            if key is not None:
+                cached = self._cached(key)
+                if cached is not None:
+                    self.hits += 1
+                    logger.info("Query served from cache (%s)", ", ".join(tables))
+                    return cached.copy()
+                self.misses += 1
+            batches = list(self.backend.iter_batches(conn, sql, params))
+        df = pd.concat(batches, ignore_index=True) if batches else pd.DataFrame()
+        if key is not None:
+            self._store(key, df)
+            df = df.copy()
+        return df
+
+    def close(self):
+        self.pool.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide client for the configured backend."""
+    name = os.getenv("WAREHOUSE_BACKEND", SnowflakeBackend.name).lower()
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = WarehouseClient(get_backend(name))
+            atexit.register(_clients[name].close)
+        return _clients[name]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import the pipeline's modules the way the stage scripts do
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
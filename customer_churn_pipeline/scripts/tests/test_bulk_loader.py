@@ -0,0 +1,129 @@
+"""Bulk loads must upsert on the key, stream frame by frame, and replace a target whose rows have no key."""
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from common.bulk_loader import BulkLoader
+from common.warehouse import SQLiteBackend
+
+KEY = "Customer ID"
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    path = str(tmp_path / "warehouse.db")
+    with BulkLoader(SQLiteBackend(path), chunk_rows=2, max_workers=2, tmp_dir=str(tmp_path)) as loader:
+        yield path, loader
+
+
+def rows(path, table="t"):
+    with sqlite3.connect(path) as conn:
+        return pd.read_sql(f'SELECT * FROM "{table}"', conn)
+
+
+def customers(ids, charge=1.0):
+    return pd.DataFrame({KEY: [f"C{i}" for i in ids], "Monthly Charge": [charge] * len(ids)})
+
+
+@pytest.mark.parametrize("keyless", ["no key column", "null keys"])
+def test_target_without_keys_is_replaced_once(warehouse, keyless):
+    path, loader = warehouse
+    old = customers([1, 2, 3])
+    if keyless == "no key column":
+        old = old.drop(columns=[KEY])
+    else:
+        old[KEY] = None
+    with sqlite3.connect(path) as conn:
+        old.to_sql("t", conn, index=False)
+
+    summary = loader.load(customers([1, 2, 3], charge=2.0), "t", KEY)
+    assert (summary["inserted"], summary["replaced"]) == (3, 3)
+    table = rows(path)
+    assert len(table) == 3 and table[KEY].notna().all() and (table["Monthly Charge"] == 2.0).all()
+
+    # Once keyed, later loads merge
+    summary = loader.load(customers([3, 4], charge=3.0), "t", KEY)
+    assert (summary["inserted"], summary["updated"]) == (1, 1)
+    assert sorted(rows(path)[KEY]) == ["C1", "C2", "C3", "C4"]
+
+
+def test_upsert_inserts_new_keys_and_updates_existing(warehouse):
+    path, loader = warehouse
+    first = loader.load(customers(range(5)), "t", KEY)
+    assert (first["inserted"], first["updated"], first["chunks"]) == (5, 0, 3)
+
+    second = loader.load(customers(range(3, 8), charge=2.0), "t", KEY)
+    assert (second["inserted"], second["updated"]) == (3, 2)
+    table = rows(path).set_index(KEY)["Monthly Charge"]
+    assert len(table) == 8
+    assert table[["C0", "C1", "C2"]].tolist() == [1.0] * 3 and table[["C3", "C7"]].tolist() == [2.0] * 2
+
+
+def test_repeated_key_keeps_the_last_row(warehouse):
+    path, loader = warehouse
+    frame = pd.concat([customers([1, 2]), customers([1], charge=5.0)], ignore_index=True)
+    assert loader.load(frame, "t", KEY)["rows"] == 2
+    assert rows(path).set_index(KEY).loc["C1", "Monthly Charge"] == 5.0
+
+
+def test_new_columns_are_added(warehouse):
+    path, loader = warehouse
+    loader.load(customers([1]), "t", KEY)
+    loader.load(customers([2]).assign(Tenure=12), "t", KEY)
+    table = rows(path).set_index(KEY)
+    assert pd.isna(table.loc["C1", "Tenure"]) and table.loc["C2", "Tenure"] == 12
+
+
+def test_missing_key_column_is_rejected(warehouse):
+    _, loader = warehouse
+    with pytest.raises(ValueError, match="Merge key"):
+        loader.load(customers([1]).drop(columns=[KEY]), "t", KEY)
+
+
+def staging_tables(path):
+    with sqlite3.connect(path) as conn:
+        return [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '%__stage_%'")]
+
+
+def test_streamed_frames_load_as_one_upsert(warehouse, tmp_path):
+    path, loader = warehouse
+    load = loader.start("t", KEY)
+    load.add(customers(range(3)))
+    # A key staged from an earlier frame keeps its staged row
+    load.add(customers(range(2, 6), charge=2.0))
+    summary = load.finish()
+    assert (summary["rows"], summary["inserted"], summary["updated"]) == (6, 6, 0)
+    table = rows(path).set_index(KEY)["Monthly Charge"]
+    assert table["C2"] == 1.0 and table["C5"] == 2.0
+    # The staging table and the chunk files are removed
+    assert staging_tables(path) == []
+    assert not list(tmp_path.glob("bulk_load_*"))
+
+
+def test_frames_must_share_columns(warehouse):
+    _, loader = warehouse
+    load = loader.start("t", KEY)
+    load.add(customers([1]))
+    with pytest.raises(ValueError, match="Frame columns differ"):
+        load.add(customers([2]).assign(Tenure=12))
+    load.abort()
+
+
+def test_finish_without_frames_is_rejected(warehouse):
+    _, loader = warehouse
+    with pytest.raises(ValueError, match="Nothing was added"):
+        loader.start("t", KEY).finish()
+
+
+def test_abort_leaves_the_target_untouched(warehouse):
+    path, loader = warehouse
+    loader.load(customers([1, 2]), "t", KEY)
+    load = loader.start("t", KEY)
+    load.add(customers(range(1, 6), charge=2.0))
+    load.abort()
+    table = rows(path)
+    assert sorted(table[KEY]) == ["C1", "C2"] and (table["Monthly Charge"] == 1.0).all()
+    assert staging_tables(path) == []
+    # Aborting twice is harmless
+    load.abort()
@@ -0,0 +1,90 @@
+"""The compiled predictor must match the sklearn pipeline bit for bit."""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from common.compiled_predictor import compile_pipeline, parity
+
+MODELS = {
+    "LogisticRegression": lambda: LogisticRegression(max_iter=1000),
+    "SGDLogisticRegression": lambda: SGDClassifier(loss="log_loss", alpha=1e-4, random_state=42),
+    "RandomForest": lambda: RandomForestClassifier(n_estimators=20, random_state=42),
+}
+
+
+NUMERIC = ["Age", "Tenure in Months", "Monthly Charge"]
+CATEGORICAL = ["Contract", "Internet Type"]
+# ColumnTransformer outputs: dense row-major, sparse, and a lone numeric block (column-major)
+LAYOUTS = {"dense": (CATEGORICAL, 0.0), "sparse": (CATEGORICAL, 1.0), "numeric": ([], 0.0)}
+
+
+@pytest.fixture(scope="module")
+def rows():
+    """Churn-like rows with missing values in numeric and categorical features."""
+    rng = np.random.default_rng(42)
+    n_rows = 600
+    X = pd.DataFrame({
+        "Age": rng.integers(19, 80, n_rows).astype(np.float64),
+        "Tenure in Months": rng.integers(1, 72, n_rows).astype(np.float64),
+        "Monthly Charge": rng.normal(65, 30, n_rows),
+        "Contract": rng.choice(["Month-to-Month", "One Year", "Two Year"], n_rows).astype(object),
+        "Internet Type": rng.choice(["Cable", "DSL", "Fiber Optic"], n_rows).astype(object),
+    })
+    X.loc[rng.random(n_rows) < 0.05, "Age"] = np.nan
+    X.loc[rng.random(n_rows) < 0.05, "Monthly Charge"] = np.nan
+    # Missing categories are NaN in frames, as after read_file; records carry None instead
+    X.loc[rng.random(n_rows) < 0.1, "Internet Type"] = np.nan
+    y = ((X["Contract"] == "Month-to-Month") & (X["Monthly Charge"].fillna(65) > 60)).astype(np.int64)
+    y[rng.random(n_rows) < 0.1] ^= 1
+    X_train, X_test, y_train = X.iloc[:450], X.iloc[450:].copy(), y.iloc[:450]
+    # A category never seen in training must be ignored like OneHotEncoder(handle_unknown="ignore") does
+    X_test.iloc[0, X_test.columns.get_loc("Contract")] = "Three Year"
+    return X_train, y_train, X_test
+
+
+def fitted_preprocessor(X_train, layout):
+    categorical, sparse_threshold = LAYOUTS[layout]
+    transformers = [("num", Pipeline([("imputer", SimpleImputer(strategy="median")), ("scaler", StandardScaler())]), NUMERIC)]
+    if categorical:
+        transformers.append(("cat", Pipeline([("imputer", SimpleImputer(strategy="constant", fill_value="Missing")),
+                                              ("onehot", OneHotEncoder(handle_unknown="ignore"))]), categorical))
+    return ColumnTransformer(transformers, sparse_threshold=sparse_threshold).fit(X_train)
+
+
+@pytest.mark.parametrize("layout", list(LAYOUTS))
+@pytest.mark.parametrize("name", list(MODELS))
+def test_parity(rows, name, layout):
+    X_train, y_train, X_test = rows
+    preprocessor = fitted_preprocessor(X_train, layout)
+    X_test = X_test[preprocessor.feature_names_in_]
+    model = MODELS[name]().fit(preprocessor.transform(X_train), y_train)
+    compiled = compile_pipeline(preprocessor, model)
+    pipeline = Pipeline([("preprocessor", preprocessor), ("classifier", model)])
+    records = X_test.astype(object).where(X_test.notna(), None).to_dict("records")
+
+    assert parity(compiled, preprocessor, model, X_test)
+    assert np.array_equal(compiled.predict_proba(records), pipeline.predict_proba(X_test))
+    assert np.array_equal(compiled.predict_proba(records[:1]), pipeline.predict_proba(X_test.iloc[:1]))
+    assert np.array_equal(compiled.predict(X_test), pipeline.predict(X_test))
+
+
+@pytest.mark.parametrize("name", list(MODELS))
+def test_non_numeric_values_are_missing(rows, name):
+    X_train, y_train, X_test = rows
+    preprocessor = fitted_preprocessor(X_train, "dense")
+    model = MODELS[name]().fit(preprocessor.transform(X_train), y_train)
+    compiled = compile_pipeline(preprocessor, model)
+    pipeline = Pipeline([("preprocessor", preprocessor), ("classifier", model)])
+    records = [{"Age": "abc", "Contract": "One Year"}, {"Age": "42", "Monthly Charge": None}]
+
+    # What the sklearn path of Scorer.frame feeds the pipeline
+    X = pd.DataFrame.from_records(records, columns=NUMERIC + CATEGORICAL)
+    X[NUMERIC] = X[NUMERIC].apply(pd.to_numeric, errors="coerce").astype(np.float64)
+    assert np.array_equal(compiled.predict_proba(records), pipeline.predict_proba(X))
+    assert np.array_equal(compiled.predict_proba(X.astype({"Age": object})), pipeline.predict_proba(X))
@@ -0,0 +1,85 @@
+"""Streaming deduplication must keep exactly the rows drop_duplicates() keeps, in memory and spilled."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from common.dedup import FingerprintSet, StreamingDeduplicator
+
+
+@pytest.fixture(scope="module")
+def rows():
+    """Churn-like rows where about a quarter are copies of earlier ones."""
+    rng = np.random.default_rng(42)
+    n_rows = 4000
+    df = pd.DataFrame({
+        "Customer ID": [f"{i:05d}-C" for i in rng.integers(0, 3000, n_rows)],
+        "Age": rng.integers(19, 80, n_rows),
+        "Monthly Charge": rng.choice([20.05, 65.5, 89.8, np.nan], n_rows),
+        "Contract": rng.choice(["Month-to-Month", "One Year", "Two Year"], n_rows),
+        "Churn": rng.random(n_rows) < 0.27,
+    })
+    return pd.concat([df, df.sample(1000, random_state=1)], ignore_index=True).sample(frac=1, random_state=2)
+
+
+def streamed(df, chunk_rows, **kwargs):
+    with StreamingDeduplicator(**kwargs) as dedup:
+        kept = [dedup.filter(df.iloc[i:i + chunk_rows]) for i in range(0, len(df), chunk_rows)]
+        return pd.concat(kept), dedup.duplicates, dedup.fingerprints.spilled
+
+
+@pytest.mark.parametrize("chunk_rows", [7, 333, 5000])
+def test_matches_drop_duplicates(rows, chunk_rows):
+    kept, duplicates, spilled = streamed(rows, chunk_rows)
+    expected = rows.drop_duplicates()
+    pd.testing.assert_frame_equal(kept, expected)
+    assert duplicates == len(rows) - len(expected)
+    assert not spilled
+
+
+def test_spilled_set_matches_drop_duplicates(rows, tmp_path):
+    # 0.01 MB holds a few hundred fingerprints, far fewer than the distinct rows
+    kept, _, spilled = streamed(rows, 500, memory_budget_mb=0.01, spill_dir=str(tmp_path))
+    assert spilled
+    pd.testing.assert_frame_equal(kept, rows.drop_duplicates())
+    # Closing the deduplicator removes the spill file
+    assert os.listdir(tmp_path) == []
+
+
+def test_rows_parsed_with_other_dtypes_are_duplicates():
+    # Like read_csv chunks: an integer column becomes float in a chunk with a missing value
+    first = pd.DataFrame({"Age": [30, 41], "Contract": ["One Year", "Two Year"], "Churn": [True, False]})
+    second = pd.DataFrame({"Age": [30.0, np.nan], "Contract": pd.Categorical(["One Year", "Two Year"]),
+                           "Churn": [True, False]})
+    with StreamingDeduplicator() as dedup:
+        assert len(dedup.filter(first)) == 2
+        kept = dedup.filter(second)
+    assert kept["Age"].isna().all() and len(kept) == 1
+
+
+def test_fingerprints_sharing_their_high_half():
+    fingerprints = FingerprintSet()
+    high = np.array([5, 5, 5, 9], dtype=np.int64)
+    assert fingerprints.add_new(high, np.array([1, 2, 3, 1], dtype=np.int64)).all()
+    mask = fingerprints.add_new(np.array([5, 5, 5], dtype=np.int64), np.array([2, 4, 3], dtype=np.int64))
+    assert mask.tolist() == [False, True, False]
+    assert fingerprints.size == 5
+
+
+def test_runs_stay_few_and_sorted():
+    rng = np.random.default_rng(0)
+    fingerprints = FingerprintSet()
+    seen = set()
+    for _ in range(200):
+        high = rng.integers(-2**62, 2**62, 50)
+        low = rng.integers(-2**62, 2**62, 50)
+        high[:10], low[:10] = high[10:20], low[10:20]
+        mask = fingerprints.add_new(high, low)
+        expected = []
+        for pair in zip(high.tolist(), low.tolist()):
+            expected.append(pair not in seen)
+            seen.add(pair)
+        assert mask.tolist() == expected
+    assert len(fingerprints._runs) <= 2 * int(np.log2(len(seen)))
+    assert all(np.all(np.diff(run_high) >= 0) for run_high, _ in fingerprints._runs)
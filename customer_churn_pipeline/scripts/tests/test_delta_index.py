@@ -0,0 +1,60 @@
+"""Row fingerprints must tell new, changed and deleted rows apart, and keep rows on their side of the split."""
+import numpy as np
+import pandas as pd
+
+from common.delta_index import RowIndex, compute_delta, fingerprint_frame, fingerprint_split
+
+
+def customers(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Customer ID": [f"{i:05d}-C" for i in range(n)],
+        "Age": rng.integers(19, 80, n).astype(np.int8),
+        "Monthly Charge": rng.normal(65, 30, n).round(2),
+        "Contract": rng.choice(["Month-to-Month", "One Year", "Two Year"], n),
+    })
+
+
+def test_delta_counts_inserts_updates_and_deletes():
+    previous = customers(1000)
+    current = previous.drop(index=range(0, 50))  # 50 deleted
+    current.loc[100:119, "Monthly Charge"] += 1.0  # 20 updated
+    current = pd.concat([current, customers(1030).iloc[1000:].assign(**{"Customer ID": lambda d: d["Customer ID"] + "-new"}),
+                         current.iloc[:5]], ignore_index=True)  # 30 inserted, 5 repeated rows
+
+    keep_mask, new_mask, counts = compute_delta(fingerprint_frame(previous), fingerprint_frame(current))
+    assert counts == {"inserted": 30, "updated": 20, "deleted": 50, "unchanged": 930}
+    assert keep_mask.sum() == 930 and not keep_mask[:50].any()
+    # Only the first copy of a repeated row is new, and unchanged rows are not
+    assert new_mask.sum() == 50
+    inserted = {key for key in current["Customer ID"] if key.endswith("-new")}
+    assert set(current.loc[new_mask, "Customer ID"]) == inserted | set(previous["Customer ID"].iloc[100:120])
+
+
+def test_unchanged_partition_has_no_delta():
+    fps = fingerprint_frame(customers(500))
+    keep_mask, new_mask, counts = compute_delta(fps, fps)
+    assert keep_mask.all() and not new_mask.any()
+    assert counts == {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 500}
+
+
+def test_row_index_round_trip(tmp_path):
+    index = RowIndex(str(tmp_path))
+    assert index.load_meta() is None
+    fps = fingerprint_frame(customers(100))
+    index.save(fps, raw_partition="2025-08-24")
+    assert index.load_meta() == {"raw_partition": "2025-08-24", "rows": 100}
+    pd.testing.assert_frame_equal(index.load(), fps)
+
+
+def test_split_is_stable_across_partitions():
+    df = customers(5000)
+    test = fingerprint_split(fingerprint_frame(df), 0.2)
+    assert 0.17 < test.mean() < 0.23
+
+    # Rows inserted before and deleted from the middle shift every position
+    changed = pd.concat([customers(300, seed=1).assign(**{"Customer ID": lambda d: d["Customer ID"] + "-new"}),
+                         df.drop(index=range(1000, 1500))], ignore_index=True)
+    changed_test = fingerprint_split(fingerprint_frame(changed), 0.2)
+    carried = pd.Series(changed_test[300:], index=df.index.drop(range(1000, 1500)))
+    assert (carried == pd.Series(test, index=df.index)[carried.index]).all()
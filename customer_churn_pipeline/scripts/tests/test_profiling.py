@@ -0,0 +1,40 @@
+"""The sketch profiler must not guess uniqueness, and must always name a most frequent value."""
+import numpy as np
+import pandas as pd
+
+from common.profiling import profile_chunks, profile_frame
+
+
+def chunks(df, size):
+    return (df.iloc[i:i + size] for i in range(0, len(df), size))
+
+
+def test_sketches_do_not_claim_uniqueness():
+    rng = np.random.default_rng(42)
+    values = rng.permutation(4000).astype(np.float64)
+    # A handful of repeats, too few for HyperLogLog to tell from a unique column
+    values[:20] = values[20:40]
+    df = pd.DataFrame({"Total Revenue": values, "Customer ID": [f"{i:05d}-ID" for i in range(4000)]})
+
+    stats = {s["Column"]: s for s in profile_chunks(chunks(df, 1000), max_exact_values=50)}
+    assert stats["Total Revenue"]["Is Unique"] is not True
+    assert stats["Customer ID"]["Is Unique"] is None
+
+    exact = {s["Column"]: s for s in profile_frame(df)}
+    assert exact["Total Revenue"]["Is Unique"] is False
+    assert exact["Customer ID"]["Is Unique"] is True
+
+
+def test_sketches_report_duplicates_they_see():
+    df = pd.DataFrame({"Gender": ["Male", "Female"] * 500})
+    stats = profile_frame(df, approximate=True)[0]
+    assert stats["Is Unique"] is False
+    assert stats["Most Frequent Value"] == df["Gender"].mode().iloc[0]
+
+
+def test_most_frequent_value_of_distinct_column():
+    df = pd.DataFrame({"Customer ID": [f"{i:05d}-ID" for i in range(3000, 0, -1)]})
+    expected = df["Customer ID"].mode().iloc[0]
+    assert profile_frame(df, approximate=True)[0]["Most Frequent Value"] == expected
+    assert profile_chunks(chunks(df, 500), max_exact_values=50)[0]["Most Frequent Value"] == expected
+    assert profile_chunks(chunks(df, 500), approximate=True)[0]["Most Frequent Value"] == expected
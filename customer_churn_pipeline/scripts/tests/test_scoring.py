@@ -0,0 +1,93 @@
+"""A bad scoring request must fail alone, with a client error."""
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from common.scoring import InvalidRecords, MicroBatcher, ModelStore, make_server
+
+FEATURES = {"Age": "float64", "Monthly Charge": "float64", "Contract": "object"}
+
+
+@pytest.fixture(scope="module", params=[True, False], ids=["compiled", "sklearn"])
+def scorer(request, tmp_path_factory):
+    rng = np.random.default_rng(42)
+    X = pd.DataFrame({
+        "Age": rng.integers(19, 80, 400).astype(np.float64),
+        "Monthly Charge": rng.normal(65, 30, 400),
+        "Contract": rng.choice(["Month-to-Month", "One Year", "Two Year"], 400).astype(object),
+    })
+    y = ((X["Contract"] == "Month-to-Month") & (X["Monthly Charge"] > 60)).astype(np.int64)
+    preprocessor = ColumnTransformer([
+        ("num", Pipeline([("imputer", SimpleImputer(strategy="median")), ("scaler", StandardScaler())]),
+         ["Age", "Monthly Charge"]),
+        ("cat", Pipeline([("imputer", SimpleImputer(strategy="constant", fill_value="Missing")),
+                          ("onehot", OneHotEncoder(handle_unknown="ignore"))]), ["Contract"]),
+    ]).fit(X)
+    model = LogisticRegression().fit(preprocessor.transform(X), y)
+    store = ModelStore(str(tmp_path_factory.mktemp("models")))
+    store.publish(preprocessor, model, "v1", FEATURES, sample=X)
+    return store.load(compiled=request.param)
+
+
+@pytest.fixture
+def batcher(scorer):
+    batcher = MicroBatcher(scorer, max_wait_ms=50)
+    yield batcher
+    batcher.close()
+
+
+def test_records_are_coerced(scorer):
+    checked = scorer.check_records([{"Age": "42", "Monthly Charge": float("nan"), "Contract": 3, "Other": [1]}])
+    assert checked == [{"Age": 42.0, "Monthly Charge": None, "Contract": "3", "Other": [1]}]
+    with pytest.raises(InvalidRecords, match="record 1: Age must be a number"):
+        scorer.check_records([{"Age": 30}, {"Age": "x"}])
+    with pytest.raises(InvalidRecords, match="Contract must be a single value"):
+        scorer.check_records([{"Contract": ["One Year"]}])
+
+
+def test_failed_batch_only_fails_the_bad_request(scorer, batcher, monkeypatch):
+    score_records = scorer.score_records
+
+    def failing(records, threshold=0.5):
+        if any(record.get("Age") == 99.0 for record in records):
+            raise RuntimeError("model failure")
+        return score_records(records, threshold)
+
+    monkeypatch.setattr(scorer, "score_records", failing)
+    good, bad = batcher.submit([{"Age": 30}]), batcher.submit([{"Age": 99}])
+    assert len(good.result(5)) == 1
+    with pytest.raises(RuntimeError):
+        bad.result(5)
+
+
+def test_http_bad_request_is_400_and_alone(batcher):
+    server = make_server(batcher, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/score"
+
+    def post(body):
+        request = urllib.request.Request(url, json.dumps(body).encode("utf-8"), {"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    try:
+        with ThreadPoolExecutor(2) as pool:
+            statuses = list(pool.map(post, [{"Age": 30}, {"Age": "x"}]))
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert statuses == [200, 400]
@@ -0,0 +1,97 @@
+"""Lazy plans must return what the eager pandas stages returned, reading only the columns they need."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from common.schema import infer_schema
+from common.storage import read_file
+from common.transforms import Plan, preparation_plan, transformation_plan
+
+RULES = {
+    "preparation": {"filters": [], "distinct": True},
+    "transformation": {"drop": ["Customer Status", "CLTV", "Churn Reason", "Customer ID"], "derive": []},
+}
+LEAKAGE = RULES["transformation"]["drop"]
+
+
+@pytest.fixture(scope="module")
+def churn():
+    """Churn-like rows with missing values and about a tenth duplicated."""
+    rng = np.random.default_rng(42)
+    n_rows = 900
+    df = pd.DataFrame({
+        "Customer ID": [f"{i:05d}-C" for i in rng.integers(0, 800, n_rows)],
+        "Age": rng.integers(19, 80, n_rows),
+        "Tenure in Months": rng.integers(1, 72, n_rows),
+        "Monthly Charge": rng.choice([20.05, 65.5, 89.8, np.nan], n_rows),
+        "Contract": rng.choice(["Month-to-Month", "One Year", "Two Year", None], n_rows),
+        "Customer Status": rng.choice(["Stayed", "Churned", "Joined"], n_rows),
+        "CLTV": rng.integers(2000, 6500, n_rows),
+        "Churn Reason": rng.choice(["Competitor", "Price", None], n_rows),
+    })
+    return pd.concat([df, df.sample(90, random_state=1)], ignore_index=True)
+
+
+@pytest.fixture(scope="module", params=["csv", "parquet"])
+def partition(request, churn, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("partition") / f"customer_churn.{request.param}")
+    if request.param == "csv":
+        churn.to_csv(path, index=False)
+    else:
+        churn.to_parquet(path, index=False)
+    return path
+
+
+def assert_same(result, expected):
+    """Frames equal, counting None and NaN as the same missing string (Arrow and pandas' CSV reader differ)."""
+    def missing_as_nan(df):
+        return df.apply(lambda col: col.where(col.notna(), np.nan) if col.dtype == object else col)
+
+    pd.testing.assert_frame_equal(missing_as_nan(result), missing_as_nan(expected))
+
+
+def test_leakage_columns_are_pruned(churn, partition):
+    plan = transformation_plan(partition, RULES)
+    optimized = plan.optimize()
+    assert optimized["pruned"] == [col for col in churn.columns if col in LEAKAGE]
+    assert not set(LEAKAGE) & set(optimized["read"])
+    assert "pruned: " + ", ".join(optimized["pruned"]) in plan.explain()
+
+    # A column kept for the warehouse key is read
+    assert "Customer ID" in transformation_plan(partition, RULES, keep=["Customer ID"]).optimize()["read"]
+
+
+def test_filter_is_pushed_into_the_scan(churn, partition):
+    plan = Plan(partition).filter("`Monthly Charge` > 50 and `Contract` == 'Two Year'").select(["Age"])
+    optimized = plan.optimize()
+    assert optimized["filter"] is not None
+    # The filter reads its columns, the output does not need them
+    assert optimized["read"] == ["Age", "Monthly Charge", "Contract"] and optimized["output"] == ["Age"]
+
+    expected = churn.loc[(churn["Monthly Charge"] > 50) & (churn["Contract"] == "Two Year"), ["Age"]]
+    pd.testing.assert_frame_equal(plan.collect(), expected.reset_index(drop=True))
+
+
+@pytest.mark.parametrize("with_schema", [False, True], ids=["inferred", "schema"])
+def test_transformation_matches_eager_read(churn, partition, with_schema):
+    schema = infer_schema(churn) if with_schema else None
+    keep = [col for col in churn.columns if col not in LEAKAGE]
+    expected = read_file(partition, columns=keep, schema=schema)
+    assert_same(transformation_plan(partition, RULES).collect(schema=schema), expected)
+
+
+def test_preparation_matches_drop_duplicates(churn, partition, tmp_path):
+    expected = read_file(partition).drop_duplicates().reset_index(drop=True)
+    plan = preparation_plan(partition, RULES)
+    # Small batches, so duplicates are found across them
+    assert_same(plan.collect(batch_rows=100), expected)
+
+    result = plan.sink(str(tmp_path), "customer_churn_prepared", batch_rows=100, fmt="parquet")
+    assert (result["rows"], result["duplicates"]) == (len(expected), len(churn) - len(expected))
+    assert_same(read_file(result["path"]), expected)
+
+
+def test_frame_source_keeps_its_index(churn):
+    df = churn.iloc[::3]
+    result = Plan(df).filter("`Age` >= 40").distinct().collect(batch_rows=50)
+    pd.testing.assert_frame_equal(result, df[df["Age"] >= 40].drop_duplicates())